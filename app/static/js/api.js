@@ -1,11 +1,17 @@
 /**
- * API layer: fetch with timeout, all GET helpers.
+ * API layer: fetch with timeout, cursor paging, all GET helpers, and the IndexedDB series
+ * cache behind getTimeseries.
  */
 (function () {
   'use strict';
   var cfg = window.LoRaWAN.config;
   var API = cfg.API;
   var timeoutMs = cfg.FETCH_TIMEOUT_MS;
+  var pageSize = cfg.PAGE_SIZE || 5000;
+  var maxPages = cfg.MAX_PAGES || 20;
+  var seriesMaxBytes = cfg.SERIES_CACHE_MAX_BYTES || 50 * 1024 * 1024;
+  var seriesFreshMs = cfg.SERIES_CACHE_FRESH_MS != null ? cfg.SERIES_CACHE_FRESH_MS : 5 * 60 * 1000;
+  var seriesSettleMs = cfg.SERIES_CACHE_SETTLE_MS != null ? cfg.SERIES_CACHE_SETTLE_MS : 5 * 60 * 1000;
 
   function fetchWithTimeout(url, options, ms) {
     var ctrl = new AbortController();
@@ -13,6 +19,28 @@
     return fetch(url, Object.assign(options || {}, { signal: ctrl.signal })).finally(function () { clearTimeout(id); });
   }
 
+  /**
+   * Follow `next` cursors from a paginated endpoint and concatenate the `key` arrays.
+   * Resolves to the last response with `key` holding all items (has_more true if MAX_PAGES was hit).
+   */
+  function fetchPages(url, key, errMsg) {
+    var items = [];
+    function step(cursor, page) {
+      var pageUrl = url + '&limit=' + pageSize + (cursor ? '&cursor=' + encodeURIComponent(cursor) : '');
+      return fetchWithTimeout(pageUrl, {}).then(function (r) {
+        if (!r.ok) throw new Error(errMsg);
+        return r.json();
+      }).then(function (j) {
+        if (!j || !Array.isArray(j[key])) throw new Error('Invalid API response');
+        items = items.concat(j[key]);
+        if (j.has_more && j.next && page + 1 < maxPages) return step(j.next, page + 1);
+        j[key] = items;
+        return j;
+      });
+    }
+    return step(null, 0);
+  }
+
   function getProfiles() {
     return fetchWithTimeout(API + '/profiles', {}).then(function (r) {
       if (!r.ok) throw new Error('Profiles failed');
@@ -44,6 +72,14 @@
     });
   }
 
+  /** Per-device battery drain rate and depletion estimate ({as_of, devices: [...]}). */
+  function getBatteryForecast() {
+    return fetchWithTimeout(API + '/health/battery-forecast', {}).then(function (r) {
+      if (!r.ok) throw new Error('Battery forecast failed');
+      return r.json();
+    });
+  }
+
   function getDevicePassport(devEui) {
     return fetchWithTimeout(API + '/device/' + encodeURIComponent(devEui), {}).then(function (r) {
       if (!r.ok) throw new Error(r.status === 404 ? 'Device not found' : 'Passport failed');
@@ -51,17 +87,264 @@
     });
   }
 
-  function getTimeseries(devEui, fromTime, toTime, fPort) {
-    var url = API + '/timeseries?dev_eui=' + encodeURIComponent(devEui) + '&limit=5000';
+  /*
+   * Series cache. Timeseries events are kept in IndexedDB ('lorawan-series') per series
+   * (device + fPort filter) in monthly chunks, with the time ranges already fetched:
+   *   series  {key, ranges: [[from, to], ...], checkedAt, bytes: {month: n}, usedAt}
+   *   chunks  {key, month, events}
+   * A request only fetches the parts of [from, to] not covered yet; the part after the newest
+   * cached point is skipped while it was checked less than SERIES_CACHE_FRESH_MS ago. A range
+   * end counts as covered only once it is SERIES_CACHE_SETTLE_MS old (until then coverage ends at
+   * the newest event received), so clock skew and slightly late uplinks are fetched again.
+   * Whole series are evicted least-recently-used first above SERIES_CACHE_MAX_BYTES (JSON size).
+   * Without IndexedDB every call goes to the network.
+   */
+  var OPEN_END = '\uffff';
+  var seriesDb = null;
+
+  function openSeriesDb() {
+    if (seriesDb) return seriesDb;
+    seriesDb = new Promise(function (resolve) {
+      if (!window.indexedDB) { resolve(null); return; }
+      var req;
+      try {
+        req = window.indexedDB.open('lorawan-series', 1);
+      } catch (e) {
+        resolve(null);
+        return;
+      }
+      req.onupgradeneeded = function () {
+        var db = req.result;
+        db.createObjectStore('series', { keyPath: 'key' });
+        db.createObjectStore('chunks', { keyPath: ['key', 'month'] });
+      };
+      req.onsuccess = function () { resolve(req.result); };
+      req.onerror = req.onblocked = function () { resolve(null); };
+    });
+    return seriesDb;
+  }
+
+  function idbDone(req) {
+    return new Promise(function (resolve, reject) {
+      req.onsuccess = function () { resolve(req.result); };
+      req.onerror = function () { reject(req.error); };
+    });
+  }
+
+  function txDone(tx) {
+    return new Promise(function (resolve, reject) {
+      tx.oncomplete = function () { resolve(); };
+      tx.onerror = tx.onabort = function () { reject(tx.error); };
+    });
+  }
+
+  function seriesKey(devEui, fPort) {
+    return devEui + '|' + (fPort != null && fPort !== '' ? fPort : '*');
+  }
+
+  function monthOf(t) {
+    return t === OPEN_END ? OPEN_END : t.slice(0, 7);
+  }
+
+  /** Parts of [lo, hi] outside the sorted, merged ranges (bounds inclusive, like the API). */
+  function missingRanges(ranges, lo, hi) {
+    var gaps = [];
+    var cur = lo;
+    for (var i = 0; i < ranges.length && cur < hi; i++) {
+      var r = ranges[i];
+      if (r[1] < cur) continue;
+      if (r[0] > hi) break;
+      if (r[0] > cur) gaps.push([cur, r[0]]);
+      if (r[1] > cur) cur = r[1];
+    }
+    if (cur < hi) gaps.push([cur, hi]);
+    return gaps;
+  }
+
+  function mergeRanges(ranges) {
+    var sorted = ranges.slice().sort(function (a, b) { return a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0; });
+    var out = [];
+    sorted.forEach(function (r) {
+      var last = out[out.length - 1];
+      if (last && r[0] <= last[1]) {
+        if (r[1] > last[1]) last[1] = r[1];
+      } else {
+        out.push([r[0], r[1]]);
+      }
+    });
+    return out;
+  }
+
+  /** Merge two time-sorted event lists; events fetched twice (range bounds overlap) are kept once. */
+  function mergeEvents(a, b) {
+    var out = [];
+    var i = 0, j = 0;
+    while (i < a.length && j < b.length) {
+      if (a[i].time < b[j].time) { out.push(a[i++]); continue; }
+      if (a[i].time > b[j].time) { out.push(b[j++]); continue; }
+      var t = a[i].time;
+      var seen = {};
+      for (; i < a.length && a[i].time === t; i++) {
+        var sa = JSON.stringify(a[i]);
+        if (!seen[sa]) { seen[sa] = true; out.push(a[i]); }
+      }
+      for (; j < b.length && b[j].time === t; j++) {
+        var sb = JSON.stringify(b[j]);
+        if (!seen[sb]) { seen[sb] = true; out.push(b[j]); }
+      }
+    }
+    return out.concat(a.slice(i), b.slice(j));
+  }
+
+  function lowerBound(events, t) {
+    var lo = 0, hi = events.length;
+    while (lo < hi) {
+      var mid = (lo + hi) >> 1;
+      if (events[mid].time < t) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+  }
+
+  function sliceEvents(events, lo, hi) {
+    var end = lowerBound(events, hi);
+    while (end < events.length && events[end].time === hi) end++;
+    return events.slice(lowerBound(events, lo), end);
+  }
+
+  /** Series record plus the events of every chunk overlapping [lo, hi]. */
+  function readSeries(db, key, lo, hi) {
+    var tx = db.transaction(['series', 'chunks'], 'readonly');
+    var meta = idbDone(tx.objectStore('series').get(key));
+    var chunks = idbDone(tx.objectStore('chunks').getAll(IDBKeyRange.bound([key, monthOf(lo)], [key, monthOf(hi)])));
+    return Promise.all([meta, chunks]).then(function (res) {
+      var rec = res[0] || { key: key, ranges: [], checkedAt: 0, bytes: {}, usedAt: 0 };
+      var events = [];
+      res[1].forEach(function (c) { events = events.concat(c.events); });
+      return { rec: rec, events: events };
+    });
+  }
+
+  function writeSeries(db, rec, events, months) {
+    var byMonth = {};
+    events.forEach(function (ev) {
+      var m = monthOf(ev.time);
+      if (months[m]) (byMonth[m] = byMonth[m] || []).push(ev);
+    });
+    var tx = db.transaction(['series', 'chunks'], 'readwrite');
+    var chunks = tx.objectStore('chunks');
+    Object.keys(byMonth).forEach(function (m) {
+      chunks.put({ key: rec.key, month: m, events: byMonth[m] });
+      rec.bytes[m] = JSON.stringify(byMonth[m]).length;
+    });
+    rec.usedAt = Date.now();
+    tx.objectStore('series').put(rec);
+    return txDone(tx).then(function () { return evictSeries(db, rec.key); });
+  }
+
+  function touchSeries(db, rec) {
+    if (!rec.ranges.length) return;
+    rec.usedAt = Date.now();
+    var tx = db.transaction('series', 'readwrite');
+    tx.objectStore('series').put(rec);
+  }
+
+  function seriesBytes(rec) {
+    return Object.keys(rec.bytes || {}).reduce(function (n, m) { return n + rec.bytes[m]; }, 0);
+  }
+
+  /** Drop least-recently-used series (never `keep`) until the cache fits SERIES_CACHE_MAX_BYTES. */
+  function evictSeries(db, keep) {
+    return idbDone(db.transaction('series', 'readonly').objectStore('series').getAll()).then(function (recs) {
+      var total = recs.reduce(function (n, r) { return n + seriesBytes(r); }, 0);
+      if (total <= seriesMaxBytes) return;
+      recs.sort(function (a, b) { return a.usedAt - b.usedAt; });
+      var tx = db.transaction(['series', 'chunks'], 'readwrite');
+      for (var i = 0; i < recs.length && total > seriesMaxBytes; i++) {
+        if (recs[i].key === keep) continue;
+        tx.objectStore('series').delete(recs[i].key);
+        tx.objectStore('chunks').delete(IDBKeyRange.bound([recs[i].key, ''], [recs[i].key, OPEN_END]));
+        total -= seriesBytes(recs[i]);
+      }
+      return txDone(tx);
+    });
+  }
+
+  function clearSeriesCache() {
+    return openSeriesDb().then(function (db) {
+      if (!db) return;
+      var tx = db.transaction(['series', 'chunks'], 'readwrite');
+      tx.objectStore('series').clear();
+      tx.objectStore('chunks').clear();
+      return txDone(tx);
+    });
+  }
+
+  function fetchTimeseries(devEui, fromTime, toTime, fPort) {
+    var url = API + '/timeseries?dev_eui=' + encodeURIComponent(devEui);
     if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
     if (toTime) url += '&to=' + encodeURIComponent(toTime);
     if (fPort != null && fPort !== '') url += '&f_port=' + encodeURIComponent(fPort);
+    return fetchPages(url, 'events', 'Timeseries failed');
+  }
+
+  /**
+   * Device events in [fromTime, toTime] (nulls: unbounded), served from the series cache where
+   * possible. maxAgeMs: how old the last check for newer points may be (default
+   * SERIES_CACHE_FRESH_MS; 0 always asks the server for points after the newest cached one).
+   */
+  function getTimeseries(devEui, fromTime, toTime, fPort, maxAgeMs) {
+    var lo = fromTime || '';
+    var hi = toTime || OPEN_END;
+    var key = seriesKey(devEui, fPort);
+    if (maxAgeMs == null) maxAgeMs = seriesFreshMs;
+    function network() {
+      return fetchTimeseries(devEui, fromTime, toTime, fPort).then(function (j) { return j.events; });
+    }
+    return openSeriesDb().then(function (db) {
+      if (!db) return network();
+      return readSeries(db, key, lo, hi).then(function (cached) {
+        var rec = cached.rec;
+        var gaps = missingRanges(rec.ranges, lo, hi);
+        var newest = rec.ranges.length ? rec.ranges[rec.ranges.length - 1][1] : null;
+        if (gaps.length === 1 && gaps[0][0] === newest && gaps[0][1] === hi && Date.now() - rec.checkedAt < maxAgeMs) gaps = [];
+        if (!gaps.length) {
+          touchSeries(db, rec);
+          return sliceEvents(cached.events, lo, hi);
+        }
+        var settled = new Date(Date.now() - seriesSettleMs).toISOString();
+        return Promise.all(gaps.map(function (g) {
+          return fetchTimeseries(devEui, g[0] || null, g[1] === OPEN_END ? null : g[1], fPort).then(function (j) {
+            var evs = j.events;
+            var end = g[1] !== OPEN_END && g[1] <= settled && !j.has_more ? g[1] : (evs.length ? evs[evs.length - 1].time : null);
+            return { events: evs, range: end !== null ? [g[0], end] : null, tail: g[1] === hi };
+          });
+        })).then(function (results) {
+          var events = cached.events;
+          var months = {};
+          var ranges = rec.ranges.slice();
+          results.forEach(function (r) {
+            events = mergeEvents(events, r.events);
+            r.events.forEach(function (ev) { months[monthOf(ev.time)] = true; });
+            if (r.range) ranges.push(r.range);
+            if (r.tail) rec.checkedAt = Date.now();
+          });
+          rec.ranges = mergeRanges(ranges);
+          var out = sliceEvents(events, lo, hi);
+          return writeSeries(db, rec, events, months).catch(function () {}).then(function () { return out; });
+        });
+      }, network);
+    });
+  }
+
+  /** The newest n events of a device, oldest first, in one request (bypasses the series cache). */
+  function getLatestTimeseries(devEui, n) {
+    var url = API + '/timeseries?dev_eui=' + encodeURIComponent(devEui) + '&latest=' + n;
     return fetchWithTimeout(url, {}).then(function (r) {
       if (!r.ok) throw new Error('Timeseries failed');
-      return r.json().then(function (j) {
-        if (!Array.isArray(j)) throw new Error('Invalid API response');
-        return j;
-      });
+      return r.json();
+    }).then(function (j) {
+      if (!j || !Array.isArray(j.events)) throw new Error('Invalid API response');
+      return j.events;
     });
   }
 
@@ -74,36 +357,88 @@
     });
   }
 
-  function getSiteEvents(gateway, fromTime, toTime) {
-    var url = API + '/site?gateway=' + encodeURIComponent(gateway) + '&limit=5000';
-    if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
-    if (toTime) url += '&to=' + encodeURIComponent(toTime);
+  /**
+   * Gateway/device positions inside a Leaflet bbox string (west,south,east,north) at a zoom;
+   * clustered server-side below the cluster zoom. Without bbox: whole world plus `extent`.
+   */
+  function getMap(bbox, zoom, kind) {
+    var url = API + '/map?zoom=' + (zoom != null ? zoom : 3) + '&kind=' + (kind || 'all');
+    if (bbox) url += '&bbox=' + encodeURIComponent(bbox);
+    return fetchWithTimeout(url, {}).then(function (r) {
+      if (!r.ok) throw new Error('Map failed');
+      return r.json();
+    });
+  }
+
+  /**
+   * RSSI/SNR/weak-link cells of one Web Mercator tile (z up to 16), as columns bx, by,
+   * uplinks, rssi_mean, snr_mean, weak_pct, ... on a bins x bins grid.
+   */
+  function getCoverageTile(z, x, y, fromTime, toTime) {
+    var url = API + '/coverage/' + z + '/' + x + '/' + y;
+    var q = [];
+    if (fromTime) q.push('from=' + encodeURIComponent(fromTime));
+    if (toTime) q.push('to=' + encodeURIComponent(toTime));
+    if (q.length) url += '?' + q.join('&');
+    return fetchWithTimeout(url, {}).then(function (r) {
+      if (!r.ok) throw new Error('Coverage tile failed');
+      return r.json();
+    });
+  }
+
+  /** The newest n events seen by a gateway, oldest first, in one request. */
+  function getLatestSiteEvents(gateway, n) {
+    var url = API + '/site?gateway=' + encodeURIComponent(gateway) + '&latest=' + n;
     return fetchWithTimeout(url, {}).then(function (r) {
       if (!r.ok) throw new Error('Site events failed');
       return r.json();
+    }).then(function (j) {
+      if (!j || !Array.isArray(j.events)) throw new Error('Invalid API response');
+      return j.events;
     });
   }
 
-  function getCorrelation(gateway, fromTime, toTime) {
-    var url = API + '/correlation?gateway=' + encodeURIComponent(gateway) + '&limit=3000';
+  /**
+   * Per-bucket events, active devices and RSSI min/mean/max for a gateway, from the server-side
+   * 1 min / 15 min / 1 h / 1 d pyramid: at most one bucket per pixel of `width`.
+   */
+  function getSiteTimeline(gateway, fromTime, toTime, width) {
+    var url = API + '/site/timeline?gateway=' + encodeURIComponent(gateway) + '&width=' + (width || 800);
     if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
     if (toTime) url += '&to=' + encodeURIComponent(toTime);
     return fetchWithTimeout(url, {}).then(function (r) {
-      if (!r.ok) throw new Error('Correlation failed');
+      if (!r.ok) throw new Error('Site timeline failed');
       return r.json();
     });
   }
 
-  function getAnomalies(gateway, fromTime, toTime) {
-    var url = API + '/anomalies?gateway=' + encodeURIComponent(gateway) + '&limit=5000';
-    if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
-    if (toTime) url += '&to=' + encodeURIComponent(toTime);
+  /** Each device the gateway has heard, with its last uplink there at or before `at` (null: latest). */
+  function getSiteState(gateway, at) {
+    var url = API + '/site/state?gateway=' + encodeURIComponent(gateway);
+    if (at) url += '&at=' + encodeURIComponent(at);
     return fetchWithTimeout(url, {}).then(function (r) {
-      if (!r.ok) return { anomalies: [] };
+      if (!r.ok) throw new Error('Site state failed');
       return r.json();
+    }).then(function (j) {
+      if (!j || !Array.isArray(j.devices)) throw new Error('Invalid API response');
+      return j.devices;
     });
   }
 
+  function getCorrelation(gateway, fromTime, toTime) {
+    var url = API + '/correlation?gateway=' + encodeURIComponent(gateway);
+    if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
+    if (toTime) url += '&to=' + encodeURIComponent(toTime);
+    return fetchPages(url, 'events', 'Correlation failed');
+  }
+
+  function getAnomalies(gateway, fromTime, toTime) {
+    var url = API + '/anomalies?gateway=' + encodeURIComponent(gateway);
+    if (fromTime) url += '&from=' + encodeURIComponent(fromTime);
+    if (toTime) url += '&to=' + encodeURIComponent(toTime);
+    return fetchPages(url, 'anomalies', 'Anomalies failed').catch(function () { return { anomalies: [] }; });
+  }
+
   function getAnomaliesOrg(limit) {
     var url = API + '/anomalies/org?limit=' + (limit || 20);
     return fetchWithTimeout(url, {}).then(function (r) {
@@ -124,13 +459,21 @@
 
   window.LoRaWAN.api = {
     fetchWithTimeout: fetchWithTimeout,
+    fetchPages: fetchPages,
     getProfiles: getProfiles,
     getDevices: getDevices,
     getDevicesWithHealth: getDevicesWithHealth,
+    getBatteryForecast: getBatteryForecast,
     getDevicePassport: getDevicePassport,
     getTimeseries: getTimeseries,
+    getLatestTimeseries: getLatestTimeseries,
+    clearSeriesCache: clearSeriesCache,
     getGateways: getGateways,
-    getSiteEvents: getSiteEvents,
+    getMap: getMap,
+    getCoverageTile: getCoverageTile,
+    getLatestSiteEvents: getLatestSiteEvents,
+    getSiteTimeline: getSiteTimeline,
+    getSiteState: getSiteState,
     getCorrelation: getCorrelation,
     getAnomalies: getAnomalies,
     getAnomaliesOrg: getAnomaliesOrg,
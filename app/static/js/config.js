@@ -8,6 +8,14 @@
     API: window.location.origin + '/api',
     FETCH_TIMEOUT_MS: 15000,
     AUTO_REFRESH_MS: 15000,
+    /** Keyset pagination: rows per request and max pages followed per call. */
+    PAGE_SIZE: 5000,
+    MAX_PAGES: 20,
+    /** IndexedDB series cache (api.getTimeseries): size budget (JSON bytes, LRU eviction), how long the
+     *  newest cached point counts as current, and how old a range end must be to count as final. */
+    SERIES_CACHE_MAX_BYTES: 50 * 1024 * 1024,
+    SERIES_CACHE_FRESH_MS: 5 * 60 * 1000,
+    SERIES_CACHE_SETTLE_MS: 5 * 60 * 1000,
     VIEW_PROFILES: {
       level: ['Dragino DDS75-LB Ultrasonic Distance Sensor', 'EM500-UDL'],
       soil: ['Makerfabs Soil Moisture Sensor'],
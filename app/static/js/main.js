@@ -69,8 +69,10 @@
       chartSite: null,
       chartCorrelation: null,
       mapInstance: null,
-      mapMarkers: [],
-      siteEventsCache: [],
+      mapLayer: null,
+      mapRequestSeq: 0,
+      siteStateSeq: 0,
+      siteTimeline: null,
       healthSortKey: 'last_seen',
       healthSortDir: -1
     };
@@ -95,7 +97,7 @@
       state.autoRefreshInterval = null;
       document.getElementById('last-updated').textContent = '';
       if (this.checked && isDeviceView()) {
-        state.autoRefreshInterval = setInterval(views.loadChart, config.AUTO_REFRESH_MS);
+        state.autoRefreshInterval = setInterval(function () { views.loadChart({ refresh: true }); }, config.AUTO_REFRESH_MS);
         views.loadChart();
       }
     });
@@ -122,7 +122,8 @@
     });
   }
 
-  function loadChart() {
+  /** opts.refresh (auto-refresh): always ask the server for points newer than the cached ones. */
+  function loadChart(opts) {
     var dom = window.LoRaWAN.dom;
     var state = window.LoRaWAN.state;
     var api = window.LoRaWAN.api;
@@ -141,7 +142,8 @@
     var devEui = dom.deviceSelect.value;
     if (!devEui) { dom.metaEl.textContent = ''; if (levelGaugeWrap) levelGaugeWrap.style.display = 'none'; return Promise.resolve(); }
     var range = getTimeRange(dom.rangeSelect.value);
-    return api.getTimeseries(devEui, range.fromTime, range.toTime, dom.fportSelect.value || null).then(function (data) {
+    var maxAgeMs = opts && opts.refresh ? 0 : undefined;
+    return api.getTimeseries(devEui, range.fromTime, range.toTime, dom.fportSelect.value || null, maxAgeMs).then(function (data) {
       if (!Array.isArray(data)) {
         dom.errEl.textContent = 'Invalid response from API';
         dom.metaEl.textContent = '';
@@ -325,7 +327,12 @@
     var errElH = document.getElementById('health-error');
     if (loadingEl) loadingEl.innerHTML = '<span class="spinner" aria-hidden="true"></span> Loading...';
     if (errElH) errElH.textContent = '';
-    api.getDevicesWithHealth().then(function (list) {
+    var forecast = api.getBatteryForecast().catch(function () { return { devices: [] }; });
+    Promise.all([api.getDevicesWithHealth(), forecast]).then(function (results) {
+      var list = results[0];
+      var byDev = {};
+      (results[1].devices || []).forEach(function (f) { byDev[f.dev_eui] = f; });
+      list.forEach(function (d) { d.forecast = byDev[d.dev_eui] || null; });
       if (loadingEl) loadingEl.textContent = '';
       var tbody = document.querySelector('#health-table tbody');
       if (!tbody) return;
@@ -337,6 +344,13 @@
         if (key === 'device') { va = (a.device_name || a.dev_eui) || ''; vb = (b.device_name || b.dev_eui) || ''; return dir * (va.localeCompare(vb)); }
         if (key === 'type') { va = (a.device_profile_name || '') || ''; vb = (b.device_profile_name || '') || ''; return dir * (va.localeCompare(vb)); }
         if (key === 'last_seen') { va = va || ''; vb = vb || ''; return dir * (va.localeCompare(vb)); }
+        if (key === 'depletion') {
+          // Soonest depletion first; devices without a projection last in either direction
+          va = a.forecast && a.forecast.days_left != null ? a.forecast.days_left : null;
+          vb = b.forecast && b.forecast.days_left != null ? b.forecast.days_left : null;
+          if (va == null || vb == null) return va == null ? (vb == null ? 0 : 1) : -1;
+          return dir * (va - vb);
+        }
         if (key === 'power') { va = formatPower(a.external_power_source) || ''; vb = formatPower(b.external_power_source) || ''; return dir * (va.localeCompare(vb)); }
         if (typeof va === 'number' && typeof vb === 'number') return dir * (va - vb);
         va = (va != null ? String(va) : ''); vb = (vb != null ? String(vb) : '');
@@ -344,7 +358,7 @@
       });
       sorted.forEach(function (d) {
         var tr = document.createElement('tr');
-        tr.innerHTML = '<td>' + (d.device_name || d.dev_eui) + (d.synthetic ? ' [Synthetic]' : '') + '</td><td>' + (d.device_profile_name || '') + '</td><td>' + (d.last_seen || '').slice(0, 19) + '</td><td>' + (d.battery != null ? d.battery : '') + '</td><td>' + (d.rssi != null ? d.rssi : '') + '</td><td>' + (d.snr != null ? d.snr : '') + '</td><td>' + (d.margin != null ? d.margin : '') + '</td><td>' + formatPower(d.external_power_source) + '</td>';
+        tr.innerHTML = '<td>' + (d.device_name || d.dev_eui) + (d.synthetic ? ' [Synthetic]' : '') + '</td><td>' + (d.device_profile_name || '') + '</td><td>' + (d.last_seen || '').slice(0, 19) + '</td><td>' + (d.battery != null ? d.battery : '') + '</td>' + formatDepletion(d.forecast) + '<td>' + (d.rssi != null ? d.rssi : '') + '</td><td>' + (d.snr != null ? d.snr : '') + '</td><td>' + (d.margin != null ? d.margin : '') + '</td><td>' + formatPower(d.external_power_source) + '</td>';
         tbody.appendChild(tr);
       });
     }).catch(function (e) {
@@ -353,6 +367,16 @@
     });
   }
 
+  /** Depletion cell: "~N d (date)" with the drain rate and earliest/latest dates as a tooltip. */
+  function formatDepletion(f) {
+    if (!f) return '<td></td>';
+    if (f.status === 'depleted') return '<td title="At or below ' + f.empty_level + ' ' + f.unit + '">Depleted</td>';
+    if (f.status !== 'draining') return '<td class="meta">' + (f.status === 'stable' ? 'Stable' : '') + '</td>';
+    var title = 'Drain ' + f.drain_per_day + ' ' + f.unit + '/day to ' + f.empty_level + ' ' + f.unit +
+      '; ' + (f.depletion_earliest || '').slice(0, 10) + ' .. ' + (f.depletion_latest ? f.depletion_latest.slice(0, 10) : 'later');
+    return '<td title="' + title + '">~' + Math.round(f.days_left) + ' d (' + f.depletion.slice(0, 10) + ')</td>';
+  }
+
   function initHealthSort() {
     var state = window.LoRaWAN.state;
     if (!state) return;
@@ -510,9 +534,8 @@
         return Promise.all([]);
       }
       var sitePromises = gateways.map(function (g) {
-        return api.getSiteEvents(g.gateway_id, null, null).then(function (events) {
-          var rssiList = (events || []).map(function (e) { return e.rssi != null ? e.rssi : null; }).filter(function (v) { return v != null; });
-          var last30 = rssiList.slice(-30);
+        return api.getLatestSiteEvents(g.gateway_id, 30).then(function (events) {
+          var last30 = (events || []).map(function (e) { return e.rssi != null ? e.rssi : null; }).filter(function (v) { return v != null; });
           var lastRssi = last30.length ? last30[last30.length - 1] : null;
           var bgImg = mapping[g.gateway_id] || fallback;
           var bgUrl = 'url(images/' + bgImg + ')';
@@ -608,8 +631,8 @@
             if (!list.length) return;
             var idx = (window.LoRaWAN.dashboardDeviceIndexByView[view] || 0) % list.length;
             var dev = list[idx];
-            api.getTimeseries(dev.dev_eui, null, null, null).then(function (data) {
-              updateDeviceCard(view, dev, Array.isArray(data) ? data.slice(-50) : []);
+            api.getLatestTimeseries(dev.dev_eui, 50).then(function (data) {
+              updateDeviceCard(view, dev, data);
             }).catch(function () { updateDeviceCard(view, dev, []); });
           });
         }
@@ -799,27 +822,22 @@
       var gw = gateways.find(function (g) { return g.gateway_id === gateway; });
       var siteLoc = document.getElementById('site-location');
       if (siteLoc) siteLoc.textContent = (gw && gw.lat != null) ? 'Location: ' + gw.lat.toFixed(4) + '°N, ' + gw.lon.toFixed(4) + '°W' + (gw.alt != null ? ', ' + gw.alt + ' m' : '') : 'Location: not in dataset';
-      return api.getSiteEvents(gateway, null, null);
-    }).then(function (events) {
-      if (!Array.isArray(events)) {
-        if (siteMeta) siteMeta.textContent = '';
-        if (siteErr) siteErr.textContent = 'Invalid response';
-        return;
-      }
+      var chartEl = document.getElementById('chart-site');
+      var width = chartEl && chartEl.parentNode ? chartEl.parentNode.clientWidth : 0;
+      // Latest state per device, the pyramid and the newest 200 events: no raw history
+      return Promise.all([api.getSiteState(gateway, null), api.getSiteTimeline(gateway, null, null, width || 800), api.getLatestSiteEvents(gateway, 200)]);
+    }).then(function (res) {
+      var healthRows = res[0];
+      var timeline = res[1];
+      var events = res[2];
       var byProfile = {};
-      var lastByDev = {};
-      events.forEach(function (ev) {
+      healthRows.forEach(function (ev) {
         var p = ev.device_profile_name || 'Other';
-        if (!byProfile[p]) byProfile[p] = [];
-        byProfile[p].push(ev);
-        var key = ev.dev_eui;
-        if (!lastByDev[key] || ev.time > lastByDev[key].time) lastByDev[key] = ev;
+        byProfile[p] = (byProfile[p] || 0) + 1;
       });
       var summaryHtml = '<div class="row" style="flex-wrap: wrap; gap: 0.5rem;">';
       Object.keys(byProfile).forEach(function (profile) {
-        var arr = byProfile[profile];
-        var devices = new Set(arr.map(function (e) { return e.dev_eui; })).size;
-        summaryHtml += '<span style="background: var(--border); padding: 0.25rem 0.5rem; border-radius: 4px;">' + profile + ': ' + devices + ' device(s), ' + arr.length + ' events</span>';
+        summaryHtml += '<span style="background: var(--border); padding: 0.25rem 0.5rem; border-radius: 4px;">' + profile + ': ' + byProfile[profile] + ' device(s)</span>';
       });
       summaryHtml += '</div>';
       var siteSummary = document.getElementById('site-summary');
@@ -833,14 +851,8 @@
             (config.VIEW_PROFILES[v] || []).forEach(function (p) { profileToView[p] = v; });
           });
         }
-        var uniqueDevices = [];
-        var seen = {};
-        events.forEach(function (ev) {
-          var k = ev.dev_eui;
-          if (!seen[k]) { seen[k] = true; uniqueDevices.push({ dev_eui: ev.dev_eui, device_name: ev.device_name, device_profile_name: ev.device_profile_name }); }
-        });
         siteDevicesEl.innerHTML = '';
-        uniqueDevices.forEach(function (d) {
+        healthRows.forEach(function (d) {
           var profileName = d.device_profile_name || '';
           var view = profileToView[profileName] || 'level';
           var a = document.createElement('a');
@@ -858,48 +870,37 @@
           });
           siteDevicesEl.appendChild(a);
         });
-        if (!uniqueDevices.length) siteDevicesEl.innerHTML = '<p class="meta empty-state">No devices at this site.</p>';
+        if (!healthRows.length) siteDevicesEl.innerHTML = '<p class="meta empty-state">No devices at this site.</p>';
       }
       var rssiCtx = document.getElementById('chart-site-rssi');
       if (rssiCtx && window.Chart) {
         if (state.chartSiteRssi) state.chartSiteRssi.destroy();
-        var rssiLabels = events.slice(-200).map(function (e) { return e.time; });
-        var rssiData = events.slice(-200).map(function (e) { return e.rssi != null ? e.rssi : null; });
+        var rssiLabels = events.map(function (e) { return e.time; });
+        var rssiData = events.map(function (e) { return e.rssi != null ? e.rssi : null; });
         state.chartSiteRssi = new window.Chart(rssiCtx.getContext('2d'), {
           type: 'line',
           data: { labels: rssiLabels, datasets: [{ label: 'RSSI (dBm)', data: rssiData, borderColor: '#58a6ff', tension: 0.2, spanGaps: true }] },
           options: { responsive: true, maintainAspectRatio: false, scales: { x: { display: true, ticks: { maxTicksLimit: 10 } }, y: { reverse: true, title: { display: true, text: 'RSSI (dBm)' } } } }
         });
       }
-      var healthRows = Object.keys(lastByDev).map(function (k) { return lastByDev[k]; }).sort(function (a, b) { return (b.time || '').localeCompare(a.time || ''); });
       var healthHtml = '<table style="width:100%; font-size:0.875rem; margin-top:0.5rem;"><thead><tr><th>Device</th><th>Type</th><th>Last seen</th><th>RSSI</th><th>SNR</th><th>Battery</th><th>Margin</th><th>Power</th></tr></thead><tbody>';
       healthRows.slice(0, 30).forEach(function (ev) {
-        var battery = ev.battery != null ? ev.battery : (ev.battery_normalized != null ? ev.battery_normalized : ev.battery_level_join);
-        healthHtml += '<tr><td>' + (ev.device_name || ev.dev_eui) + (ev.synthetic ? ' [Synthetic]' : '') + '</td><td>' + (ev.device_profile_name || '') + '</td><td>' + (ev.time || '').slice(0, 19) + '</td><td>' + (ev.rssi != null ? ev.rssi : '') + '</td><td>' + (ev.snr != null ? ev.snr : '') + '</td><td>' + (battery != null ? battery : '') + '</td><td>' + (ev.margin != null ? ev.margin : '') + '</td><td>' + formatPower(ev.external_power_source) + '</td></tr>';
+        healthHtml += '<tr><td>' + (ev.device_name || ev.dev_eui) + (ev.synthetic ? ' [Synthetic]' : '') + '</td><td>' + (ev.device_profile_name || '') + '</td><td>' + (ev.time || '').slice(0, 19) + '</td><td>' + (ev.rssi != null ? ev.rssi : '') + '</td><td>' + (ev.snr != null ? ev.snr : '') + '</td><td>' + (ev.battery != null ? ev.battery : '') + '</td><td>' + (ev.margin != null ? ev.margin : '') + '</td><td>' + formatPower(ev.external_power_source) + '</td></tr>';
       });
       healthHtml += '</tbody></table>';
       var siteHealth = document.getElementById('site-health');
       if (siteHealth) siteHealth.innerHTML = healthRows.length ? healthHtml : '<p class="meta empty-state">No events.</p>';
-      if (siteMeta) siteMeta.textContent = events.length + ' events total. Showing last-seen per device (up to 30).';
-      if (state.chartSite) state.chartSite.destroy();
-      var ctx = document.getElementById('chart-site');
-      if (ctx) {
-        var labels = events.slice(-100).map(function (e) { return e.time; });
-        var rssi = events.slice(-100).map(function (e) { return e.rssi != null ? e.rssi : null; });
-        state.chartSite = new window.Chart(ctx.getContext('2d'), {
-          type: 'line',
-          data: { labels: labels, datasets: [{ label: 'RSSI (last 100)', data: rssi, borderColor: '#58a6ff', tension: 0.2, spanGaps: true }] },
-          options: { responsive: true, maintainAspectRatio: false, scales: { x: { display: true, ticks: { maxTicksLimit: 8 } }, y: { reverse: true } } }
-        });
-      }
-      state.siteEventsCache = events;
+      if (siteMeta) siteMeta.textContent = (timeline && timeline.total_events != null ? timeline.total_events : 0) + ' events total. Showing last-seen per device (up to 30).';
+      drawSiteTimeline(timeline);
+      state.siteTimeline = timeline;
       var scrubWrap = document.getElementById('site-scrubber-wrap');
       var scrubber = document.getElementById('site-scrubber');
       var stateAsOf = document.getElementById('site-state-as-of');
-      if (events.length > 1) {
+      var buckets = timeline && timeline.time ? timeline.time.length : 0;
+      if (buckets > 1) {
         if (scrubWrap) scrubWrap.style.display = 'block';
-        if (scrubber) { scrubber.min = 0; scrubber.max = events.length - 1; scrubber.value = events.length - 1; scrubber.step = 1; }
-        updateSiteScrubber(events.length - 1);
+        if (scrubber) { scrubber.min = 0; scrubber.max = buckets - 1; scrubber.value = buckets - 1; scrubber.step = 1; }
+        updateSiteScrubber(buckets - 1);
       } else {
         if (scrubWrap) scrubWrap.style.display = 'none';
         if (stateAsOf) stateAsOf.style.display = 'none';
@@ -910,32 +911,70 @@
     });
   }
 
+  /** Site chart from the timeline pyramid: RSSI min–max band and mean, events per bucket as bars. */
+  function drawSiteTimeline(timeline) {
+    var state = window.LoRaWAN.state;
+    if (state.chartSite) state.chartSite.destroy();
+    state.chartSite = null;
+    var ctx = document.getElementById('chart-site');
+    if (!ctx || !window.Chart || !timeline || !timeline.time) return;
+    state.chartSite = new window.Chart(ctx.getContext('2d'), {
+      type: 'line',
+      data: {
+        labels: timeline.time,
+        datasets: [
+          { label: 'RSSI max', data: timeline.rssi_max, borderColor: 'rgba(88,166,255,0.35)', borderWidth: 1, pointRadius: 0, spanGaps: false },
+          { label: 'RSSI min', data: timeline.rssi_min, borderColor: 'rgba(88,166,255,0.35)', backgroundColor: 'rgba(88,166,255,0.15)', borderWidth: 1, pointRadius: 0, fill: '-1', spanGaps: false },
+          { label: 'RSSI mean', data: timeline.rssi_mean, borderColor: '#58a6ff', borderWidth: 1.5, pointRadius: 0, spanGaps: false },
+          { type: 'bar', label: 'Events', data: timeline.events, yAxisID: 'y1', backgroundColor: 'rgba(139,148,158,0.35)' }
+        ]
+      },
+      options: {
+        responsive: true,
+        maintainAspectRatio: false,
+        animation: false,
+        plugins: { title: { display: true, text: 'Per ' + timeline.level + ' bucket (' + timeline.total_events + ' events)' } },
+        scales: {
+          x: { display: true, ticks: { maxTicksLimit: 8, callback: function (v) { return (this.getLabelForValue(v) || '').slice(0, timeline.bucket_sec >= 86400 ? 10 : 16).replace('T', ' '); } } },
+          y: { reverse: true, title: { display: true, text: 'RSSI (dBm)' } },
+          y1: { position: 'right', beginAtZero: true, grid: { drawOnChartArea: false }, title: { display: true, text: 'Events' } }
+        }
+      }
+    });
+  }
+
+  /** Scrubber over timeline buckets: that bucket's stats, then last-seen per device up to its end (/api/site/state). */
   function updateSiteScrubber(index) {
     var state = window.LoRaWAN.state;
-    if (!state || !state.siteEventsCache || !state.siteEventsCache.length) return;
-    var events = state.siteEventsCache;
-    var i = Math.min(Math.max(0, Math.round(index)), events.length - 1);
-    var untilTime = events[i].time;
+    var api = window.LoRaWAN.api;
+    var timeline = state && state.siteTimeline;
+    if (!timeline || !timeline.time || !timeline.time.length) return;
+    var i = Math.min(Math.max(0, Math.round(index)), timeline.time.length - 1);
+    var bucketStart = timeline.time[i];
+    var untilTime = new Date(Date.parse(bucketStart) + timeline.bucket_sec * 1000).toISOString();
     var scrubberTime = document.getElementById('site-scrubber-time');
-    if (scrubberTime) scrubberTime.textContent = (untilTime || '').slice(0, 19);
-    var filtered = events.filter(function (e) { return e.time <= untilTime; });
-    var lastByDev = {};
-    filtered.forEach(function (ev) {
-      var key = ev.dev_eui;
-      if (!lastByDev[key] || ev.time > lastByDev[key].time) lastByDev[key] = ev;
-    });
-    var rows = Object.keys(lastByDev).map(function (k) { return lastByDev[k]; }).sort(function (a, b) { return (b.time || '').localeCompare(a.time || ''); });
+    if (scrubberTime) scrubberTime.textContent = bucketStart.slice(0, 16).replace('T', ' ') + ' (' + timeline.level + ')';
     var stateEl = document.getElementById('site-state-as-of');
-    if (stateEl) {
-      stateEl.style.display = 'block';
-      var html = '<p class="meta">State as of ' + (untilTime || '').slice(0, 19) + ' — ' + rows.length + ' device(s) had reported by then:</p>';
+    if (!stateEl) return;
+    stateEl.style.display = 'block';
+    var rssi = timeline.rssi_mean[i] != null ? timeline.rssi_min[i] + ' / ' + timeline.rssi_mean[i] + ' / ' + timeline.rssi_max[i] + ' dBm' : '—';
+    var bucketHtml = '<p class="meta">Bucket ' + bucketStart.slice(0, 16).replace('T', ' ') + ': ' + timeline.events[i] + ' event(s) from ' + timeline.devices[i] + ' device(s), RSSI min/mean/max ' + rssi + '</p>';
+    stateEl.innerHTML = bucketHtml;
+    // Dragging fires many requests: only the newest one renders
+    var seq = ++state.siteStateSeq;
+    api.getSiteState(timeline.gateway, untilTime).then(function (rows) {
+      if (seq !== state.siteStateSeq) return;
+      var html = bucketHtml + '<p class="meta">State as of ' + untilTime.slice(0, 19) + ' — ' + rows.length + ' device(s) had reported by then:</p>';
       html += '<table style="width:100%; font-size:0.8rem;"><thead><tr><th>Device</th><th>Type</th><th>Last seen</th></tr></thead><tbody>';
       rows.slice(0, 20).forEach(function (ev) {
         html += '<tr><td>' + (ev.device_name || ev.dev_eui) + '</td><td>' + (ev.device_profile_name || '') + '</td><td>' + (ev.time || '').slice(0, 19) + '</td></tr>';
       });
       html += '</tbody></table>';
       stateEl.innerHTML = html;
-    }
+    }).catch(function (e) {
+      if (seq !== state.siteStateSeq) return;
+      stateEl.innerHTML = bucketHtml + '<p class="meta">' + (e.name === 'AbortError' ? 'Request timed out.' : e.message) + '</p>';
+    });
   }
 
   function mergeCorrelationEvents(events) {
@@ -1005,6 +1044,97 @@
     });
   }
 
+  function escapeHtml(text) {
+    return String(text == null ? '' : text).replace(/[&<>"']/g, function (c) {
+      return { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c];
+    });
+  }
+
+  /** Replace the map layer with /api/map results for the current viewport and zoom. */
+  function drawMapViewport() {
+    var dom = window.LoRaWAN.dom;
+    var state = window.LoRaWAN.state;
+    var api = window.LoRaWAN.api;
+    var map = state.mapInstance;
+    if (!map) return;
+    var seq = (state.mapRequestSeq || 0) + 1;
+    state.mapRequestSeq = seq;
+    api.getMap(map.getBounds().toBBoxString(), map.getZoom()).then(function (res) {
+      if (seq !== state.mapRequestSeq || map !== state.mapInstance) return;  // superseded by a later pan/zoom
+      if (state.mapLayer) state.mapLayer.remove();
+      var layer = L.layerGroup();
+      (res.clusters || []).forEach(function (c) {
+        var size = c.count >= 100 ? 44 : c.count >= 10 ? 36 : 30;
+        var icon = L.divIcon({ className: 'map-cluster', html: '<span>' + c.count + '</span>', iconSize: [size, size] });
+        var m = L.marker([c.lat, c.lon], { icon: icon });
+        m.bindTooltip(c.gateways + ' gateway(s), ' + c.devices + ' device(s), ' + c.uplinks + ' uplinks');
+        m.on('click', function () {
+          var b = c.bounds;
+          if (b.south === b.north && b.west === b.east) map.setView([c.lat, c.lon], map.getZoom() + 2);
+          else map.fitBounds([[b.south, b.west], [b.north, b.east]], { padding: [20, 20] });
+        });
+        layer.addLayer(m);
+      });
+      (res.points || []).forEach(function (p) {
+        if (p.kind === 'gateway') {
+          var m = L.marker([p.lat, p.lon]);
+          m.bindPopup('<b>' + escapeHtml(p.id) + '</b><br/>' + (p.uplinks || 0) + ' events');
+          m.on('click', function () {
+            dom.gatewaySelect.value = p.id;
+            dom.gatewayCorrelationSelect.value = p.id;
+            window.LoRaWAN.setActiveView('site');
+            window.LoRaWAN.url.pushUrlState();
+          });
+          layer.addLayer(m);
+        } else {
+          var d = L.circleMarker([p.lat, p.lon], { radius: 5, weight: 1, color: '#fff', fillColor: '#f0a030', fillOpacity: 0.9 });
+          d.bindPopup('<b>' + escapeHtml(p.name || p.id) + '</b><br/>' + (p.uplinks || 0) + ' uplinks<br/>last seen ' + escapeHtml(p.last_seen || ''));
+          layer.addLayer(d);
+        }
+      });
+      layer.addTo(map);
+      state.mapLayer = layer;
+    }).catch(function (e) {
+      var mapErr = document.getElementById('map-err');
+      if (mapErr) mapErr.textContent = e.name === 'AbortError' ? 'Request timed out.' : e.message;
+    });
+  }
+
+  /** Colour of a coverage cell: mean RSSI from -120 dBm (red) to -70 dBm (green). */
+  function coverageColor(rssi) {
+    var t = Math.max(0, Math.min(1, (rssi - -120) / 50));
+    return 'hsla(' + Math.round(t * 120) + ', 85%, 45%, 0.55)';
+  }
+
+  /**
+   * Leaflet canvas layer drawing /api/coverage tiles: one square per non-empty cell coloured
+   * by mean RSSI. Past zoom 16 Leaflet scales the zoom-16 tiles (maxNativeZoom).
+   */
+  function coverageLayer() {
+    var api = window.LoRaWAN.api;
+    var Layer = L.GridLayer.extend({
+      createTile: function (coords, done) {
+        var tile = document.createElement('canvas');
+        var size = this.getTileSize();
+        tile.width = size.x;
+        tile.height = size.y;
+        api.getCoverageTile(coords.z, coords.x, coords.y).then(function (res) {
+          var ctx = tile.getContext('2d');
+          var cw = size.x / res.bins;
+          var ch = size.y / res.bins;
+          for (var i = 0; i < res.cells; i++) {
+            if (res.rssi_mean[i] == null) continue;
+            ctx.fillStyle = coverageColor(res.rssi_mean[i]);
+            ctx.fillRect(res.bx[i] * cw, res.by[i] * ch, Math.ceil(cw), Math.ceil(ch));
+          }
+          done(null, tile);
+        }).catch(function (e) { done(e, tile); });
+        return tile;
+      }
+    });
+    return new Layer({ maxNativeZoom: 16, maxZoom: 19, opacity: 1, zIndex: 5 });
+  }
+
   function loadMap() {
     var dom = window.LoRaWAN.dom;
     var state = window.LoRaWAN.state;
@@ -1012,46 +1142,43 @@
     if (!state) return;
     var mapErr = document.getElementById('map-err');
     if (mapErr) mapErr.textContent = '';
-    api.getGateways(true).then(function (gateways) {
-      var withLoc = gateways.filter(function (g) { return g.lat != null && g.lon != null; });
-      if (!withLoc.length) {
-        if (mapErr) mapErr.innerHTML = '<p class="meta empty-state">No gateway locations in dataset.</p>';
-        if (state.mapInstance) { state.mapInstance.remove(); state.mapInstance = null; }
-        state.mapMarkers = [];
-        return;
-      }
-      var container = document.getElementById('map-container');
+    Promise.all([api.getMap(null, 3), api.getGateways(false)]).then(function (results) {
+      var world = results[0];
+      var gateways = results[1];
+      var extent = world.extent;
       if (state.mapInstance) { state.mapInstance.remove(); state.mapInstance = null; }
-      (state.mapMarkers || []).forEach(function (m) { m.remove(); });
-      state.mapMarkers = [];
-      var center = withLoc[0];
-      var gatewaysForMap = withLoc;
-      requestAnimationFrame(function () {
+      state.mapLayer = null;
+      if (!extent) {
+        if (mapErr) mapErr.innerHTML = '<p class="meta empty-state">No gateway locations in dataset.</p>';
+      } else {
+        var container = document.getElementById('map-container');
         requestAnimationFrame(function () {
-          if (!container || !container.offsetParent) return;
-          state.mapInstance = L.map(container).setView([center.lat, center.lon], 3);
-          L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', { attribution: '© OpenStreetMap', maxZoom: 19 }).addTo(state.mapInstance);
-          state.mapInstance.invalidateSize();
-          gatewaysForMap.forEach(function (g) {
-            var m = L.marker([g.lat, g.lon]).addTo(state.mapInstance);
-            m.bindPopup('<b>' + g.gateway_id + '</b><br/>' + (g.event_count || 0) + ' events');
-            m.on('click', function () {
-              dom.gatewaySelect.value = g.gateway_id;
-              dom.gatewayCorrelationSelect.value = g.gateway_id;
-              window.LoRaWAN.setActiveView('site');
-              window.LoRaWAN.url.pushUrlState();
-            });
-            state.mapMarkers.push(m);
+          requestAnimationFrame(function () {
+            if (!container || !container.offsetParent) return;
+            state.mapInstance = L.map(container);
+            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', { attribution: '© OpenStreetMap', maxZoom: 19 }).addTo(state.mapInstance);
+            state.mapInstance.on('moveend', drawMapViewport);
+            state.coverageLayer = coverageLayer();
+            var coverageToggle = document.getElementById('map-coverage');
+            if (coverageToggle) {
+              if (coverageToggle.checked) state.coverageLayer.addTo(state.mapInstance);
+              coverageToggle.onchange = function () {
+                if (!state.mapInstance) return;
+                if (coverageToggle.checked) state.coverageLayer.addTo(state.mapInstance);
+                else state.coverageLayer.remove();
+              };
+            }
+            state.mapInstance.fitBounds([[extent.south, extent.west], [extent.north, extent.east]], { padding: [30, 30], maxZoom: 14 });
+            setTimeout(function () { if (state.mapInstance) state.mapInstance.invalidateSize(); }, 100);
           });
-          setTimeout(function () { if (state.mapInstance) state.mapInstance.invalidateSize(); }, 100);
         });
-      });
+      }
       dom.gatewaySelect.innerHTML = '';
       dom.gatewayCorrelationSelect.innerHTML = '';
       gateways.forEach(function (gw) {
         var opt = document.createElement('option');
         opt.value = gw.gateway_id;
-        opt.textContent = gw.gateway_id + ' (' + (gw.event_count || 0) + ' events' + (gw.lat != null ? ', ' + gw.lat.toFixed(4) + '°' : '') + ')';
+        opt.textContent = gw.gateway_id + ' (' + (gw.event_count || 0) + ' events)';
         dom.gatewaySelect.appendChild(opt);
         dom.gatewayCorrelationSelect.appendChild(opt.cloneNode(true));
       });
@@ -0,0 +1,884 @@
+#!/usr/bin/env python3
+"""
+Alert engine: declarative rules evaluated on each new uplink and on a timer, with alerts
+delivered to a local webhook.
+
+Rules (RULES, or a JSON list in the file named by the ALERT_RULES environment variable)
+each have an "id", a "type", an optional "profile" (device profile name; every device
+when omitted) and "severity" (default "warning"):
+
+- threshold {"metric", "above" and/or "below", "hysteresis"}: metric is an object_json
+  key or the rssi/snr/battery_normalized column. Fires when the value crosses, resolves
+  once it is back inside by `hysteresis`.
+- silence {"factor", "min_sec"}: no uplink for factor x the device's cadence (median of
+  its last CADENCE_SAMPLES intervals, as in data_gaps.py) and at least min_sec. Checked on
+  the timer; resolves on the next uplink.
+- door_open {"max_open_sec"}: a door sensor (open / eventType OPEN) still open after
+  max_open_sec. Checked on uplinks and the timer; resolves when it reports closed.
+  Uplinks without a door state (link checks, MAC commands) leave it unchanged.
+- anomaly {"anomalies", "cooldown_sec"}: the /api/anomalies/device types (temp_dip,
+  soil_drop, temp_swing, distance_jump, door_toggle, battery_drop) from short per-device
+  windows of past values, and the stream detectors' "ewma"/"seasonal" detections
+  (optionally limited to "metrics"). These are point events: the same rule and type is
+  sent for a device at most once per cooldown_sec. temp_swing uses the trailing window
+  (the endpoint's window is centred, but an alert can't wait for later uplinks); it and
+  door_toggle flag ordinary daily swings and door use, so the default rule leaves them out.
+
+Per-device state lives in data/cache/alerts.db next to the alerts:
+
+- alert_devices: last uplink, recent intervals and cadence, door open time, value windows
+- alert_active (rule_id, dev_eui): conditions firing now, and anomaly cooldowns; a
+  condition is notified once when it starts and once when it resolves
+- alert_log: every alert with its delivery status
+- alert_meta: uplink watermark, stream detector rowid, rate-limit bucket
+- alert_replay: uplinks written at or before the watermark, queued by on_write()
+
+The engine is an IncrementalEngine (scripts/incremental.py): refresh() evaluates the queued
+late uplinks, then up to MAX_BATCH_ROWS after the (time, event_id) watermark, and loads
+state for the devices in that batch only; history is never re-read. A late uplink is
+evaluated like any other unless the device already has a later (or same-time) one: state
+only moves forward, so that one is skipped.
+
+deliver() POSTs pending alerts as {"alerts": [...], "suppressed": n} to ALERT_WEBHOOK_URL.
+A token bucket allows ALERT_RATE_PER_MIN alerts a minute; alerts over the budget wait up
+to RATE_HOLD_SEC, then are marked suppressed and counted in the next POST. Failed POSTs
+are retried with backoff up to MAX_ATTEMPTS. Alerts about uplinks older than
+MAX_ALERT_AGE_SEC (backfill, old data) are logged as stale and not sent. Without a webhook
+alerts are only logged.
+
+scripts/api.py runs the engine in a background thread when ALERT_WEBHOOK_URL is set or
+alerts.db exists; POST /api/ingest wakes it and GET /api/alerts lists the log.
+
+Run:
+  python scripts/alert_engine.py update          # evaluate uplinks after the watermark (first run: backfill)
+  python scripts/alert_engine.py run --webhook http://localhost:9000/alerts
+  python scripts/alert_engine.py rules           # effective rules as JSON
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    from scripts.data_gaps import GAP_FACTOR, MIN_GAP_SEC
+    from scripts.incremental import IncrementalEngine
+    from scripts.stream_detectors import STATE_PATH as DETECTORS_PATH
+    from scripts import partitions
+except ImportError:  # run as python scripts/alert_engine.py
+    from data_gaps import GAP_FACTOR, MIN_GAP_SEC
+    from incremental import IncrementalEngine
+    from stream_detectors import STATE_PATH as DETECTORS_PATH
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "alerts.db"
+# Optional JSON file with the rule list (replaces RULES)
+ALERT_RULES = os.environ.get("ALERT_RULES")
+ALERT_WEBHOOK_URL = os.environ.get("ALERT_WEBHOOK_URL") or None
+ALERT_RATE_PER_MIN = float(os.environ.get("ALERT_RATE_PER_MIN", "20"))
+# Seconds between timer runs (silence, door open, stream detections, delivery)
+ALERT_CHECK_SEC = float(os.environ.get("ALERT_CHECK_SEC", "30"))
+# Alerts about older uplinks are logged as stale, not sent
+MAX_ALERT_AGE_SEC = 3600
+# Uplinks evaluated per refresh(); callers loop until caught up
+MAX_BATCH_ROWS = 50_000
+# Intervals kept per device for its cadence
+CADENCE_SAMPLES = 15
+WEBHOOK_TIMEOUT_SEC = 5
+MAX_PER_POST = 100
+MAX_ATTEMPTS = 8
+RETRY_BASE_SEC = 5
+RETRY_MAX_SEC = 600
+# Alerts over the rate budget wait this long for a token before they are suppressed
+RATE_HOLD_SEC = 60
+
+COLUMN_METRICS = ("rssi", "snr", "battery_normalized")
+SOIL_PROFILE = "Makerfabs Soil Moisture Sensor"
+CLIMATE_PROFILES = ("rbs305-ath", "Multitech RBS301 Temp Sensor")
+DOOR_PROFILE = "rbs301-dws"
+BATTERY_PROFILE = "SW3L"
+DEVICE_ANOMALIES = ("temp_dip", "soil_drop", "temp_swing", "distance_jump", "door_toggle", "battery_drop")
+STREAM_ANOMALIES = ("ewma", "seasonal")
+RULE_TYPES = ("threshold", "silence", "door_open", "anomaly")
+# Past values kept per window key for the device anomaly types (same spans as /api/anomalies/device)
+WINDOWS = {"temp": 24, "soil_val": 48, "temperature": 24, "BAT": 6}
+
+RULES = [
+    {"id": "silent", "type": "silence", "factor": GAP_FACTOR, "min_sec": MIN_GAP_SEC},
+    {"id": "door-open", "type": "door_open", "profile": DOOR_PROFILE, "max_open_sec": 600},
+    {"id": "sw3l-battery-low", "type": "threshold", "profile": BATTERY_PROFILE, "metric": "BAT",
+     "below": 3.3, "hysteresis": 0.05},
+    {"id": "device-anomalies", "type": "anomaly",
+     "anomalies": ["temp_dip", "soil_drop", "distance_jump", "battery_drop", "ewma", "seasonal"]},
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_devices (
+    dev_eui TEXT PRIMARY KEY,
+    profile TEXT,
+    last_time TEXT NOT NULL,
+    last_epoch REAL NOT NULL,
+    intervals TEXT NOT NULL,
+    cadence REAL,
+    door_open_since REAL,
+    windows TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alert_active (
+    rule_id TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    point INTEGER NOT NULL,
+    since REAL NOT NULL,
+    value REAL,
+    last_sent REAL NOT NULL,
+    repeats INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (rule_id, dev_eui)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alert_log (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    created REAL NOT NULL,
+    rule_id TEXT NOT NULL,
+    rule_type TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    state TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    profile TEXT,
+    value REAL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_alert_log_status ON alert_log(status, next_attempt);
+CREATE INDEX IF NOT EXISTS idx_alert_log_dev_time ON alert_log(dev_eui, time);
+CREATE INDEX IF NOT EXISTS idx_alert_log_time ON alert_log(time);
+CREATE TABLE IF NOT EXISTS alert_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS alert_replay (event_id TEXT PRIMARY KEY, time TEXT NOT NULL);
+"""
+
+_BATCH_SQL = """
+    SELECT dev_eui, device_profile_name, time, event_id, rssi, snr, battery_normalized, object_json
+    FROM uplinks
+    WHERE {where}
+    ORDER BY time, event_id
+"""
+
+
+def _epoch(value: str) -> float | None:
+    try:
+        t = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _duration(sec: float) -> str:
+    if sec >= 86400:
+        return f"{sec / 86400:.1f} d"
+    if sec >= 3600:
+        return f"{sec / 3600:.1f} h"
+    if sec >= 60:
+        return f"{sec / 60:.0f} min"
+    return f"{sec:.0f} s"
+
+
+def _number(value) -> float | None:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def _door_state(obj: dict) -> int | None:
+    """1 open, 0 closed, None when the payload carries no door state."""
+    value = _number(obj.get("open"))
+    if value is not None:
+        return 1 if value else 0
+    event = obj.get("eventType")
+    return 1 if event == "OPEN" else 0 if event == "CLOSED" else None
+
+
+def load_rules(path: str | None = ALERT_RULES) -> list[dict]:
+    """RULES, or the list in a JSON file, validated with defaults filled in."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            raw = json.load(f)
+    else:
+        raw = RULES
+    if not isinstance(raw, list):
+        raise ValueError("alert rules must be a JSON list")
+    rules, seen = [], set()
+    for i, rule in enumerate(raw):
+        if not isinstance(rule, dict):
+            raise ValueError(f"rule {i} is not an object")
+        kind = rule.get("type")
+        if kind not in RULE_TYPES:
+            raise ValueError(f"rule {i}: type must be one of {', '.join(RULE_TYPES)}")
+        rule = {"id": f"{kind}-{i}", "profile": None, "severity": "warning", **rule}
+        if rule["id"] in seen:
+            raise ValueError(f"duplicate rule id {rule['id']}")
+        seen.add(rule["id"])
+        if kind == "threshold":
+            if not rule.get("metric") or (_number(rule.get("above")) is None and _number(rule.get("below")) is None):
+                raise ValueError(f"rule {rule['id']}: threshold needs metric and above or below")
+            rule.setdefault("above", None)
+            rule.setdefault("below", None)
+            rule.setdefault("hysteresis", 0.0)
+        elif kind == "silence":
+            rule.setdefault("factor", GAP_FACTOR)
+            rule.setdefault("min_sec", MIN_GAP_SEC)
+        elif kind == "door_open":
+            if _number(rule.get("max_open_sec")) is None:
+                raise ValueError(f"rule {rule['id']}: door_open needs max_open_sec")
+        else:
+            names = rule.get("anomalies") or list(DEVICE_ANOMALIES)
+            unknown = set(names) - set(DEVICE_ANOMALIES) - set(STREAM_ANOMALIES)
+            if unknown:
+                raise ValueError(f"rule {rule['id']}: unknown anomalies {', '.join(sorted(unknown))}")
+            rule["anomalies"] = list(names)
+            rule.setdefault("metrics", None)
+            rule.setdefault("cooldown_sec", 3600)
+        rules.append(rule)
+    return rules
+
+
+class Device:
+    """Alert state of one device, loaded for the batch and written back after it."""
+
+    __slots__ = ("profile", "last_time", "last_epoch", "intervals", "cadence", "door_open_since", "windows")
+
+    def __init__(self, profile=None, last_time="", last_epoch=0.0, intervals=None, cadence=None,
+                 door_open_since=None, windows=None):
+        self.profile = profile
+        self.last_time = last_time
+        self.last_epoch = last_epoch
+        self.intervals = intervals if intervals is not None else []
+        self.cadence = cadence
+        self.door_open_since = door_open_since
+        self.windows = windows if windows is not None else {}
+
+    def row(self, dev: str) -> tuple:
+        return (dev, self.profile, self.last_time, self.last_epoch, json.dumps(self.intervals), self.cadence,
+                self.door_open_since, json.dumps(self.windows))
+
+
+def device_anomalies(profile: str, obj: dict, windows: dict) -> list[tuple[str, float, str]]:
+    """[(type, value, description)] for one uplink against the device's windows, then fold it in.
+
+    The rules of /api/anomalies/device, evaluated against past values instead of a re-read window.
+    """
+    found = []
+
+    def push(key, value):
+        w = windows.setdefault(key, [])
+        w.append(value)
+        if len(w) > WINDOWS[key]:
+            del w[0]
+
+    if profile == SOIL_PROFILE:
+        temp = _number(obj.get("temp"))
+        soil = _number(obj.get("soil_val"))
+        if temp is not None:
+            prev = windows.get("temp")
+            if prev and temp < min(prev) - 2:
+                found.append(("temp_dip", temp, f"Temperature dip to {temp:g}°C (drop > 2°C from recent)"))
+            push("temp", temp)
+        if soil is not None:
+            prev = windows.get("soil_val")
+            if prev and len(prev) >= 2 and max(prev) > 0:
+                pct = (max(prev) - soil) / max(prev) * 100
+                if pct > 20:
+                    found.append(("soil_drop", soil, f"Soil value dropped ~{pct:.0f}% from recent"))
+            push("soil_val", soil)
+    elif profile in CLIMATE_PROFILES:
+        temp = _number(obj.get("temperature"))
+        if temp is not None:
+            push("temperature", temp)
+            w = windows["temperature"]
+            if len(w) >= 3 and max(w) - min(w) > 2:
+                found.append(("temp_swing", temp, f"Temperature swing > 2°C in window (current {temp:g}°C)"))
+    elif "Ultrasonic" in profile or profile == "EM500-UDL":
+        dist = _number(obj.get("distance"))
+        if dist is not None:
+            prev = windows.get("distance")
+            if prev is not None and abs(dist - prev) > 50:
+                found.append(("distance_jump", dist, f"Distance jump from {prev:g} to {dist:g}"))
+            windows["distance"] = dist
+    elif profile == DOOR_PROFILE:
+        state = _door_state(obj)
+        if state is not None:
+            prev = windows.get("open")
+            if prev is not None and prev != state:
+                found.append(("door_toggle", float(state), "Door state changed"))
+            windows["open"] = state
+    elif profile == BATTERY_PROFILE:
+        bat = _number(obj.get("BAT"))
+        if bat is not None:
+            prev = windows.get("BAT")
+            if prev and bat < min(prev) - 0.2:
+                found.append(("battery_drop", bat, f"Battery drop to {bat:g}V"))
+            push("BAT", bat)
+    return found
+
+
+class AlertEngine(IncrementalEngine):
+    """Watermark-driven rule evaluation over new uplinks, timer checks and webhook delivery."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "alert"
+    REPLAY = "rows"
+    TABLES = ("alert_devices", "alert_active", "alert_log", "alert_replay", "alert_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH, rules: list[dict] | None = None, webhook: str | None = ALERT_WEBHOOK_URL,
+                 rate_per_min: float = ALERT_RATE_PER_MIN, detectors_path: Path | None = DETECTORS_PATH):
+        super().__init__(path)
+        self.rules = rules if rules is not None else load_rules()
+        self.webhook = webhook
+        self.rate_per_min = rate_per_min
+        self.detectors_path = Path(detectors_path) if detectors_path else None
+        self._wake = threading.Event()
+        self._by_profile: dict[str, dict] = {}
+
+    def _meta(self, state, key: str):
+        row = state.execute("SELECT value FROM alert_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, state, key: str, value) -> None:
+        state.execute("INSERT OR REPLACE INTO alert_meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def rules_for(self, profile: str | None) -> dict:
+        """Rules that apply to a device profile, grouped by type (cached)."""
+        key = profile or ""
+        found = self._by_profile.get(key)
+        if found is None:
+            found = {kind: [] for kind in RULE_TYPES}
+            for rule in self.rules:
+                if rule["profile"] in (None, "*", key):
+                    found[rule["type"]].append(rule)
+            found["device_anomalies"] = {
+                name for rule in found["anomaly"] for name in rule["anomalies"] if name in DEVICE_ANOMALIES
+            }
+            # object_json is decoded only when a rule of this profile reads it
+            found["needs_obj"] = bool(
+                found["door_open"] or found["device_anomalies"]
+                or any(r["metric"] not in COLUMN_METRICS for r in found["threshold"])
+            )
+            self._by_profile[key] = found
+        return found
+
+    def refresh(self, connect, now: float | None = None, max_rows: int = MAX_BATCH_ROWS) -> dict:
+        """Evaluate the queued late uplinks and up to max_rows after the watermark; returns {uplinks, firing, resolved}."""
+        now = time.time() if now is None else now
+        out = {"uplinks": 0, "firing": 0, "resolved": 0}
+
+        def fold(state, cur, replay=False):
+            rows = cur.fetchall()
+            if not rows:
+                return 0
+            devs = {r[0] for r in rows}
+            devices = self._load_devices(state, devs)
+            batch = _Batch(self._load_active(state, devs), now, self.webhook)
+            self._evaluate(rows, devices, batch, late=replay)
+            self._write(state, devices, batch)
+            out["firing"] += batch.firing
+            out["resolved"] += batch.resolved
+            return len(rows)
+
+        out["uplinks"] = self._refresh(connect, max_rows, fold)
+        return out
+
+    def _load_devices(self, state, devs: set) -> dict[str, Device]:
+        out = {}
+        for dev, profile, last_time, last_epoch, intervals, cadence, door_open_since, windows in state.execute(
+            "SELECT * FROM alert_devices WHERE dev_eui IN (SELECT value FROM json_each(?))", (json.dumps(list(devs)),)
+        ):
+            out[dev] = Device(profile, last_time, last_epoch, json.loads(intervals), cadence, door_open_since,
+                              json.loads(windows))
+        return out
+
+    def _load_active(self, state, devs: set | None) -> dict[tuple, list]:
+        sql = "SELECT rule_id, dev_eui, point, since, value, last_sent, repeats FROM alert_active"
+        args = ()
+        if devs is not None:
+            sql += " WHERE dev_eui IN (SELECT value FROM json_each(?))"
+            args = (json.dumps(list(devs)),)
+        return {(rule_id, dev): [point, since, value, last_sent, repeats]
+                for rule_id, dev, point, since, value, last_sent, repeats in state.execute(sql, args)}
+
+    def _evaluate(self, rows: list, devices: dict, batch: "_Batch", late: bool = False) -> None:
+        """late: queued rows at or before the watermark, where a same-time uplink is a re-send already seen."""
+        for dev, profile, time_val, _, rssi, snr, battery, obj_json in rows:
+            t = _epoch(time_val)
+            if t is None:
+                continue
+            d = devices.get(dev)
+            if d is None:
+                d = devices[dev] = Device(profile)
+            elif t < d.last_epoch or (late and t == d.last_epoch):
+                continue  # the device has a later uplink: state only moves forward
+            if d.last_time:
+                d.intervals.append(t - d.last_epoch)
+                if len(d.intervals) > CADENCE_SAMPLES:
+                    del d.intervals[0]
+                if len(d.intervals) >= 2:
+                    d.cadence = statistics.median(d.intervals)
+            gap = t - d.last_epoch if d.last_time else None
+            d.profile, d.last_time, d.last_epoch = profile, time_val, t
+            rules = self.rules_for(profile)
+            for rule in rules["silence"]:
+                if (rule["id"], dev) in batch.active:
+                    batch.resolve(rule, dev, profile, time_val, t, gap, f"Uplink after {_duration(gap or 0)} of silence")
+            if not rules["needs_obj"] and not rules["threshold"]:
+                continue
+            obj = {}
+            if rules["needs_obj"] and obj_json:
+                try:
+                    obj = json.loads(obj_json)
+                except json.JSONDecodeError:
+                    obj = {}
+                if not isinstance(obj, dict):
+                    obj = {}
+            for rule in rules["threshold"]:
+                metric = rule["metric"]
+                if metric in COLUMN_METRICS:
+                    value = rssi if metric == "rssi" else snr if metric == "snr" else battery
+                else:
+                    value = _number(obj.get(metric))
+                if value is None:
+                    continue
+                above, below, margin = rule["above"], rule["below"], rule["hysteresis"]
+                key = (rule["id"], dev)
+                if key in batch.active:
+                    if (above is None or value <= above - margin) and (below is None or value >= below + margin):
+                        batch.resolve(rule, dev, profile, time_val, t, value, f"{metric} back to {value:g}")
+                elif above is not None and value > above:
+                    batch.fire(rule, dev, profile, time_val, t, value, f"{metric} {value:g} above {above:g}")
+                elif below is not None and value < below:
+                    batch.fire(rule, dev, profile, time_val, t, value, f"{metric} {value:g} below {below:g}")
+            if rules["door_open"]:
+                door = _door_state(obj)
+                if door == 1 and d.door_open_since is None:
+                    d.door_open_since = t
+                elif door == 0 and d.door_open_since is not None:
+                    opened = t - d.door_open_since
+                    d.door_open_since = None
+                    for rule in rules["door_open"]:
+                        if (rule["id"], dev) in batch.active:
+                            batch.resolve(rule, dev, profile, time_val, t, opened, f"Door closed after {_duration(opened)}")
+                if d.door_open_since is not None:
+                    self._check_door(rules, dev, d, t, time_val, batch)
+            if rules["device_anomalies"]:
+                for name, value, description in device_anomalies(profile or "", obj, d.windows):
+                    if name not in rules["device_anomalies"]:
+                        continue
+                    for rule in rules["anomaly"]:
+                        if name in rule["anomalies"]:
+                            batch.point(rule, name, dev, profile, time_val, t, value, description)
+
+    def _check_door(self, rules: dict, dev: str, d: Device, t: float, time_val: str, batch: "_Batch") -> None:
+        opened = t - d.door_open_since
+        for rule in rules["door_open"]:
+            if opened > rule["max_open_sec"] and (rule["id"], dev) not in batch.active:
+                batch.fire(rule, dev, d.profile, time_val, t, opened, f"Door open for {_duration(opened)}")
+
+    def _write(self, state, devices: dict | None, batch: "_Batch") -> None:
+        if devices:
+            state.executemany("INSERT OR REPLACE INTO alert_devices VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              [d.row(dev) for dev, d in devices.items()])
+        state.executemany("DELETE FROM alert_active WHERE rule_id = ? AND dev_eui = ?", list(batch.deleted))
+        state.executemany(
+            "INSERT OR REPLACE INTO alert_active VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(rule_id, dev, *batch.active[(rule_id, dev)]) for rule_id, dev in batch.changed if (rule_id, dev) in batch.active],
+        )
+        state.executemany(
+            """
+            INSERT INTO alert_log (time, created, rule_id, rule_type, severity, state, dev_eui, profile, value, message, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            batch.log,
+        )
+
+    def check(self, now: float | None = None) -> dict:
+        """Timer checks: silent devices, doors left open and new stream detections; returns {firing, resolved}."""
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._open()
+            try:
+                state.execute("BEGIN IMMEDIATE")
+                batch = _Batch(self._load_active(state, None), now, self.webhook)
+                now_iso = _iso(now)
+                for dev, profile, last_epoch, cadence, door_open_since in state.execute(
+                    "SELECT dev_eui, profile, last_epoch, cadence, door_open_since FROM alert_devices"
+                ):
+                    rules = self.rules_for(profile)
+                    for rule in rules["silence"]:
+                        if cadence is None or (rule["id"], dev) in batch.active:
+                            continue
+                        silent = now - last_epoch
+                        if silent > max(rule["factor"] * cadence, rule["min_sec"]):
+                            batch.fire(rule, dev, profile, now_iso, now, silent,
+                                       f"No uplink for {_duration(silent)} (cadence {_duration(cadence)})")
+                    if door_open_since is not None:
+                        self._check_door(rules, dev, Device(profile, door_open_since=door_open_since), now, now_iso, batch)
+                self._detections(state, batch)
+                self._write(state, None, batch)
+                # Anomaly cooldowns that have run out
+                cooldown = max((r["cooldown_sec"] for r in self.rules if r["type"] == "anomaly"), default=0)
+                state.execute("DELETE FROM alert_active WHERE point = 1 AND last_sent < ?", (now - cooldown,))
+                state.commit()
+                return {"firing": batch.firing, "resolved": batch.resolved}
+            except BaseException:
+                state.rollback()
+                raise
+            finally:
+                state.close()
+
+    def _detections(self, state, batch: "_Batch") -> None:
+        """Stream detector events (ewma/seasonal) after the last one seen, as anomaly alerts."""
+        if self.detectors_path is None or not self.detectors_path.exists():
+            return
+        if not any(name in STREAM_ANOMALIES for rule in self.rules if rule["type"] == "anomaly" for name in rule["anomalies"]):
+            return
+        after = self._meta(state, "detector_rowid") or 0
+        det = sqlite3.connect(f"file:{self.detectors_path}?mode=ro", uri=True, timeout=30)
+        try:
+            rows = det.execute(
+                "SELECT rowid, time, dev_eui, metric, kind, value, expected, z FROM detector_events "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (after, MAX_BATCH_ROWS),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return  # detectors never ran
+        finally:
+            det.close()
+        if not rows:
+            return
+        profiles = dict(state.execute(
+            "SELECT dev_eui, profile FROM alert_devices WHERE dev_eui IN (SELECT value FROM json_each(?))",
+            (json.dumps(list({r[2] for r in rows})),),
+        ).fetchall())
+        for _, time_val, dev, metric, kind, value, expected, z in rows:
+            profile = profiles.get(dev)
+            t = _epoch(time_val)
+            if t is None:
+                continue
+            for rule in self.rules_for(profile)["anomaly"]:
+                if kind in rule["anomalies"] and (not rule["metrics"] or metric in rule["metrics"]):
+                    where = "its usual value for this hour" if kind == "seasonal" else "its recent average"
+                    batch.point(rule, f"{metric}_{kind}", dev, profile, time_val, t, value,
+                                f"{metric} {value:g} is {abs(z):.1f}σ {'above' if z > 0 else 'below'} {where} ({expected:.4g})")
+        self._set_meta(state, "detector_rowid", rows[-1][0])
+
+    def deliver(self, now: float | None = None) -> dict:
+        """POST pending alerts within the rate budget; returns {sent, suppressed, failed}."""
+        out = {"sent": 0, "suppressed": 0, "failed": 0}
+        if not self.webhook:
+            return out
+        now = time.time() if now is None else now
+        claim = self._claim(now, out)
+        if claim is None:
+            return out
+        ids, payload = claim
+        try:
+            req = urllib.request.Request(self.webhook, data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+            with urllib.request.urlopen(req, timeout=WEBHOOK_TIMEOUT_SEC):
+                ok = True
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print("Alert webhook failed:", e, file=sys.stderr)
+            ok = False
+        with self._lock:
+            state = self._open()
+            try:
+                state.execute("BEGIN IMMEDIATE")
+                if ok:
+                    state.executemany("UPDATE alert_log SET status = 'sent', attempts = attempts + 1 WHERE id = ?",
+                                      [(i,) for i in ids])
+                    left = (self._meta(state, "suppressed_unreported") or 0) - payload["suppressed"]
+                    self._set_meta(state, "suppressed_unreported", max(0, left))
+                    out["sent"] = len(ids)
+                else:
+                    for i, attempts in state.execute(
+                        "SELECT id, attempts FROM alert_log WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+                    ).fetchall():
+                        attempts += 1
+                        if attempts >= MAX_ATTEMPTS:
+                            state.execute("UPDATE alert_log SET status = 'failed', attempts = ? WHERE id = ?", (attempts, i))
+                            out["failed"] += 1
+                        else:
+                            retry_at = now + min(RETRY_BASE_SEC * 2 ** attempts, RETRY_MAX_SEC)
+                            state.execute("UPDATE alert_log SET attempts = ?, next_attempt = ? WHERE id = ?",
+                                          (attempts, retry_at, i))
+                state.commit()
+            finally:
+                state.close()
+        return out
+
+    def _claim(self, now: float, out: dict) -> tuple[list, dict] | None:
+        """Take a token per new alert, suppress what is over budget and claim the rest; (ids, payload) or None."""
+        with self._lock:
+            state = self._open()
+            try:
+                state.execute("BEGIN IMMEDIATE")
+                tokens, updated = self._meta(state, "bucket") or (self.rate_per_min, now)
+                tokens = min(self.rate_per_min, tokens + max(0.0, now - updated) * self.rate_per_min / 60)
+                # Retries (and claims left by a worker that died mid-POST) already hold a token
+                retry = state.execute(
+                    "SELECT id FROM alert_log WHERE status = 'sending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+                    (now, MAX_PER_POST),
+                ).fetchall()
+                fresh = state.execute("SELECT id, created FROM alert_log WHERE status = 'pending' ORDER BY id").fetchall()
+                n_take = max(0, min(int(tokens), MAX_PER_POST) - len(retry))
+                take = [(i,) for i, _ in fresh[:n_take]]
+                # Over budget: wait up to RATE_HOLD_SEC for tokens, then give up on the alert
+                dropped = [(i,) for i, created in fresh[n_take:] if created < now - RATE_HOLD_SEC]
+                if dropped:
+                    state.executemany("UPDATE alert_log SET status = 'suppressed' WHERE id = ?", dropped)
+                    out["suppressed"] = len(dropped)
+                unreported = (self._meta(state, "suppressed_unreported") or 0) + len(dropped)
+                self._set_meta(state, "suppressed_unreported", unreported)
+                ids = [r[0] for r in retry + take]
+                if ids or (unreported and tokens >= 1):
+                    # A POST carrying only the suppressed count costs one token
+                    tokens -= len(take) if ids else 1
+                    # Claimed until the POST can have timed out, so other workers leave these alone
+                    state.executemany(
+                        "UPDATE alert_log SET status = 'sending', next_attempt = ? WHERE id = ?",
+                        [(now + WEBHOOK_TIMEOUT_SEC + 5, i) for i in ids],
+                    )
+                    alerts = self._alerts(state, ids)
+                    for a in alerts:
+                        del a["status"]
+                    claim = ids, {"alerts": alerts, "suppressed": unreported}
+                else:
+                    claim = None
+                self._set_meta(state, "bucket", [tokens, now])
+                state.commit()
+                return claim
+            except BaseException:
+                state.rollback()
+                raise
+            finally:
+                state.close()
+
+    def _alerts(self, state, ids: list) -> list[dict]:
+        rows = state.execute(
+            """
+            SELECT id, time, rule_id, rule_type, severity, state, dev_eui, profile, value, message, status
+            FROM alert_log WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+            """,
+            (json.dumps(ids),),
+        ).fetchall()
+        return [_alert_dict(r) for r in rows]
+
+    def run_once(self, connect, now: float | None = None) -> dict:
+        """Evaluate new uplinks until caught up, run the timer checks and deliver; returns the counts."""
+        now = time.time() if now is None else now
+        out = {"uplinks": 0, "firing": 0, "resolved": 0}
+        while True:
+            step = self.refresh(connect, now)
+            for k in out:
+                out[k] += step[k]
+            if not self._advanced:
+                break
+        for k, v in self.check(now).items():
+            out[k] += v
+        out.update(self.deliver(now))
+        return out
+
+    def wake(self) -> None:
+        """Ingest hook: evaluate now instead of at the next timer tick (no-op until start())."""
+        self._wake.set()
+
+    def start(self, connect, interval_sec: float = ALERT_CHECK_SEC, on_cycle=None) -> threading.Event:
+        """Daemon thread: run_once() every interval_sec, or as soon as wake() is called."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                self._wake.clear()
+                try:
+                    counts = self.run_once(connect)
+                    if on_cycle is not None:
+                        on_cycle(counts)
+                except (sqlite3.Error, OSError) as e:
+                    print("Alert engine cycle failed:", e, file=sys.stderr)
+                self._wake.wait(interval_sec)
+
+        threading.Thread(target=run, name="alert-engine", daemon=True).start()
+        return stop
+
+    def alerts(
+        self,
+        dev_eui: str | None = None,
+        from_time: str | None = None,
+        to_time: str | None = None,
+        rule_id: str | None = None,
+        status: str | None = None,
+        limit: int = 500,
+    ) -> dict:
+        """{alerts: newest first, active: conditions firing now}."""
+        if not self.path.exists():
+            return {"alerts": [], "active": []}
+        where, args = ["1"], []
+        for cond, value in (("dev_eui = ?", dev_eui), ("time >= ?", from_time), ("time <= ?", to_time),
+                            ("rule_id = ?", rule_id), ("status = ?", status)):
+            if value:
+                where.append(cond)
+                args.append(value)
+        state = self._open()
+        try:
+            rows = state.execute(
+                f"""
+                SELECT id, time, rule_id, rule_type, severity, state, dev_eui, profile, value, message, status
+                FROM alert_log WHERE {' AND '.join(where)}
+                ORDER BY id DESC LIMIT ?
+                """,
+                args + [limit],
+            ).fetchall()
+            active = state.execute(
+                "SELECT rule_id, dev_eui, since, value FROM alert_active WHERE point = 0"
+                + (" AND dev_eui = ?" if dev_eui else "") + " ORDER BY since DESC",
+                (dev_eui,) if dev_eui else (),
+            ).fetchall()
+        finally:
+            state.close()
+        return {
+            "alerts": [_alert_dict(r) for r in rows],
+            "active": [{"rule": r, "dev_eui": d, "since": _iso(s), "value": v} for r, d, s, v in active],
+        }
+
+
+def _alert_dict(r) -> dict:
+    i, t, rule_id, rule_type, severity, state, dev, profile, value, message, status = r
+    return {
+        "id": i, "time": t, "rule": rule_id, "type": rule_type, "severity": severity, "state": state,
+        "dev_eui": dev, "device_profile_name": profile, "value": value, "message": message, "status": status,
+    }
+
+
+class _Batch:
+    """Alerts raised during one refresh()/check(), with the active set they update."""
+
+    def __init__(self, active: dict, now: float, webhook: str | None):
+        self.active = active
+        self.now = now
+        self.webhook = webhook
+        self.changed: set[tuple] = set()
+        self.deleted: set[tuple] = set()
+        self.log: list[tuple] = []
+        self.firing = 0
+        self.resolved = 0
+
+    def _status(self, t: float) -> str:
+        if t < self.now - MAX_ALERT_AGE_SEC:
+            return "stale"
+        return "pending" if self.webhook else "logged"
+
+    def _log(self, rule, rule_id, state, dev, profile, time_val, t, value, message):
+        value = None if value is None or (isinstance(value, float) and not math.isfinite(value)) else float(value)
+        self.log.append((time_val, self.now, rule_id, rule["type"], rule["severity"], state, dev, profile, value, message,
+                         self._status(t)))
+
+    def fire(self, rule, dev, profile, time_val, t, value, message):
+        key = (rule["id"], dev)
+        self.active[key] = [0, t, value, self.now, 0]
+        self.changed.add(key)
+        self.deleted.discard(key)
+        self.firing += 1
+        self._log(rule, rule["id"], "firing", dev, profile, time_val, t, value, message)
+
+    def resolve(self, rule, dev, profile, time_val, t, value, message):
+        key = (rule["id"], dev)
+        self.active.pop(key, None)
+        self.changed.discard(key)
+        self.deleted.add(key)
+        self.resolved += 1
+        self._log(rule, rule["id"], "resolved", dev, profile, time_val, t, value, message)
+
+    def point(self, rule, name, dev, profile, time_val, t, value, message):
+        """A point anomaly: logged unless the same rule/type fired for this device within cooldown_sec."""
+        key = (f"{rule['id']}/{name}", dev)
+        entry = self.active.get(key)
+        self.changed.add(key)
+        if entry is not None and t - entry[3] < rule["cooldown_sec"]:
+            entry[4] += 1
+            return
+        self.active[key] = [1, t, value, t, 0]
+        self.firing += 1
+        self._log(rule, key[0], "firing", dev, profile, time_val, t, value, message)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="alert DB (default data/cache/alerts.db)")
+    parser.add_argument("--rules", default=ALERT_RULES, help="JSON rule list (default: ALERT_RULES or built-in RULES)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="evaluate uplinks after the watermark and run the timer checks")
+    sub.add_parser("rebuild", help="reset all state and re-evaluate every uplink (nothing is sent)")
+    p_run = sub.add_parser("run", help="evaluate, check and deliver every --interval seconds")
+    p_run.add_argument("--webhook", default=ALERT_WEBHOOK_URL, help="POST alerts here (default ALERT_WEBHOOK_URL)")
+    p_run.add_argument("--interval", type=float, default=ALERT_CHECK_SEC)
+    p_run.add_argument("--once", action="store_true")
+    sub.add_parser("rules", help="print the effective rules")
+    args = parser.parse_args()
+    try:
+        rules = load_rules(args.rules)
+    except (OSError, ValueError) as e:
+        print("Bad alert rules:", e, file=sys.stderr)
+        return 1
+    if args.command == "rules":
+        print(json.dumps(rules, indent=2))
+        return 0
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    engine = AlertEngine(args.state, rules, webhook=getattr(args, "webhook", None))
+    if args.command == "rebuild":
+        engine.reset()
+    if args.command in ("update", "rebuild"):
+        t0 = time.perf_counter()
+        n = firing = resolved = 0
+        while True:
+            step = engine.refresh(connect)
+            n, firing, resolved = n + step["uplinks"], firing + step["firing"], resolved + step["resolved"]
+            if step["uplinks"] == 0:
+                break
+        elapsed = time.perf_counter() - t0
+        checked = engine.check()
+        print(f"Evaluated {n} uplinks in {elapsed:.1f}s ({n / elapsed if elapsed else 0:.0f}/s): "
+              f"{firing + checked['firing']} firing, {resolved + checked['resolved']} resolved:", args.state)
+        return 0
+    try:
+        while True:
+            print(json.dumps(engine.run_once(connect)))
+            if args.once:
+                return 0
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,70 +7,423 @@ Endpoints:
   GET /api/timeseries    — time-series for a device (dev_eui, from, to, profile)
   GET /api/profiles      — device profile names and counts
   GET /api/gateways      — gateway IDs and device counts
+  GET /api/site/timeline — per-gateway events, active devices and RSSI per bucket (1 min … 1 d pyramid)
+  GET /api/site/state    — each device's last uplink through a gateway as of a time (Site view scrubber)
+  GET /api/map           — gateway/device positions in a bbox, clustered at low zoom (R*Tree)
+  GET /api/coverage/{z}/{x}/{y} — RSSI/SNR/weak-link cells of one Web Mercator tile (heatmap overlay)
+  GET /api/health/battery-forecast — robust drain rate and depletion date per device
+  GET /api/quality       — missing fields, per-device cadence and gaps, per-gateway totals
+  GET /api/link/loss     — fCnt loss, duplicates and counter resets per device and gateway
+  GET /api/radio/stats   — RSSI/SNR percentiles, histograms and trends per gateway, device, SF or frequency
+  GET /api/anomalies/stream — EWMA / seasonal z-score anomalies from the streaming detectors
+  GET /api/alerts        — alert log (threshold, silence, door open, anomaly rules) and conditions firing now
+  POST /api/ingest       — append raw ChirpStack uplink JSON (one event or a list); needs
+                           X-Ingest-Token: <API_INGEST_TOKEN>, disabled when that is unset
+  GET /api/replica       — read-snapshot generation and staleness (READ_REPLICA=1)
+  GET /api/debug/slow-queries — statements over SLOW_QUERY_MS by total time, with query plans;
+                           needs X-Admin-Token: <API_ADMIN_TOKEN>
+  GET /metrics           — Prometheus text: route latency, per-query SQL time/rows, JSON
+                           render time, DB connections, ingest and anomaly throughput
+
+Any route can be profiled by an admin (API_ADMIN_TOKEN set): ?_profile=table|collapsed
+with an X-Admin-Token header returns a sampled profile instead of the response.
+
+Storage is data/uplinks.db, or monthly files in data/partitions/ when any exist
+(scripts/partitions.py); then each request attaches only the months its from/to needs, and
+reads longer or unbounded ranges partitions.MAX_ATTACHED months at a time, merging the results.
+With READ_REPLICA=1 (single-file storage) requests read the latest snapshot published by
+scripts/read_replica.py, so ingest never holds up dashboard queries; writes go to the DB.
+Payloads stored encoded (scripts/payload_codec.py) are decoded inside get_db() connections.
+Derived-state engines built on scripts/incremental.py are folded by a background thread
+after each POST /api/ingest and every REFRESH_SEC; their GET endpoints only read them.
+
+Event endpoints (/api/timeseries, /api/site, /api/correlation, /api/anomalies) are
+keyset-paginated on (time, event_id): each response carries `next` (opaque cursor,
+pass back as ?cursor=) and `has_more`. /api/timeseries and /api/site also take ?latest=N
+for just the newest N events (one index read from the end; dashboard sparklines).
 """
 
+import base64
+import binascii
+import hmac
 import json
+import os
 import sqlite3
+import time
+from contextlib import closing
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from fastapi import FastAPI, Query
+from fastapi import Body, FastAPI, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import csv
 import io
 
+try:
+    from scripts.http_cache import AssetStaticFiles, CompressionMiddleware
+    from scripts.ingest import extract_event, insert_rows
+    from scripts import metrics, migrations, partitions, payload_codec
+    from scripts.alert_engine import AlertEngine
+    from scripts.columnar_cache import NUMERIC_COLUMNS, ColumnarCache
+    from scripts.coverage_grid import CoverageGrid
+    from scripts import battery_forecast
+    from scripts.data_gaps import GAP_FACTOR, MAX_GAPS_PER_DEVICE, MIN_GAP_SEC, quality_report
+    from scripts.incremental import Refresher, open_windows, windows
+    from scripts.link_loss import LinkLoss
+    from scripts.radio_stats import BUCKETS as RADIO_BUCKETS, DIMENSIONS as RADIO_DIMENSIONS, RadioStats
+    from scripts.read_replica import ReadReplica
+    from scripts.site_timeline import SiteTimeline
+    from scripts.spatial_index import KINDS as MAP_KINDS, SpatialIndex
+    from scripts.stream_detectors import StreamDetectors
+    from scripts.profiling import ADMIN_TOKEN, ProfileMiddleware
+    from scripts.slow_queries import SLOW_QUERIES
+except ImportError:  # run as python scripts/api.py
+    from http_cache import AssetStaticFiles, CompressionMiddleware
+    from ingest import extract_event, insert_rows
+    import metrics
+    import migrations
+    import partitions
+    import payload_codec
+    from alert_engine import AlertEngine
+    from columnar_cache import NUMERIC_COLUMNS, ColumnarCache
+    from coverage_grid import CoverageGrid
+    import battery_forecast
+    from data_gaps import GAP_FACTOR, MAX_GAPS_PER_DEVICE, MIN_GAP_SEC, quality_report
+    from incremental import Refresher, open_windows, windows
+    from link_loss import LinkLoss
+    from radio_stats import BUCKETS as RADIO_BUCKETS, DIMENSIONS as RADIO_DIMENSIONS, RadioStats
+    from read_replica import ReadReplica
+    from site_timeline import SiteTimeline
+    from spatial_index import KINDS as MAP_KINDS, SpatialIndex
+    from stream_detectors import StreamDetectors
+    from profiling import ADMIN_TOKEN, ProfileMiddleware
+    from slow_queries import SLOW_QUERIES
+
 APP_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = APP_ROOT / "data" / "uplinks.db"
 STATIC_DIR = APP_ROOT / "app" / "static"
 FONTS_DIR = APP_ROOT / "fonts"
+# Monthly partition files (scripts/partitions.py); used instead of DB_PATH when present
+PARTITION_DIR = APP_ROOT / "data" / "partitions"
+# Shared secret for POST /api/ingest (X-Ingest-Token); the endpoint refuses writes when unset
+INGEST_TOKEN = os.environ.get("API_INGEST_TOKEN", "")
+# Shared memory-mapped per-device windows for /api/timeseries and device anomalies
+COLUMNAR = ColumnarCache(APP_ROOT / "data" / "cache" / "columnar")
+COLUMNAR_REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "api_columnar_cache_requests_total", "Columnar cache lookups by result (hit, delta, build, bypass).", ("result",)))
+metrics.REGISTRY.register(metrics.Gauge(
+    "api_columnar_cache_mapped_bytes", "Bytes of device windows mapped by this worker.",
+    fn=lambda: {(): COLUMNAR.stats()["mapped_bytes"]}))
+metrics.REGISTRY.register(metrics.Gauge(
+    "api_columnar_cache_devices", "Device windows mapped by this worker.",
+    fn=lambda: {(): COLUMNAR.stats()["devices_mapped"]}))
+# Daily fCnt loss/duplicate/reset sums, folded incrementally from the uplinks
+LINK_LOSS = LinkLoss(APP_ROOT / "data" / "cache" / "link_loss.db")
+# Daily RSSI/SNR moments and histograms per gateway, device, SF and frequency
+RADIO = RadioStats(APP_ROOT / "data" / "cache" / "radio_stats.db")
+# EWMA / hour-of-day z-score detectors with persisted per-device state
+DETECTORS = StreamDetectors(APP_ROOT / "data" / "cache" / "detectors.db")
+# Rule evaluation and webhook delivery (ALERT_WEBHOOK_URL); runs in a background thread once enabled
+ALERTS = AlertEngine(APP_ROOT / "data" / "cache" / "alerts.db", detectors_path=DETECTORS.path)
+ALERT_EVENTS = metrics.REGISTRY.register(metrics.Counter(
+    "api_alert_engine_total", "Alert engine counts: uplinks evaluated, alerts firing/resolved, webhook sent/suppressed/failed.",
+    ("event",)))
+# R*Tree of gateway/device positions for /api/map viewport queries
+SPATIAL = SpatialIndex(APP_ROOT / "data" / "cache" / "spatial.db")
+# Per-gateway 1 min / 15 min / 1 h / 1 d buckets for the Site view chart and scrubber
+SITE_TIMELINE = SiteTimeline(APP_ROOT / "data" / "cache" / "site_timeline.db")
+# Daily RSSI/SNR cells of located uplinks on a Web Mercator tile pyramid for the coverage overlay
+COVERAGE = CoverageGrid(APP_ROOT / "data" / "cache" / "coverage.db")
+# READ_REPLICA=1: reads go to snapshots of DB_PATH in data/replica/, refreshed every few seconds
+REPLICA = ReadReplica(DB_PATH, APP_ROOT / "data" / "replica") if os.environ.get("READ_REPLICA", "0") not in ("", "0") else None
+if REPLICA is not None:
+    metrics.REGISTRY.register(metrics.Gauge(
+        "api_replica_lag_seconds", "Age of the read snapshot while the primary has newer writes (0 when current).",
+        fn=lambda: {(): REPLICA.status().get("lag_sec", 0.0)}))
+# JSON/CSV API responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+# /api/quality reports kept per worker (reused until the DB files change)
+QUALITY_CACHE_SIZE = 16
+_quality_cache: dict[tuple, tuple] = {}
+# Battery forecasts kept per worker (refitted when the DB files change)
+BATTERY_CACHE_SIZE = 8
+_battery_cache: dict[tuple, tuple] = {}
+
+
+def use_cache_dir(cache_dir: Path) -> None:
+    """Point every cache and derived-state singleton at cache_dir (bench_api runs against its own DB).
+
+    Engine settings (alert rules, webhook, rate) carry over; the per-worker report caches are cleared.
+    """
+    global COLUMNAR, LINK_LOSS, RADIO, DETECTORS, ALERTS, SPATIAL, SITE_TIMELINE, COVERAGE
+    cache_dir = Path(cache_dir)
+    COLUMNAR = ColumnarCache(cache_dir / "columnar")
+    LINK_LOSS = LinkLoss(cache_dir / "link_loss.db")
+    RADIO = RadioStats(cache_dir / "radio_stats.db")
+    DETECTORS = StreamDetectors(cache_dir / "detectors.db")
+    ALERTS = AlertEngine(cache_dir / "alerts.db", rules=ALERTS.rules, webhook=ALERTS.webhook,
+                         rate_per_min=ALERTS.rate_per_min, detectors_path=DETECTORS.path)
+    SPATIAL = SpatialIndex(cache_dir / "spatial.db")
+    SITE_TIMELINE = SiteTimeline(cache_dir / "site_timeline.db")
+    COVERAGE = CoverageGrid(cache_dir / "coverage.db")
+    _quality_cache.clear()
+    _battery_cache.clear()
+
 
+def get_db(from_time: str | None = None, to_time: str | None = None):
+    """Read connection. With monthly partitions present, only months overlapping from/to are attached.
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    object_json reads as text even where it is stored encoded (scripts/payload_codec.py).
+    """
+    if PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        conn = partitions.connect(PARTITION_DIR, from_time, to_time, factory=metrics.TimedConnection)
+    else:
+        if REPLICA is not None and REPLICA.available():
+            conn = REPLICA.connect(factory=metrics.TimedConnection)
+        else:
+            conn = sqlite3.connect(DB_PATH, factory=metrics.TimedConnection)
+        payload_codec.install(conn)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def ensure_synthetic_column():
-    """Add synthetic column if missing (for DBs created before synthetic was added)."""
-    if not DB_PATH.is_file():
-        return
-    conn = sqlite3.connect(DB_PATH)
+def _read_windows(from_time: str | None = None, to_time: str | None = None):
+    """get_db() connections over [from_time, to_time], oldest first, each closed before the next.
+
+    One, unless the range overlaps more partitions than partitions.MAX_ATTACHED; unbounded
+    reads (device list, passport, gateways) go through here so they work past that.
+    """
+    return windows(get_db, from_time, to_time)
+
+
+def _open_windows(from_time: str | None = None, to_time: str | None = None) -> list:
+    """The _read_windows() connections all open at once, for scans that merge them; caller closes."""
+    return open_windows(get_db, from_time, to_time)
+
+
+def _fetch_ascending(name: str, sql: str, args: list, from_time: str | None, to_time: str | None) -> list:
+    """Rows of a time-ascending query ending in LIMIT ?, read window by window until the limit is met.
+
+    from_time is where rows can start (the cursor's time when paging): older months aren't opened.
+    """
+    limit, rows = args[-1], []
+    with closing(_read_windows(from_time, to_time)) as conns:
+        for conn in conns:
+            rows.extend(conn.fetchall(name, sql, args[:-1] + [limit - len(rows)]))
+            if len(rows) >= limit:
+                break
+    return rows
+
+
+def _fetch_descending(name: str, sql: str, args: list, from_time: str | None, to_time: str | None) -> list:
+    """Rows of a time-descending query ending in LIMIT ?, newest window first until the limit is met."""
+    limit, rows = args[-1], []
+    conns = _open_windows(from_time, to_time)
     try:
-        conn.execute("ALTER TABLE uplinks ADD COLUMN synthetic INTEGER")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass  # column already exists
+        for conn in reversed(conns):
+            rows.extend(conn.fetchall(name, sql, args[:-1] + [limit - len(rows)]))
+            if len(rows) >= limit:
+                break
+    finally:
+        for conn in conns:
+            conn.close()
+    return rows
+
+
+def _latest_with_cursor() -> JSONResponse:
+    return JSONResponse(status_code=400, content={"error": "latest returns one page: drop cursor"})
+
+
+def get_primary_db():
+    """Write connection to DB_PATH (get_db() may be a read snapshot)."""
+    return sqlite3.connect(DB_PATH, factory=metrics.TimedConnection)
+
+
+def _storage_stamp() -> tuple:
+    """Changes whenever a write lands in the files get_db() reads (DB, partitions or snapshot)."""
+    if PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        paths = [p for _, p in partitions.list_partitions(PARTITION_DIR)]
+    elif REPLICA is not None and REPLICA.available():
+        paths = [REPLICA.snapshot]
+    else:
+        paths = [DB_PATH]
+    stamp = []
+    for path in paths:
+        try:
+            st = path.stat()
+            stamp.append((str(path), st.st_mtime_ns, st.st_size))
+        except OSError:
+            pass
+    return tuple(stamp)
+
+
+def _storage_identity() -> str:
+    """Which files get_db() reads, by path and inode (a replica snapshot counts as its primary).
+
+    Unlike _storage_stamp() it ignores writes and changes only when a DB file is replaced or a
+    partition is added or dropped; the columnar cache keys device windows by it.
+    """
+    if PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        paths = [p for _, p in partitions.list_partitions(PARTITION_DIR)]
+    else:
+        paths = [DB_PATH]
+    parts = []
+    for path in paths:
+        try:
+            parts.append(f"{path}@{path.stat().st_ino}")
+        except OSError:
+            parts.append(f"{path}@-")
+    return "|".join(parts)
+
+
+def ensure_schema():
+    """Migrate the DB and partitions to the current schema version; one pragma read each when current."""
+    paths = [DB_PATH]
+    if PARTITION_DIR is not None:
+        paths += [p for _, p in partitions.list_partitions(PARTITION_DIR)]
+    for path in paths:
+        migrations.migrate_path(path)
+
+
+def _encode_cursor(time_val: str, event_id: str) -> str:
+    """Opaque keyset cursor for the last row of a page."""
+    raw = json.dumps([time_val, event_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, str] | None:
+    """(time, event_id) from a cursor; None if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        time_val, event_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(time_val, str) or not isinstance(event_id, str):
+        return None
+    return time_val, event_id
+
+
+def _invalid_cursor(cursor: str) -> JSONResponse:
+    return JSONResponse(status_code=400, content={"error": "Invalid cursor", "cursor": cursor})
+
+
+def _columnar_view(dev_eui: str, from_time: str | None):
+    """Cached device window covering from_time onward, or None (caller reads SQL).
+
+    The cache checks and builds windows against the device's whole history, so it reads all of
+    storage; bypassed when that is more partitions than one connection attaches.
+    """
+    try:
+        conn = get_db()
+    except partitions.PartitionLimitError:
+        COLUMNAR_REQUESTS.inc(1, "bypass")
+        return None
+    try:
+        view, result = COLUMNAR.get(conn, dev_eui, _storage_identity())
     finally:
         conn.close()
+    if view is None or not view.covers(from_time):
+        COLUMNAR_REQUESTS.inc(1, "bypass")
+        return None
+    COLUMNAR_REQUESTS.inc(1, result)
+    return view
 
 
-app = FastAPI(title="LoRaWAN Dataset API", version="0.1.0")
+def _num_json(values: list, as_int: bool) -> list[str]:
+    """JSON numbers for a float64 column slice (NaN = NULL)."""
+    if as_int:
+        return ["null" if v != v else str(int(v)) for v in values]
+    return ["null" if v != v else repr(v) for v in values]
+
+
+def _timeseries_from_columnar(view, sel, limit: int) -> Response:
+    """/api/timeseries page rendered straight from mapped columns; object JSON is spliced, not re-encoded."""
+    t0 = time.perf_counter()
+    part = view.rows[sel]
+    has_more = len(part) > limit
+    part = part[:limit]
+    times = [t.decode() for t in part["time"].tolist()]
+    cols = [(name, _num_json(part[name].tolist(), as_int)) for name, as_int in NUMERIC_COLUMNS]
+    offs = part["obj_off"].tolist()
+    lens = part["obj_len"].tolist()
+    blob = view.blob
+    events = []
+    for i, t in enumerate(times):
+        obj = blob[offs[i]:offs[i] + lens[i]].tobytes().decode() if lens[i] >= 0 else "null"
+        fields = "".join(f',"{name}":{vals[i]}' for name, vals in cols)
+        events.append(f'{{"time":{json.dumps(t)},"object":{obj}{fields}}}')
+    next_cursor = _encode_cursor(times[-1], part["event_id"][-1].decode()) if has_more else None
+    body = '{"events":[' + ",".join(events) + '],"next":' + json.dumps(next_cursor) + ',"has_more":' + ("true" if has_more else "false") + "}"
+    metrics.record_json_render(time.perf_counter() - t0)
+    return Response(body.encode("utf-8"), media_type="application/json")
+
+
+def _page(rows: list, limit: int) -> tuple[list, str | None, bool]:
+    """Split limit+1 fetched rows into (page, next cursor, has_more)."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1]["time"], rows[-1]["event_id"]) if has_more else None
+    return rows, next_cursor, has_more
+
+
+app = FastAPI(title="LoRaWAN Dataset API", version="0.1.0", default_response_class=metrics.TimedJSONResponse)
 
 
 @app.on_event("startup")
 def on_startup():
-    ensure_synthetic_column()
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+    ensure_schema()
+    if PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        partitions.start_compactor(PARTITION_DIR)
+    elif REPLICA is not None:
+        if not REPLICA.available() and REPLICA.acquire_publisher():
+            REPLICA.publish()
+        REPLICA.start()
+    REFRESHER.start()
+    if ALERTS.webhook or ALERTS.path.exists():
+        ALERTS.start(get_db, on_cycle=_count_alerts)
+    for route in app.routes:
+        if isinstance(getattr(route, "app", None), AssetStaticFiles):
+            route.app.precompress()
+# Cross-origin pages may read; no cross-origin writes (the ingest preflight is refused)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "HEAD"], allow_headers=["*"])
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+app.add_middleware(metrics.MetricsMiddleware)
+if ADMIN_TOKEN:
+    # ?_profile=table|collapsed with X-Admin-Token; not installed (zero cost) without a token
+    app.add_middleware(ProfileMiddleware, token=ADMIN_TOKEN)
+
+
+@app.exception_handler(partitions.PartitionLimitError)
+def partition_limit(_request: Request, e: partitions.PartitionLimitError):
+    """A query spanning more months than can be attached fails instead of reading part of them."""
+    return JSONResponse(status_code=400, content={"error": str(e), "months": len(e.months)})
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus text exposition of the in-process metrics."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/api/profiles")
 def list_profiles():
     """Device profile names and event counts."""
-    conn = get_db()
-    rows = conn.execute(
-        """
-        SELECT device_profile_name AS profile, COUNT(*) AS count
-        FROM uplinks
-        WHERE device_profile_name IS NOT NULL
-        GROUP BY device_profile_name
-        ORDER BY count DESC
-        """
-    ).fetchall()
-    conn.close()
-    return [{"profile": r["profile"], "count": r["count"]} for r in rows]
+    counts = {}
+    for conn in _read_windows():
+        rows = conn.fetchall(
+            "profiles",
+            """
+            SELECT device_profile_name AS profile, COUNT(*) AS count
+            FROM uplinks
+            WHERE device_profile_name IS NOT NULL
+            GROUP BY device_profile_name
+            ORDER BY count DESC
+            """
+        )
+        for r in rows:
+            counts[r["profile"]] = counts.get(r["profile"], 0) + r["count"]
+    return [{"profile": p, "count": c} for p, c in sorted(counts.items(), key=lambda x: -x[1])]
 
 
 @app.get("/api/devices")
@@ -79,81 +432,84 @@ def list_devices(
     include_health: bool = Query(False, description="Include last rssi, snr, battery, margin"),
 ):
     """List devices with last_seen; optionally last rssi, snr, battery (payload or join), margin."""
-    conn = get_db()
-    if include_health:
-        # One row per dev_eui with latest time; attach that row's rssi, snr, battery, margin
-        sub_where = " WHERE device_profile_name = ?" if profile else ""
-        outer_where = " WHERE u.device_profile_name = ?" if profile else ""
-        rows = conn.execute(
-            """
-            SELECT u.dev_eui, u.device_name, u.device_profile_name, u.time AS last_seen,
-                   u.rssi, u.snr, u.battery_normalized, u.battery_level_join, u.margin, u.external_power_source,
-                   COALESCE(u.synthetic, 0) AS synthetic
-            FROM uplinks u
-            INNER JOIN (
-                SELECT dev_eui, MAX(time) AS mt FROM uplinks
-                """ + sub_where + """
+    # Per window, then the newest window a device appears in wins (windows run oldest first)
+    latest = {}
+    for conn in _read_windows():
+        if include_health:
+            # One row per dev_eui with latest time; attach that row's rssi, snr, battery, margin
+            sub_where = " WHERE device_profile_name = ?" if profile else ""
+            outer_where = " WHERE u.device_profile_name = ?" if profile else ""
+            rows = conn.fetchall(
+                "devices_health",
+                """
+                SELECT u.dev_eui, u.device_name, u.device_profile_name, u.time AS last_seen,
+                       u.rssi, u.snr, u.battery_normalized, u.battery_level_join, u.margin, u.external_power_source,
+                       COALESCE(u.synthetic, 0) AS synthetic
+                FROM uplinks u
+                INNER JOIN (
+                    SELECT dev_eui, MAX(time) AS mt FROM uplinks
+                    """ + sub_where + """
+                    GROUP BY dev_eui
+                ) m ON u.dev_eui = m.dev_eui AND u.time = m.mt
+                """ + outer_where + """
+                ORDER BY u.time DESC
+                """,
+                [profile, profile] if profile else [],
+            )
+            seen = set()
+            for r in rows:
+                if r["dev_eui"] in seen:
+                    continue
+                seen.add(r["dev_eui"])
+                battery = r["battery_normalized"] if r["battery_normalized"] is not None else r["battery_level_join"]
+                latest[r["dev_eui"]] = {
+                    "dev_eui": r["dev_eui"],
+                    "device_name": r["device_name"],
+                    "device_profile_name": r["device_profile_name"],
+                    "last_seen": r["last_seen"],
+                    "rssi": r["rssi"],
+                    "snr": r["snr"],
+                    "battery": battery,
+                    "margin": r["margin"],
+                    "external_power_source": r["external_power_source"],
+                    "synthetic": 1 if (r["synthetic"]) else 0,
+                }
+            continue
+        if profile:
+            rows = conn.fetchall(
+                "devices_by_profile",
+                """
+                SELECT dev_eui, device_name, device_profile_name, MAX(time) AS last_seen,
+                       MAX(COALESCE(synthetic, 0)) AS synthetic
+                FROM uplinks
+                WHERE device_profile_name = ?
                 GROUP BY dev_eui
-            ) m ON u.dev_eui = m.dev_eui AND u.time = m.mt
-            """ + outer_where + """
-            ORDER BY u.time DESC
-            """,
-            [profile, profile] if profile else [],
-        ).fetchall()
-        out = []
-        seen = set()
+                ORDER BY last_seen DESC
+                """,
+                (profile,),
+            )
+        else:
+            rows = conn.fetchall(
+                "devices",
+                """
+                SELECT dev_eui, device_name, device_profile_name, MAX(time) AS last_seen,
+                       MAX(COALESCE(synthetic, 0)) AS synthetic
+                FROM uplinks
+                GROUP BY dev_eui
+                ORDER BY last_seen DESC
+                """
+            )
         for r in rows:
-            if r["dev_eui"] in seen:
-                continue
-            seen.add(r["dev_eui"])
-            battery = r["battery_normalized"] if r["battery_normalized"] is not None else r["battery_level_join"]
-            out.append({
+            synthetic = 1 if (r["synthetic"]) else 0
+            earlier = latest.get(r["dev_eui"])
+            latest[r["dev_eui"]] = {
                 "dev_eui": r["dev_eui"],
                 "device_name": r["device_name"],
                 "device_profile_name": r["device_profile_name"],
                 "last_seen": r["last_seen"],
-                "rssi": r["rssi"],
-                "snr": r["snr"],
-                "battery": battery,
-                "margin": r["margin"],
-                "external_power_source": r["external_power_source"],
-                "synthetic": 1 if (r["synthetic"]) else 0,
-            })
-        conn.close()
-        return out
-    if profile:
-        rows = conn.execute(
-            """
-            SELECT dev_eui, device_name, device_profile_name, MAX(time) AS last_seen,
-                   MAX(COALESCE(synthetic, 0)) AS synthetic
-            FROM uplinks
-            WHERE device_profile_name = ?
-            GROUP BY dev_eui
-            ORDER BY last_seen DESC
-            """,
-            (profile,),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            """
-            SELECT dev_eui, device_name, device_profile_name, MAX(time) AS last_seen,
-                   MAX(COALESCE(synthetic, 0)) AS synthetic
-            FROM uplinks
-            GROUP BY dev_eui
-            ORDER BY last_seen DESC
-            """
-        ).fetchall()
-    conn.close()
-    return [
-        {
-            "dev_eui": r["dev_eui"],
-            "device_name": r["device_name"],
-            "device_profile_name": r["device_profile_name"],
-            "last_seen": r["last_seen"],
-            "synthetic": 1 if (r["synthetic"]) else 0,
-        }
-        for r in rows
-    ]
+                "synthetic": max(synthetic, earlier["synthetic"]) if earlier else synthetic,
+            }
+    return sorted(latest.values(), key=lambda d: d["last_seen"], reverse=True)
 
 
 @app.get("/api/timeseries")
@@ -163,9 +519,20 @@ def get_timeseries(
     to_time: str | None = Query(None, alias="to"),
     f_port: int | None = Query(None, description="Filter by fPort"),
     limit: int = Query(5000, ge=1, le=20000),
+    cursor: str | None = Query(None, description="Cursor from the previous page's next"),
+    latest: int | None = Query(None, ge=1, le=1000, description="Only the newest N events (still oldest first; no next page)"),
 ):
-    """Time-series for a device: time, object, rssi, snr, battery_normalized, f_port, frequency, spreading_factor."""
-    conn = get_db()
+    """Time-series page for a device: {events: [time, object, rssi, snr, battery_normalized, f_port, frequency, spreading_factor], next, has_more}."""
+    after = None
+    if cursor:
+        if latest is not None:
+            return _latest_with_cursor()
+        after = _decode_cursor(cursor)
+        if after is None:
+            return _invalid_cursor(cursor)
+    view = _columnar_view(dev_eui, from_time) if latest is None else None
+    if view is not None:
+        return _timeseries_from_columnar(view, view.select(from_time, to_time, after, f_port, limit + 1), limit)
     args = [dev_eui]
     where = "dev_eui = ?"
     if from_time:
@@ -177,18 +544,36 @@ def get_timeseries(
     if f_port is not None:
         where += " AND f_port = ?"
         args.append(f_port)
-    args.append(limit)
-    rows = conn.execute(
-        f"""
-        SELECT time, object_json, rssi, snr, battery_normalized, f_port, frequency, spreading_factor
-        FROM uplinks
-        WHERE {where}
-        ORDER BY time ASC
-        LIMIT ?
-        """,
-        args,
-    ).fetchall()
-    conn.close()
+    columns = "event_id, time, object_json, rssi, snr, battery_normalized, f_port, frequency, spreading_factor"
+    if latest is not None:
+        args.append(latest)
+        rows = _fetch_descending(
+            "timeseries_latest",
+            f"SELECT {columns} FROM uplinks WHERE {where} ORDER BY time DESC, event_id DESC LIMIT ?",
+            args,
+            from_time,
+            to_time,
+        )
+        rows, next_cursor, has_more = rows[::-1], None, False
+    else:
+        if after:
+            where += " AND (time, event_id) > (?, ?)"
+            args.extend(after)
+        args.append(limit + 1)
+        rows = _fetch_ascending(
+            "timeseries_page",
+            f"""
+            SELECT {columns}
+            FROM uplinks
+            WHERE {where}
+            ORDER BY time ASC, event_id ASC
+            LIMIT ?
+            """,
+            args,
+            after[0] if after else from_time,
+            to_time,
+        )
+        rows, next_cursor, has_more = _page(rows, limit)
     out = []
     for r in rows:
         obj = json.loads(r["object_json"]) if r["object_json"] else None
@@ -204,68 +589,98 @@ def get_timeseries(
                 "spreading_factor": r["spreading_factor"],
             }
         )
-    return out
+    return {"events": out, "next": next_cursor, "has_more": has_more}
 
 
 @app.get("/api/gateways")
 def list_gateways(
-    with_location: bool = Query(False, alias="with_location", description="Include representative lat/lon/alt per gateway"),
+    with_location: bool = Query(False, alias="with_location", description="Include lat/lon/alt per gateway (latest reported, from the spatial index)"),
 ):
-    """Gateway IDs and event count; optionally representative location (from uplinks that have location)."""
-    conn = get_db()
-    rows = conn.execute(
-        "SELECT gateway_ids FROM uplinks WHERE gateway_ids IS NOT NULL"
-    ).fetchall()
+    """Gateway IDs and event count; optionally each gateway's location from the spatial index."""
     counts = {}
-    for r in rows:
-        try:
-            gids = json.loads(r["gateway_ids"])
-            for gid in gids:
-                counts[gid] = counts.get(gid, 0) + 1
-        except (json.JSONDecodeError, TypeError):
-            pass
-    out = [{"gateway_id": gid, "event_count": c} for gid, c in sorted(counts.items(), key=lambda x: -x[1])]
-    if with_location:
-        loc_rows = conn.execute(
-            """
-            SELECT gateway_ids, location_lat, location_lon, location_alt
-            FROM uplinks
-            WHERE gateway_ids IS NOT NULL AND location_lat IS NOT NULL AND location_lon IS NOT NULL
-            ORDER BY time ASC
-            """
-        ).fetchall()
-        loc_by_gw = {}
-        for r in loc_rows:
+    for conn in _read_windows():
+        rows = conn.fetchall("gateway_ids", "SELECT gateway_ids FROM uplinks WHERE gateway_ids IS NOT NULL")
+        for r in rows:
             try:
                 gids = json.loads(r["gateway_ids"])
                 for gid in gids:
-                    if gid not in loc_by_gw:
-                        loc_by_gw[gid] = {
-                            "lat": r["location_lat"],
-                            "lon": r["location_lon"],
-                            "alt": r["location_alt"],
-                        }
+                    counts[gid] = counts.get(gid, 0) + 1
             except (json.JSONDecodeError, TypeError):
                 pass
+    out = [{"gateway_id": gid, "event_count": c} for gid, c in sorted(counts.items(), key=lambda x: -x[1])]
+    if with_location:
+        _use(SPATIAL)
+        loc_by_gw = SPATIAL.gateway_locations()
         for g in out:
-            gid = g["gateway_id"]
-            if gid in loc_by_gw:
-                g["lat"] = loc_by_gw[gid]["lat"]
-                g["lon"] = loc_by_gw[gid]["lon"]
-                g["alt"] = loc_by_gw[gid]["alt"]
-    conn.close()
+            loc = loc_by_gw.get(g["gateway_id"])
+            if loc:
+                g.update(loc)
     return out
 
 
+@app.get("/api/map")
+def get_map(
+    bbox: str | None = Query(None, description="west,south,east,north in degrees (Leaflet toBBoxString); whole world if omitted"),
+    zoom: int = Query(3, ge=0, le=22),
+    kind: str = Query("all", pattern="^(all|gateway|device)$"),
+):
+    """Gateway/device positions inside the viewport from the R*Tree index; clustered server-side below the cluster zoom."""
+    if bbox:
+        try:
+            west, south, east, north = (float(v) for v in bbox.split(","))
+        except ValueError:
+            return JSONResponse(status_code=400, content={"error": "bbox must be west,south,east,north"})
+        if not (-90 <= south <= north <= 90):
+            return JSONResponse(status_code=400, content={"error": "bbox latitudes out of range"})
+        # Leaflet keeps counting past +/-180 when panning across the antimeridian
+        if east - west >= 360:
+            west, east = -180.0, 180.0
+        else:
+            west = (west + 180) % 360 - 180
+            east = (east + 180) % 360 - 180
+    else:
+        west, south, east, north = -180.0, -90.0, 180.0, 90.0
+    kinds = MAP_KINDS if kind == "all" else (kind,)
+    _use(SPATIAL)
+    out = SPATIAL.query(south, west, north, east, zoom, kinds)
+    out["zoom"] = zoom
+    out["extent"] = SPATIAL.extent(kinds)
+    return out
+
+
+@app.get("/api/coverage/{z}/{x}/{y}")
+def get_coverage_tile(
+    z: int,
+    x: int,
+    y: int,
+    from_time: str | None = Query(None, alias="from", description="First day (ISO date/time); default: all history"),
+    to_time: str | None = Query(None, alias="to", description="Last day, inclusive"),
+):
+    """Non-empty cells of tile z/x/y (z up to 16; the map scales those tiles past it) as columns: bx, by, uplinks, rssi/snr mean/min/max and weak_pct."""
+    _use(COVERAGE)
+    try:
+        return COVERAGE.tile(z, x, y, from_time, to_time)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
 @app.get("/api/site")
 def get_site_events(
     gateway: str = Query(..., description="Gateway ID"),
     from_time: str | None = Query(None, alias="from"),
     to_time: str | None = Query(None, alias="to"),
     limit: int = Query(5000, ge=1, le=20000),
+    cursor: str | None = Query(None, description="Cursor from the previous page's next"),
+    latest: int | None = Query(None, ge=1, le=1000, description="Only the newest N events (still oldest first; no next page)"),
 ):
-    """All events seen by this gateway (for site view). Returns time, dev_eui, device_name, device_profile_name, object, rssi, snr, battery (coalesced), margin, external_power_source."""
-    conn = get_db()
+    """Events seen by this gateway (for site view), one page at a time: {events, next, has_more}. Each event has time, dev_eui, device_name, device_profile_name, object, rssi, snr, battery (coalesced), margin, external_power_source."""
+    after = None
+    if cursor:
+        if latest is not None:
+            return _latest_with_cursor()
+        after = _decode_cursor(cursor)
+        if after is None:
+            return _invalid_cursor(cursor)
     args = [gateway]
     where = "EXISTS (SELECT 1 FROM json_each(uplinks.gateway_ids) j WHERE j.value = ?)"
     if from_time:
@@ -274,19 +689,37 @@ def get_site_events(
     if to_time:
         where += " AND uplinks.time <= ?"
         args.append(to_time)
-    args.append(limit)
-    rows = conn.execute(
-        f"""
-        SELECT time, dev_eui, device_name, device_profile_name, object_json, rssi, snr, battery_normalized, battery_level_join, margin, external_power_source,
-               COALESCE(synthetic, 0) AS synthetic
-        FROM uplinks
-        WHERE {where}
-        ORDER BY time ASC
-        LIMIT ?
-        """,
-        args,
-    ).fetchall()
-    conn.close()
+    columns = """event_id, time, dev_eui, device_name, device_profile_name, object_json, rssi, snr, battery_normalized, battery_level_join, margin, external_power_source,
+               COALESCE(synthetic, 0) AS synthetic"""
+    if latest is not None:
+        args.append(latest)
+        rows = _fetch_descending(
+            "site_latest",
+            f"SELECT {columns} FROM uplinks WHERE {where} ORDER BY time DESC, event_id DESC LIMIT ?",
+            args,
+            from_time,
+            to_time,
+        )
+        rows, next_cursor, has_more = rows[::-1], None, False
+    else:
+        if after:
+            where += " AND (uplinks.time, uplinks.event_id) > (?, ?)"
+            args.extend(after)
+        args.append(limit + 1)
+        rows = _fetch_ascending(
+            "site_page",
+            f"""
+            SELECT {columns}
+            FROM uplinks
+            WHERE {where}
+            ORDER BY time ASC, event_id ASC
+            LIMIT ?
+            """,
+            args,
+            after[0] if after else from_time,
+            to_time,
+        )
+        rows, next_cursor, has_more = _page(rows, limit)
     out = []
     for r in rows:
         obj = json.loads(r["object_json"]) if r["object_json"] else None
@@ -306,7 +739,81 @@ def get_site_events(
             "external_power_source": r["external_power_source"],
             "synthetic": 1 if (r["synthetic"]) else 0,
         })
-    return out
+    return {"events": out, "next": next_cursor, "has_more": has_more}
+
+
+@app.get("/api/site/timeline")
+def get_site_timeline(
+    gateway: str = Query(..., description="Gateway ID"),
+    from_time: str | None = Query(None, alias="from", description="Range start (ISO time); default: first bucket"),
+    to_time: str | None = Query(None, alias="to", description="Range end (ISO time); default: end of the last day"),
+    width: int = Query(800, ge=10, le=20000, description="Chart width in pixels: at most one bucket per pixel"),
+):
+    """Dense per-bucket columns (time, events, devices, rssi_min/mean/max) at the finest pyramid level that fits the width; level and bucket_sec say which."""
+    _use(SITE_TIMELINE)
+    try:
+        return SITE_TIMELINE.timeline(gateway, from_time, to_time, width)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
+@app.get("/api/site/state")
+def get_site_state(
+    gateway: str = Query(..., description="Gateway ID"),
+    at: str | None = Query(None, description="ISO time; default: the latest uplinks"),
+):
+    """Each device the gateway has heard, with its last uplink through that gateway at or before `at` (time, rssi, snr, battery, margin, power), newest first: {gateway, at, devices}."""
+    # Devices from the site timeline, then one (dev_eui, time) index seek each, newest window first
+    _use(SITE_TIMELINE)
+    pending = SITE_TIMELINE.devices(gateway)
+    where = "dev_eui = ? AND EXISTS (SELECT 1 FROM json_each(uplinks.gateway_ids) j WHERE j.value = ?)"
+    if at:
+        where += " AND time <= ?"
+    found = []
+    conns = _open_windows(None, at)
+    try:
+        for conn in reversed(conns):
+            if not pending:
+                break
+            missing = []
+            for dev in pending:
+                row = conn.fetchone(
+                    "site_state_device",
+                    f"""
+                    SELECT time, dev_eui, device_name, device_profile_name, rssi, snr, battery_normalized, battery_level_join,
+                           margin, external_power_source, COALESCE(synthetic, 0) AS synthetic
+                    FROM uplinks
+                    WHERE {where}
+                    ORDER BY time DESC, event_id DESC
+                    LIMIT 1
+                    """,
+                    (dev, gateway, at) if at else (dev, gateway),
+                )
+                if row:
+                    found.append(row)
+                else:
+                    missing.append(dev)
+            pending = missing
+    finally:
+        for conn in conns:
+            conn.close()
+    found.sort(key=lambda r: r["time"], reverse=True)
+    devices = []
+    for r in found:
+        battery = r["battery_normalized"] if r["battery_normalized"] is not None else r["battery_level_join"]
+        devices.append({
+            "time": r["time"],
+            "dev_eui": r["dev_eui"],
+            "device_name": r["device_name"],
+            "device_profile_name": r["device_profile_name"],
+            "rssi": r["rssi"],
+            "snr": r["snr"],
+            "battery": battery,
+            "margin": r["margin"],
+            "external_power_source": r["external_power_source"],
+            "synthetic": 1 if (r["synthetic"]) else 0,
+        })
+    return {"gateway": gateway, "at": at, "devices": devices}
 
 
 @app.get("/api/correlation")
@@ -315,9 +822,14 @@ def get_correlation(
     from_time: str | None = Query(None, alias="from"),
     to_time: str | None = Query(None, alias="to"),
     limit: int = Query(3000, ge=1, le=10000),
+    cursor: str | None = Query(None, description="Cursor from the previous page's next"),
 ):
-    """Merged timeline for door (DWS) + climate (ATH) at this gateway: events sorted by time with type, open, temperature, humidity."""
-    conn = get_db()
+    """Merged timeline for door (DWS) + climate (ATH) at this gateway: events sorted by time with type, open, temperature, humidity; paginated with next/has_more."""
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return _invalid_cursor(cursor)
     args = [gateway]
     where = "EXISTS (SELECT 1 FROM json_each(uplinks.gateway_ids) j WHERE j.value = ?) AND device_profile_name IN ('rbs301-dws', 'rbs305-ath')"
     if from_time:
@@ -326,18 +838,24 @@ def get_correlation(
     if to_time:
         where += " AND uplinks.time <= ?"
         args.append(to_time)
-    args.append(limit)
-    rows = conn.execute(
+    if after:
+        where += " AND (uplinks.time, uplinks.event_id) > (?, ?)"
+        args.extend(after)
+    args.append(limit + 1)
+    rows = _fetch_ascending(
+        "correlation_page",
         f"""
-        SELECT time, device_profile_name, object_json
+        SELECT event_id, time, device_profile_name, object_json
         FROM uplinks
         WHERE {where}
-        ORDER BY time ASC
+        ORDER BY time ASC, event_id ASC
         LIMIT ?
         """,
         args,
-    ).fetchall()
-    conn.close()
+        after[0] if after else from_time,
+        to_time,
+    )
+    rows, next_cursor, has_more = _page(rows, limit)
     events = []
     for r in rows:
         obj = json.loads(r["object_json"]) if r["object_json"] else {}
@@ -355,11 +873,25 @@ def get_correlation(
                 "temperature": obj.get("temperature"),
                 "humidity": obj.get("humidity"),
             })
-    return {"events": events}
+    return {"events": events, "next": next_cursor, "has_more": has_more}
+
+
+def _door_climate_event(r) -> dict | None:
+    obj = json.loads(r["object_json"]) if r["object_json"] else {}
+    profile = r["device_profile_name"]
+    if profile == "rbs301-dws":
+        open_val = obj.get("open") if isinstance(obj.get("open"), (int, float)) else (1 if obj.get("eventType") == "OPEN" else 0)
+        return {"time": r["time"], "type": "door", "open": open_val, "temperature": None}
+    if profile == "rbs305-ath":
+        return {"time": r["time"], "type": "climate", "open": None, "temperature": obj.get("temperature")}
+    return None
 
 
-def _gateway_anomalies(conn, gateway: str, from_time: str | None, to_time: str | None, limit: int) -> list:
-    """Door-climate anomalies for one gateway. Returns list of {time, type, description}."""
+def _gateway_anomalies(
+    gateway: str, from_time: str | None, to_time: str | None, limit: int, after: tuple[str, str] | None = None
+) -> tuple[list, str | None, bool]:
+    """Door-climate anomalies for one page of a gateway's events. Returns ({time, type, description} list, next cursor, has_more)."""
+    t0 = time.perf_counter()
     args = [gateway]
     where = "EXISTS (SELECT 1 FROM json_each(uplinks.gateway_ids) j WHERE j.value = ?) AND device_profile_name IN ('rbs301-dws', 'rbs305-ath')"
     if from_time:
@@ -368,26 +900,63 @@ def _gateway_anomalies(conn, gateway: str, from_time: str | None, to_time: str |
     if to_time:
         where += " AND uplinks.time <= ?"
         args.append(to_time)
-    args.append(limit)
-    rows = conn.execute(
+    range_where, range_args = where, list(args)
+    if after:
+        where += " AND (uplinks.time, uplinks.event_id) > (?, ?)"
+        args.extend(after)
+    args.append(limit + 1)
+    rows = _fetch_ascending(
+        "anomalies_page",
         f"""
-        SELECT time, device_profile_name, object_json
+        SELECT event_id, time, device_profile_name, object_json
         FROM uplinks
         WHERE {where}
-        ORDER BY time ASC
+        ORDER BY time ASC, event_id ASC
         LIMIT ?
         """,
         args,
-    ).fetchall()
-    events = []
-    for r in rows:
-        obj = json.loads(r["object_json"]) if r["object_json"] else {}
-        profile = r["device_profile_name"]
-        if profile == "rbs301-dws":
-            open_val = obj.get("open") if isinstance(obj.get("open"), (int, float)) else (1 if obj.get("eventType") == "OPEN" else 0)
-            events.append({"time": r["time"], "type": "door", "open": open_val, "temperature": None})
-        elif profile == "rbs305-ath":
-            events.append({"time": r["time"], "type": "climate", "open": None, "temperature": obj.get("temperature")})
+        after[0] if after else from_time,
+        to_time,
+    )
+    rows, next_cursor, has_more = _page(rows, limit)
+    events = [ev for ev in (_door_climate_event(r) for r in rows) if ev]
+    # Page boundaries: seed with the last climate reading before the page and read the
+    # climate rows in the 60 min after it, so results match an unpaged scan.
+    if after:
+        prev = None
+        for conn in _read_windows(from_time, after[0]):
+            # Newest window with a reading wins
+            prev = conn.fetchone(
+                "anomalies_seed",
+                f"""
+                SELECT time, device_profile_name, object_json FROM uplinks
+                WHERE {range_where} AND device_profile_name = 'rbs305-ath' AND (uplinks.time, uplinks.event_id) <= (?, ?)
+                ORDER BY time DESC, event_id DESC
+                LIMIT 1
+                """,
+                range_args + list(after),
+            ) or prev
+        if prev:
+            events.insert(0, _door_climate_event(prev))
+    if has_more and rows:
+        try:
+            t_last = datetime.fromisoformat(rows[-1]["time"].replace("Z", "+00:00"))
+            tail_end = (t_last + timedelta(minutes=60)).isoformat().replace("+00:00", "Z")
+        except ValueError:
+            tail_end = None
+        if tail_end:
+            with closing(get_db(rows[-1]["time"], tail_end)) as conn:
+                tail = conn.fetchall(
+                    "anomalies_tail",
+                    f"""
+                    SELECT time, device_profile_name, object_json FROM uplinks
+                    WHERE {range_where} AND device_profile_name = 'rbs305-ath'
+                      AND (uplinks.time, uplinks.event_id) > (?, ?) AND uplinks.time <= ?
+                    ORDER BY time ASC, event_id ASC
+                    """,
+                    range_args + [rows[-1]["time"], rows[-1]["event_id"], tail_end],
+                )
+            events.extend(_door_climate_event(r) for r in tail)
     anomalies = []
     last_temp_before_door = None
     for i, ev in enumerate(events):
@@ -413,7 +982,10 @@ def _gateway_anomalies(conn, gateway: str, from_time: str | None, to_time: str |
                         "type": "door_temp_delta",
                         "description": f"Door opened; temperature varied by {delta:.1f}°C in next 60 min",
                     })
-    return anomalies
+    metrics.ANOMALY_EVENTS.inc(len(events), "gateway")
+    metrics.ANOMALY_FOUND.inc(len(anomalies), "gateway")
+    metrics.ANOMALY_SECONDS.observe(time.perf_counter() - t0, "gateway")
+    return anomalies, next_cursor, has_more
 
 
 @app.get("/api/anomalies")
@@ -422,14 +994,16 @@ def get_anomalies(
     from_time: str | None = Query(None, alias="from"),
     to_time: str | None = Query(None, alias="to"),
     limit: int = Query(5000, ge=1, le=10000),
+    cursor: str | None = Query(None, description="Cursor from the previous page's next"),
 ):
-    """Rule-based anomalies: door opened + temperature changed > 1°C within next 60 minutes."""
-    conn = get_db()
-    try:
-        anomalies = _gateway_anomalies(conn, gateway, from_time, to_time, limit)
-        return {"anomalies": anomalies}
-    finally:
-        conn.close()
+    """Rule-based anomalies: door opened + temperature changed > 1°C within next 60 minutes. Paginated over the gateway's events (limit = events scanned per page)."""
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return _invalid_cursor(cursor)
+    anomalies, next_cursor, has_more = _gateway_anomalies(gateway, from_time, to_time, limit, after)
+    return {"anomalies": anomalies, "next": next_cursor, "has_more": has_more}
 
 
 @app.get("/api/anomalies/org")
@@ -437,12 +1011,9 @@ def get_anomalies_org(
     limit: int = Query(20, ge=1, le=100),
 ):
     """Recent anomalies across all gateways (door-climate correlation). Sorted by time descending."""
-    conn = get_db()
-    try:
-        rows = conn.execute(
-            "SELECT gateway_ids FROM uplinks WHERE gateway_ids IS NOT NULL"
-        ).fetchall()
-        gateways = set()
+    gateways = set()
+    for conn in _read_windows():
+        rows = conn.fetchall("gateway_ids", "SELECT gateway_ids FROM uplinks WHERE gateway_ids IS NOT NULL")
         for r in rows:
             try:
                 gids = json.loads(r["gateway_ids"])
@@ -450,22 +1021,33 @@ def get_anomalies_org(
                     gateways.add(gid)
             except (json.JSONDecodeError, TypeError):
                 pass
-        merged = []
-        for gid in gateways:
-            for a in _gateway_anomalies(conn, gid, None, None, 5000):
+    merged = []
+    for gid in gateways:
+        # Every page of the gateway's events, not just the first
+        after = None
+        while True:
+            anomalies, next_cursor, has_more = _gateway_anomalies(gid, None, None, 5000, after)
+            for a in anomalies:
                 merged.append({"gateway_id": gid, "time": a["time"], "type": a.get("type"), "description": a.get("description", "")})
-        merged.sort(key=lambda x: x["time"] or "", reverse=True)
-        return {"anomalies": merged[:limit]}
-    finally:
-        conn.close()
+            if not has_more:
+                break
+            after = _decode_cursor(next_cursor)
+    merged.sort(key=lambda x: x["time"] or "", reverse=True)
+    return {"anomalies": merged[:limit]}
 
 
 def _device_anomalies(rows: list, profile: str) -> list:
     """Rule-based anomalies per device profile. rows = [(time, object_json), ...] ordered by time."""
+    t0 = time.perf_counter()
     anomalies = []
-    for i, (time_val, obj_json) in enumerate(rows):
+    # Decode each payload once; the rules look back (and ahead) over windows of neighbours
+    objs = []
+    for _, obj_json in rows:
         obj = json.loads(obj_json) if obj_json else {}
-        if not isinstance(obj, dict):
+        objs.append(obj if isinstance(obj, dict) else None)
+    for i, (time_val, _) in enumerate(rows):
+        obj = objs[i]
+        if obj is None:
             continue
         try:
             t = datetime.fromisoformat(time_val.replace("Z", "+00:00"))
@@ -481,8 +1063,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
                 if window:
                     prev_temps = []
                     for j in window:
-                        rj = rows[j]
-                        o = json.loads(rj[1]) if rj[1] else {}
+                        o = objs[j] or {}
                         if isinstance(o.get("temp"), (int, float)):
                             prev_temps.append(o["temp"])
                     if prev_temps and temp < min(prev_temps) - 2:
@@ -494,7 +1075,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
             if isinstance(soil, (int, float)) and i >= 2:
                 prev_soils = []
                 for j in range(max(0, i - 48), i):
-                    o = json.loads(rows[j][1]) if rows[j][1] else {}
+                    o = objs[j] or {}
                     if isinstance(o.get("soil_val"), (int, float)):
                         prev_soils.append(o["soil_val"])
                 if prev_soils and max(prev_soils) > 0:
@@ -513,7 +1094,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
                 for j in range(max(0, i - 12), min(len(rows), i + 13)):
                     if j == i:
                         continue
-                    o = json.loads(rows[j][1]) if rows[j][1] else {}
+                    o = objs[j] or {}
                     if isinstance(o.get("temperature"), (int, float)):
                         window_temps.append(o["temperature"])
                 if len(window_temps) >= 2 and (max(window_temps) - min(window_temps)) > 2:
@@ -526,7 +1107,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
         elif "Ultrasonic" in profile or profile == "EM500-UDL":
             dist = obj.get("distance")
             if isinstance(dist, (int, float)) and i >= 1:
-                prev = json.loads(rows[i - 1][1]) if rows[i - 1][1] else {}
+                prev = objs[i - 1] or {}
                 prev_d = prev.get("distance") if isinstance(prev.get("distance"), (int, float)) else None
                 if prev_d is not None and abs(dist - prev_d) > 50:
                     anomalies.append({
@@ -541,7 +1122,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
                 open_val = 1
             if isinstance(open_val, (int, float)) and i >= 2:
                 # Rapid toggle: open then closed within 2 events
-                prev = json.loads(rows[i - 1][1]) if rows[i - 1][1] else {}
+                prev = objs[i - 1] or {}
                 p_open = prev.get("open") if isinstance(prev.get("open"), (int, float)) else (1 if prev.get("eventType") == "OPEN" else 0)
                 if p_open != open_val:
                     anomalies.append({
@@ -553,7 +1134,7 @@ def _device_anomalies(rows: list, profile: str) -> list:
         elif profile == "SW3L":
             bat = obj.get("BAT")
             if isinstance(bat, (int, float)) and i >= 3:
-                prev_bats = [json.loads(rows[j][1]).get("BAT") for j in range(max(0, i - 6), i) if rows[j][1]]
+                prev_bats = [(objs[j] or {}).get("BAT") for j in range(max(0, i - 6), i) if rows[j][1]]
                 prev_bats = [b for b in prev_bats if isinstance(b, (int, float))]
                 if prev_bats and bat < min(prev_bats) - 0.2:
                     anomalies.append({
@@ -561,6 +1142,9 @@ def _device_anomalies(rows: list, profile: str) -> list:
                         "type": "battery_drop",
                         "description": f"Battery drop to {bat}V",
                     })
+    metrics.ANOMALY_EVENTS.inc(len(rows), "device")
+    metrics.ANOMALY_FOUND.inc(len(anomalies), "device")
+    metrics.ANOMALY_SECONDS.observe(time.perf_counter() - t0, "device")
     return anomalies[:50]
 
 
@@ -572,15 +1156,30 @@ def get_device_anomalies(
     limit: int = Query(5000, ge=1, le=10000),
 ):
     """Rule-based anomalies for a single device (soil temp dip, soil drop, climate swing, level jump, door toggle, battery drop)."""
-    conn = get_db()
-    row = conn.execute(
-        "SELECT device_profile_name FROM uplinks WHERE dev_eui = ? LIMIT 1",
-        (dev_eui,),
-    ).fetchone()
+    row = None
+    with closing(_read_windows(from_time, to_time)) as conns:
+        for conn in conns:
+            row = conn.fetchone(
+                "device_profile",
+                "SELECT device_profile_name FROM uplinks WHERE dev_eui = ? LIMIT 1",
+                (dev_eui,),
+            )
+            if row:
+                break
     if not row:
-        conn.close()
         return {"anomalies": []}
     profile = row["device_profile_name"] or ""
+    view = _columnar_view(dev_eui, from_time)
+    if view is not None:
+        sel = view.select(from_time, to_time, limit=limit)
+        part = view.rows[sel]
+        offs = part["obj_off"].tolist()
+        lens = part["obj_len"].tolist()
+        rows_tuples = [
+            (t.decode(), view.blob[o:o + n].tobytes() if n >= 0 else None)
+            for t, o, n in zip(part["time"].tolist(), offs, lens)
+        ]
+        return {"anomalies": _device_anomalies(rows_tuples, profile)}
     args = [dev_eui]
     where = "dev_eui = ?"
     if from_time:
@@ -590,39 +1189,94 @@ def get_device_anomalies(
         where += " AND time <= ?"
         args.append(to_time)
     args.append(limit)
-    rows = conn.execute(
+    rows = _fetch_ascending(
+        "device_anomaly_rows",
         f"SELECT time, object_json FROM uplinks WHERE {where} ORDER BY time ASC LIMIT ?",
         args,
-    ).fetchall()
-    conn.close()
+        from_time,
+        to_time,
+    )
     rows_tuples = [(r["time"], r["object_json"]) for r in rows]
     anomalies = _device_anomalies(rows_tuples, profile)
     return {"anomalies": anomalies}
 
 
+def _score_stream() -> None:
+    """Run the streaming detectors over queued late uplinks and the ones not scored yet."""
+    t0 = time.perf_counter()
+    scanned, found = DETECTORS.catch_up(get_db)
+    if scanned:
+        metrics.ANOMALY_EVENTS.inc(scanned, "stream")
+        metrics.ANOMALY_FOUND.inc(found, "stream")
+        metrics.ANOMALY_SECONDS.observe(time.perf_counter() - t0, "stream")
+
+
+@app.get("/api/anomalies/stream")
+def get_stream_anomalies(
+    dev_eui: str | None = Query(None, description="Device EUI (all devices if omitted)"),
+    from_time: str | None = Query(None, alias="from"),
+    to_time: str | None = Query(None, alias="to"),
+    metric: str | None = Query(None, description="e.g. temperature, rssi, battery_normalized"),
+    kind: str | None = Query(None, pattern="^(ewma|seasonal)$"),
+    limit: int = Query(500, ge=1, le=10000),
+):
+    """Statistical anomalies (EWMA z-score and hour-of-day seasonal baseline), newest first; with dev_eui also the device's current baselines."""
+    _use(DETECTORS)
+    out = {"anomalies": DETECTORS.events(dev_eui, from_time, to_time, metric, kind, limit)}
+    if dev_eui:
+        out["baselines"] = DETECTORS.baselines(dev_eui)
+    return out
+
+
+def _count_alerts(counts: dict) -> None:
+    for event, n in counts.items():
+        if n:
+            ALERT_EVENTS.inc(n, event)
+
+
+@app.get("/api/alerts")
+def get_alerts(
+    dev_eui: str | None = Query(None, description="Device EUI (all devices if omitted)"),
+    from_time: str | None = Query(None, alias="from"),
+    to_time: str | None = Query(None, alias="to"),
+    rule: str | None = Query(None, description="Rule id, e.g. silent or device-anomalies/battery_drop"),
+    status: str | None = Query(None, pattern="^(pending|sending|sent|suppressed|failed|stale|logged)$"),
+    limit: int = Query(500, ge=1, le=10000),
+):
+    """Alerts newest first with their delivery status, the conditions firing now and the rules in effect."""
+    out = ALERTS.alerts(dev_eui, from_time, to_time, rule, status, limit)
+    out["rules"] = ALERTS.rules
+    out["webhook"] = bool(ALERTS.webhook)
+    return out
+
+
 @app.get("/api/device/{dev_eui}")
 def get_device_passport(dev_eui: str):
     """Device passport: first_seen, last_seen, gateways, application_name, payload keys, health, event_count."""
-    conn = get_db()
-    row = conn.execute(
-        """
-        SELECT device_name, device_profile_name, application_name, time AS last_seen,
-               rssi, snr, battery_normalized, battery_level_join, margin, external_power_source,
-               gateway_ids, object_json, COALESCE(synthetic, 0) AS synthetic
-        FROM uplinks
-        WHERE dev_eui = ?
-        ORDER BY time DESC
-        LIMIT 1
-        """,
-        (dev_eui,),
-    ).fetchone()
+    row, first_seen, event_count, gw_rows = None, None, 0, []
+    for conn in _read_windows():
+        # Windows run oldest first: the newest one with rows has the latest uplink
+        row = conn.fetchone(
+            "device_latest",
+            """
+            SELECT device_name, device_profile_name, application_name, time AS last_seen,
+                   rssi, snr, battery_normalized, battery_level_join, margin, external_power_source,
+                   gateway_ids, object_json, COALESCE(synthetic, 0) AS synthetic
+            FROM uplinks
+            WHERE dev_eui = ?
+            ORDER BY time DESC
+            LIMIT 1
+            """,
+            (dev_eui,),
+        ) or row
+        if first_seen is None:
+            first = conn.fetchone("device_first_seen", "SELECT MIN(time) AS t FROM uplinks WHERE dev_eui = ?", (dev_eui,))
+            first_seen = first["t"] if first else None
+        count = conn.fetchone("device_event_count", "SELECT COUNT(*) AS c FROM uplinks WHERE dev_eui = ?", (dev_eui,))
+        event_count += count["c"] if count else 0
+        gw_rows += conn.fetchall("device_gateways", "SELECT gateway_ids FROM uplinks WHERE dev_eui = ? AND gateway_ids IS NOT NULL", (dev_eui,))
     if not row:
-        conn.close()
         return JSONResponse(status_code=404, content={"error": "Device not found", "dev_eui": dev_eui})
-    first = conn.execute("SELECT MIN(time) AS t FROM uplinks WHERE dev_eui = ?", (dev_eui,)).fetchone()
-    count = conn.execute("SELECT COUNT(*) AS c FROM uplinks WHERE dev_eui = ?", (dev_eui,)).fetchone()
-    gw_rows = conn.execute("SELECT gateway_ids FROM uplinks WHERE dev_eui = ? AND gateway_ids IS NOT NULL", (dev_eui,)).fetchall()
-    conn.close()
     gateways = []
     for r in gw_rows:
         try:
@@ -640,9 +1294,9 @@ def get_device_passport(dev_eui: str):
         "device_name": row["device_name"],
         "device_profile_name": row["device_profile_name"],
         "application_name": row["application_name"],
-        "first_seen": first["t"] if first else None,
+        "first_seen": first_seen,
         "last_seen": row["last_seen"],
-        "event_count": count["c"] if count else 0,
+        "event_count": event_count,
         "gateways": gateways,
         "payload_keys": payload_keys,
         "rssi": row["rssi"],
@@ -662,7 +1316,6 @@ def export_events(
     format: str = Query("csv", description="csv or json"),
 ):
     """Export timeseries as CSV or JSON for the device and time range."""
-    conn = get_db()
     args = [dev_eui]
     where = "dev_eui = ?"
     if from_time:
@@ -672,7 +1325,8 @@ def export_events(
         where += " AND time <= ?"
         args.append(to_time)
     args.append(10000)
-    rows = conn.execute(
+    rows = _fetch_ascending(
+        "export_rows",
         f"""
         SELECT time, device_name, object_json, rssi, snr, battery_normalized, f_port, frequency, spreading_factor
         FROM uplinks
@@ -681,8 +1335,9 @@ def export_events(
         LIMIT ?
         """,
         args,
-    ).fetchall()
-    conn.close()
+        from_time,
+        to_time,
+    )
     if format == "json":
         out = []
         for r in rows:
@@ -723,10 +1378,201 @@ def export_events(
     )
 
 
+@app.get("/api/quality")
+def get_quality(
+    from_time: str | None = Query(None, alias="from"),
+    to_time: str | None = Query(None, alias="to"),
+    factor: float = Query(GAP_FACTOR, gt=1, le=100, description="Gap = interval > factor x device's median interval"),
+    min_gap_sec: float = Query(MIN_GAP_SEC, ge=0, description="Shortest interval reported as a gap"),
+    max_gaps: int = Query(MAX_GAPS_PER_DEVICE, ge=0, le=1000, description="Longest gaps listed per device"),
+):
+    """Missing-field counts, per-device cadence and gaps (incl. devices silent at the end of the range), per-gateway totals. One ordered scan; cached until the data changes."""
+    key = (from_time, to_time, factor, min_gap_sec, max_gaps)
+    stamp = _storage_stamp()
+    cached = _quality_cache.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    conns = _open_windows(from_time, to_time)
+    try:
+        report = quality_report(conns, from_time, to_time, factor, min_gap_sec, max_gaps)
+    finally:
+        for conn in conns:
+            conn.close()
+    if len(_quality_cache) >= QUALITY_CACHE_SIZE:
+        _quality_cache.pop(next(iter(_quality_cache)))
+    _quality_cache[key] = (stamp, report)
+    return report
+
+
+@app.get("/api/health/battery-forecast")
+def get_battery_forecast(
+    window_days: float = Query(battery_forecast.WINDOW_DAYS, gt=0, le=3650, description="Fit readings from the last N days"),
+    empty_v: float = Query(battery_forecast.EMPTY_LEVEL["V"], ge=0, description="Depleted level for volt readings"),
+    empty_pct: float = Query(battery_forecast.EMPTY_LEVEL["%"], ge=0, lt=100, description="Depleted level for percent readings"),
+    profile: str | None = Query(None),
+):
+    """Per device: unit, drain rate (robust fit since the last battery swap), current level, depletion date with earliest/latest bounds. All devices fitted in one batch; cached until the data changes."""
+    if battery_forecast.np is None:
+        return JSONResponse(status_code=503, content={"error": "Battery forecast requires numpy"})
+    key = (window_days, empty_v, empty_pct, profile)
+    stamp = _storage_stamp()
+    cached = _battery_cache.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    # forecast() fits the window_days before the newest uplink, which is in the newest month
+    since = None
+    if PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        newest = datetime.fromisoformat(partitions.list_partitions(PARTITION_DIR)[-1][0] + "-01")
+        since = (newest - timedelta(days=window_days)).strftime("%Y-%m-%d")
+    conns = _open_windows(since)
+    try:
+        report = battery_forecast.forecast(conns, window_days, {"V": empty_v, "%": empty_pct}, profile)
+    finally:
+        for conn in conns:
+            conn.close()
+    if len(_battery_cache) >= BATTERY_CACHE_SIZE:
+        _battery_cache.pop(next(iter(_battery_cache)))
+    _battery_cache[key] = (stamp, report)
+    return report
+
+
+@app.get("/api/link/loss")
+def get_link_loss(
+    from_time: str | None = Query(None, alias="from", description="First day (YYYY-MM-DD or ISO time)"),
+    to_time: str | None = Query(None, alias="to", description="Last day, inclusive"),
+    dev_eui: str | None = Query(None),
+    profile: str | None = Query(None, description="Filter by device_profile_name"),
+    gateway: str | None = Query(None, description="Only devices this gateway heard, and that gateway's reception"),
+):
+    """fCnt-based loss per device (missed frames, duplicates, counter resets) and per gateway (reception of its devices' frames), over whole days."""
+    _use(LINK_LOSS)
+    return LINK_LOSS.report(from_time, to_time, dev_eui, profile, gateway)
+
+
+@app.get("/api/radio/stats")
+def get_radio_stats(
+    group_by: str = Query("gateway", description="gateway, device, sf or frequency"),
+    from_time: str | None = Query(None, alias="from", description="First day (YYYY-MM-DD or ISO time)"),
+    to_time: str | None = Query(None, alias="to", description="Last day, inclusive"),
+    key: str | None = Query(None, description="Only this gateway ID / dev_eui / SF / frequency"),
+    bucket: str = Query("day", description="Trend bucket: day, week or month"),
+    limit: int = Query(100, ge=1, le=5000, description="Groups with the most uplinks"),
+):
+    """Per group: RSSI and SNR mean/std/min/max, p10/p50/p90, histogram, weak-link share, mean margin and a trend per bucket, summed from daily summaries over whole days."""
+    if group_by not in RADIO_DIMENSIONS:
+        return JSONResponse(status_code=400, content={"error": f"group_by must be one of {', '.join(RADIO_DIMENSIONS)}"})
+    if bucket not in RADIO_BUCKETS:
+        return JSONResponse(status_code=400, content={"error": f"bucket must be one of {', '.join(RADIO_BUCKETS)}"})
+    _use(RADIO)
+    return RADIO.report(group_by, from_time, to_time, key, bucket, limit)
+
+
+def refresh_derived() -> None:
+    """Fold new uplinks into every derived-state engine in use (the refresher thread's cycle)."""
+    for engine in (LINK_LOSS, RADIO, SPATIAL, SITE_TIMELINE, COVERAGE):
+        if engine.path.exists():
+            engine.catch_up(get_db)
+    if DETECTORS.path.exists():
+        _score_stream()
+
+
+# Engines are refreshed here, in the background, never in a request
+REFRESHER = Refresher(lambda: refresh_derived())
+
+
+def _use(engine) -> None:
+    """A GET reads engine state as it is; the first one creates it and starts the backfill."""
+    if not engine.path.exists():
+        engine.create()
+        REFRESHER.wake()
+
+
+def _after_ingest(rows: list[dict]) -> None:
+    """Invalidate/advance the caches and derived indexes for newly written rows."""
+    COLUMNAR.on_write(rows)
+    LINK_LOSS.on_write(rows)
+    RADIO.on_write(rows)
+    SITE_TIMELINE.on_write(rows)
+    COVERAGE.on_write(rows)
+    DETECTORS.on_write(rows)
+    ALERTS.on_write(rows)
+    REFRESHER.wake()
+    ALERTS.wake()
+
+
+@app.post("/api/ingest")
+def ingest_uplinks(
+    payload: list[dict] | dict = Body(..., description="ChirpStack uplink event JSON, or a list of them"),
+    synthetic: bool = Query(False, description="Mark rows synthetic=1"),
+    x_ingest_token: str = Header("", description="Must equal API_INGEST_TOKEN"),
+):
+    """Normalize raw uplinks with ingest.extract_event and write them in one transaction."""
+    if not INGEST_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Ingest is disabled; start the API with API_INGEST_TOKEN set"})
+    if not hmac.compare_digest(x_ingest_token.encode(), INGEST_TOKEN.encode()):
+        return JSONResponse(status_code=403, content={"error": "Ingest requires a valid X-Ingest-Token"})
+    events = payload if isinstance(payload, list) else [payload]
+    rows = []
+    for raw in events:
+        row = extract_event(None, raw) if isinstance(raw, dict) else None
+        if row is None:
+            continue
+        if synthetic:
+            row["synthetic"] = 1
+        rows.append(row)
+    if rows and PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR):
+        partitions.insert_rows(PARTITION_DIR, rows)
+    elif rows:
+        conn = get_primary_db()
+        try:
+            insert_rows(conn, rows)
+            conn.commit()
+        finally:
+            conn.close()
+    if rows and REPLICA is not None and not (PARTITION_DIR is not None and partitions.list_partitions(PARTITION_DIR)):
+        # Derived state reads get_db(): update it once a snapshot holding these rows is live
+        REPLICA.after_publish(time.time(), lambda: _after_ingest(rows))
+    elif rows:
+        _after_ingest(rows)
+    metrics.INGEST_EVENTS.inc(len(rows), "accepted")
+    metrics.INGEST_EVENTS.inc(len(events) - len(rows), "rejected")
+    return {"accepted": len(rows), "rejected": len(events) - len(rows)}
+
+
+@app.get("/api/replica")
+def get_replica():
+    """Read-snapshot generation, as_of, age_sec and lag_sec (0 while the primary has no newer writes)."""
+    if REPLICA is None:
+        return {"enabled": False}
+    return REPLICA.status()
+
+
+@app.get("/api/debug/slow-queries")
+def get_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    x_admin_token: str = Header("", description="Must equal API_ADMIN_TOKEN"),
+):
+    """Slowest statement shapes by total time: normalized SQL, count, total/mean/max ms, rows, last params, query plan."""
+    # Last params include ingested payloads: admin only, like profiling
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "The slow-query log needs API_ADMIN_TOKEN set"})
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse(status_code=403, content={"error": "The slow-query log requires a valid X-Admin-Token"})
+    return {
+        "threshold_ms": SLOW_QUERIES.threshold_ms,
+        "dropped_shapes": SLOW_QUERIES.dropped,
+        "queries": SLOW_QUERIES.top(limit),
+    }
+
+
 if STATIC_DIR.is_dir():
     if FONTS_DIR.is_dir():
-        app.mount("/fonts", StaticFiles(directory=str(FONTS_DIR)), name="fonts")
-    app.mount("/", StaticFiles(directory=str(STATIC_DIR), html=True), name="static")
+        app.mount("/fonts", AssetStaticFiles(directory=str(FONTS_DIR)), name="fonts")
+    app.mount(
+        "/",
+        AssetStaticFiles(directory=str(STATIC_DIR), html=True, url_roots={"/fonts/": FONTS_DIR, "/": STATIC_DIR}),
+        name="static",
+    )
 
 if __name__ == "__main__":
     import uvicorn
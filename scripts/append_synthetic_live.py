@@ -1,117 +1,332 @@
 #!/usr/bin/env python3
 """
-Append one new synthetic uplink every 30 seconds for a synthetic device.
-Run while the API is running; use "Live / auto-refresh (15 s)" on the dashboard
-to see new points appear (e.g. select "Synthetic Soil 1 [Synthetic]" in Soil view).
+Live synthetic uplink load generator.
 
-Stop with Ctrl+C.
+Simulates N synthetic devices across M gateways sending uplinks with Poisson arrivals at a
+target total rate (e.g. 1 to 10,000 uplinks/s), written in batches either straight into
+data/uplinks.db (the monthly files in data/partitions/ once the DB has been split) or through
+an HTTP ingest endpoint (POST /api/ingest). Reports achieved write
+throughput and lag (write completion time minus scheduled arrival time) while it runs.
+
+With no options it behaves like the original demo feed: one device (Synthetic Soil 1,
+syn_soil_1) at about one uplink every 30 s. Run while the API is running; use
+"Live / auto-refresh (15 s)" on the dashboard to see new points appear.
+
+  python scripts/append_synthetic_live.py --devices 1000 --gateways 50 --rate 2000 --batch 500
+  API_INGEST_TOKEN=<secret> python scripts/append_synthetic_live.py --url http://localhost:8000/api/ingest --rate 200 --batch 50
+
+Stop with Ctrl+C (or --duration).
 """
 
+import argparse
 import json
-import random
+import os
 import sqlite3
 import sys
 import time
+import urllib.error
+import urllib.request
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+import numpy as np
+
+try:
+    from scripts.generate_synthetic import (
+        PAYLOAD_GENERATORS, SYNTHETIC_LAT, SYNTHETIC_LON, SYNTHETIC_PROFILES, gateway_ids,
+    )
+    from scripts.ingest import create_schema, extract_event, insert_rows
+    from scripts import partitions
+except ImportError:  # run as python scripts/append_synthetic_live.py
+    from generate_synthetic import PAYLOAD_GENERATORS, SYNTHETIC_LAT, SYNTHETIC_LON, SYNTHETIC_PROFILES, gateway_ids
+    from ingest import create_schema, extract_event, insert_rows
+    import partitions
+
 APP_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = APP_ROOT / "data" / "uplinks.db"
+PARTITION_DIR = APP_ROOT / "data" / "partitions"
 
-SYNTHETIC_GATEWAY_ID = "synthetic-gateway-01"
-SYNTHETIC_LAT = 45.42
-SYNTHETIC_LON = -75.69
+# Battery key written into the payload per kind, so extract_event fills battery_normalized
+BATTERY_KEYS = {"soil": ("battery_v", 3.0, 0.05), "level": ("Bat", 3.2, 0.06)}
 
-# Device to append to (must exist from generate_synthetic.py)
-LIVE_DEV_EUI = "syn_soil_1"
-LIVE_DEVICE_NAME = "Synthetic Soil 1"
-LIVE_PROFILE = "Makerfabs Soil Moisture Sensor"
-INTERVAL_SEC = 30
 
+class Fleet:
+    """Device identities (round-robin over profiles, so device 0 is syn_soil_1) and per-device fCnt."""
 
-def main() -> int:
-    if not DB_PATH.is_file():
-        print("DB not found. Run ingest.py and generate_synthetic.py first.", file=sys.stderr)
-        return 1
+    def __init__(self, devices: int, gateways: int):
+        kinds = list(SYNTHETIC_PROFILES)
+        self.kind = [kinds[i % len(kinds)] for i in range(devices)]
+        self.dev_eui = []
+        self.name = []
+        for i, kind in enumerate(self.kind):
+            prefix, _, label, _ = SYNTHETIC_PROFILES[kind]
+            self.dev_eui.append(f"{prefix}_{i // len(kinds) + 1}")
+            self.name.append(f"{label} {i // len(kinds) + 1}")
+        self.gateways = gateway_ids(max(1, gateways))
+        self.f_cnt = np.zeros(devices, dtype=np.int64)
+
+    def uplinks(self, rng: np.random.Generator, device_idx: np.ndarray, times: list[str], anomaly_rate: float) -> list[dict]:
+        """ChirpStack-shaped uplink JSON for each (device, time) pair."""
+        out = [None] * len(device_idx)
+        kinds = np.array(self.kind)[device_idx]
+        for kind in set(kinds.tolist()):
+            pos = np.nonzero(kinds == kind)[0]
+            devs = device_idx[pos]
+            steps = np.empty((len(pos), 1), dtype=np.int64)
+            for j, d in enumerate(devs.tolist()):  # sequential fCnt, even for repeats in one batch
+                steps[j, 0] = self.f_cnt[d]
+                self.f_cnt[d] += 1
+            objs, _ = PAYLOAD_GENERATORS[kind](rng, steps, rng.random(steps.shape) < anomaly_rate)
+            bat = BATTERY_KEYS.get(kind)
+            bat_vals = rng.normal(bat[1], bat[2], len(pos)).round(2).tolist() if bat else None
+            rssi = rng.integers(-115, -74, len(pos)).tolist()
+            snr = rng.uniform(2, 9, len(pos)).round(1).tolist()
+            _, profile, _, _ = SYNTHETIC_PROFILES[kind]
+            for j, (p, d) in enumerate(zip(pos.tolist(), devs.tolist())):
+                obj = json.loads(objs[j])
+                if bat:
+                    obj[bat[0]] = bat_vals[j]
+                gw = d % len(self.gateways)
+                out[p] = {
+                    "deduplicationId": str(uuid.uuid4()),
+                    "time": times[p],
+                    "deviceInfo": {
+                        "devEui": self.dev_eui[d],
+                        "deviceName": self.name[d],
+                        "deviceProfileName": profile,
+                        "applicationId": "synthetic-app",
+                        "applicationName": "Synthetic",
+                    },
+                    "fCnt": int(steps[j, 0]),
+                    "fPort": 1,
+                    "rxInfo": [{
+                        "gatewayId": self.gateways[gw],
+                        "rssi": rssi[j],
+                        "snr": snr[j],
+                        "location": {"latitude": SYNTHETIC_LAT + gw * 0.05, "longitude": SYNTHETIC_LON - gw * 0.05},
+                    }],
+                    "txInfo": {"frequency": 868100000, "modulation": {"lora": {"spreadingFactor": 7}}},
+                    "object": obj,
+                }
+        return out
+
+
+def _synthetic_rows(uplinks: list[dict]) -> list[dict]:
+    rows = []
+    for raw in uplinks:
+        row = extract_event(None, raw)
+        if row is not None:
+            row["synthetic"] = 1
+            rows.append(row)
+    return rows
+
+
+class DbWriter:
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        create_schema(self.conn)
+
+    def write(self, uplinks: list[dict]) -> int:
+        rows = _synthetic_rows(uplinks)
+        insert_rows(self.conn, rows)
+        self.conn.commit()
+        return len(rows)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class PartitionWriter:
+    """Writes to the monthly partitions; once they exist the API reads nothing else."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def write(self, uplinks: list[dict]) -> int:
+        return partitions.insert_rows(self.root, _synthetic_rows(uplinks))
+
+    def close(self) -> None:
+        pass
 
-    conn = sqlite3.connect(DB_PATH)
 
-    row = conn.execute(
-        "SELECT 1 FROM uplinks WHERE dev_eui = ? AND synthetic = 1 LIMIT 1",
-        (LIVE_DEV_EUI,),
-    ).fetchone()
-    if not row:
-        print(f"Synthetic device {LIVE_DEV_EUI} not found. Run generate_synthetic.py first.", file=sys.stderr)
-        conn.close()
+def open_writer(db: Path | None):
+    """(writer, target) for the DB path given, else data/partitions/ once split, else data/uplinks.db;
+    (None, None) when the default DB doesn't exist."""
+    if db is None and partitions.list_partitions(PARTITION_DIR):
+        return PartitionWriter(PARTITION_DIR), str(PARTITION_DIR)
+    db_path = db or DB_PATH
+    if not db_path.is_file():
+        return None, None
+    return DbWriter(db_path), str(db_path)
+
+
+class HttpWriter:
+    def __init__(self, url: str, token: str = ""):
+        self.url = url + ("&" if "?" in url else "?") + "synthetic=1"
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["X-Ingest-Token"] = token
+
+    def write(self, uplinks: list[dict]) -> int:
+        req = urllib.request.Request(self.url, data=json.dumps(uplinks).encode("utf-8"), headers=self.headers, method="POST")
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return int(json.loads(resp.read()).get("accepted", len(uplinks)))
+
+    def close(self) -> None:
+        pass
+
+
+def poisson_arrivals(rng: np.random.Generator, rate: float, start: float, chunk: int = 4096):
+    """Infinite stream of arrival times (perf_counter seconds) with exponential gaps of mean 1/rate."""
+    t = start
+    while True:
+        times = t + np.cumsum(rng.exponential(1.0 / rate, chunk))
+        t = float(times[-1])
+        yield from times.tolist()
+
+
+class Stats:
+    """Write counters plus lag samples: every lag of the current report interval, and a
+    fixed-size uniform reservoir over the whole run for the final percentiles."""
+
+    RESERVOIR = 100_000
+
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+        self.written = 0
+        self.errors = 0
+        self.seen = 0
+        self.lag_max = 0.0
+        self.lags: list[float] = []
+        self.all_lags: list[float] = []
+
+    def add(self, lags: list[float]) -> None:
+        self.lags.extend(lags)
+        self.lag_max = max(self.lag_max, max(lags, default=0.0))
+        for lag in lags:
+            self.seen += 1
+            if len(self.all_lags) < self.RESERVOIR:
+                self.all_lags.append(lag)
+            else:
+                j = int(self.rng.integers(0, self.seen))
+                if j < self.RESERVOIR:
+                    self.all_lags[j] = lag
+
+    def summary(self, lags: list[float]) -> dict:
+        if not lags:
+            return {"lag_p50_ms": None, "lag_p99_ms": None, "lag_max_ms": None}
+        arr = np.asarray(lags) * 1000
+        return {
+            "lag_p50_ms": round(float(np.percentile(arr, 50)), 2),
+            "lag_p99_ms": round(float(np.percentile(arr, 99)), 2),
+            "lag_max_ms": round(float(arr.max()), 2),
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rate-controlled synthetic uplink load generator.")
+    parser.add_argument("--devices", type=int, default=1, help="simulated devices, round-robin over profiles (default 1)")
+    parser.add_argument("--gateways", type=int, default=1, help="synthetic gateways (default 1)")
+    parser.add_argument("--rate", type=float, default=1 / 30, help="target total uplinks/s (default 1/30)")
+    parser.add_argument("--batch", type=int, default=1, help="uplinks per write/commit (default 1)")
+    parser.add_argument("--max-wait-ms", type=float, default=1000, help="flush a partial batch after this long (default 1000)")
+    parser.add_argument("--anomaly-rate", type=float, default=0.025)
+    parser.add_argument("--duration", type=float, help="stop after this many seconds (default: run until Ctrl+C)")
+    parser.add_argument("--report-sec", type=float, default=10, help="progress report interval (default 10)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--db", type=Path, help="target DB (default data/uplinks.db, or data/partitions/ once split)")
+    parser.add_argument("--url", help="POST batches to this ingest endpoint instead of writing the DB")
+    parser.add_argument("--token", default=os.environ.get("API_INGEST_TOKEN", ""),
+                        help="X-Ingest-Token for --url (default $API_INGEST_TOKEN)")
+    parser.add_argument("--json-out", type=Path, help="write the final summary as JSON")
+    args = parser.parse_args()
+
+    if args.rate <= 0 or args.devices <= 0 or args.batch <= 0:
+        print("--rate, --devices and --batch must be positive.", file=sys.stderr)
         return 1
+    if args.url:
+        writer = HttpWriter(args.url, args.token)
+        target = args.url
+    else:
+        writer, target = open_writer(args.db)
+        if writer is None:
+            print("DB not found. Run ingest.py first.", file=sys.stderr)
+            return 1
 
-    print(f"Appending one uplink every {INTERVAL_SEC}s for {LIVE_DEVICE_NAME} ({LIVE_DEV_EUI}).")
-    print("In the dashboard: Soil → Synthetic Soil 1 [Synthetic] → check Live / auto-refresh (15 s).")
+    rng = np.random.default_rng(args.seed)
+    fleet = Fleet(args.devices, args.gateways)
+    print(f"Simulating {args.devices} device(s) on {len(fleet.gateways)} gateway(s) at {args.rate:g} uplinks/s "
+          f"(batch {args.batch}) -> {target}")
     print("Stop with Ctrl+C.\n")
 
-    step = 0
+    t0 = time.perf_counter()
+    wall0 = datetime.now(timezone.utc)
+    arrivals = poisson_arrivals(rng, args.rate, t0)
+    max_wait = args.max_wait_ms / 1000
+    pending: list[float] = []
+    stats = Stats(np.random.default_rng(args.seed))
+    last_report = t0
+    last_written = 0
+
+    def flush():
+        times = [(wall0 + timedelta(seconds=due - t0)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z" for due in pending]
+        uplinks = fleet.uplinks(rng, rng.integers(0, args.devices, len(pending)), times, args.anomaly_rate)
+        try:
+            stats.written += writer.write(uplinks)
+        except (sqlite3.Error, urllib.error.URLError, OSError) as e:
+            stats.errors += len(pending)
+            print("Write error:", e, file=sys.stderr)
+        done = time.perf_counter()
+        stats.add([done - due for due in pending])
+        pending.clear()
+
     try:
         while True:
-            now = datetime.now(timezone.utc)
-            time_str = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-            event_id = str(uuid.uuid4())
-            soil = 400 + random.gauss(0, 15)
-            soil = max(0, min(1023, soil))
-            temp = 22.0 + random.gauss(0, 0.5)
-            obj = {"soil_val": round(soil, 1), "temp": round(temp, 2)}
-            object_json = json.dumps(obj)
-            gateway_ids = json.dumps([SYNTHETIC_GATEWAY_ID])
-            rssi = random.randint(-115, -75)
-            snr = round(random.uniform(2, 9), 1)
-
-            conn.execute(
-                """
-                INSERT INTO uplinks (
-                    event_id, time, dev_eui, device_name, device_profile_name,
-                    application_id, application_name, gateway_ids, rssi, snr,
-                    location_lat, location_lon, location_alt, battery_normalized, object_json,
-                    f_port, dev_addr, f_cnt, margin, external_power_source,
-                    battery_level_unavailable, battery_level_join, frequency, spreading_factor, region_config_id, synthetic
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    event_id,
-                    time_str,
-                    LIVE_DEV_EUI,
-                    LIVE_DEVICE_NAME,
-                    LIVE_PROFILE,
-                    "synthetic-app",
-                    "Synthetic",
-                    gateway_ids,
-                    rssi,
-                    snr,
-                    SYNTHETIC_LAT,
-                    SYNTHETIC_LON,
-                    None,
-                    3.0 + random.gauss(0, 0.05),
-                    object_json,
-                    1,
-                    None,
-                    step,
-                    None,
-                    None,
-                    None,
-                    None,
-                    868100000,
-                    7,
-                    None,
-                    1,
-                ),
-            )
-            conn.commit()
-            step += 1
-            print(f"  {time_str}  soil={obj['soil_val']}, temp={obj['temp']}°C (count={step})")
-            time.sleep(INTERVAL_SEC)
+            due = next(arrivals)
+            if args.duration is not None and due - t0 > args.duration:
+                break
+            while True:
+                now = time.perf_counter()
+                if pending and (len(pending) >= args.batch or now - pending[0] >= max_wait):
+                    flush()
+                    now = time.perf_counter()
+                if now - last_report >= args.report_sec:
+                    rate = (stats.written - last_written) / (now - last_report)
+                    s = stats.summary(stats.lags)
+                    print(f"  written={stats.written}  rate={rate:.1f}/s (target {args.rate:g})  "
+                          f"lag p50={s['lag_p50_ms']} p99={s['lag_p99_ms']} max={s['lag_max_ms']} ms  errors={stats.errors}")
+                    last_report, last_written = now, stats.written
+                    stats.lags = []
+                if due <= now:
+                    break
+                deadline = min(due, pending[0] + max_wait) if pending else due
+                time.sleep(max(0.0, min(deadline, last_report + args.report_sec) - now))
+            pending.append(due)
     except KeyboardInterrupt:
         print("\nStopped.")
     finally:
-        conn.close()
+        if pending:
+            flush()
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    summary = {
+        "target": target,
+        "devices": args.devices,
+        "gateways": len(fleet.gateways),
+        "target_rate": args.rate,
+        "batch": args.batch,
+        "elapsed_sec": round(elapsed, 2),
+        "written": stats.written,
+        "errors": stats.errors,
+        "achieved_rate": round(stats.written / elapsed, 2) if elapsed else None,
+        **stats.summary(stats.all_lags),
+        "lag_max_ms": round(stats.lag_max * 1000, 2),
+    }
+    print("Summary:", json.dumps(summary))
+    if args.json_out:
+        args.json_out.write_text(json.dumps(summary, indent=2), encoding="utf-8")
     return 0
 
 
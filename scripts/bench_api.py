@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Endpoint latency benchmark for scripts/api.py over scaled synthetic databases.
+
+- Builds (or reuses) one SQLite DB per scale under data/bench/ with the synthetic fleet
+  generator (scripts/generate_synthetic.py)
+- Drives every dashboard endpoint in-process through the ASGI app (no server, no sockets)
+  with representative parameters: random devices/gateways, 24 h and 7 d windows
+- Caches and derived state (columnar windows, engine DBs) live in a temporary directory next
+  to the bench DB for the run, so production data/cache/ is neither read nor overwritten
+- Reports per-endpoint p50/p95/p99/mean latency, throughput and errors, plus build time,
+  DB size and peak RSS, as JSON (data/bench/api-<timestamp>.json by default)
+
+Run: python scripts/bench_api.py --scales 100k,1m [--requests 50] [--out results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from scripts import api  # noqa: E402
+from scripts.generate_synthetic import SYNTHETIC_PROFILES, defer_indexes, generate_fleet, restore_indexes  # noqa: E402
+from scripts.ingest import create_schema  # noqa: E402
+
+BENCH_DIR = REPO_ROOT / "data" / "bench"
+
+# name -> (rows, devices, gateways)
+SCALES = {
+    "100k": (100_000, 100, 10),
+    "1m": (1_000_000, 1_000, 50),
+    "10m": (10_000_000, 10_000, 500),
+}
+
+# Uplink interval for bench fleets; history length is derived from rows per device
+INTERVAL_SEC = 600
+BENCH_END = datetime(2026, 1, 31, 23, 59, 0, tzinfo=timezone.utc)
+
+
+def build_db(path: Path, rows: int, devices: int, gateways: int, seed: int = 0) -> float:
+    """Create path with ~`rows` uplinks spread over `devices` devices and `gateways` gateways; returns seconds."""
+    t0 = time.perf_counter()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    create_schema(conn)
+    kinds = list(SYNTHETIC_PROFILES)
+    per_profile = {k: devices // len(kinds) + (1 if i < devices % len(kinds) else 0) for i, k in enumerate(kinds)}
+    per_device = max(2, rows // devices)
+    deferred = defer_indexes(conn)
+    generate_fleet(
+        conn,
+        per_profile,
+        gateways=gateways,
+        end=BENCH_END,
+        duration=timedelta(seconds=INTERVAL_SEC * (per_device - 1)),
+        interval_sec=INTERVAL_SEC,
+        seed=seed,
+    )
+    restore_indexes(conn, deferred)
+    conn.execute("ANALYZE")
+    conn.close()
+    return time.perf_counter() - t0
+
+
+async def _asgi_get(url: str) -> tuple[int, int]:
+    """GET url against api.app in-process; returns (status, body bytes)."""
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    status = 0
+    size = 0
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Disconnect listeners (StreamingResponse) block here until the response is sent
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    await api.app(scope, receive, send)
+    return status, size
+
+
+def _requests(conn: sqlite3.Connection, rng: random.Random, n: int) -> dict[str, list[str]]:
+    """Representative URLs per endpoint, sampled from what the DB actually holds."""
+    devs = [r[0] for r in conn.execute("SELECT DISTINCT dev_eui FROM uplinks LIMIT 1000")]
+    gws = sorted({g for (j,) in conn.execute("SELECT DISTINCT gateway_ids FROM uplinks WHERE gateway_ids IS NOT NULL") for g in json.loads(j)})
+    t_max = conn.execute("SELECT MAX(time) FROM uplinks").fetchone()[0]
+    end = datetime.fromisoformat(t_max.replace("Z", "+00:00"))
+
+    def window():
+        span = rng.choice((timedelta(hours=24), timedelta(days=7)))
+        return {"from": (end - span).strftime("%Y-%m-%dT%H:%M:%SZ"), "to": t_max}
+
+    def q(path, **params):
+        return path + ("?" + urlencode(params) if params else "")
+
+    return {
+        "/api/devices": [q("/api/devices", include_health=rng.choice(("0", "1"))) for _ in range(n)],
+        "/api/timeseries": [q("/api/timeseries", dev_eui=rng.choice(devs), **window()) for _ in range(n)],
+        "/api/site": [q("/api/site", gateway=rng.choice(gws), limit=5000, **window()) for _ in range(n)],
+        "/api/anomalies/org": [q("/api/anomalies/org", limit=20) for _ in range(n)],
+        "/api/device/{dev_eui}": [q(f"/api/device/{rng.choice(devs)}") for _ in range(n)],
+        "/api/export": [q("/api/export", dev_eui=rng.choice(devs), format="csv", **window()) for _ in range(n)],
+    }
+
+
+def _percentile(sorted_vals: list[float], pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, round(pct / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_endpoints(db_path: Path, n: int, seed: int = 0) -> dict:
+    with tempfile.TemporaryDirectory(prefix=db_path.stem + "-state-", dir=db_path.parent) as state_dir:
+        api.DB_PATH = db_path
+        api.PARTITION_DIR = None  # always measure the bench DB, not data/partitions/
+        api.REPLICA = None  # ... nor snapshots of the production DB
+        api.use_cache_dir(Path(state_dir))
+        api.ALERTS.webhook = None  # never deliver bench alerts
+        return _run_endpoints(db_path, n, seed)
+
+
+def _run_endpoints(db_path: Path, n: int, seed: int) -> dict:
+    api.ensure_schema()
+    conn = sqlite3.connect(db_path)
+    urls = _requests(conn, random.Random(seed), n)
+    conn.close()
+
+    async def drive():
+        results = {}
+        for name, batch in urls.items():
+            await _asgi_get(batch[0])  # warm-up (page cache, statement cache)
+            lat = []
+            errors = 0
+            out_bytes = 0
+            t0 = time.perf_counter()
+            for url in batch:
+                t = time.perf_counter()
+                status, size = await _asgi_get(url)
+                lat.append((time.perf_counter() - t) * 1000)
+                out_bytes += size
+                if status >= 400:
+                    errors += 1
+            elapsed = time.perf_counter() - t0
+            lat.sort()
+            results[name] = {
+                "requests": len(batch),
+                "errors": errors,
+                "p50_ms": round(_percentile(lat, 50), 3),
+                "p95_ms": round(_percentile(lat, 95), 3),
+                "p99_ms": round(_percentile(lat, 99), 3),
+                "mean_ms": round(sum(lat) / len(lat), 3),
+                "throughput_rps": round(len(batch) / elapsed, 2) if elapsed else None,
+                "mean_response_bytes": out_bytes // len(batch),
+            }
+            print(f"  {name:24} p50 {results[name]['p50_ms']:9.2f} ms  p99 {results[name]['p99_ms']:9.2f} ms  {results[name]['throughput_rps']} req/s")
+        return results
+
+    return asyncio.run(drive())
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="100k", help=f"comma-separated presets ({', '.join(SCALES)})")
+    parser.add_argument("--devices", type=int, help="override device count for every scale")
+    parser.add_argument("--gateways", type=int, help="override gateway count for every scale")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint (default 50)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild DBs even if present in data/bench/")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="result JSON path (default data/bench/api-<timestamp>.json)")
+    args = parser.parse_args()
+
+    runs = []
+    for name in [s.strip().lower() for s in args.scales.split(",") if s.strip()]:
+        if name not in SCALES:
+            print("Unknown scale:", name, file=sys.stderr)
+            return 1
+        rows, devices, gateways = SCALES[name]
+        devices = args.devices or devices
+        gateways = args.gateways or gateways
+        db_path = BENCH_DIR / f"bench-{name}-{devices}d-{gateways}g.db"
+        build_sec = None
+        if args.rebuild or not db_path.is_file():
+            print(f"Building {db_path.name}: {rows} rows, {devices} devices, {gateways} gateways ...")
+            build_sec = round(build_db(db_path, rows, devices, gateways, args.seed), 2)
+            print(f"  built in {build_sec}s")
+        print(f"Scale {name}:")
+        endpoints = run_endpoints(db_path, args.requests, args.seed)
+        runs.append({
+            "scale": name,
+            "rows": rows,
+            "devices": devices,
+            "gateways": gateways,
+            "db_path": str(db_path),
+            "db_bytes": db_path.stat().st_size,
+            "build_seconds": build_sec,
+            "endpoints": endpoints,
+            "peak_rss_mb": _peak_rss_mb(),  # process-wide high-water mark after this scale
+        })
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out = args.out or BENCH_DIR / f"api-{stamp}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "benchmark": "api",
+        "timestamp": stamp,
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "requests_per_endpoint": args.requests,
+        "runs": runs,
+    }
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print("Results:", out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
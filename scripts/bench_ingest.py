@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Ingest throughput benchmark for scripts/ingest.py, with a time breakdown per stage.
+
+Runs the same loop as ingest.py main() (walk_dataset -> read -> json.loads ->
+extract_event -> insert_rows -> commit) into a fresh DB under data/bench/, timing each
+stage separately:
+
+  walk       directory enumeration (walk_dataset), or 0 for NDJSON
+  read       file read_text(), or readline() for NDJSON
+  parse      json.loads
+  normalize  extract_event
+  insert     insert_rows (INSERT OR REPLACE executemany, payload encoding if enabled)
+  commit     conn.commit()
+  other      loop overhead (total minus the stages)
+
+Sources are the shipped dataset/ and generated datasets of 100k, 1m or 10m events, cloned
+from the shipped events (new deduplicationId, devEui and time per copy, so every row is
+new), as one JSON file per event in the dataset/ layout or as NDJSON lines. Generated
+data is kept in data/bench/ and reused.
+
+Each run happens in a fresh child process, so `peak_rss_mb` is that run's own high-water
+mark. Reports rows/s, seconds and us/row per stage, peak RSS and DB size as JSON
+(data/bench/ingest-<timestamp>.json by default). With --baseline, exits 1 when any run's
+rows/s fell more than --max-regression below the same run in an earlier result file.
+--profile samples Python stacks with scripts/profiling.py during each run.
+
+Run:
+  python scripts/bench_ingest.py                                  # shipped dataset, batch 1 as ingest.py
+  python scripts/bench_ingest.py --sources shipped,100k,1m --format ndjson --batch 500
+  python scripts/bench_ingest.py --sources 100k --baseline data/bench/ingest-<earlier>.json
+  python scripts/bench_ingest.py --profile table
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    from scripts.ingest import create_schema, extract_event, insert_rows, walk_dataset
+    from scripts.profiling import Sampler
+except ImportError:  # run as python scripts/bench_ingest.py
+    from ingest import create_schema, extract_event, insert_rows, walk_dataset
+    from profiling import Sampler
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DATASET_ROOT = APP_ROOT / "dataset"
+BENCH_DIR = APP_ROOT / "data" / "bench"
+STAGES = ("walk", "read", "parse", "normalize", "insert", "commit")
+# name -> generated events
+SCALES = {
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+FORMATS = ("files", "ndjson")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _templates(dataset_root: Path) -> list[tuple[str, dict]]:
+    """(device type, raw event) for every valid shipped event, oldest first."""
+    out = []
+    for device_type, _, path in walk_dataset(dataset_root):
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if isinstance(raw, dict) and extract_event(path, raw) is not None:
+            out.append((device_type, raw))
+    out.sort(key=lambda t: t[1]["time"])
+    return out
+
+
+def _clones(templates: list[tuple[str, dict]], n: int, seed: int):
+    """n (device type, event) copies of the templates; copy k shifts time by k spans and renames devices."""
+    rng = random.Random(seed)
+    t0 = datetime.fromisoformat(templates[0][1]["time"].replace("Z", "+00:00"))
+    t1 = datetime.fromisoformat(templates[-1][1]["time"].replace("Z", "+00:00"))
+    span = t1 - t0 + timedelta(hours=1)
+    for i in range(n):
+        k, j = divmod(i, len(templates))
+        device_type, raw = templates[j]
+        event = dict(raw)
+        info = dict(raw.get("deviceInfo") or {})
+        dev_eui = info.get("devEui") or raw.get("devEui")
+        info["devEui"] = f"{dev_eui[:-4]}{(int(dev_eui[-4:], 16) + k) % 0x10000:04x}" if k else dev_eui
+        event["deviceInfo"] = info
+        event["deduplicationId"] = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        t = datetime.fromisoformat(raw["time"].replace("Z", "+00:00")) + span * k
+        event["time"] = t.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        yield device_type, event
+
+
+def generate(path: Path, n: int, fmt: str, dataset_root: Path = DATASET_ROOT, seed: int = 0) -> float:
+    """Write n cloned events to path (a dataset/-style directory or an NDJSON file); returns seconds."""
+    t_start = time.perf_counter()
+    templates = _templates(dataset_root)
+    if not templates:
+        raise ValueError(f"no events under {dataset_root}")
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "ndjson":
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            for _, event in _clones(templates, n, seed):
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+    else:
+        made = set()
+        for device_type, event in _clones(templates, n, seed):
+            d = tmp / device_type / event["deviceInfo"]["devEui"]
+            if d not in made:
+                d.mkdir(parents=True, exist_ok=True)
+                made.add(d)
+            (d / f"{event['deduplicationId']}.json").write_text(json.dumps(event, indent=2), encoding="utf-8")
+    tmp.rename(path)
+    return time.perf_counter() - t_start
+
+
+def run_ingest(source: Path, fmt: str, db_path: Path, batch: int = 1, commit_every: int = 0,
+               profile: str | None = None) -> dict:
+    """Ingest source into a fresh db_path, timing every stage; returns the run's figures."""
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        Path(str(db_path) + suffix).unlink(missing_ok=True)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    create_schema(conn)
+    timers = dict.fromkeys(STAGES, 0.0)
+    counts = {"rows": 0, "invalid": 0, "skipped": 0}
+    pending: list[dict] = []
+    since_commit = 0
+    clock = time.perf_counter
+
+    def texts():
+        """(file path or None, text), timing walk and read."""
+        if fmt == "ndjson":
+            with open(source, encoding="utf-8") as f:
+                while True:
+                    t = clock()
+                    line = f.readline()
+                    timers["read"] += clock() - t
+                    if not line:
+                        return
+                    if line.strip():
+                        yield None, line
+            return
+        walker = walk_dataset(source)
+        while True:
+            t = clock()
+            item = next(walker, None)
+            t1 = clock()
+            timers["walk"] += t1 - t
+            if item is None:
+                return
+            try:
+                text = item[2].read_text(encoding="utf-8")
+            except OSError:
+                counts["invalid"] += 1
+                continue
+            finally:
+                timers["read"] += clock() - t1
+            yield item[2], text
+
+    def flush():
+        nonlocal since_commit
+        t = clock()
+        try:
+            insert_rows(conn, pending)
+            counts["rows"] += len(pending)
+            since_commit += len(pending)
+        except sqlite3.IntegrityError:
+            counts["skipped"] += len(pending)
+        t1 = clock()
+        timers["insert"] += t1 - t
+        pending.clear()
+        if commit_every and since_commit >= commit_every:
+            conn.commit()
+            since_commit = 0
+            timers["commit"] += clock() - t1
+
+    sampler = Sampler() if profile else None
+    if sampler:
+        sampler.__enter__()
+    t_start = clock()
+    try:
+        for path, text in texts():
+            t = clock()
+            try:
+                raw = json.loads(text)
+            except json.JSONDecodeError:
+                raw = None
+            t1 = clock()
+            timers["parse"] += t1 - t
+            row = extract_event(path, raw) if isinstance(raw, dict) else None
+            timers["normalize"] += clock() - t1
+            if row is None:
+                counts["invalid"] += 1
+                continue
+            pending.append(row)
+            if len(pending) >= batch:
+                flush()
+        if pending:
+            flush()
+        t = clock()
+        conn.commit()
+        timers["commit"] += clock() - t
+    finally:
+        total = clock() - t_start
+        if sampler:
+            sampler.__exit__(None, None, None)
+        conn.close()
+    n = max(counts["rows"], 1)
+    stages = {name: {"sec": round(sec, 3), "us_per_row": round(sec / n * 1e6, 2), "pct": round(100 * sec / total, 1)}
+              for name, sec in timers.items()}
+    other = total - sum(timers.values())
+    stages["other"] = {"sec": round(other, 3), "us_per_row": round(other / n * 1e6, 2), "pct": round(100 * other / total, 1)}
+    result = {
+        **counts,
+        "seconds": round(total, 3),
+        "rows_per_sec": round(counts["rows"] / total, 1) if total else None,
+        "stages": stages,
+        "peak_rss_mb": _peak_rss_mb(),
+        "db_bytes": db_path.stat().st_size,
+    }
+    if sampler:
+        result["profile"] = sampler.table() if profile == "table" else sampler.collapsed()
+    return result
+
+
+def _print_run(run: dict) -> None:
+    print(f"  {run['rows']} rows in {run['seconds']}s = {run['rows_per_sec']} rows/s, "
+          f"peak RSS {run['peak_rss_mb']} MB, DB {run['db_bytes'] / 1e6:.1f} MB"
+          + (f", {run['invalid']} invalid" if run["invalid"] else ""))
+    for name, s in run["stages"].items():
+        print(f"    {name:10} {s['sec']:9.3f}s {s['us_per_row']:9.2f} us/row {s['pct']:5.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sources", default="shipped", help=f"comma-separated: shipped, {', '.join(SCALES)}")
+    parser.add_argument("--format", choices=FORMATS, default="files", help="generated data layout (default files)")
+    parser.add_argument("--dataset", type=Path, default=DATASET_ROOT)
+    parser.add_argument("--batch", type=int, default=1, help="rows per insert_rows call (default 1, as ingest.py)")
+    parser.add_argument("--commit-every", type=int, default=0, help="commit every N rows (default 0: once at the end)")
+    parser.add_argument("--regenerate", action="store_true", help="regenerate data even if present in data/bench/")
+    parser.add_argument("--keep-db", action="store_true", help="keep the ingested DBs in data/bench/")
+    parser.add_argument("--profile", choices=("table", "collapsed"), help="sample stacks; written next to --out")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="result JSON path (default data/bench/ingest-<timestamp>.json)")
+    parser.add_argument("--baseline", type=Path, help="earlier result JSON to compare rows/s against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed rows/s drop vs baseline (default 0.2)")
+    args = parser.parse_args()
+    if args.batch <= 0:
+        print("--batch must be positive.", file=sys.stderr)
+        return 1
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out = args.out or BENCH_DIR / f"ingest-{stamp}.json"
+    runs = []
+    for name in [s.strip().lower() for s in args.sources.split(",") if s.strip()]:
+        gen_sec = None
+        if name == "shipped":
+            source, fmt = args.dataset, "files"
+            if not source.is_dir():
+                print("Dataset root not found:", source, file=sys.stderr)
+                return 1
+        elif name in SCALES:
+            fmt = args.format
+            source = BENCH_DIR / (f"ingest-{name}.ndjson" if fmt == "ndjson" else f"ingest-{name}-files")
+            if args.regenerate or not source.exists():
+                print(f"Generating {source.name}: {SCALES[name]} events ...")
+                if source.is_dir():
+                    shutil.rmtree(source)
+                gen_sec = round(generate(source, SCALES[name], fmt, args.dataset, args.seed), 2)
+                print(f"  generated in {gen_sec}s")
+        else:
+            print("Unknown source:", name, file=sys.stderr)
+            return 1
+        db_path = BENCH_DIR / f"ingest-{name}-{fmt}.db"
+        print(f"Source {name} ({fmt}), batch {args.batch}:")
+        # A spawned (not forked) process: its peak RSS excludes this one's, e.g. after generate()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            run = pool.submit(run_ingest, source, fmt, db_path, args.batch, args.commit_every, args.profile).result()
+        if not args.keep_db:
+            db_path.unlink(missing_ok=True)
+        profile = run.pop("profile", None)
+        if profile is not None:
+            prof_path = out.with_name(f"{out.stem}-{name}.{'txt' if args.profile == 'table' else 'collapsed'}")
+            prof_path.parent.mkdir(parents=True, exist_ok=True)
+            prof_path.write_text(profile, encoding="utf-8")
+            run["profile_path"] = str(prof_path)
+        runs.append({"source": name, "format": fmt, "path": str(source), "generate_seconds": gen_sec, **run})
+        _print_run(run)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "benchmark": "ingest",
+        "timestamp": stamp,
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "batch": args.batch,
+        "commit_every": args.commit_every,
+        "runs": runs,
+    }
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print("Results:", out)
+
+    if args.baseline:
+        base = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if (base.get("batch"), base.get("commit_every")) != (args.batch, args.commit_every):
+            print(f"Baseline ran with batch {base.get('batch')}, commit every {base.get('commit_every')}: "
+                  "rows/s are not comparable", file=sys.stderr)
+            return 1
+        base_runs = {(r["source"], r["format"]): r for r in base.get("runs", [])}
+        failed = False
+        for run in runs:
+            prev = base_runs.get((run["source"], run["format"]))
+            if not prev or not prev.get("rows_per_sec"):
+                continue
+            change = run["rows_per_sec"] / prev["rows_per_sec"] - 1
+            slower = change < -args.max_regression
+            failed = failed or slower
+            print(f"{run['source']} ({run['format']}): {prev['rows_per_sec']} -> {run['rows_per_sec']} rows/s "
+                  f"({change:+.1%}){'  REGRESSION' if slower else ''}")
+        if failed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Memory-mapped columnar cache of each device's recent uplinks, shared by all API workers.
+
+Per device (data/cache/columnar/):
+  <name>.json             meta: generation, row count, columns, window coverage
+  <name>.<gen>.rows.npy   structured array sorted by (time, event_id): time, event_id,
+                          rssi, snr, battery_normalized, f_port, frequency, spreading_factor,
+                          obj_off/obj_len into the blob, plus one float64 column per numeric
+                          payload key ("obj.<key>", NaN where absent)
+  <name>.<gen>.blob.npy   uint8: concatenated object_json bytes
+
+Workers np.load() both files with mmap_mode="r", so every process shares one page-cache
+copy and reads are zero-copy slices. A device is built from SQL on first use and kept to
+WINDOW_ROWS most recent rows. Each window records the storage it was read from (the
+caller's identity string: DB path and inode, or the partition files); a window built from
+other storage is rebuilt, and so is one whose head row is gone from SQL (retention, a DB
+replaced in place) or, for a complete window, no longer the device's oldest row. On each
+read the newest (time, event_id) in SQL is checked too (one index seek per check); rows
+written since, by the API or any other writer, are read as a delta
+and a new generation is written (old rows copied from the map, no JSON decoding) and
+swapped in by atomically replacing the meta file. Late rows older than the cached tail
+invalidate the device when written through the API (on_write) and are otherwise picked up
+when the device is rebuilt after MAX_AGE_SEC.
+
+NumPy is optional: without it the cache is disabled and the API reads SQL as before.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # optional; cache disabled
+    np = None
+
+WINDOW_ROWS = 20000
+# Rebuild from SQL at least this often so late (out-of-order) rows are not missed forever
+MAX_AGE_SEC = 3600
+META_VERSION = 2
+
+# (column, rendered as int) for the fixed numeric columns, in /api/timeseries order
+NUMERIC_COLUMNS = (
+    ("rssi", True),
+    ("snr", False),
+    ("battery_normalized", False),
+    ("f_port", True),
+    ("frequency", True),
+    ("spreading_factor", True),
+)
+SELECT_COLUMNS = "event_id, time, rssi, snr, battery_normalized, f_port, frequency, spreading_factor, object_json"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _file_stem(dev_eui: str) -> str:
+    digest = hashlib.sha1(dev_eui.encode("utf-8")).hexdigest()[:8]
+    return f"{_UNSAFE.sub('_', dev_eui)[:64]}-{digest}"
+
+
+def _num(v):
+    return float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else math.nan
+
+
+class DeviceView:
+    """Read-only mapped rows of one device; rows[i] ordered by (time, event_id)."""
+
+    __slots__ = ("dev_eui", "meta", "rows", "blob", "meta_stamp")
+
+    def __init__(self, dev_eui: str, meta: dict, rows, blob, meta_stamp):
+        self.dev_eui = dev_eui
+        self.meta = meta
+        self.rows = rows
+        self.blob = blob
+        self.meta_stamp = meta_stamp
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def covers(self, from_time: str | None) -> bool:
+        """True if every row with time >= from_time is cached."""
+        if self.meta["complete"]:
+            return True
+        return bool(from_time) and len(self.rows) > 0 and from_time.encode() > bytes(self.rows["time"][0])
+
+    def select(self, from_time=None, to_time=None, after=None, f_port=None, limit=None):
+        """slice(lo, hi) into rows for the query (zero-copy), or an index array when filtering by f_port."""
+        times = self.rows["time"]
+        lo = int(np.searchsorted(times, from_time.encode(), "left")) if from_time else 0
+        hi = int(np.searchsorted(times, to_time.encode(), "right")) if to_time else len(times)
+        if after:
+            t_after, e_after = after[0].encode(), after[1].encode()
+            start = int(np.searchsorted(times, t_after, "left"))
+            eids = self.rows["event_id"]
+            while start < len(times) and times[start] == t_after and eids[start] <= e_after:
+                start += 1
+            lo = max(lo, start)
+        if f_port is not None:
+            idx = lo + np.flatnonzero(self.rows["f_port"][lo:hi] == f_port)
+            return idx[:limit] if limit is not None else idx
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return slice(lo, max(lo, hi))
+
+    def object_json(self, i: int) -> bytes | None:
+        n = int(self.rows["obj_len"][i])
+        if n < 0:
+            return None
+        off = int(self.rows["obj_off"][i])
+        return self.blob[off:off + n].tobytes()
+
+    def nbytes(self) -> int:
+        return self.rows.nbytes + self.blob.nbytes
+
+
+class ColumnarCache:
+    def __init__(self, root: Path, window_rows: int = WINDOW_ROWS, max_age_sec: float = MAX_AGE_SEC):
+        self.root = Path(root)
+        self.window_rows = window_rows
+        self.max_age_sec = max_age_sec
+        self.enabled = np is not None
+        self._views: dict[str, DeviceView] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    # ---- files ----
+
+    def _meta_path(self, dev_eui: str) -> Path:
+        return self.root / (_file_stem(dev_eui) + ".json")
+
+    def _load(self, dev_eui: str) -> DeviceView | None:
+        """Current generation of dev_eui, re-mapped only when its meta file changed."""
+        meta_path = self._meta_path(dev_eui)
+        try:
+            st = os.stat(meta_path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        view = self._views.get(dev_eui)
+        if view is not None and view.meta_stamp == stamp:
+            return view
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("version") != META_VERSION:
+                return None
+            base = self.root / f"{_file_stem(dev_eui)}.{meta['generation']}"
+            rows = np.load(str(base) + ".rows.npy", mmap_mode="r")
+            blob = np.load(str(base) + ".blob.npy", mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None  # replaced between stat and open; caller rebuilds or retries
+        view = DeviceView(dev_eui, meta, rows, blob, stamp)
+        with self._lock:
+            self._views[dev_eui] = view
+        return view
+
+    def _write(self, dev_eui: str, records: list, complete: bool, previous: DeviceView | None, storage: str) -> DeviceView | None:
+        """Write a new generation from previous rows (copied from the map) plus records; swap meta."""
+        with self._write_lock:
+            return self._write_locked(dev_eui, records, complete, previous, storage)
+
+    def _write_locked(self, dev_eui, records, complete, previous, storage):
+        keep = previous.rows if previous is not None else None
+        if keep is not None and len(keep) + len(records) > self.window_rows:
+            drop = len(keep) + len(records) - self.window_rows
+            keep = keep[drop:] if drop < len(keep) else keep[:0]
+            complete = False
+        if len(records) > self.window_rows:
+            records = records[-self.window_rows:]
+            complete = False
+
+        obj_keys = list(previous.meta["obj_keys"]) if previous is not None else []
+        parsed = []
+        for rec in records:
+            obj = None
+            if rec[8]:
+                try:
+                    obj = json.loads(rec[8])
+                except ValueError:
+                    obj = None
+            parsed.append(obj if isinstance(obj, dict) else None)
+            for k, v in (obj.items() if isinstance(obj, dict) else ()):
+                if k not in obj_keys and not math.isnan(_num(v)):
+                    obj_keys.append(k)
+
+        time_w = max([len(r[1].encode()) for r in records] + ([keep.dtype["time"].itemsize] if keep is not None else []) + [1])
+        eid_w = max([len(r[0].encode()) for r in records] + ([keep.dtype["event_id"].itemsize] if keep is not None else []) + [1])
+        dtype = np.dtype(
+            [("time", f"S{time_w}"), ("event_id", f"S{eid_w}")]
+            + [(c, "f8") for c, _ in NUMERIC_COLUMNS]
+            + [("obj_off", "i8"), ("obj_len", "i4")]
+            + [("obj." + k, "f8") for k in obj_keys]
+        )
+        n_keep = len(keep) if keep is not None else 0
+        rows = np.zeros(n_keep + len(records), dtype=dtype)
+        for k in obj_keys:
+            rows["obj." + k] = math.nan
+        blobs = []
+        blob_base = 0
+        if n_keep:
+            for name in keep.dtype.names:
+                rows[name][:n_keep] = keep[name]
+            # Rebase kept offsets onto the compacted blob
+            first_off = int(keep["obj_off"][0])
+            last = n_keep - 1
+            end = int(keep["obj_off"][last]) + max(0, int(keep["obj_len"][last]))
+            blobs.append(previous.blob[first_off:end])
+            rows["obj_off"][:n_keep] -= first_off
+            blob_base = end - first_off
+        new = rows[n_keep:]
+        new["time"] = [r[1].encode() for r in records]
+        new["event_id"] = [r[0].encode() for r in records]
+        for j, (c, _) in enumerate(NUMERIC_COLUMNS):
+            new[c] = [math.nan if r[2 + j] is None else r[2 + j] for r in records]
+        pieces = []
+        offs = []
+        lens = []
+        for rec in records:
+            raw = rec[8].encode("utf-8") if rec[8] else None
+            offs.append(blob_base)
+            lens.append(len(raw) if raw is not None else -1)
+            if raw is not None:
+                pieces.append(raw)
+                blob_base += len(raw)
+        new["obj_off"] = offs
+        new["obj_len"] = lens
+        for k in obj_keys:
+            new["obj." + k] = [_num(o.get(k)) if o is not None else math.nan for o in parsed]
+        blobs.append(np.frombuffer(b"".join(pieces), dtype=np.uint8))
+        blob = np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8)
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        stem = _file_stem(dev_eui)
+        generation = f"{time.time_ns()}-{os.getpid()}"
+        base = self.root / f"{stem}.{generation}"
+        np.save(str(base) + ".rows.npy", rows, allow_pickle=False)
+        np.save(str(base) + ".blob.npy", blob, allow_pickle=False)
+        meta = {
+            "version": META_VERSION,
+            "dev_eui": dev_eui,
+            "storage": storage,
+            "generation": generation,
+            "rows": len(rows),
+            "complete": complete,
+            "obj_keys": obj_keys,
+            "built_at": previous.meta["built_at"] if previous is not None else time.time(),
+        }
+        tmp = self.root / f"{stem}.json.{generation}.tmp"
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, self._meta_path(dev_eui))
+        self._sweep(stem, generation)
+        return self._load(dev_eui)
+
+    def _sweep(self, stem: str, current: str) -> None:
+        """Delete superseded generations, including ones orphaned by concurrent writers in other workers.
+
+        Files younger than a few seconds may belong to a writer in another worker that has not
+        swapped its meta in yet, so they are left for the next sweep.
+        """
+        cutoff = time.time() - 5
+        for path in self.root.glob(f"{stem}.*.npy"):
+            if path.name.startswith(f"{stem}.{current}."):
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    os.unlink(path)  # mapped readers keep their pages (POSIX)
+            except OSError:
+                pass
+
+    # ---- read path ----
+
+    def get(self, conn, dev_eui: str, storage: str = "") -> tuple[DeviceView | None, str]:
+        """(up-to-date view of dev_eui or None, "hit" | "delta" | "build" | "disabled" | "empty").
+
+        storage names what conn reads (see the module docstring). Builds or extends the device
+        from conn as needed.
+        """
+        if not self.enabled:
+            return None, "disabled"
+        view = self._load(dev_eui)
+        if view is not None and time.time() - view.meta["built_at"] > self.max_age_sec:
+            view = None  # periodic full rebuild
+        if view is not None and (view.meta["storage"] != storage or not self._head_matches(conn, view)):
+            view = None  # other storage, or rows deleted/replaced under the window
+        if view is not None:
+            latest = conn.execute(
+                "SELECT time, event_id FROM uplinks WHERE dev_eui = ? ORDER BY time DESC, event_id DESC LIMIT 1",
+                (dev_eui,),
+            ).fetchone()
+            tail = (bytes(view.rows["time"][-1]).decode(), bytes(view.rows["event_id"][-1]).decode()) if len(view) else None
+            if latest is None or tail is None or (latest[0], latest[1]) == tail:
+                return view, "hit"
+            if (latest[0], latest[1]) > tail:
+                delta = conn.execute(
+                    f"SELECT {SELECT_COLUMNS} FROM uplinks WHERE dev_eui = ? AND (time, event_id) > (?, ?) "
+                    "ORDER BY time ASC, event_id ASC LIMIT ?",
+                    (dev_eui, tail[0], tail[1], self.window_rows),
+                ).fetchall()
+                if len(delta) < self.window_rows:
+                    return self._write(dev_eui, [tuple(r) for r in delta], view.meta["complete"], view, storage), "delta"
+            # Newest row went backwards (deleted/rewritten) or the delta overflows the window: rebuild
+        rows = conn.execute(
+            f"SELECT {SELECT_COLUMNS} FROM uplinks WHERE dev_eui = ? ORDER BY time DESC, event_id DESC LIMIT ?",
+            (dev_eui, self.window_rows + 1),
+        ).fetchall()
+        if not rows:
+            return None, "empty"
+        complete = len(rows) <= self.window_rows
+        records = [tuple(r) for r in reversed(rows[: self.window_rows])]
+        return self._write(dev_eui, records, complete, None, storage), "build"
+
+    def _head_matches(self, conn, view: DeviceView) -> bool:
+        """The window's first row is still in SQL, and is the device's oldest when the window is complete."""
+        if not len(view):
+            return True
+        head = (bytes(view.rows["time"][0]).decode(), bytes(view.rows["event_id"][0]).decode())
+        if view.meta["complete"]:
+            first = conn.execute(
+                "SELECT time, event_id FROM uplinks WHERE dev_eui = ? ORDER BY time ASC, event_id ASC LIMIT 1",
+                (view.dev_eui,),
+            ).fetchone()
+            return first is not None and (first[0], first[1]) == head
+        found = conn.execute(
+            "SELECT 1 FROM uplinks WHERE dev_eui = ? AND time = ? AND event_id = ?", (view.dev_eui,) + head
+        ).fetchone()
+        return found is not None
+
+    def on_write(self, rows: list[dict]) -> None:
+        """Write hook: drop cached devices that got rows at or before their cached tail.
+
+        Rows after the tail are appended as a delta on the next read; late or replaced rows
+        would otherwise be invisible until the periodic rebuild.
+        """
+        if not self.enabled:
+            return
+        oldest: dict[str, tuple] = {}
+        for row in rows:
+            key = (row["time"], row["event_id"])
+            if row["dev_eui"] not in oldest or key < oldest[row["dev_eui"]]:
+                oldest[row["dev_eui"]] = key
+        for dev_eui, key in oldest.items():
+            view = self._load(dev_eui)
+            if view is None or not len(view):
+                continue
+            tail = (bytes(view.rows["time"][-1]).decode(), bytes(view.rows["event_id"][-1]).decode())
+            if key <= tail:
+                self.invalidate(dev_eui)
+
+    def invalidate(self, dev_eui: str) -> None:
+        """Forget dev_eui in every worker; the next read rebuilds it from SQL."""
+        try:
+            os.unlink(self._meta_path(dev_eui))
+        except OSError:
+            pass
+        with self._lock:
+            self._views.pop(dev_eui, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            views = list(self._views.values())
+        return {"devices_mapped": len(views), "mapped_bytes": sum(v.nbytes() for v in views)}
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Coverage grid: RSSI/SNR statistics of located uplinks binned on Web Mercator tiles, for the
+Map view's coverage heatmap (/api/coverage/{z}/{x}/{y}).
+
+Each tile of zoom 0..MAX_ZOOM is split into BINS x BINS cells (the tile grid of zoom
+z + BIN_BITS), and every located uplink (location_lat/location_lon) counts in the cell
+that contains it at every zoom. Uplinks carry the location of the first gateway that
+received them, so with fixed gateways a cell is where a gateway sits and its statistics
+are how well that gateway hears its devices; uplinks located by field testers or GPS
+trackers fill in the cells in between.
+
+The grid lives in data/cache/coverage.db:
+
+- cov_cells (zoom, tx, ty, day, bx, by): uplinks, rssi and snr count/sum/min/max and
+  `weak` (rssi < WEAK_RSSI) per UTC day, so a tile can be limited to a date range and a
+  late row's day can be recomputed
+
+refresh() (scripts/incremental.py: watermark, replay queue, locking) loads located uplinks
+after the watermark into a temp table and collapses them per (day, finest cell); each zoom
+is then upserted and merged 2 x 2 into the next coarser one inside SQLite, so every GROUP BY
+reads the cells of one zoom only. Located rows written at or before the watermark queue
+their day via on_write(); the day is recomputed on the next refresh.
+tile() is one primary-key range read.
+
+Run:
+  python scripts/coverage_grid.py update             # fold new uplinks (first run: backfill)
+  python scripts/coverage_grid.py rebuild
+  python scripts/coverage_grid.py tile Z X Y [--from DAY] [--to DAY]
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine
+    from scripts import partitions
+except ImportError:  # run as python scripts/coverage_grid.py
+    from incremental import IncrementalEngine
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "coverage.db"
+# Tiles are kept for zoom 0..MAX_ZOOM; deeper map zooms scale the MAX_ZOOM tiles
+MAX_ZOOM = 16
+# A tile holds 2**BIN_BITS x 2**BIN_BITS cells (32 x 32: 8 px each on 256 px tiles)
+BIN_BITS = 5
+BINS = 1 << BIN_BITS
+# Same threshold as the Map view's weak links
+WEAK_RSSI = -100
+# Uplink rows read per fetchmany while loading a batch
+FETCH_ROWS = 50_000
+# Positions whose finest cell is remembered during a fold (cleared when full)
+CELL_CACHE_SIZE = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cov_cells (
+    zoom INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    ty INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    bx INTEGER NOT NULL,
+    by INTEGER NOT NULL,
+    uplinks INTEGER NOT NULL DEFAULT 0,
+    rssi_n INTEGER NOT NULL DEFAULT 0,
+    rssi_sum REAL NOT NULL DEFAULT 0,
+    rssi_min REAL,
+    rssi_max REAL,
+    snr_n INTEGER NOT NULL DEFAULT 0,
+    snr_sum REAL NOT NULL DEFAULT 0,
+    snr_min REAL,
+    snr_max REAL,
+    weak INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (zoom, tx, ty, day, bx, by)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cov_replay (day TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS cov_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT substr(time, 1, 10), location_lat, location_lon, rssi, snr
+    FROM uplinks
+    WHERE {where} AND location_lat IS NOT NULL AND location_lon IS NOT NULL
+"""
+
+_AGGREGATES = """
+    SUM(uplinks), SUM(rssi_n), TOTAL(rssi_sum), MIN(rssi_min), MAX(rssi_max),
+    SUM(snr_n), TOTAL(snr_sum), MIN(snr_min), MAX(snr_max), SUM(weak)
+"""
+
+# Finest cells of the batch (zoom MAX_ZOOM + BIN_BITS tiles): one row per (day, cell)
+_COLLAPSE = f"""
+    INSERT INTO temp.cov_level0
+    SELECT day, cx, cy, COUNT(*), COUNT(rssi), TOTAL(rssi), MIN(rssi), MAX(rssi),
+           COUNT(snr), TOTAL(snr), MIN(snr), MAX(snr), COUNT(CASE WHEN rssi < {WEAK_RSSI} THEN 1 END)
+    FROM temp.cov_batch GROUP BY day, cx, cy
+"""
+
+# The next zoom up: each cell merges the 2 x 2 cells under it
+_COARSEN = f"""
+    INSERT INTO temp.{{dst}}
+    SELECT day, cx >> 1, cy >> 1, {_AGGREGATES}
+    FROM temp.{{src}} GROUP BY day, cx >> 1, cy >> 1
+"""
+
+# Cells of one zoom (one row per (day, cx, cy) already) merged into the tiles
+_UPSERT_ZOOM = """
+    INSERT INTO cov_cells
+    SELECT {zoom}, cx >> {bits}, cy >> {bits}, day, cx & {mask}, cy & {mask},
+           uplinks, rssi_n, rssi_sum, rssi_min, rssi_max, snr_n, snr_sum, snr_min, snr_max, weak
+    FROM temp.{src}
+    ORDER BY 2, 3, 4, 5, 6
+    ON CONFLICT(zoom, tx, ty, day, bx, by) DO UPDATE SET
+        uplinks = uplinks + excluded.uplinks,
+        rssi_n = rssi_n + excluded.rssi_n,
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_min = MIN(COALESCE(rssi_min, excluded.rssi_min), COALESCE(excluded.rssi_min, rssi_min)),
+        rssi_max = MAX(COALESCE(rssi_max, excluded.rssi_max), COALESCE(excluded.rssi_max, rssi_max)),
+        snr_n = snr_n + excluded.snr_n,
+        snr_sum = snr_sum + excluded.snr_sum,
+        snr_min = MIN(COALESCE(snr_min, excluded.snr_min), COALESCE(excluded.snr_min, snr_min)),
+        snr_max = MAX(COALESCE(snr_max, excluded.snr_max), COALESCE(excluded.snr_max, snr_max)),
+        weak = weak + excluded.weak
+"""
+
+def cell_of(lat: float, lon: float, zoom: int) -> tuple[int, int]:
+    """Web Mercator tile (x, y) containing lat/lon at zoom."""
+    n = 1 << zoom
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    s = math.sin(math.radians(lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(z: int, x: int, y: int) -> dict:
+    """{north, west, south, east} of a Web Mercator tile in degrees."""
+    n = 1 << z
+
+    def lat(t):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+
+    return {"north": lat(y), "west": x / n * 360.0 - 180.0, "south": lat(y + 1), "east": (x + 1) / n * 360.0 - 180.0}
+
+
+class CoverageGrid(IncrementalEngine):
+    """Per-day RSSI/SNR cells on a Web Mercator tile pyramid, maintained from the uplinks incrementally."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "cov"
+    TABLES = ("cov_cells", "cov_replay", "cov_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH):
+        super().__init__(path)
+
+    def _replays(self, row: dict) -> bool:
+        return row.get("location_lat") is not None
+
+    def _clear_day(self, state, day: str) -> None:
+        state.execute("DELETE FROM cov_cells WHERE day = ?", (day,))
+
+    def _fold(self, state, cur, replay: bool = False) -> int:
+        """Load located rows into temp.cov_batch at the finest cell, collapse them and upsert every zoom."""
+        finest = MAX_ZOOM + BIN_BITS
+        cells: dict[tuple, tuple] = {}  # (lat, lon) -> finest cell; uplinks repeat their gateway's position
+
+        def cell(lat, lon):
+            c = cells.get((lat, lon))
+            if c is None:
+                if len(cells) >= CELL_CACHE_SIZE:
+                    cells.clear()
+                c = cells[(lat, lon)] = cell_of(lat, lon, finest)
+            return c
+
+        state.execute("CREATE TEMP TABLE IF NOT EXISTS cov_batch (day, cx, cy, rssi, snr)")
+        for level in ("cov_level0", "cov_level1"):
+            state.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {level} "
+                "(day, cx, cy, uplinks, rssi_n, rssi_sum, rssi_min, rssi_max, snr_n, snr_sum, snr_min, snr_max, weak)"
+            )
+            state.execute(f"DELETE FROM temp.{level}")
+        state.execute("DELETE FROM temp.cov_batch")
+        n = 0
+        while True:
+            batch = cur.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            state.executemany(
+                "INSERT INTO temp.cov_batch VALUES (?, ?, ?, ?, ?)",
+                [(day, *cell(lat, lon), rssi, snr) for day, lat, lon, rssi, snr in batch],
+            )
+            n += len(batch)
+        if not n:
+            return 0
+        state.execute(_COLLAPSE)
+        state.execute("DELETE FROM temp.cov_batch")
+        # Coarsen level by level: each GROUP BY reads the previous zoom's cells, not every uplink
+        src, dst = "cov_level0", "cov_level1"
+        for zoom in range(MAX_ZOOM, -1, -1):
+            state.execute(_UPSERT_ZOOM.format(zoom=zoom, bits=BIN_BITS, mask=BINS - 1, src=src))
+            if zoom:
+                state.execute(_COARSEN.format(src=src, dst=dst))
+            state.execute(f"DELETE FROM temp.{src}")
+            src, dst = dst, src
+        return n
+
+    def tile(self, z: int, x: int, y: int, from_day: str | None = None, to_day: str | None = None) -> dict:
+        """Non-empty cells of tile z/x/y summed over [from_day, to_day] (whole history by default), as columns."""
+        if not 0 <= z <= MAX_ZOOM:
+            raise ValueError(f"z must be within 0..{MAX_ZOOM}")
+        if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise ValueError(f"x and y must be within 0..{(1 << z) - 1} at zoom {z}")
+        for day in (from_day, to_day):
+            if day is not None:
+                try:
+                    date.fromisoformat(day[:10])
+                except ValueError:
+                    raise ValueError("from/to must be ISO-8601 dates") from None
+        state = self._open()
+        try:
+            rows = state.execute(
+                """
+                SELECT bx, by, SUM(uplinks), SUM(rssi_n), TOTAL(rssi_sum), MIN(rssi_min), MAX(rssi_max),
+                       SUM(snr_n), TOTAL(snr_sum), MIN(snr_min), MAX(snr_max), SUM(weak)
+                FROM cov_cells
+                WHERE zoom = ? AND tx = ? AND ty = ? AND day >= ? AND day <= ?
+                GROUP BY by, bx ORDER BY by, bx
+                """,
+                (z, x, y, from_day[:10] if from_day else "", to_day[:10] if to_day else "9999"),
+            ).fetchall()
+            mark = self.watermark(state)
+        finally:
+            state.close()
+        cols = {k: [] for k in ("bx", "by", "uplinks", "rssi_mean", "rssi_min", "rssi_max",
+                                "snr_mean", "snr_min", "snr_max", "weak_pct")}
+        for bx, by, uplinks, rssi_n, rssi_sum, rssi_min, rssi_max, snr_n, snr_sum, snr_min, snr_max, weak in rows:
+            cols["bx"].append(bx)
+            cols["by"].append(by)
+            cols["uplinks"].append(uplinks)
+            cols["rssi_mean"].append(round(rssi_sum / rssi_n, 1) if rssi_n else None)
+            cols["rssi_min"].append(rssi_min)
+            cols["rssi_max"].append(rssi_max)
+            cols["snr_mean"].append(round(snr_sum / snr_n, 1) if snr_n else None)
+            cols["snr_min"].append(snr_min)
+            cols["snr_max"].append(snr_max)
+            cols["weak_pct"].append(round(100 * weak / rssi_n, 1) if rssi_n else None)
+        return {
+            "z": z,
+            "x": x,
+            "y": y,
+            "bins": BINS,
+            "max_zoom": MAX_ZOOM,
+            "bounds": tile_bounds(z, x, y),
+            "from": from_day[:10] if from_day else None,
+            "to": to_day[:10] if to_day else None,
+            "cells": len(rows),
+            "processed_through": mark[0] if mark else None,
+            **cols,
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="grid DB (default data/cache/coverage.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="fold uplinks after the watermark")
+    sub.add_parser("rebuild", help="drop the grid and rebuild it from all uplinks")
+    p_tile = sub.add_parser("tile", help="print one tile as JSON")
+    p_tile.add_argument("z", type=int)
+    p_tile.add_argument("x", type=int)
+    p_tile.add_argument("y", type=int)
+    p_tile.add_argument("--from", dest="from_day")
+    p_tile.add_argument("--to", dest="to_day")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    grid = CoverageGrid(args.state)
+    if args.command in ("update", "rebuild"):
+        t0 = time.perf_counter()
+        n = (grid.rebuild if args.command == "rebuild" else grid.catch_up)(connect)
+        print(f"Folded {n} located uplinks in {time.perf_counter() - t0:.1f}s:", args.state)
+        return 0
+    grid.catch_up(connect)
+    try:
+        print(json.dumps(grid.tile(args.z, args.x, args.y, args.from_day, args.to_day), indent=2))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
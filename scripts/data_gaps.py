@@ -1,56 +1,306 @@
 #!/usr/bin/env python3
-"""Report missing/empty data and fields we don't parse. Run: python scripts/data_gaps.py"""
+"""
+Data-quality report: missing fields and per-device uplink gaps, in one ordered scan.
 
+A single statement reads uplinks ordered by (dev_eui, time, event_id) (the pagination
+index, so no sort) with julianday(time) and a bitmask of the row's missing fields; over
+more monthly partitions than one connection attaches, each window's cursor is merged on
+(dev_eui, time). The
+fold takes each interval from the previous row of the same device (what LAG() would
+return; SQLite's window operator roughly doubled the scan time at 1M rows) and finishes a
+device when the scan moves on to the next, so only one device's intervals are held at a
+time: a histogram of them at INTERVAL_RESOLUTION_SEC, the intervals longer than
+MIN_GAP_SEC (no shorter one can be a gap) with their times, and counts per
+(gateway_ids, mask) pair:
+
+- cadence: median interval of the device (from the histogram)
+- gap: an interval longer than GAP_FACTOR x cadence (and at least MIN_GAP_SEC)
+- silent: time from the device's last uplink to the end of the scanned range, flagged as
+  an open gap when it is itself gap-sized
+
+Per-gateway totals are kept per distinct gateway_ids string and split into gateways at the
+end, so rows are never JSON-decoded. scripts/api.py serves this as /api/quality.
+
+Run: python scripts/data_gaps.py [--from ISO] [--to ISO] [--factor 2.5] [--json]
+"""
+
+import argparse
+import heapq
 import json
-import sqlite3
+import sys
+from datetime import datetime, timezone
 from pathlib import Path
 
+try:
+    from scripts import partitions
+    from scripts.incremental import open_windows
+except ImportError:  # run as python scripts/data_gaps.py
+    import partitions
+    from incremental import open_windows
+
 REPO_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = REPO_ROOT / "data" / "uplinks.db"
 
+# An interval is a gap when longer than GAP_FACTOR x the device's median interval; halfway
+# between multiples so jitter doesn't flip it (2.5: two or more consecutive uplinks missed)
+GAP_FACTOR = 2.5
+# ... and never shorter than this, so sub-minute jitter on fast senders isn't reported
+MIN_GAP_SEC = 300
+# Longest gaps listed per device (all are counted)
+MAX_GAPS_PER_DEVICE = 20
+# Bucket width of the interval histogram the cadence median is taken from (cadence is reported to 0.1 s)
+INTERVAL_RESOLUTION_SEC = 0.1
+
+# Bit per missing field, in the order of the SQL mask below
+FIELDS = ("object", "gateway_ids", "location", "rssi", "snr", "battery")
+MISSING_MASK_SQL = """
+    (object_json IS NULL OR object_json IN ('null', '{}'))
+    | (gateway_ids IS NULL) << 1
+    | (location_lat IS NULL) << 2
+    | (rssi IS NULL) << 3
+    | (snr IS NULL) << 4
+    | (battery_normalized IS NULL) << 5
+"""
+
+
+def _missing(masks: dict) -> dict:
+    """{mask: rows} -> {field: rows missing it}."""
+    out = dict.fromkeys(FIELDS, 0)
+    for mask, n in masks.items():
+        if mask:
+            for bit, field in enumerate(FIELDS):
+                if mask >> bit & 1:
+                    out[field] += n
+    return out
+
+
+def _histogram_median(counts: dict, n: int) -> float:
+    """Median of n values given as {value: occurrences}."""
+    lo, hi = (n - 1) // 2, n // 2
+    seen, low = 0, None
+    for value in sorted(counts):
+        seen += counts[value]
+        if low is None and seen > lo:
+            low = value
+        if seen > hi:
+            return (low + value) / 2
+    raise ValueError("n exceeds the histogram count")
+
+
+def _seconds_between(a: str, b: str) -> float | None:
+    try:
+        ta = datetime.fromisoformat(a.replace("Z", "+00:00"))
+        tb = datetime.fromisoformat(b.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ta.tzinfo is None:
+        ta = ta.replace(tzinfo=timezone.utc)
+    if tb.tzinfo is None:
+        tb = tb.replace(tzinfo=timezone.utc)
+    return (tb - ta).total_seconds()
+
+
+def _device_entry(scan: dict, last_seen: str, factor: float, min_gap_sec: float, max_gaps: int) -> dict:
+    """Report entry of one scanned device; silent_sec/silent are filled in once the end of the range is known."""
+    masks: dict[int, int] = {}
+    for (_, mask), n in scan["pairs"].items():
+        masks[mask] = masks.get(mask, 0) + n
+    intervals = scan["intervals"]
+    known = sum(intervals.values())
+    cadence = _histogram_median(intervals, known) * INTERVAL_RESOLUTION_SEC if known >= 2 else None
+    threshold = max(factor * cadence, min_gap_sec) if cadence is not None else None
+    gaps = [c for c in scan["candidates"] if c[0] > threshold] if threshold is not None else []
+    gaps.sort(key=lambda iv: iv[0], reverse=True)
+    return {
+        "dev_eui": scan["dev_eui"],
+        "device_name": scan["device_name"],
+        "profile": scan["profile"],
+        "rows": sum(scan["pairs"].values()),
+        "first_seen": scan["first_seen"],
+        "last_seen": last_seen,
+        "missing": _missing(masks),
+        "cadence_sec": round(cadence, 1) if cadence is not None else None,
+        "silent_sec": None,
+        "silent": False,
+        "gap_count": len(gaps),
+        "gap_sec_total": round(sum(g for g, _, _ in gaps), 1),
+        "gaps": [{"from": a, "to": b, "duration_sec": round(g, 1)} for g, a, b in gaps[:max_gaps]],
+        "_threshold": threshold,
+    }
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    total = conn.execute("SELECT COUNT(*) FROM uplinks").fetchone()[0]
-    no_obj = conn.execute(
-        "SELECT COUNT(*) FROM uplinks WHERE object_json IS NULL OR object_json = 'null' OR object_json = '{}'"
-    ).fetchone()[0]
-    no_gw = conn.execute("SELECT COUNT(*) FROM uplinks WHERE gateway_ids IS NULL").fetchone()[0]
-    no_loc = conn.execute("SELECT COUNT(*) FROM uplinks WHERE location_lat IS NULL").fetchone()[0]
-    has_loc = conn.execute("SELECT COUNT(*) FROM uplinks WHERE location_lat IS NOT NULL").fetchone()[0]
-    no_rssi = conn.execute("SELECT COUNT(*) FROM uplinks WHERE rssi IS NULL").fetchone()[0]
-    no_snr = conn.execute("SELECT COUNT(*) FROM uplinks WHERE snr IS NULL").fetchone()[0]
-    no_bat = conn.execute("SELECT COUNT(*) FROM uplinks WHERE battery_normalized IS NULL").fetchone()[0]
-    conn.close()
 
+def quality_report(
+    conns: list,
+    from_time: str | None = None,
+    to_time: str | None = None,
+    factor: float = GAP_FACTOR,
+    min_gap_sec: float = MIN_GAP_SEC,
+    max_gaps: int = MAX_GAPS_PER_DEVICE,
+) -> dict:
+    """Missing-field totals, per-device cadence/gaps and per-gateway totals over [from_time, to_time].
+
+    conns: read connections over consecutive time ranges, oldest first (usually just one).
+    """
+    where, args = [], []
+    if from_time:
+        where.append("time >= ?")
+        args.append(from_time)
+    if to_time:
+        where.append("time <= ?")
+        args.append(to_time)
+    sql = f"""
+        SELECT dev_eui, device_name, device_profile_name, gateway_ids, time, julianday(time),
+               {MISSING_MASK_SQL}
+        FROM uplinks
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY dev_eui, time, event_id
+    """
+    cur = heapq.merge(*(conn.execute(sql, args) for conn in conns), key=lambda r: (r[0], r[4]))
+
+    devices = []
+    gateway_rows: dict[str, dict] = {}  # gateway_ids string -> {mask: rows}
+    gateway_devices: dict[str, set] = {}
+    total_masks: dict[int, int] = {}
+
+    def finish(scan: dict, last_seen: str) -> None:
+        for (gids, mask), n in scan["pairs"].items():
+            total_masks[mask] = total_masks.get(mask, 0) + n
+            if gids is not None:
+                per_gw = gateway_rows.setdefault(gids, {})
+                per_gw[mask] = per_gw.get(mask, 0) + n
+                gateway_devices.setdefault(gids, set()).add(scan["dev_eui"])
+        devices.append(_device_entry(scan, last_seen, factor, min_gap_sec, max_gaps))
+
+    # The device being scanned: intervals counted per INTERVAL_RESOLUTION_SEC bucket, the ones
+    # longer than min_gap_sec (the gap threshold never is lower) as (interval, from, to)
+    # candidates, and rows per (gateway_ids, mask)
+    dev = None
+    prev_dev = prev_jd = prev_time = None
+    per_sec = 1 / INTERVAL_RESOLUTION_SEC
+    for dev_eui, name, profile, gids, time_val, jd, mask in cur:
+        if dev_eui != prev_dev:
+            if dev is not None:
+                finish(dev, prev_time)
+            intervals, candidates, pairs = {}, [], {}
+            dev = {"dev_eui": dev_eui, "device_name": name, "profile": profile, "first_seen": time_val,
+                   "intervals": intervals, "candidates": candidates, "pairs": pairs}
+            prev_dev = dev_eui
+        elif jd is not None and prev_jd is not None:
+            interval = (jd - prev_jd) * 86400.0
+            bucket = round(interval * per_sec)
+            intervals[bucket] = intervals.get(bucket, 0) + 1
+            if interval > min_gap_sec:
+                candidates.append((interval, prev_time, time_val))
+        prev_jd, prev_time = jd, time_val
+        key = (gids, mask)
+        pairs[key] = pairs.get(key, 0) + 1
+    if dev is not None:
+        finish(dev, prev_time)
+
+    scan_end = max((d["last_seen"] for d in devices), default=None)
+    range_end = to_time or scan_end
+    for dev in devices:
+        threshold = dev.pop("_threshold")
+        if threshold is not None:
+            silent = _seconds_between(dev["last_seen"], range_end) if range_end else None
+            dev["silent_sec"] = round(silent, 1) if silent is not None and silent > 0 else 0
+            dev["silent"] = silent is not None and silent > threshold
+    devices.sort(key=lambda d: (-d["gap_sec_total"], d["dev_eui"]))
+
+    # Split gateway_ids strings (one per distinct receiving set) into gateways
+    gateways: dict[str, dict] = {}
+    for gids, masks in gateway_rows.items():
+        try:
+            ids = json.loads(gids)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        for gid in ids if isinstance(ids, list) else ():
+            g = gateways.setdefault(gid, {"gateway_id": gid, "rows": 0, "_masks": {}, "_devices": set()})
+            for mask, n in masks.items():
+                g["rows"] += n
+                g["_masks"][mask] = g["_masks"].get(mask, 0) + n
+            g["_devices"] |= gateway_devices.get(gids, set())
+    gateway_list = []
+    for g in gateways.values():
+        g["devices"] = len(g.pop("_devices"))
+        g["missing"] = _missing(g.pop("_masks"))
+        gateway_list.append(g)
+    gateway_list.sort(key=lambda g: (-g["rows"], g["gateway_id"]))
+
+    total = sum(total_masks.values())
+    return {
+        "from": from_time,
+        "to": range_end,
+        "rows": total,
+        "missing": _missing(total_masks),
+        "gap_factor": factor,
+        "min_gap_sec": min_gap_sec,
+        "devices_with_gaps": sum(1 for d in devices if d["gap_count"]),
+        "devices_silent": sum(1 for d in devices if d["silent"]),
+        "devices": devices,
+        "gateways": gateway_list,
+    }
+
+
+def print_report(report: dict) -> None:
+    total = report["rows"]
     pct = lambda n: round(100 * n / total, 1) if total else 0
     print("=== Missing data (stored but null/empty) ===\n")
-    print(f"Total rows: {total}")
-    print(f"No/empty object_json:  {no_obj:5}  ({pct(no_obj)}%)  -> no telemetry for charts")
-    print(f"No gateway_ids:         {no_gw:5}  ({pct(no_gw)}%)  -> excluded from Site / Correlation")
-    print(f"No location (lat/lon): {no_loc:5}  ({pct(no_loc)}%)  -> no map pin for that uplink")
-    print(f"Has location:          {has_loc:5}  ({pct(has_loc)}%)")
-    print(f"No rssi:               {no_rssi:5}  ({pct(no_rssi)}%)  -> join/status or no rxInfo")
-    print(f"No snr:                {no_snr:5}  ({pct(no_snr)}%)")
-    print(f"No battery_normalized: {no_bat:5}  ({pct(no_bat)}%)  -> object has no Bat/battery_*")
-    print()
-    print("=== Raw JSON fields we do NOT parse/store ===\n")
-    print("- devAddr, adr, dr, fCnt, fPort, confirmed, data (base64)")
-    print("- txInfo: frequency, modulation (bandwidth, spreadingFactor, codeRate)")
-    print("- regionConfigId")
-    print("- margin, externalPowerSource, batteryLevelUnavailable, batteryLevel (join/status)")
-    print("- tenantId, tenantName, deviceProfileId, deviceClassEnabled, tags")
-    print("- rxInfo: only first gateway's rssi/snr/location; we drop uplinkId, nsTime, timeSinceGpsEpoch, channel, context, crcStatus")
-    print("- rxInfo: multiple gateways -> we store all gateway_ids but only one rssi/snr/location (first)")
-    print()
-    print("=== Impact for app effectiveness ===\n")
-    print(f"- ~{pct(no_obj)}% of rows have no decoded payload -> device charts show gaps; join/status-only records.")
-    print(f"- ~{pct(no_loc)}% of rows have no gateway location -> map shows only gateways that had at least one uplink with location.")
-    print(f"- Rows with no gateway_ids ({pct(no_gw)}%) cannot be used in Site or Door+climate views.")
-    print("- We do not store fPort -> cannot filter by port (e.g. SW3L flow vs config).")
-    print("- We do not store join/status fields (margin, batteryLevel) -> device list cannot show 'last join margin'.")
-    print("- We do not store txInfo -> no 'frequency / SF' view for radio analysis.")
+    print(f"Rows: {total}  ({report['from'] or 'start'} .. {report['to'] or 'end'})")
+    notes = {
+        "object": "no telemetry for charts",
+        "gateway_ids": "excluded from Site / Correlation",
+        "location": "no map pin for that uplink",
+        "rssi": "join/status or no rxInfo",
+        "snr": "",
+        "battery": "object has no Bat/battery_*",
+    }
+    for field, n in report["missing"].items():
+        print(f"No {field + ':':13} {n:9}  ({pct(n):5}%)  {'-> ' + notes[field] if notes[field] else ''}")
+
+    devices = report["devices"]
+    print(f"\n=== Gaps (interval > {report['gap_factor']:g} x device cadence, >= {report['min_gap_sec']:g}s) ===\n")
+    print(f"Devices: {len(devices)}, with gaps: {report['devices_with_gaps']}, silent at end: {report['devices_silent']}\n")
+    for d in devices:
+        if not d["gap_count"] and not d["silent"]:
+            continue
+        print(f"{d['dev_eui']}  {d['device_name'] or '':24}  cadence {d['cadence_sec']}s  "
+              f"{d['gap_count']} gaps, {d['gap_sec_total'] / 3600:.1f} h missing"
+              + (f", silent {d['silent_sec'] / 3600:.1f} h" if d["silent"] else ""))
+        for g in d["gaps"][:5]:
+            print(f"    {g['from']} .. {g['to']}  ({g['duration_sec'] / 3600:.1f} h)")
+
+    print("\n=== Gateways ===\n")
+    for g in report["gateways"]:
+        no_loc = round(100 * g["missing"]["location"] / g["rows"], 1) if g["rows"] else 0
+        print(f"{g['gateway_id']:24} {g['rows']:9} rows  {g['devices']:5} devices  no location {no_loc}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--from", dest="from_time")
+    parser.add_argument("--to", dest="to_time")
+    parser.add_argument("--factor", type=float, default=GAP_FACTOR)
+    parser.add_argument("--json", action="store_true", help="print the /api/quality JSON instead of text")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+    conns = open_windows(connect, args.from_time, args.to_time)
+    try:
+        report = quality_report(conns, args.from_time, args.to_time, args.factor)
+    finally:
+        for conn in conns:
+            conn.close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,180 +1,317 @@
 #!/usr/bin/env python3
 """
-Generate synthetic device uplinks for demo/testing when real data is sparse.
-Inserts into data/uplinks.db with synthetic=1 and device_name like "Synthetic Soil 1".
-Run after ingest.py. Label synthetic devices clearly in the UI.
+Generate a synthetic device fleet for demo, testing and capacity runs.
+Inserts into data/uplinks.db (or the monthly files in data/partitions/ once the DB has been
+split) with synthetic=1 and device_name like "Synthetic Soil 1". Run after ingest.py. Label synthetic devices clearly in the UI.
+
+The default run is the demo fleet (2 soil, 1 level, 2 climate, 1 door, 1 SW3L on one gateway,
+one uplink per ~2 h over the last 48 h). Everything is configurable, e.g. a 10M-row capacity DB:
+
+  python scripts/generate_synthetic.py --db data/bench/fleet.db --soil 2000 --level 2000 \\
+      --climate 2000 --door 2000 --sw3l 2000 --gateways 500 --duration-hours 2000 --interval-sec 720
+
+Payloads are generated as NumPy arrays per block of devices x steps and bulk-inserted with
+executemany in large transactions. Event IDs are "<dev_eui>:<f_cnt>", so re-running with the
+same fleet shape replaces rows instead of duplicating them.
 """
 
+import argparse
 import json
-import random
 import sqlite3
 import sys
-import uuid
+import time
 from datetime import datetime, timedelta, timezone
+from itertools import repeat
 from pathlib import Path
 
+import numpy as np
+
+try:
+    from scripts.ingest import create_schema
+    from scripts import partitions
+except ImportError:  # run as python scripts/generate_synthetic.py
+    from ingest import create_schema
+    import partitions
+
 APP_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = APP_ROOT / "data" / "uplinks.db"
+PARTITION_DIR = APP_ROOT / "data" / "partitions"
+
+# payload kind -> (dev_eui prefix, device_profile_name, device_name label, demo device count)
+SYNTHETIC_PROFILES = {
+    "soil": ("syn_soil", "Makerfabs Soil Moisture Sensor", "Synthetic Soil", 2),
+    "level": ("syn_level", "Dragino DDS75-LB Ultrasonic Distance Sensor", "Synthetic Level", 1),
+    "climate": ("syn_climate", "rbs305-ath", "Synthetic Climate", 2),
+    "door": ("syn_door", "rbs301-dws", "Synthetic Door", 1),
+    "sw3l": ("syn_sw3l", "SW3L", "Synthetic SW3L", 1),
+}
+
+# Dedicated synthetic gateways and location (so synthetic devices appear under their own "sites")
+SYNTHETIC_GATEWAY_PREFIX = "synthetic-gateway-"
+SYNTHETIC_LAT = 45.42  # Ottawa area, clearly for demo
+SYNTHETIC_LON = -75.69
 
-# Synthetic devices: (dev_eui_prefix, device_profile_name, device_name_label, payload generator)
-SYNTHETIC_SPECS = [
-    ("syn_soil_1", "Makerfabs Soil Moisture Sensor", "Synthetic Soil 1", "soil"),
-    ("syn_soil_2", "Makerfabs Soil Moisture Sensor", "Synthetic Soil 2", "soil"),
-    ("syn_level_1", "Dragino DDS75-LB Ultrasonic Distance Sensor", "Synthetic Level 1", "level"),
-    ("syn_climate_1", "rbs305-ath", "Synthetic Climate 1", "climate"),
-    ("syn_climate_2", "rbs305-ath", "Synthetic Climate 2", "climate"),
-    ("syn_door_1", "rbs301-dws", "Synthetic Door 1", "door"),
-    ("syn_sw3l_1", "SW3L", "Synthetic SW3L 1", "sw3l"),
-]
+INSERT_SQL = """
+    INSERT OR REPLACE INTO uplinks (
+        event_id, time, dev_eui, device_name, device_profile_name,
+        application_id, application_name, gateway_ids, rssi, snr,
+        location_lat, location_lon, location_alt, battery_normalized, object_json,
+        f_port, dev_addr, f_cnt, margin, external_power_source,
+        battery_level_unavailable, battery_level_join, frequency, spreading_factor, region_config_id, synthetic
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
 # Real device payload reference: Makerfabs soil_val ~100–1500, temp 15–25°C; DDS75 distance 80–350 cm;
 # rbs305-ath temp 21–23°C, humidity 9–60%; rbs301-dws open 0/1 + eventType; SW3L BAT 2.8–3.7 V.
+# Each generator takes (rng, steps[devices, steps], anomaly mask) and returns
+# (object_json strings, battery_normalized array or None), both flattened row-major.
 
 
-def generate_soil(step: int, base_soil: float = 600, base_temp: float = 19.0) -> dict:
+def generate_soil(rng: np.random.Generator, steps: np.ndarray, anomaly: np.ndarray):
     # Conform to Makerfabs: soil_val typical 200–1200, temp 15–24°C; optional hum, battery_v
-    temp = base_temp + random.gauss(0, 0.6)
-    if step % 47 == 23:
-        temp = base_temp - 3.2  # anomaly dip (rule-based detector)
-    soil = base_soil + random.gauss(0, 80)
-    soil = max(100, min(1400, soil))
-    hum = 18 + random.gauss(0, 3)
-    hum = max(5, min(40, hum))
-    return {"soil_val": round(soil, 1), "temp": round(temp, 2), "hum": round(hum, 1)}
+    base_temp = rng.uniform(17.0, 21.0, (steps.shape[0], 1))
+    base_soil = rng.uniform(450, 750, (steps.shape[0], 1))
+    temp = base_temp + rng.normal(0, 0.6, steps.shape)
+    temp = np.where(anomaly, base_temp - 3.2, temp)  # anomaly dip (rule-based detector)
+    soil = np.clip(base_soil + rng.normal(0, 80, steps.shape), 100, 1400)
+    hum = np.clip(18 + rng.normal(0, 3, steps.shape), 5, 40)
+    objs = [
+        f'{{"soil_val": {s}, "temp": {t}, "hum": {h}}}'
+        for s, t, h in zip(soil.round(1).ravel().tolist(), temp.round(2).ravel().tolist(), hum.round(1).ravel().tolist())
+    ]
+    battery = 2.9 + rng.normal(0, 0.08, steps.size)  # Makerfabs-style battery_v ~2.8–3.1
+    return objs, battery
 
 
-def generate_level(step: int) -> dict:
+def generate_level(rng: np.random.Generator, steps: np.ndarray, anomaly: np.ndarray):
     # Conform to Dragino DDS75: distance in cm, typical 80–350; Bat optional
-    dist = 180 + random.gauss(0, 25)
-    if step % 31 == 15:
-        dist = 180 + random.randint(80, 120)  # jump anomaly
-    dist = max(50, min(400, dist))
-    return {"distance": int(dist)}
+    dist = 180 + rng.normal(0, 25, steps.shape)
+    dist = np.where(anomaly, 180 + rng.integers(80, 121, steps.shape), dist)  # jump anomaly
+    dist = np.clip(dist, 50, 400).astype(np.int64)
+    objs = [f'{{"distance": {d}}}' for d in dist.ravel().tolist()]
+    battery = 3.2 + rng.normal(0, 0.06, steps.size)  # DDS75 Bat in payload sometimes
+    return objs, battery
 
 
-def generate_climate(step: int) -> dict:
+def generate_climate(rng: np.random.Generator, steps: np.ndarray, anomaly: np.ndarray):
     # Conform to rbs305-ath: temperature 20–24°C, humidity often low (9–25) or up to 60
-    temp = 22 + random.gauss(0, 0.8)
-    if step % 41 == 20:
-        temp = 22 + random.gauss(3.5, 0.4)  # swing anomaly
-    hum = 12 + random.gauss(0, 6)
-    hum = max(5, min(65, hum))
-    return {"temperature": round(temp, 2), "humidity": round(hum, 1)}
+    temp = 22 + rng.normal(0, 0.8, steps.shape)
+    temp = np.where(anomaly, 22 + rng.normal(3.5, 0.4, steps.shape), temp)  # swing anomaly
+    hum = np.clip(12 + rng.normal(0, 6, steps.shape), 5, 65)
+    objs = [
+        f'{{"temperature": {t}, "humidity": {h}}}'
+        for t, h in zip(temp.round(2).ravel().tolist(), hum.round(1).ravel().tolist())
+    ]
+    return objs, None
 
 
-def generate_door(step: int) -> dict:
-    # Conform to rbs301-dws: open 0/1, eventType OPEN/CLOSED
-    open_val = 1 if step % 20 < 8 else 0
-    return {"open": open_val, "eventType": "OPEN" if open_val else "CLOSED"}
+def generate_door(rng: np.random.Generator, steps: np.ndarray, anomaly: np.ndarray):
+    # Conform to rbs301-dws: open 0/1, eventType OPEN/CLOSED; anomalies flip the duty cycle
+    open_val = (steps % 20 < 8) ^ anomaly
+    objs = [
+        '{"open": 1, "eventType": "OPEN"}' if o else '{"open": 0, "eventType": "CLOSED"}'
+        for o in open_val.ravel().tolist()
+    ]
+    return objs, None
 
 
-def generate_sw3l(step: int) -> dict:
+def generate_sw3l(rng: np.random.Generator, steps: np.ndarray, anomaly: np.ndarray):
     # Conform to SW3L: BAT 2.8–3.7 V; optional FREQUENCY_BAND, SUB_BAND
-    bat = 3.3 - step * 0.00008 + random.gauss(0, 0.03)
-    if step % 50 == 25:
-        bat = bat - 0.22  # drop anomaly
-    bat = max(2.6, min(3.7, bat))
-    return {"BAT": round(bat, 2), "FREQUENCY_BAND": "US915", "SUB_BAND": 0}
+    bat = 3.3 - steps * 0.00008 + rng.normal(0, 0.03, steps.shape)
+    bat = np.where(anomaly, bat - 0.22, bat)  # drop anomaly
+    bat = np.clip(bat, 2.6, 3.7).round(2)
+    objs = [f'{{"BAT": {b}, "FREQUENCY_BAND": "US915", "SUB_BAND": 0}}' for b in bat.ravel().tolist()]
+    return objs, bat.ravel()
+
+
+PAYLOAD_GENERATORS = {
+    "soil": generate_soil,
+    "level": generate_level,
+    "climate": generate_climate,
+    "door": generate_door,
+    "sw3l": generate_sw3l,
+}
+
+
+def _blocks(n_devices: int, n_steps: int, batch_rows: int):
+    """(d0, d1, s0, s1) blocks of at most ~batch_rows rows."""
+    steps_per = max(1, min(n_steps, batch_rows))
+    devs_per = max(1, batch_rows // steps_per)
+    for s0 in range(0, n_steps, steps_per):
+        for d0 in range(0, n_devices, devs_per):
+            yield d0, min(n_devices, d0 + devs_per), s0, min(n_steps, s0 + steps_per)
+
+
+def gateway_ids(n: int) -> list[str]:
+    return [f"{SYNTHETIC_GATEWAY_PREFIX}{g + 1:02d}" for g in range(n)]
+
+
+def defer_indexes(conn: sqlite3.Connection) -> list[tuple[str, str]]:
+    """If uplinks is empty, drop its secondary indexes so a bulk load builds them once at the end.
+
+    Returns the (name, sql) pairs to pass to restore_indexes(); empty if nothing was dropped.
+    """
+    if conn.execute("SELECT 1 FROM uplinks LIMIT 1").fetchone() is not None:
+        return []
+    deferred = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'uplinks' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in deferred:
+        conn.execute(f"DROP INDEX {name}")
+    return deferred
+
+
+def restore_indexes(conn: sqlite3.Connection, deferred: list[tuple[str, str]]) -> None:
+    for _, sql in deferred:
+        conn.execute(sql)
+    conn.commit()
+
+
+def generate_fleet(
+    conn: sqlite3.Connection,
+    devices_per_profile: dict[str, int],
+    gateways: int = 1,
+    end: datetime | None = None,
+    duration: timedelta = timedelta(hours=48),
+    interval_sec: int = 7200,
+    anomaly_rate: float = 0.025,
+    seed: int | None = None,
+    batch_rows: int = 200_000,
+    progress=None,
+    partition_dir: Path | None = None,
+) -> int:
+    """Insert the fleet's uplinks into conn, or the monthly partitions in partition_dir when given;
+    returns rows written. Commits once per block."""
+    rng = np.random.default_rng(seed)
+    end = (end or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    start = end - duration
+    n_steps = max(2, int(duration.total_seconds() // interval_sec) + 1)
+    start_ms = np.datetime64(start.replace(tzinfo=None), "ms")
+    jitter_ms = int(min(interval_sec / 4, 1800) * 1000)
+    gw_names = gateway_ids(max(1, gateways))
+    gw_lat = SYNTHETIC_LAT + np.arange(len(gw_names)) * 0.05
+    gw_lon = SYNTHETIC_LON - np.arange(len(gw_names)) * 0.05
+
+    written = 0
+    device_offset = 0  # spreads devices of every profile across all gateways
+    for kind, count in devices_per_profile.items():
+        if count <= 0:
+            continue
+        prefix, profile, label, _ = SYNTHETIC_PROFILES[kind]
+        gen = PAYLOAD_GENERATORS[kind]
+        for d0, d1, s0, s1 in _blocks(count, n_steps, batch_rows):
+            n_dev, n_st = d1 - d0, s1 - s0
+            steps = np.broadcast_to(np.arange(s0, s1), (n_dev, n_st))
+            anomaly = rng.random((n_dev, n_st)) < anomaly_rate
+            objs, battery = gen(rng, steps, anomaly)
+
+            offsets = steps.astype(np.int64) * interval_sec * 1000 + rng.integers(-jitter_ms, jitter_ms + 1, (n_dev, n_st))
+            times = [t + "Z" for t in np.datetime_as_string(start_ms + offsets.ravel(), unit="ms").tolist()]
+            dev_idx = np.repeat(np.arange(d0, d1), n_st)
+            gw_idx = (dev_idx + device_offset) % len(gw_names)
+            dev_euis = [f"{prefix}_{i + 1}" for i in dev_idx.tolist()]
+            names = [f"{label} {i + 1}" for i in dev_idx.tolist()]
+            gw_json = [json.dumps([gw_names[g]]) for g in range(len(gw_names))]
+            f_cnts = steps.ravel().tolist()
+            size = n_dev * n_st
+            rows = zip(
+                [f"{e}:{c}" for e, c in zip(dev_euis, f_cnts)],
+                times,
+                dev_euis,
+                names,
+                repeat(profile),
+                repeat("synthetic-app"),
+                repeat("Synthetic"),
+                [gw_json[g] for g in gw_idx.tolist()],
+                rng.integers(-115, -74, size).tolist(),
+                rng.uniform(2, 9, size).round(1).tolist(),
+                (gw_lat[gw_idx] + rng.normal(0, 0.002, size)).tolist(),
+                (gw_lon[gw_idx] + rng.normal(0, 0.002, size)).tolist(),
+                repeat(None),
+                battery.tolist() if battery is not None else repeat(None),
+                objs,
+                repeat(1),
+                repeat(None),
+                f_cnts,
+                repeat(None),
+                repeat(None),
+                repeat(None),
+                repeat(None),
+                repeat(868100000),
+                repeat(7),
+                repeat(None),
+                repeat(1),
+            )
+            if partition_dir is not None:
+                partitions.insert_values(partition_dir, rows)
+            else:
+                conn.executemany(INSERT_SQL, rows)
+                conn.commit()
+            written += size
+            if progress:
+                progress(written)
+        device_offset += count
+    return written
 
 
 def main() -> int:
-    if not DB_PATH.is_file():
+    parser = argparse.ArgumentParser(description="Generate a synthetic LoRaWAN device fleet into uplinks.db.")
+    for kind, (_, profile, _, demo_count) in SYNTHETIC_PROFILES.items():
+        parser.add_argument(f"--{kind}", type=int, default=demo_count, help=f"{profile} devices (default {demo_count})")
+    parser.add_argument("--gateways", type=int, default=1, help="synthetic gateways; devices are spread round-robin")
+    parser.add_argument("--duration-hours", type=float, default=48, help="history length ending at --end (default 48)")
+    parser.add_argument("--end", help="ISO end time, e.g. 2026-01-31T23:59:00Z (default now)")
+    parser.add_argument("--interval-sec", type=int, default=7200, help="uplink interval per device (default 7200)")
+    parser.add_argument("--anomaly-rate", type=float, default=0.025, help="fraction of uplinks with an injected anomaly")
+    parser.add_argument("--seed", type=int, help="RNG seed for reproducible fleets")
+    parser.add_argument("--batch-rows", type=int, default=200_000, help="rows per executemany/commit block")
+    parser.add_argument("--db", type=Path, help="target DB (created if missing); default data/uplinks.db, "
+                        "or data/partitions/ once split")
+    args = parser.parse_args()
+
+    db_path = args.db or DB_PATH
+    # Once split, the API reads only the partitions: write there too
+    partition_dir = PARTITION_DIR if args.db is None and partitions.list_partitions(PARTITION_DIR) else None
+    if partition_dir is None and args.db is None and not db_path.is_file():
         print("DB not found. Run ingest.py first.", file=sys.stderr)
         return 1
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    end = datetime.fromisoformat(args.end.replace("Z", "+00:00")) if args.end else None
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    counts = {kind: getattr(args, kind) for kind in SYNTHETIC_PROFILES}
 
-    conn = sqlite3.connect(DB_PATH)
-    # Ensure synthetic column exists
-    try:
-        conn.execute("ALTER TABLE uplinks ADD COLUMN synthetic INTEGER")
-    except sqlite3.OperationalError:
-        pass
-
-    # Synthetic data synced to today (Jan 31): last ~48h so it appears in "24h" / "7d" views
-    utc = timezone.utc
-    t_end = datetime(2026, 1, 31, 23, 59, 0, tzinfo=utc)
-    t_start = datetime(2026, 1, 30, 0, 0, 0, tzinfo=utc)
-    # Dedicated synthetic gateway and location (so synthetic devices appear under one "site")
-    SYNTHETIC_GATEWAY_ID = "synthetic-gateway-01"
-    SYNTHETIC_LAT = 45.42  # Ottawa area, clearly for demo
-    SYNTHETIC_LON = -75.69
-    gateway_ids_json = json.dumps([SYNTHETIC_GATEWAY_ID])
-
-    payload_gens = {
-        "soil": generate_soil,
-        "level": generate_level,
-        "climate": generate_climate,
-        "door": generate_door,
-        "sw3l": generate_sw3l,
-    }
-
-    inserted = 0
-    for dev_eui_prefix, profile, name_label, payload_kind in SYNTHETIC_SPECS:
-        gen = payload_gens.get(payload_kind, lambda s: {})
-        # ~1 point per 2 hours over the range
-        num_points = max(24, int((t_end - t_start).total_seconds() / 7200))
-        for step in range(num_points):
-            t = t_start + (t_end - t_start) * (step / max(1, num_points - 1)) + timedelta(minutes=random.randint(-30, 30))
-            time_str = t.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-            event_id = str(uuid.uuid4())
-            obj = gen(step)
-            object_json = json.dumps(obj)
-            battery = None
-            if payload_kind == "soil":
-                battery = 2.9 + random.gauss(0, 0.08)  # Makerfabs-style battery_v ~2.8–3.1
-            elif payload_kind == "level":
-                battery = 3.2 + random.gauss(0, 0.06)  # DDS75 Bat in payload sometimes
-            elif payload_kind == "sw3l":
-                battery = obj.get("BAT")
-            rssi = random.randint(-115, -75)
-            snr = round(random.uniform(2, 9), 1)
-            try:
-                conn.execute(
-                    """
-                    INSERT OR REPLACE INTO uplinks (
-                        event_id, time, dev_eui, device_name, device_profile_name,
-                        application_id, application_name, gateway_ids, rssi, snr,
-                        location_lat, location_lon, location_alt, battery_normalized, object_json,
-                        f_port, dev_addr, f_cnt, margin, external_power_source,
-                        battery_level_unavailable, battery_level_join, frequency, spreading_factor, region_config_id, synthetic
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        event_id,
-                        time_str,
-                        dev_eui_prefix,
-                        name_label,
-                        profile,
-                        "synthetic-app",
-                        "Synthetic",
-                        gateway_ids_json,
-                        rssi,
-                        snr,
-                        SYNTHETIC_LAT + random.gauss(0, 0.002),
-                        SYNTHETIC_LON + random.gauss(0, 0.002),
-                        None,
-                        float(battery) if battery is not None else None,
-                        object_json,
-                        1,
-                        None,
-                        step,
-                        None,
-                        None,
-                        None,
-                        None,
-                        868100000,
-                        7,
-                        None,
-                        1,
-                    ),
-                )
-                inserted += 1
-            except sqlite3.IntegrityError:
-                pass
-
-    conn.commit()
-    conn.close()
-    print("Synthetic data generated:", inserted, "rows (synthetic=1).")
-    print("Devices:", [s[2] for s in SYNTHETIC_SPECS])
+    if partition_dir is not None:
+        conn = None
+        deferred = []
+    else:
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")  # 256 MiB page cache for bulk index maintenance
+        create_schema(conn)
+        deferred = defer_indexes(conn)
+    t0 = time.perf_counter()
+    inserted = generate_fleet(
+        conn,
+        counts,
+        gateways=args.gateways,
+        end=end,
+        duration=timedelta(hours=args.duration_hours),
+        interval_sec=args.interval_sec,
+        anomaly_rate=args.anomaly_rate,
+        seed=args.seed,
+        batch_rows=args.batch_rows,
+        progress=lambda n: print(f"  {n} rows ...", end="\r", flush=True),
+        partition_dir=partition_dir,
+    )
+    if deferred:
+        print(f"\n  building {len(deferred)} indexes ...")
+        restore_indexes(conn, deferred)
+    elapsed = time.perf_counter() - t0
+    if conn is not None:
+        conn.close()
+    print(f"Synthetic data generated: {inserted} rows (synthetic=1) -> {partition_dir or db_path} in {elapsed:.1f}s ({inserted / elapsed if elapsed else 0:.0f} rows/s).")
+    print("Devices per profile:", counts, "| gateways:", gateway_ids(max(1, args.gateways)) if args.gateways <= 5 else args.gateways)
     return 0
 
 
@@ -0,0 +1,227 @@
+"""
+HTTP transfer helpers for scripts/api.py: response compression and static asset caching.
+
+- CompressionMiddleware: gzip (or brotli, if the optional `brotli` package is installed)
+  for /api/* JSON and CSV responses above a size threshold.
+- AssetStaticFiles: StaticFiles that serves JS/CSS/HTML/SVG/fonts from an in-memory cache of
+  precompressed variants, rewrites asset references in HTML/CSS to `?v=<content hash>` and
+  marks versioned requests `immutable`. Everything else (site banner images) keeps
+  Starlette's ETag/Last-Modified conditional GETs with `Cache-Control: no-cache`.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from pathlib import Path
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/csv")
+# Static suffixes served from the in-memory variant cache (content-hashed, precompressed)
+ASSET_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".ttf": "font/ttf",
+    ".json": "application/json",
+}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Compressing in a worker thread only pays off for larger bodies
+THREAD_MIN_SIZE = 256 * 1024
+
+
+def _accepted_encoding(scope) -> str | None:
+    """'br' or 'gzip' if the client accepts it (br only when brotli is installed)."""
+    accept = Headers(scope=scope).get("accept-encoding", "")
+    tokens = {t.split(";")[0].strip().lower() for t in accept.split(",")}
+    if brotli is not None and "br" in tokens:
+        return "br"
+    if "gzip" in tokens:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, level: int | None = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level if level is not None else 5)
+    return gzip.compress(body, compresslevel=level if level is not None else 6, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compress /api/* JSON and CSV responses of at least minimum_size bytes.
+
+    API responses are built in memory before they are sent, so the body is buffered
+    and compressed in one shot; anything else passes through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, path_prefix: str = "/api/"):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        encoding = _accepted_encoding(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                if media_type not in COMPRESSIBLE_TYPES or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) >= self.minimum_size:
+                if len(body) >= THREAD_MIN_SIZE:
+                    body = await anyio.to_thread.run_sync(compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class _Asset:
+    __slots__ = ("body", "version", "variants", "stamp", "deps")
+
+    def __init__(self, body: bytes, stamp: tuple[int, int], deps: list):
+        self.body = body
+        self.stamp = stamp
+        self.deps = deps  # [(path, stamp)] of assets whose versions were written into body
+        self.version = hashlib.sha256(body).hexdigest()[:12]
+        self.variants = {"gzip": compress(body, "gzip", 9)}
+        if brotli is not None:
+            self.variants["br"] = compress(body, "br", 11)
+
+
+# path -> _Asset; shared by every AssetStaticFiles mount
+_ASSETS: dict[str, _Asset] = {}
+
+def _stamp(path: Path) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+_HTML_REF = re.compile(r'\b(src|href)="([^"#?]+)"')
+_CSS_REF = re.compile(r"""url\((['"]?)([^'")#?]+)\1\)""")
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles with content-hashed URLs, precompressed variants and Cache-Control.
+
+    url_roots maps absolute URL prefixes (e.g. "/fonts/") to directories so HTML/CSS
+    references into other mounts can be versioned too.
+    """
+
+    def __init__(self, *, directory, url_roots: dict[str, Path] | None = None, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.url_roots = dict(url_roots or {})
+
+    def _resolve(self, ref: str, base_dir: Path) -> Path | None:
+        if ":" in ref or ref.startswith("//"):
+            return None  # external (https:, data:, //cdn)
+        if ref.startswith("/"):
+            for prefix, root in self.url_roots.items():
+                if ref.startswith(prefix):
+                    return Path(root) / ref[len(prefix):]
+            return None
+        return base_dir / ref
+
+    def _rewrite(self, path: Path, body: bytes, deps: list) -> bytes:
+        pattern = {".html": _HTML_REF, ".css": _CSS_REF}.get(path.suffix.lower())
+        if pattern is None:
+            return body
+        text = body.decode("utf-8")
+
+        def versioned(m):
+            ref = m.group(2)
+            target = self._resolve(ref, path.parent)
+            if target is None or not target.is_file():
+                return m.group(0)
+            dep = self.load(target)
+            deps.append((target, dep.stamp))
+            return m.group(0).replace(ref, f"{ref}?v={dep.version}", 1)
+
+        return pattern.sub(versioned, text).encode("utf-8")
+
+    def load(self, path: Path) -> _Asset:
+        """Cached (rewritten, hashed, precompressed) asset; rebuilt when it or a referenced asset changes."""
+        asset = _ASSETS.get(str(path))
+        if asset is not None and asset.stamp == _stamp(path) and all(_stamp(p) == s for p, s in asset.deps):
+            return asset
+        stamp = _stamp(path)
+        deps = []
+        asset = _Asset(self._rewrite(path, path.read_bytes(), deps), stamp, deps)
+        _ASSETS[str(path)] = asset
+        return asset
+
+    def precompress(self) -> int:
+        """Build variants for every asset under this mount up front; returns the count."""
+        count = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = Path(root) / name
+                if path.suffix.lower() in ASSET_TYPES:
+                    self.load(path)
+                    count += 1
+        return count
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        path = Path(full_path)
+        media_type = ASSET_TYPES.get(path.suffix.lower())
+        if media_type is None or status_code != 200:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers["Cache-Control"] = REVALIDATE
+            return response
+
+        asset = self.load(path)
+        versioned = QueryParams(scope["query_string"]).get("v") == asset.version
+        encoding = _accepted_encoding(scope)
+        body = asset.variants.get(encoding, asset.body) if encoding else asset.body
+        compressed = body is not asset.body
+        headers = {
+            "ETag": f'"{asset.version}-{encoding}"' if compressed else f'"{asset.version}"',
+            "Cache-Control": IMMUTABLE if versioned else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        if f'"{asset.version}' in if_none_match or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        if compressed:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=media_type, headers=headers)
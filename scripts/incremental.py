@@ -0,0 +1,309 @@
+"""
+Shared machinery of the engines that fold the uplinks into derived state incrementally
+(coverage_grid.py, site_timeline.py, radio_stats.py, spatial_index.py, link_loss.py,
+stream_detectors.py, alert_engine.py).
+
+Each engine keeps its state in its own SQLite file (WAL, so reads never wait on a refresh)
+with, next to its own tables:
+
+- <PREFIX>_meta: the watermark, the largest (time, event_id) folded so far
+- <PREFIX>_replay: what on_write() queued for rows written at or before the watermark:
+  their days (REPLAY = "day": the day's state is cleared and recomputed) or the rows
+  themselves (REPLAY = "rows": folded as they are, for state that moves forward per device
+  and skips a row older than the device's last; its table is (event_id, time)); engines
+  with REPLAY = None ignore such rows
+
+refresh() takes the engine's lock and the state file's write lock (BEGIN IMMEDIATE: one
+refresh at a time across workers), replays the queue, fixes the upper bound of
+the uplinks after the watermark (at most MAX_ROWS of them) so rows committed while folding
+wait for the next refresh, folds them and saves the new watermark in the same transaction.
+An engine supplies SCHEMA, PREFIX, TABLES, BATCH_SQL (a SELECT over uplinks with a {where}
+placeholder, rows in time order for REPLAY = "rows"), _fold() and, for day replays,
+_clear_day().
+
+connect(from_time, to_time=None) returns a read connection covering at least that range
+(api.get_db, or the CLI's sqlite3.connect). With monthly partitions a backfill can span more
+months than one connection attaches; windows() then reads them MAX_ATTACHED months at a
+time (open_window() opens one such window), and the watermark only passes months that were
+read.
+
+scripts/api.py never refreshes in a request: its Refresher thread catches the engines up
+after POST /api/ingest and every REFRESH_SEC for rows from other writers.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+from contextlib import closing
+from datetime import date, timedelta
+from pathlib import Path
+
+try:
+    from scripts.partitions import MAX_ATTACHED, PartitionLimitError
+except ImportError:  # run as python scripts/<engine>.py
+    from partitions import MAX_ATTACHED, PartitionLimitError
+
+# Background refresh period (rows written by other processes show up within this)
+REFRESH_SEC = 5.0
+
+
+def day_key(time_val: str) -> str:
+    """'YYYY-MM-DD' bucket of a UTC ISO-8601 time string."""
+    return time_val[:10]
+
+
+def next_day(day: str) -> str:
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def open_window(connect, from_time: str | None, to_time: str | None = None):
+    """(read connection, until) for [from_time, to_time]; until is None if it covers the range.
+
+    When the range overlaps more monthly partitions than can be attached (PartitionLimitError),
+    the connection covers its first MAX_ATTACHED months and until is the next window's from_time.
+    """
+    try:
+        return connect(from_time, to_time), None
+    except PartitionLimitError as e:
+        return connect(from_time, e.months[MAX_ATTACHED - 1]), e.months[MAX_ATTACHED]
+
+
+def windows(connect, from_time: str | None, to_time: str | None = None):
+    """Read connections covering [from_time, to_time], oldest first, each closed before the next.
+
+    One connection, unless the range overlaps more monthly partitions than can be attached;
+    then one per MAX_ATTACHED consecutive months (open_window()).
+    """
+    while True:
+        conn, until = open_window(connect, from_time, to_time)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        if until is None:
+            return
+        from_time = until
+
+
+def open_windows(connect, from_time: str | None, to_time: str | None = None) -> list:
+    """The windows() connections all open at once, oldest first, for scans that merge them; the caller closes them."""
+    conns = []
+    try:
+        while True:
+            conn, from_time = open_window(connect, from_time, to_time)
+            conns.append(conn)
+            if from_time is None:
+                return conns
+    except BaseException:
+        for conn in conns:
+            conn.close()
+        raise
+
+
+class IncrementalEngine:
+    """Watermark-driven fold of the uplinks into a state DB; subclasses supply the fold."""
+
+    SCHEMA = ""
+    # Table prefix: <PREFIX>_meta (and with REPLAY, <PREFIX>_replay) must be in SCHEMA
+    PREFIX = ""
+    # How rows written at or before the watermark are caught up: "day", "rows" or None
+    REPLAY = "day"
+    # Tables reset() empties (meta and replay included)
+    TABLES: tuple = ()
+    BATCH_SQL = ""
+    # Uplinks folded per refresh(); None: everything up to the newest
+    MAX_ROWS: int | None = None
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._advanced = False
+
+    def _open(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def create(self) -> None:
+        """Create the empty state file; the next refresh() backfills it."""
+        self._open().close()
+
+    def watermark(self, state: sqlite3.Connection) -> tuple[str, str] | None:
+        row = state.execute(f"SELECT value FROM {self.PREFIX}_meta WHERE key = 'watermark'").fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def _replays(self, row: dict) -> bool:
+        """Whether a row written at or before the watermark changes the state (all rows by default)."""
+        return True
+
+    def on_write(self, rows: list[dict]) -> None:
+        """Ingest hook: queue rows written at or before the watermark (or their days) for the next refresh."""
+        if not self.REPLAY or not self.path.exists():
+            return  # nothing folded yet; the first refresh reads everything
+        with self._lock:
+            state = self._open()
+            try:
+                mark = self.watermark(state)
+                if mark is None:
+                    return
+                late = [r for r in rows if (r["time"], r["event_id"]) <= mark and self._replays(r)]
+                if self.REPLAY == "rows":
+                    state.executemany(f"INSERT OR REPLACE INTO {self.PREFIX}_replay (event_id, time) VALUES (?, ?)",
+                                      [(r["event_id"], r["time"]) for r in late])
+                else:
+                    state.executemany(f"INSERT OR IGNORE INTO {self.PREFIX}_replay (day) VALUES (?)",
+                                      [(d,) for d in {day_key(r["time"]) for r in late}])
+                state.commit()
+            finally:
+                state.close()
+
+    def refresh(self, connect) -> int:
+        """Fold uplinks after the watermark (and queued days); returns uplinks read."""
+        return self._refresh(connect, self.MAX_ROWS, self._fold)
+
+    def _refresh(self, connect, max_rows: int | None, fold) -> int:
+        with self._lock:
+            state = self._open()
+            try:
+                state.execute("BEGIN IMMEDIATE")  # one refresh at a time across workers
+                mark = self.watermark(state)
+                processed = 0
+                if mark is not None and self.REPLAY:
+                    processed += self._replay(state, connect, mark, fold)
+                where, args = ("(time, event_id) > (?, ?)", list(mark)) if mark else ("1", [])
+                last = None
+                # The first window holding uplinks after the watermark; later ones wait for the next refresh
+                with closing(windows(connect, mark[0] if mark else None)) as conns:
+                    for conn in conns:
+                        last = self._upper_bound(conn, where, args, max_rows)
+                        if last is not None:
+                            processed += fold(state, conn.execute(
+                                self.BATCH_SQL.format(where=where + " AND (time, event_id) <= (?, ?)"), args + list(last)
+                            ))
+                            break
+                if last is not None:
+                    state.execute(
+                        f"INSERT OR REPLACE INTO {self.PREFIX}_meta (key, value) VALUES ('watermark', ?)",
+                        (json.dumps(last),),
+                    )
+                state.commit()
+                self._advanced = last is not None
+                return processed
+            except BaseException:
+                state.rollback()
+                raise
+            finally:
+                state.close()
+
+    @staticmethod
+    def _upper_bound(conn, where: str, args: list, max_rows: int | None) -> tuple | None:
+        """(time, event_id) of the last uplink this refresh folds: the max_rows-th after the watermark, or the newest."""
+        last = None
+        if max_rows:
+            last = conn.execute(
+                f"SELECT time, event_id FROM uplinks WHERE {where} ORDER BY time, event_id LIMIT 1 OFFSET ?",
+                args + [max_rows - 1],
+            ).fetchone()
+        if last is None:
+            last = conn.execute(
+                f"SELECT time, event_id FROM uplinks WHERE {where} ORDER BY time DESC, event_id DESC LIMIT 1", args
+            ).fetchone()
+        return tuple(last) if last is not None else None
+
+    def _replay(self, state, connect, mark: tuple, fold) -> int:
+        """Fold the queued rows, or recompute the queued days up to the watermark; returns uplinks read."""
+        if self.REPLAY == "rows":
+            return self._replay_rows(state, connect, mark, fold)
+        processed = 0
+        for (day,) in state.execute(f"SELECT day FROM {self.PREFIX}_replay ORDER BY day").fetchall():
+            self._clear_day(state, day)
+            end = next_day(day)
+            conn = connect(day, end)
+            try:
+                processed += fold(state, conn.execute(
+                    self.BATCH_SQL.format(where="time >= ? AND time < ? AND (time, event_id) <= (?, ?)"),
+                    [day, end, *mark],
+                ), replay=True)
+            finally:
+                conn.close()
+        state.execute(f"DELETE FROM {self.PREFIX}_replay")
+        return processed
+
+    def _replay_rows(self, state, connect, mark: tuple, fold) -> int:
+        queued = state.execute(f"SELECT event_id, time FROM {self.PREFIX}_replay ORDER BY time, event_id").fetchall()
+        if not queued:
+            return 0
+        processed = 0
+        event_ids = json.dumps([event_id for event_id, _ in queued])
+        for conn in windows(connect, queued[0][1], queued[-1][1]):
+            processed += fold(state, conn.execute(
+                self.BATCH_SQL.format(where="event_id IN (SELECT value FROM json_each(?)) AND (time, event_id) <= (?, ?)"),
+                [event_ids, *mark],
+            ), replay=True)
+        state.execute(f"DELETE FROM {self.PREFIX}_replay")
+        return processed
+
+    def _clear_day(self, state, day: str) -> None:
+        """Delete the state folded from one day's uplinks before it is recomputed."""
+        raise NotImplementedError
+
+    def _fold(self, state, cur, replay: bool = False) -> int:
+        """Fold the rows of a BATCH_SQL cursor into the state; returns rows read.
+
+        replay is True for a recomputed day (its state was just cleared) or queued late rows.
+        """
+        raise NotImplementedError
+
+    def catch_up(self, connect) -> int:
+        """refresh() until the watermark stops moving (it reached the newest uplink); returns uplinks read."""
+        total = 0
+        while True:
+            total += self.refresh(connect)
+            if not self._advanced:
+                return total
+
+    def reset(self) -> None:
+        with self._lock:
+            state = self._open()
+            try:
+                for table in self.TABLES:
+                    state.execute(f"DELETE FROM {table}")
+                state.commit()
+            finally:
+                state.close()
+
+    def rebuild(self, connect) -> int:
+        """Drop the state and fold all uplinks again."""
+        self.reset()
+        return self.catch_up(connect)
+
+
+class Refresher:
+    """Daemon thread running cycle() every interval_sec, or as soon as wake() is called."""
+
+    def __init__(self, cycle, interval_sec: float = REFRESH_SEC):
+        self.cycle = cycle
+        self.interval_sec = interval_sec
+        self._wake = threading.Event()
+
+    def wake(self) -> None:
+        """Run the next cycle now instead of at the next tick (no-op until start())."""
+        self._wake.set()
+
+    def start(self) -> threading.Event:
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                self._wake.clear()
+                try:
+                    self.cycle()
+                except (sqlite3.Error, OSError) as e:
+                    print("Derived-state refresh failed:", e, file=sys.stderr)
+                self._wake.wait(self.interval_sec)
+
+        threading.Thread(target=run, name="derived-refresh", daemon=True).start()
+        return stop
@@ -8,8 +8,9 @@ Phase 1 — Ingest and normalize LoRaWAN uplink JSON into SQLite.
   applicationName, gatewayIds, rssi, snr, location (lat/lon/alt), object fields,
   fPort, devAddr, fCnt, margin, externalPowerSource, batteryLevelUnavailable, batteryLevel,
   frequency, spreadingFactor, regionConfigId
-- Normalizes battery into battery_normalized (Bat | battery_v | battery | batteryLevel)
-- Writes to data/uplinks.db (unified table uplinks)
+- Normalizes battery into battery_normalized (Bat | BAT | battery_v | battery | batteryLevel)
+- Writes to data/uplinks.db (unified table uplinks), or to the monthly files in
+  data/partitions/ once scripts/partitions.py has split the DB
 """
 
 import json
@@ -17,8 +18,18 @@ import sqlite3
 import sys
 from pathlib import Path
 
+try:
+    from scripts.migrations import migrate
+    from scripts.payload_codec import Encoder
+except ImportError:  # run as python scripts/ingest.py
+    from migrations import migrate
+    from payload_codec import Encoder
+
+# Rows per insert_rows() / partitions.insert_rows() call (the encoder is looked up once per call)
+BATCH_ROWS = 10_000
+
 # Canonical battery field names per device (from object)
-BATTERY_KEYS = ("Bat", "battery_v", "battery", "batteryLevel")
+BATTERY_KEYS = ("Bat", "BAT", "battery_v", "battery", "batteryLevel")
 
 
 def normalize_battery(obj: dict) -> float | None:
@@ -69,10 +80,11 @@ def get_location(rx: dict | None) -> tuple[float | None, float | None, float | N
     )
 
 
-def extract_event(file_path: Path, raw: dict) -> dict | None:
+def extract_event(file_path: Path | None, raw: dict) -> dict | None:
     """
     Extract normalized event from raw ChirpStack uplink JSON.
-    Returns None if missing time or devEui (invalid).
+    Returns None if missing time or devEui (invalid), or if there is neither a
+    deduplicationId nor a file name to use as event_id.
     """
     time_val = raw.get("time")
     device_info = raw.get("deviceInfo") or {}
@@ -80,7 +92,9 @@ def extract_event(file_path: Path, raw: dict) -> dict | None:
     if not time_val or not dev_eui:
         return None
 
-    event_id = raw.get("deduplicationId") or file_path.stem
+    event_id = raw.get("deduplicationId") or (file_path.stem if file_path else None)
+    if not event_id:
+        return None
     rx = get_first_rx(raw.get("rxInfo") or [])
     gateway_ids = get_gateway_ids(raw.get("rxInfo") or [])
     lat, lon, alt = get_location(rx)
@@ -185,72 +199,95 @@ def walk_dataset(dataset_root: Path):
 
 
 def create_schema(conn: sqlite3.Connection) -> None:
-    conn.executescript("""
-    CREATE TABLE IF NOT EXISTS uplinks (
-        event_id TEXT PRIMARY KEY,
-        time TEXT NOT NULL,
-        dev_eui TEXT NOT NULL,
-        device_name TEXT,
-        device_profile_name TEXT,
-        application_id TEXT,
-        application_name TEXT,
-        gateway_ids TEXT,
-        rssi INTEGER,
-        snr REAL,
-        location_lat REAL,
-        location_lon REAL,
-        location_alt REAL,
-        battery_normalized REAL,
-        object_json TEXT
-    );
-    CREATE INDEX IF NOT EXISTS idx_uplinks_dev_eui ON uplinks(dev_eui);
-    CREATE INDEX IF NOT EXISTS idx_uplinks_time ON uplinks(time);
-    CREATE INDEX IF NOT EXISTS idx_uplinks_device_profile ON uplinks(device_profile_name);
-    CREATE INDEX IF NOT EXISTS idx_uplinks_application_id ON uplinks(application_id);
-    """)
-    _migrate_schema(conn)
-
-
-def _migrate_schema(conn: sqlite3.Connection) -> None:
-    """Add new columns if missing (safe to run multiple times)."""
-    new_columns = [
-        ("f_port", "INTEGER"),
-        ("dev_addr", "TEXT"),
-        ("f_cnt", "INTEGER"),
-        ("margin", "REAL"),
-        ("external_power_source", "INTEGER"),
-        ("battery_level_unavailable", "INTEGER"),
-        ("battery_level_join", "REAL"),
-        ("frequency", "INTEGER"),
-        ("spreading_factor", "INTEGER"),
-        ("region_config_id", "TEXT"),
-        ("synthetic", "INTEGER"),
-    ]
-    for col, typ in new_columns:
-        try:
-            conn.execute(f"ALTER TABLE uplinks ADD COLUMN {col} {typ}")
-        except sqlite3.OperationalError:
-            pass  # column already exists
+    """Create or upgrade the uplinks schema (scripts/migrations.py); a pragma read when current."""
+    migrate(conn)
+
+
+INSERT_COLUMNS = (
+    "event_id", "time", "dev_eui", "device_name", "device_profile_name",
+    "application_id", "application_name", "gateway_ids", "rssi", "snr",
+    "location_lat", "location_lon", "location_alt", "battery_normalized", "object_json",
+    "f_port", "dev_addr", "f_cnt", "margin", "external_power_source",
+    "battery_level_unavailable", "battery_level_join", "frequency", "spreading_factor", "region_config_id",
+    "synthetic",
+)
+INSERT_SQL = (
+    f"INSERT OR REPLACE INTO uplinks ({', '.join(INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in INSERT_COLUMNS)})"
+)
+
+
+def insert_rows(conn: sqlite3.Connection, rows: list[dict]) -> int:
+    """INSERT OR REPLACE extract_event() rows in one executemany; caller commits. Returns rows written.
+
+    object_json is stored encoded for profiles with a payload dictionary (scripts/payload_codec.py).
+    """
+    values = [[row.get(col) for col in INSERT_COLUMNS] for row in rows]
+    encoder = Encoder.for_connection(conn)
+    if encoder is not None:
+        obj = INSERT_COLUMNS.index("object_json")
+        profile = INSERT_COLUMNS.index("device_profile_name")
+        for v in values:
+            v[obj] = encoder.encode(v[profile], v[obj])
+    conn.executemany(INSERT_SQL, values)
+    return len(rows)
 
 
 def main() -> int:
+    # partitions imports this module, so it is imported here rather than at the top
+    try:
+        from scripts import partitions
+    except ImportError:  # run as python scripts/ingest.py
+        import partitions
+
     repo_root = Path(__file__).resolve().parent.parent
     dataset_root = repo_root / "dataset"
     data_dir = repo_root / "data"
     data_dir.mkdir(exist_ok=True)
     db_path = data_dir / "uplinks.db"
+    partition_dir = data_dir / "partitions"
 
     if not dataset_root.is_dir():
         print("Dataset root not found:", dataset_root, file=sys.stderr)
         return 1
 
-    conn = sqlite3.connect(db_path)
-    create_schema(conn)
+    # Once split, the API reads only the partitions: write there too
+    if partitions.list_partitions(partition_dir):
+        conn = None
+        target = partition_dir
+    else:
+        conn = sqlite3.connect(db_path)
+        create_schema(conn)
+        target = db_path
+    pending: list[tuple[Path, dict]] = []
 
     inserted = 0
     skipped = 0
     invalid = 0
 
+    def flush() -> tuple[int, int]:
+        """Write pending rows; returns (inserted, skipped)."""
+        rows = [row for _, row in pending]
+        if conn is None:
+            return partitions.insert_rows(partition_dir, rows), 0
+        try:
+            with conn:  # one transaction per batch
+                insert_rows(conn, rows)
+            return len(rows), 0
+        except sqlite3.IntegrityError:
+            pass
+        # A bad row fails the whole executemany: retry row by row to skip and report just it
+        done = bad = 0
+        for file_path, row in pending:
+            try:
+                insert_rows(conn, [row])
+                done += 1
+            except sqlite3.IntegrityError as e:
+                print("Insert error", file_path, e, file=sys.stderr)
+                bad += 1
+        conn.commit()
+        return done, bad
+
     for device_type, dev_eui, file_path in walk_dataset(dataset_root):
         try:
             text = file_path.read_text(encoding="utf-8")
@@ -265,54 +302,18 @@ def main() -> int:
             invalid += 1
             continue
 
-        try:
-            conn.execute(
-                """
-                INSERT OR REPLACE INTO uplinks (
-                    event_id, time, dev_eui, device_name, device_profile_name,
-                    application_id, application_name, gateway_ids, rssi, snr,
-                    location_lat, location_lon, location_alt, battery_normalized, object_json,
-                    f_port, dev_addr, f_cnt, margin, external_power_source,
-                    battery_level_unavailable, battery_level_join, frequency, spreading_factor, region_config_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    row["event_id"],
-                    row["time"],
-                    row["dev_eui"],
-                    row["device_name"],
-                    row["device_profile_name"],
-                    row["application_id"],
-                    row["application_name"],
-                    row["gateway_ids"],
-                    row["rssi"],
-                    row["snr"],
-                    row["location_lat"],
-                    row["location_lon"],
-                    row["location_alt"],
-                    row["battery_normalized"],
-                    row["object_json"],
-                    row["f_port"],
-                    row["dev_addr"],
-                    row["f_cnt"],
-                    row["margin"],
-                    row["external_power_source"],
-                    row["battery_level_unavailable"],
-                    row["battery_level_join"],
-                    row["frequency"],
-                    row["spreading_factor"],
-                    row["region_config_id"],
-                ),
-            )
-            inserted += 1
-        except sqlite3.IntegrityError as e:
-            print("Insert error", file_path, e, file=sys.stderr)
-            skipped += 1
-
-    conn.commit()
-    conn.close()
-
-    print("Ingest complete:", db_path)
+        pending.append((file_path, row))
+        if len(pending) >= BATCH_ROWS:
+            done, bad = flush()
+            inserted, skipped = inserted + done, skipped + bad
+            pending = []
+
+    done, bad = flush()
+    inserted, skipped = inserted + done, skipped + bad
+    if conn is not None:
+        conn.close()
+
+    print("Ingest complete:", target)
     print("  Inserted:", inserted)
     print("  Skipped (e.g. duplicate):", skipped)
     print("  Invalid (missing time/devEui or parse error):", invalid)
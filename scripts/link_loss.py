@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+fCnt-based packet loss, duplicates and counter resets per device and gateway.
+
+Every uplink carries the device's frame counter (f_cnt). Walking a device's uplinks in
+(time, event_id) order, LAG(f_cnt) gives the previous frame and the step classifies it:
+
+- step 1: in order; step n > 1: n - 1 frames missed (up to MAX_FCNT_GAP)
+- step 0: duplicate (the same frame stored twice, e.g. re-delivered by the network server)
+- step < 0, step > MAX_FCNT_GAP or a new dev_addr: counter reset / rejoin (nothing missed)
+
+Results are kept as daily sums in their own SQLite file (data/cache/link_loss.db) so they
+work with single-file and partitioned storage alike:
+
+- link_daily (day, dev_eui): uplinks, missed, duplicates, resets
+- link_gateway_daily (day, dev_eui, gateway_id): non-duplicate uplinks the gateway heard
+- link_state: last frame per device, the starting point of the next batch
+- link_meta: watermark, the largest (time, event_id) processed
+
+refresh() (scripts/incremental.py: watermark, locking) processes only uplinks after the
+watermark, in one ordered window query. Uplinks that arrive older than the watermark (late
+or re-sent rows) are queued by on_write() and that device is replayed from the start of
+the row's day on the next refresh. A frame's expected count is received frames + missed;
+a gateway's reception is what it heard out of the expected frames of the devices it heard.
+
+Run:
+  python scripts/link_loss.py update            # process new uplinks (first run: backfill)
+  python scripts/link_loss.py rebuild           # drop the summary and backfill
+  python scripts/link_loss.py report [--from DAY] [--to DAY]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine, day_key, windows
+    from scripts import partitions
+except ImportError:  # run as python scripts/link_loss.py
+    from incremental import IncrementalEngine, day_key, windows
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "link_loss.db"
+# LoRaWAN 1.0 MAX_FCNT_GAP: larger forward jumps are a counter reset, not loss
+MAX_FCNT_GAP = 16384
+# Rows read per fetchmany while folding a batch
+FETCH_ROWS = 50_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS link_daily (
+    day TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    uplinks INTEGER NOT NULL DEFAULT 0,
+    missed INTEGER NOT NULL DEFAULT 0,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    resets INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, dev_eui)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS link_gateway_daily (
+    day TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    gateway_id TEXT NOT NULL,
+    heard INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, dev_eui, gateway_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS link_state (
+    dev_eui TEXT PRIMARY KEY,
+    device_name TEXT,
+    profile TEXT,
+    time TEXT,
+    event_id TEXT,
+    f_cnt INTEGER,
+    dev_addr TEXT
+);
+CREATE TABLE IF NOT EXISTS link_replay (dev_eui TEXT PRIMARY KEY, from_day TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS link_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT dev_eui, device_name, device_profile_name, time, event_id, f_cnt, dev_addr, gateway_ids,
+           LAG(f_cnt) OVER w, LAG(dev_addr) OVER w
+    FROM uplinks
+    WHERE f_cnt IS NOT NULL AND {where}
+    WINDOW w AS (PARTITION BY dev_eui ORDER BY time, event_id)
+    ORDER BY dev_eui, time, event_id
+"""
+
+
+def classify(prev_f_cnt, prev_dev_addr, f_cnt: int, dev_addr) -> tuple[int, int, int]:
+    """(missed, duplicate, reset) for one frame following (prev_f_cnt, prev_dev_addr)."""
+    if prev_f_cnt is None:
+        return 0, 0, 0
+    if dev_addr and prev_dev_addr and dev_addr != prev_dev_addr:
+        return 0, 0, 1  # rejoin: new session, counter starts over
+    step = f_cnt - prev_f_cnt
+    if step == 0:
+        return 0, 1, 0
+    if step < 0 or step > MAX_FCNT_GAP:
+        return 0, 0, 1
+    return step - 1, 0, 0
+
+
+class LinkLoss(IncrementalEngine):
+    """Incrementally maintained fCnt loss summary in a SQLite file next to the uplinks."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "link"
+    TABLES = ("link_daily", "link_gateway_daily", "link_state", "link_replay", "link_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH):
+        super().__init__(path)
+
+    def on_write(self, rows: list[dict]) -> None:
+        """Ingest hook: queue a replay for devices that got uplinks at or before the watermark."""
+        late: dict[str, str] = {}
+        if not self.path.exists():
+            return  # nothing summarized yet; the first refresh reads everything
+        with self._lock:
+            state = self._open()
+            try:
+                mark = self.watermark(state)
+                if mark is None:
+                    return
+                for row in rows:
+                    if row.get("f_cnt") is not None and (row["time"], row["event_id"]) <= mark:
+                        day = day_key(row["time"])
+                        late[row["dev_eui"]] = min(day, late.get(row["dev_eui"], day))
+                for dev_eui, day in late.items():
+                    state.execute(
+                        "INSERT INTO link_replay (dev_eui, from_day) VALUES (?, ?)"
+                        " ON CONFLICT(dev_eui) DO UPDATE SET from_day = MIN(from_day, excluded.from_day)",
+                        (dev_eui, day),
+                    )
+                state.commit()
+            finally:
+                state.close()
+
+    def _replay(self, state, connect, mark: tuple, fold) -> int:
+        """Recompute each queued device from its from_day up to the watermark."""
+        processed = 0
+        for dev_eui, from_day in state.execute("SELECT dev_eui, from_day FROM link_replay").fetchall():
+            state.execute("DELETE FROM link_daily WHERE dev_eui = ? AND day >= ?", (dev_eui, from_day))
+            state.execute("DELETE FROM link_gateway_daily WHERE dev_eui = ? AND day >= ?", (dev_eui, from_day))
+            # Unbounded below: the frame before from_day may be in an earlier partition
+            prev = None
+            for conn in windows(connect, None, from_day):
+                prev = conn.execute(
+                    """
+                    SELECT device_name, device_profile_name, time, event_id, f_cnt, dev_addr FROM uplinks
+                    WHERE dev_eui = ? AND f_cnt IS NOT NULL AND time < ?
+                    ORDER BY time DESC, event_id DESC LIMIT 1
+                    """,
+                    (dev_eui, from_day),
+                ).fetchone() or prev
+            state.execute("DELETE FROM link_state WHERE dev_eui = ?", (dev_eui,))
+            if prev:
+                state.execute("INSERT INTO link_state VALUES (?, ?, ?, ?, ?, ?, ?)", (dev_eui, *prev))
+            # Each window's fold continues from the link_state the previous one left
+            for conn in windows(connect, from_day, mark[0]):
+                processed += fold(state, conn.execute(
+                    _BATCH_SQL.format(where="dev_eui = ? AND time >= ? AND (time, event_id) <= (?, ?)"),
+                    [dev_eui, from_day, *mark],
+                ), replay=True)
+        state.execute("DELETE FROM link_replay")
+        return processed
+
+    def _fold(self, state, cur, replay: bool = False) -> int:
+        """Accumulate a (dev_eui, time, event_id)-ordered batch; returns rows read."""
+        daily: dict[tuple, list] = {}
+        heard: dict[tuple, int] = {}
+        states: dict[str, tuple] = {}
+        gateways_of: dict[str, list] = {}
+        n = 0
+        prev_dev = None
+        prev_state = None
+        while True:
+            batch = cur.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            for dev_eui, name, profile, time_val, event_id, f_cnt, dev_addr, gids, lag_f, lag_addr in batch:
+                if dev_eui != prev_dev:
+                    # First row of the device in this batch: LAG is NULL, continue from stored state
+                    prev_dev = dev_eui
+                    prev_state = state.execute(
+                        "SELECT f_cnt, dev_addr FROM link_state WHERE dev_eui = ?", (dev_eui,)
+                    ).fetchone()
+                    if prev_state:
+                        lag_f, lag_addr = prev_state
+                missed, dup, reset = classify(lag_f, lag_addr, f_cnt, dev_addr)
+                day = day_key(time_val)
+                d = daily.get((day, dev_eui))
+                if d is None:
+                    d = daily[(day, dev_eui)] = [0, 0, 0, 0]
+                d[0] += 1
+                d[1] += missed
+                d[2] += dup
+                d[3] += reset
+                if gids and not dup:
+                    ids = gateways_of.get(gids)
+                    if ids is None:
+                        try:
+                            ids = json.loads(gids)
+                        except (json.JSONDecodeError, TypeError):
+                            ids = []
+                        gateways_of[gids] = ids = ids if isinstance(ids, list) else []
+                    for gid in ids:
+                        heard[(day, dev_eui, gid)] = heard.get((day, dev_eui, gid), 0) + 1
+                states[dev_eui] = (dev_eui, name, profile, time_val, event_id, f_cnt, dev_addr)
+                n += 1
+        state.executemany(
+            """
+            INSERT INTO link_daily (day, dev_eui, uplinks, missed, duplicates, resets) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, dev_eui) DO UPDATE SET
+                uplinks = uplinks + excluded.uplinks, missed = missed + excluded.missed,
+                duplicates = duplicates + excluded.duplicates, resets = resets + excluded.resets
+            """,
+            [(day, dev, *v) for (day, dev), v in daily.items()],
+        )
+        state.executemany(
+            """
+            INSERT INTO link_gateway_daily (day, dev_eui, gateway_id, heard) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, dev_eui, gateway_id) DO UPDATE SET heard = heard + excluded.heard
+            """,
+            [(*k, v) for k, v in heard.items()],
+        )
+        state.executemany("INSERT OR REPLACE INTO link_state VALUES (?, ?, ?, ?, ?, ?, ?)", states.values())
+        return n
+
+    def report(
+        self,
+        from_day: str | None = None,
+        to_day: str | None = None,
+        dev_eui: str | None = None,
+        profile: str | None = None,
+        gateway: str | None = None,
+    ) -> dict:
+        """Per-device and per-gateway loss over whole days [from_day, to_day]."""
+        where, args = ["1"], []
+        if from_day:
+            where.append("d.day >= ?")
+            args.append(day_key(from_day))
+        if to_day:
+            where.append("d.day <= ?")
+            args.append(day_key(to_day))
+        if dev_eui:
+            where.append("d.dev_eui = ?")
+            args.append(dev_eui)
+        if profile:
+            where.append("s.profile = ?")
+            args.append(profile)
+        if gateway:
+            where.append(
+                "d.dev_eui IN (SELECT dev_eui FROM link_gateway_daily g"
+                " WHERE g.gateway_id = ? AND g.day BETWEEN ? AND ?)"
+            )
+            args.extend([gateway, day_key(from_day) if from_day else "", day_key(to_day) if to_day else "~"])
+        cond = " AND ".join(where)
+        state = self._open()
+        try:
+            devices = state.execute(
+                f"""
+                SELECT d.dev_eui, s.device_name, s.profile, SUM(d.uplinks), SUM(d.missed), SUM(d.duplicates),
+                       SUM(d.resets), MIN(d.day), MAX(d.day)
+                FROM link_daily d LEFT JOIN link_state s ON s.dev_eui = d.dev_eui
+                WHERE {cond}
+                GROUP BY d.dev_eui
+                """,
+                args,
+            ).fetchall()
+            gateways = state.execute(
+                f"""
+                WITH dev AS (
+                    SELECT d.dev_eui, SUM(d.uplinks - d.duplicates + d.missed) AS expected
+                    FROM link_daily d LEFT JOIN link_state s ON s.dev_eui = d.dev_eui
+                    WHERE {cond}
+                    GROUP BY d.dev_eui
+                ), gw AS (
+                    SELECT g.gateway_id, g.dev_eui, SUM(g.heard) AS heard
+                    FROM link_gateway_daily g
+                    WHERE g.day >= ? AND g.day <= ?
+                    GROUP BY g.gateway_id, g.dev_eui
+                )
+                SELECT gw.gateway_id, COUNT(*), SUM(gw.heard), SUM(dev.expected)
+                FROM gw JOIN dev USING (dev_eui)
+                GROUP BY gw.gateway_id
+                """,
+                args + [day_key(from_day) if from_day else "", day_key(to_day) if to_day else "~"],
+            ).fetchall()
+            mark = self.watermark(state)
+        finally:
+            state.close()
+
+        def loss(missed, expected):
+            return round(100 * missed / expected, 3) if expected else None
+
+        dev_out = []
+        totals = {"uplinks": 0, "expected": 0, "missed": 0, "duplicates": 0, "resets": 0}
+        for dev, name, prof, uplinks, missed, dups, resets, first_day, last_day in devices:
+            expected = uplinks - dups + missed
+            dev_out.append({
+                "dev_eui": dev, "device_name": name, "profile": prof,
+                "uplinks": uplinks, "expected": expected, "missed": missed, "duplicates": dups, "resets": resets,
+                "loss_pct": loss(missed, expected), "from": first_day, "to": last_day,
+            })
+            for k, v in (("uplinks", uplinks), ("expected", expected), ("missed", missed),
+                         ("duplicates", dups), ("resets", resets)):
+                totals[k] += v
+        totals["loss_pct"] = loss(totals["missed"], totals["expected"])
+        dev_out.sort(key=lambda d: (-(d["loss_pct"] or 0), d["dev_eui"]))
+        gw_out = [
+            {
+                "gateway_id": gid, "devices": n_dev, "heard": heard, "expected": expected,
+                "reception_pct": round(100 * heard / expected, 3) if expected else None,
+                "missed_pct": loss(expected - heard, expected),
+            }
+            for gid, n_dev, heard, expected in gateways
+        ]
+        if gateway:
+            gw_out = [g for g in gw_out if g["gateway_id"] == gateway]
+        gw_out.sort(key=lambda g: (-(g["missed_pct"] or 0), g["gateway_id"]))
+        return {
+            "from": day_key(from_day) if from_day else None,
+            "to": day_key(to_day) if to_day else None,
+            "processed_through": mark[0] if mark else None,
+            "totals": totals,
+            "devices": dev_out,
+            "gateways": gw_out,
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="summary DB (default data/cache/link_loss.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="process uplinks after the watermark")
+    sub.add_parser("rebuild", help="drop the summary and backfill from all uplinks")
+    p_report = sub.add_parser("report", help="per-device and per-gateway loss")
+    p_report.add_argument("--from", dest="from_day")
+    p_report.add_argument("--to", dest="to_day")
+    p_report.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    engine = LinkLoss(args.state)
+    if args.command in ("update", "rebuild"):
+        t0 = time.perf_counter()
+        n = (engine.rebuild if args.command == "rebuild" else engine.catch_up)(connect)
+        print(f"Processed {n} uplinks in {time.perf_counter() - t0:.1f}s:", args.state)
+        return 0
+    engine.catch_up(connect)
+    report = engine.report(args.from_day, args.to_day)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    t = report["totals"]
+    print(f"{t['uplinks']} uplinks, {t['expected']} frames expected, {t['missed']} missed ({t['loss_pct']}%), "
+          f"{t['duplicates']} duplicates, {t['resets']} resets\n")
+    for d in report["devices"]:
+        print(f"{d['dev_eui']}  {d['device_name'] or '':24} {d['loss_pct'] if d['loss_pct'] is not None else '-':>8}% lost  "
+              f"{d['missed']:7} missed  {d['duplicates']:5} dup  {d['resets']:3} resets")
+    print()
+    for g in report["gateways"]:
+        print(f"{g['gateway_id']:24} heard {g['heard']:9} of {g['expected']:9} ({g['reception_pct']}%)  {g['devices']} devices")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
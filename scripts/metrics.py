@@ -0,0 +1,363 @@
+"""
+In-process instrumentation for scripts/api.py, exposed at /metrics in Prometheus text format.
+
+- MetricsMiddleware: request latency histogram per route template, method and status
+- TimedConnection: sqlite3 connection (get_db factory) whose every execute() is timed from
+  the statement start until its rows are exhausted (time spent between fetches by the caller
+  is not counted), recording SQL time and rows per query name, plus connection open/close
+  counts. fetchall/fetchone(name, sql, params) name a query; any other execute() is named
+  after the calling module and the statement's first keyword (e.g. `battery_forecast.select`).
+  Statements over the slow-query threshold also go to slow_queries.SLOW_QUERIES
+- TimedJSONResponse: default response class; records JSON render time per route
+- Counters for ingest and anomaly engine throughput, updated by the endpoints
+
+Stdlib only. Each observation is a perf_counter pair, a bisect and a locked add, so it is
+cheap enough to leave on in production.
+"""
+
+import contextvars
+import os
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from starlette.responses import JSONResponse
+
+try:
+    from scripts.slow_queries import SLOW_QUERIES
+except ImportError:  # run as python scripts/api.py
+    from slow_queries import SLOW_QUERIES
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; covers sub-ms SQL lookups up to multi-second org-wide scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Rows fetched per timed step when a TimedCursor is iterated
+ITER_CHUNK = 256
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels: c.inc(n, *label_values)."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield self.name + _labels(self.labels, key), v
+
+
+class Gauge:
+    """Value read at scrape time from fn() -> {label_values tuple: value}."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self):
+        values = self.fn() if self.fn else {}
+        for key, v in sorted(values.items()):
+            yield self.name + _labels(self.labels, key), v
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels: h.observe(seconds, *label_values)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # key -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                yield self.name + "_bucket" + _labels(self.labels, key, f'le="{_fmt(bound)}"'), running
+            yield self.name + "_sum" + _labels(self.labels, key), total
+            yield self.name + "_count" + _labels(self.labels, key), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            lines.extend(f"{name} {_fmt(v)}" for name, v in m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "api_request_duration_seconds", "HTTP request latency by route template.", ("route", "method", "status")))
+SQL_SECONDS = REGISTRY.register(Histogram(
+    "api_sql_duration_seconds", "SQL execute + fetch time by query name (or module.keyword).", ("query",)))
+SQL_ROWS = REGISTRY.register(Counter(
+    "api_sql_rows_total", "Rows returned by query name (or module.keyword).", ("query",)))
+JSON_SECONDS = REGISTRY.register(Histogram(
+    "api_json_serialize_duration_seconds", "JSON response render time by route template.", ("route",)))
+DB_OPENED = REGISTRY.register(Counter(
+    "api_db_connections_opened_total", "SQLite connections opened by the API."))
+DB_CLOSED = REGISTRY.register(Counter(
+    "api_db_connections_closed_total", "SQLite connections closed by the API."))
+INGEST_EVENTS = REGISTRY.register(Counter(
+    "api_ingest_events_total", "Uplinks received on POST /api/ingest by result.", ("result",)))
+ANOMALY_EVENTS = REGISTRY.register(Counter(
+    "api_anomaly_events_scanned_total", "Events evaluated by the anomaly rules.", ("engine",)))
+ANOMALY_FOUND = REGISTRY.register(Counter(
+    "api_anomalies_detected_total", "Anomalies produced by the anomaly rules.", ("engine",)))
+ANOMALY_SECONDS = REGISTRY.register(Histogram(
+    "api_anomaly_duration_seconds", "Anomaly rule evaluation time per call.", ("engine",)))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is not None:
+        return path or "/"
+    if scope.get("endpoint") is not None:
+        return scope.get("root_path", "") + "/*"  # mounted static app
+    return "unmatched"  # 404s: keep arbitrary URLs out of the label set
+
+
+def _default_name(sql: str) -> str:
+    """`module.keyword` of the first caller outside this file, e.g. `radio_stats.insert`."""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0] if frame is not None else "sql"
+    words = sql.split(None, 1)
+    return f"{module}.{words[0].lower() if words else 'empty'}"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times its statement from execute() until the rows run out, then records it once.
+
+    Only time inside SQLite calls counts; a statement whose rows are never exhausted is recorded
+    when the cursor is closed, re-executed or dropped.
+    """
+
+    _name = None
+
+    def execute(self, sql: str, params=(), name: str | None = None):
+        self._finish()
+        t0 = time.perf_counter()
+        super().execute(sql, params)
+        self._seconds = time.perf_counter() - t0
+        self._name = name or _default_name(sql)
+        self._sql, self._params, self._rows = sql, params, 0
+        if self.description is None:  # no result set (DDL/DML): done already
+            self._finish()
+        return self
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._seconds += time.perf_counter() - t0
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: int | None = None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._seconds += time.perf_counter() - t0
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._seconds += time.perf_counter() - t0
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        # for-loops pull rows in timed chunks: a clock read per row would cost more than the row
+        while True:
+            rows = self.fetchmany(ITER_CHUNK)
+            if not rows:
+                return
+            yield from rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._seconds += time.perf_counter() - t0
+            self._finish()
+            raise
+        self._seconds += time.perf_counter() - t0
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self) -> None:
+        name = self._name
+        if name is None:
+            return
+        self._name = None
+        self.connection._observe(name, self._sql, self._params, self._seconds, self._rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    """get_db() connection factory: counts open/close; every execute() is timed (TimedCursor)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        DB_OPENED.inc()
+
+    def close(self):
+        super().close()
+        DB_CLOSED.inc()
+
+    def execute(self, sql: str, params=()):
+        return self.cursor(TimedCursor).execute(sql, params)
+
+    def fetchall(self, name: str, sql: str, params=()) -> list:
+        return self.cursor(TimedCursor).execute(sql, params, name).fetchall()
+
+    def fetchone(self, name: str, sql: str, params=()):
+        cur = self.cursor(TimedCursor).execute(sql, params, name)
+        row = cur.fetchone()
+        cur.close()
+        return row
+
+    def _observe(self, name: str, sql: str, params, seconds: float, rows: int) -> None:
+        SQL_SECONDS.observe(seconds, name)
+        SQL_ROWS.inc(rows, name)
+        SLOW_QUERIES.record(self, name, sql, params, seconds, rows)
+
+
+# Per-request cell [seconds] for JSON render time; set by MetricsMiddleware. Responses are
+# rendered in the request's own task, so the render adds into the right request's cell.
+_json_seconds: contextvars.ContextVar[list | None] = contextvars.ContextVar("json_seconds", default=None)
+
+
+def record_json_render(seconds: float) -> None:
+    """Count hand-rendered JSON (responses built without TimedJSONResponse) toward the route."""
+    cell = _json_seconds.get()
+    if cell is not None:
+        cell[0] += seconds
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records render time; MetricsMiddleware attributes it to the route."""
+
+    def render(self, content) -> bytes:
+        t0 = time.perf_counter()
+        body = super().render(content)
+        cell = _json_seconds.get()
+        if cell is not None:
+            cell[0] += time.perf_counter() - t0
+        return body
+
+
+class MetricsMiddleware:
+    """Record request latency per route template and JSON render time per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        cell = [0.0]
+        token = _json_seconds.set(cell)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _json_seconds.reset(token)
+            route = _route_label(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, route, scope["method"], status)
+            if cell[0]:
+                JSON_SECONDS.observe(cell[0], route)
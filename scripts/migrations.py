@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the uplinks DB (data/uplinks.db and each monthly partition).
+
+The schema version is SQLite's PRAGMA user_version (a header field: reading it is one page
+read, no lock held past the statement). MIGRATIONS is append-only; migration N brings a DB
+from version N-1 to N. migrate():
+
+- reads user_version; when it equals SCHEMA_VERSION (the common case) it returns at once
+- otherwise takes the write lock (BEGIN IMMEDIATE), re-reads the version so a worker that
+  waited behind another one sees its work and does nothing, applies the pending steps and
+  sets user_version in the same transaction (SQLite DDL is transactional: all or none)
+
+DBs created before versioning report version 0 but may already have some columns, so the
+column step checks PRAGMA table_info rather than trying ALTERs and swallowing errors.
+
+ingest.create_schema(), the API startup hook and the synthetic generators all go through
+migrate(); new schema changes are a new entry at the end of MIGRATIONS.
+
+Run:
+  python scripts/migrations.py              # migrate data/uplinks.db and data/partitions/*
+  python scripts/migrations.py --status     # print versions only
+"""
+
+import argparse
+import sqlite3
+import sys
+from pathlib import Path
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+PARTITION_DIR = APP_ROOT / "data" / "partitions"
+
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uplinks (
+    event_id TEXT PRIMARY KEY,
+    time TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    device_name TEXT,
+    device_profile_name TEXT,
+    application_id TEXT,
+    application_name TEXT,
+    gateway_ids TEXT,
+    rssi INTEGER,
+    snr REAL,
+    location_lat REAL,
+    location_lon REAL,
+    location_alt REAL,
+    battery_normalized REAL,
+    object_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_uplinks_dev_eui ON uplinks(dev_eui);
+CREATE INDEX IF NOT EXISTS idx_uplinks_time ON uplinks(time);
+CREATE INDEX IF NOT EXISTS idx_uplinks_device_profile ON uplinks(device_profile_name);
+CREATE INDEX IF NOT EXISTS idx_uplinks_application_id ON uplinks(application_id);
+"""
+
+# Columns added to uplinks after the first release (MAC/radio fields, then synthetic)
+ADDED_COLUMNS = (
+    ("f_port", "INTEGER"),
+    ("dev_addr", "TEXT"),
+    ("f_cnt", "INTEGER"),
+    ("margin", "REAL"),
+    ("external_power_source", "INTEGER"),
+    ("battery_level_unavailable", "INTEGER"),
+    ("battery_level_join", "REAL"),
+    ("frequency", "INTEGER"),
+    ("spreading_factor", "INTEGER"),
+    ("region_config_id", "TEXT"),
+    ("synthetic", "INTEGER"),
+)
+
+
+def _base_schema(conn: sqlite3.Connection) -> None:
+    # executescript() would COMMIT the open transaction first; run statement by statement
+    for stmt in BASE_SCHEMA.split(";"):
+        if stmt.strip():
+            conn.execute(stmt)
+
+
+def _added_columns(conn: sqlite3.Connection) -> None:
+    have = {row[1] for row in conn.execute("PRAGMA table_info(uplinks)")}
+    for col, typ in ADDED_COLUMNS:
+        if col not in have:
+            conn.execute(f"ALTER TABLE uplinks ADD COLUMN {col} {typ}")
+
+
+def _pagination_indexes(conn: sqlite3.Connection) -> None:
+    # Keyset pages on (time, event_id), per device and overall, are index range reads
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_uplinks_dev_eui_time_event ON uplinks(dev_eui, time, event_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_uplinks_time_event ON uplinks(time, event_id)")
+
+
+# (description, step); position + 1 is the version the step produces. Append only.
+MIGRATIONS = (
+    ("uplinks table and base indexes", _base_schema),
+    ("MAC/radio and synthetic columns", _added_columns),
+    ("(time, event_id) pagination indexes", _pagination_indexes),
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> list[str]:
+    """Bring conn's DB to SCHEMA_VERSION; returns the descriptions of the steps applied (usually none)."""
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)  # another process may have migrated while we waited
+        applied = []
+        for description, step in MIGRATIONS[version:]:
+            step(conn)
+            applied.append(description)
+        if applied:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+
+def migrate_path(path: Path, timeout: float = 30) -> list[str]:
+    """migrate() an existing DB file; missing files are left alone."""
+    if not Path(path).is_file():
+        return []
+    conn = sqlite3.connect(path, timeout=timeout)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--partitions", type=Path, default=PARTITION_DIR, help="monthly partition dir")
+    parser.add_argument("--status", action="store_true", help="print schema versions, change nothing")
+    args = parser.parse_args()
+    paths = [args.db] if args.db.is_file() else []
+    if args.partitions.is_dir():
+        paths += sorted(args.partitions.glob("uplinks-*.db"))
+    if not paths:
+        print("No DB found:", args.db, file=sys.stderr)
+        return 1
+    for path in paths:
+        if args.status:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                print(f"{path}: version {schema_version(conn)} of {SCHEMA_VERSION}")
+            finally:
+                conn.close()
+            continue
+        applied = migrate_path(path)
+        print(f"{path}: " + ("; ".join(applied) if applied else "up to date") + f" (version {SCHEMA_VERSION})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Monthly partitioned storage for uplinks: one SQLite file per UTC month.
+
+    data/partitions/uplinks-2026-01.db, uplinks-2026-02.db, ...
+
+Each file holds an ordinary `uplinks` table (ingest.create_schema), so dropping a month is
+deleting its file and compacting a cold month only locks that month. scripts/api.py serves
+partitions when this directory holds any: each request opens an in-memory connection,
+ATTACHes (read-only) just the months its from/to range overlaps and reads them through a
+TEMP VIEW named `uplinks`, so endpoint SQL is unchanged. SQLite allows at most
+MAX_ATTACHED (10) attached files: connect() raises PartitionLimitError for a range
+overlapping more months rather than silently reading part of it. Callers read such ranges
+MAX_ATTACHED months at a time (incremental.windows()): the API's unbounded views (device
+list, passport, gateways) and long ranges merge the windows' results, and the derived-state
+engines (scripts/incremental.py) fold long backfills window by window.
+
+Writes go through insert_rows() (or insert_values() for pre-built tuples), which group rows
+by month. Once partitions exist the API reads only them, so every writer (POST /api/ingest,
+ingest.py, generate_synthetic.py, append_synthetic_live.py, replay_dataset.py) writes here
+instead of data/uplinks.db, and the engine and report CLIs (link_loss.py, radio_stats.py,
+site_timeline.py, coverage_grid.py, spatial_index.py, stream_detectors.py, alert_engine.py,
+data_gaps.py, battery_forecast.py) read them through reader() unless given --db.
+
+Run:
+  python scripts/partitions.py split [--db data/uplinks.db]   # copy a single-file DB into partitions
+  python scripts/partitions.py list
+  python scripts/partitions.py retain --keep-months 6 [--dry-run]
+  python scripts/partitions.py compact [--cold-after-days 7]
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    from scripts.ingest import INSERT_COLUMNS, INSERT_SQL, create_schema, insert_rows as insert_into
+    from scripts import payload_codec
+except ImportError:  # run as python scripts/partitions.py
+    from ingest import INSERT_COLUMNS, INSERT_SQL, create_schema, insert_rows as insert_into
+    import payload_codec
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+PARTITION_DIR = APP_ROOT / "data" / "partitions"
+# SQLITE_MAX_ATTACHED default; the compile-time limit can't be raised at runtime
+MAX_ATTACHED = 10
+# A month is cold (compactable) this long after it ends
+COLD_AFTER_DAYS = 7
+COMPACT_INTERVAL_SEC = 3600
+
+_NAME = re.compile(r"^uplinks-(\d{4}-\d{2})\.db$")
+_listing: tuple[tuple, list] = ((), [])
+
+
+def month_key(time_val: str) -> str:
+    """'YYYY-MM' partition key of an ISO-8601 time string."""
+    return time_val[:7]
+
+
+def partition_path(root: Path, key: str) -> Path:
+    return Path(root) / f"uplinks-{key}.db"
+
+
+def list_partitions(root: Path) -> list[tuple[str, Path]]:
+    """[(key, path)] oldest first; cached until the directory changes."""
+    global _listing
+    try:
+        stamp = (str(root), os.stat(root).st_mtime_ns)
+    except OSError:
+        return []
+    if _listing[0] != stamp:
+        found = []
+        for name in os.listdir(root):
+            m = _NAME.match(name)
+            if m:
+                found.append((m.group(1), Path(root) / name))
+        _listing = (stamp, sorted(found))
+    return list(_listing[1])
+
+
+class PartitionLimitError(ValueError):
+    """A range overlaps more than MAX_ATTACHED partitions; months lists their keys, oldest first."""
+
+    def __init__(self, months: list[str]):
+        super().__init__(
+            f"range covers {len(months)} monthly partitions ({months[0]} to {months[-1]}) but at most "
+            f"{MAX_ATTACHED} can be read at once: narrow from/to or retain fewer months"
+        )
+        self.months = months
+
+
+def partitions_for_range(root: Path, from_time: str | None = None, to_time: str | None = None) -> list[tuple[str, Path]]:
+    """Partitions overlapping [from_time, to_time]; PartitionLimitError if more than MAX_ATTACHED do."""
+    lo = month_key(from_time) if from_time else None
+    hi = month_key(to_time) if to_time else None
+    parts = [(k, p) for k, p in list_partitions(root) if (lo is None or k >= lo) and (hi is None or k <= hi)]
+    if len(parts) > MAX_ATTACHED:
+        raise PartitionLimitError([k for k, _ in parts])
+    return parts
+
+
+def connect(root: Path, from_time: str | None = None, to_time: str | None = None, factory=sqlite3.Connection):
+    """Read-only connection whose TEMP VIEW `uplinks` unions the partitions the range needs."""
+    conn = sqlite3.connect("file::memory:", uri=True, factory=factory)
+    payload_codec.install(conn)
+    arms = []
+    for i, (_, path) in enumerate(partitions_for_range(root, from_time, to_time)):
+        conn.execute(f"ATTACH DATABASE ? AS p{i}", (f"file:{path}?mode=ro",))
+        if payload_codec.load_dictionaries(conn, f"p{i}"):
+            cols = ("payload_json(object_json) AS object_json" if c == "object_json" else c for c in INSERT_COLUMNS)
+        else:
+            cols = INSERT_COLUMNS
+        arms.append(f"SELECT {', '.join(cols)} FROM p{i}.uplinks")
+    if not arms:
+        # No partition in range: an empty view keeps endpoint SQL valid
+        arms.append(f"SELECT {', '.join('NULL AS ' + c for c in INSERT_COLUMNS)} WHERE 0")
+    conn.execute("CREATE TEMP VIEW uplinks AS " + " UNION ALL ".join(arms))
+    return conn
+
+
+def reader(db_path: Path | None = None, root: Path = PARTITION_DIR):
+    """connect(from_time=None, to_time=None) for a CLI's --db, or None if there is nothing to read.
+
+    Without db_path it reads what the API does: the partitions under root once any exist, else
+    DB_PATH. Connections are read-only and decode encoded payloads.
+    """
+    if db_path is None and list_partitions(root):
+        def connect_partitions(from_time=None, to_time=None):
+            return connect(root, from_time, to_time)
+        return connect_partitions
+    path = db_path or DB_PATH
+    if not path.is_file():
+        return None
+
+    def connect_db(_from_time=None, _to_time=None):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        payload_codec.install(conn)
+        return conn
+    return connect_db
+
+
+def open_partition(root: Path, key: str) -> sqlite3.Connection:
+    """Writable connection to one month, created with the uplinks schema if missing."""
+    Path(root).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(partition_path(root, key), timeout=30)
+    create_schema(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS partition_info (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def insert_rows(root: Path, rows: list[dict]) -> int:
+    """Write extract_event() rows to their month partitions, one transaction per month."""
+    by_month: dict[str, list] = {}
+    for row in rows:
+        by_month.setdefault(month_key(row["time"]), []).append(row)
+    for key, month_rows in by_month.items():
+        _write_month(root, key, lambda conn: insert_into(conn, month_rows))
+    return len(rows)
+
+
+def insert_values(root: Path, values) -> int:
+    """insert_rows() for tuples in INSERT_COLUMNS order (bulk generators); object_json is stored as given."""
+    by_month: dict[str, list] = {}
+    for v in values:
+        by_month.setdefault(month_key(v[1]), []).append(v)
+    for key, month_values in by_month.items():
+        _write_month(root, key, lambda conn: conn.executemany(INSERT_SQL, month_values))
+    return sum(len(v) for v in by_month.values())
+
+
+def _write_month(root: Path, key: str, write) -> None:
+    conn = open_partition(root, key)
+    try:
+        write(conn)
+        # New data in a compacted month: let the compactor pick it up again
+        conn.execute("DELETE FROM partition_info WHERE key = 'compacted_at'")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def split(db_path: Path, root: Path) -> dict[str, int]:
+    """Copy every row of a single-file DB into monthly partitions; returns rows per month."""
+    src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    cols = [r[1] for r in src.execute("PRAGMA table_info(uplinks)")]
+    select = ", ".join(c if c in cols else "NULL" for c in INSERT_COLUMNS)
+    months = [r[0] for r in src.execute("SELECT DISTINCT substr(time, 1, 7) FROM uplinks ORDER BY 1")]
+    # Encoded payloads are copied as they are, with the dictionaries they need
+    dicts = src.execute("SELECT * FROM payload_dicts").fetchall() if payload_codec.has_dictionaries(src) else []
+    counts = {}
+    for key in months:
+        conn = open_partition(root, key)
+        try:
+            if dicts:
+                conn.execute(payload_codec.SCHEMA)
+                conn.executemany(f"INSERT OR REPLACE INTO payload_dicts VALUES ({', '.join('?' * len(dicts[0]))})", dicts)
+            next_key = _month_end(key).strftime("%Y-%m")
+            cur = src.execute(f"SELECT {select} FROM uplinks WHERE time >= ? AND time < ?", (key, next_key))
+            n = 0
+            while True:
+                batch = cur.fetchmany(50_000)
+                if not batch:
+                    break
+                conn.executemany(INSERT_SQL, batch)
+                n += len(batch)
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        counts[key] = n
+    src.close()
+    return counts
+
+
+def _month_end(key: str) -> datetime:
+    year, month = int(key[:4]), int(key[5:7])
+    return datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def retain(root: Path, keep_months: int, now: datetime | None = None, dry_run: bool = False) -> list[Path]:
+    """Delete partitions older than the last keep_months calendar months (current month included)."""
+    now = now or datetime.now(timezone.utc)
+    year, month = now.year, now.month - (keep_months - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    oldest_kept = f"{year:04d}-{month:02d}"
+    dropped = []
+    for key, path in list_partitions(root):
+        if key >= oldest_kept:
+            continue
+        dropped.append(path)
+        if not dry_run:
+            for suffix in ("", "-journal", "-wal", "-shm"):
+                Path(str(path) + suffix).unlink(missing_ok=True)
+    return dropped
+
+
+def compact_cold(root: Path, cold_after_days: int = COLD_AFTER_DAYS, now: datetime | None = None) -> list[str]:
+    """VACUUM + ANALYZE months that ended cold_after_days ago and changed since their last compaction."""
+    now = now or datetime.now(timezone.utc)
+    done = []
+    for key, path in list_partitions(root):
+        if _month_end(key) + timedelta(days=cold_after_days) > now:
+            continue
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS partition_info (key TEXT PRIMARY KEY, value TEXT)")
+            if conn.execute("SELECT 1 FROM partition_info WHERE key = 'compacted_at'").fetchone():
+                continue
+            conn.execute("ANALYZE")
+            conn.execute(
+                "INSERT OR REPLACE INTO partition_info (key, value) VALUES ('compacted_at', ?)",
+                (now.strftime("%Y-%m-%dT%H:%M:%SZ"),),
+            )
+            conn.commit()
+            conn.execute("VACUUM")
+            done.append(key)
+        finally:
+            conn.close()
+    return done
+
+
+def start_compactor(root: Path, interval_sec: float = COMPACT_INTERVAL_SEC) -> threading.Event:
+    """Daemon thread running compact_cold every interval_sec; set the returned event to stop it."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval_sec):
+            try:
+                compact_cold(root)
+            except sqlite3.Error as e:
+                print("Partition compaction failed:", e, file=sys.stderr)
+
+    threading.Thread(target=run, name="partition-compactor", daemon=True).start()
+    return stop
+
+
+def describe(root: Path) -> list[dict]:
+    out = []
+    for key, path in list_partitions(root):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows, t_min, t_max = conn.execute("SELECT COUNT(*), MIN(time), MAX(time) FROM uplinks").fetchone()
+            compacted = conn.execute("SELECT value FROM partition_info WHERE key = 'compacted_at'").fetchone()
+        finally:
+            conn.close()
+        out.append({
+            "month": key, "rows": rows, "from": t_min, "to": t_max,
+            "bytes": path.stat().st_size, "compacted_at": compacted[0] if compacted else None,
+        })
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=PARTITION_DIR, help="partition directory (default data/partitions)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_split = sub.add_parser("split", help="copy a single-file DB into monthly partitions")
+    p_split.add_argument("--db", type=Path, default=DB_PATH)
+    sub.add_parser("list", help="partitions with rows, time range, size")
+    p_retain = sub.add_parser("retain", help="delete months older than --keep-months")
+    p_retain.add_argument("--keep-months", type=int, required=True)
+    p_retain.add_argument("--dry-run", action="store_true")
+    p_compact = sub.add_parser("compact", help="VACUUM + ANALYZE cold months")
+    p_compact.add_argument("--cold-after-days", type=int, default=COLD_AFTER_DAYS)
+    args = parser.parse_args()
+
+    if args.command == "split":
+        if not args.db.is_file():
+            print("DB not found:", args.db, file=sys.stderr)
+            return 1
+        t0 = time.perf_counter()
+        counts = split(args.db, args.dir)
+        for key, n in counts.items():
+            print(f"  {key}: {n} rows")
+        print(f"Split {sum(counts.values())} rows into {len(counts)} partitions in {time.perf_counter() - t0:.1f}s:", args.dir)
+    elif args.command == "list":
+        for p in describe(args.dir):
+            print(f"{p['month']}  {p['rows']:>10} rows  {p['bytes'] / 1e6:8.1f} MB  {p['from']} .. {p['to']}"
+                  f"  {'compacted ' + p['compacted_at'] if p['compacted_at'] else ''}")
+    elif args.command == "retain":
+        if args.keep_months < 1:
+            print("--keep-months must be >= 1", file=sys.stderr)
+            return 1
+        dropped = retain(args.dir, args.keep_months, dry_run=args.dry_run)
+        for path in dropped:
+            print(("Would delete " if args.dry_run else "Deleted ") + str(path))
+        if not dropped:
+            print("Nothing to delete")
+    elif args.command == "compact":
+        done = compact_cold(args.dir, args.cold_after_days)
+        print("Compacted:", ", ".join(done) if done else "nothing")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
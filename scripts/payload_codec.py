@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Optional compact encoding of uplinks.object_json: raw deflate with a preset dictionary per
+device profile.
+
+Decoded payloads are short JSON objects whose keys (and often whole values) repeat in
+every uplink of a profile, so generic compression gains little per row but a shared
+dictionary of typical payloads does: on the shipped dataset object_json shrinks ~10x. A
+compressed value is a BLOB
+
+    0x01 | dictionary id (4 bytes, big-endian) | raw deflate stream (zlib wbits -15, zdict)
+
+in the same column; text values are plain JSON as before, so a DB can be half converted,
+payloads shorter than MIN_ENCODE_BYTES ('null', '{}') stay text and old readers of
+untouched rows keep working. Dictionaries live in a `payload_dicts` table of the same DB
+file (one active dictionary per profile, the newest; older ones stay for the rows that
+use them). The feature is on for a DB exactly when that table exists:
+
+- train builds it from the newest SAMPLE_ROWS payloads of each profile
+- ingest.insert_rows() encodes new rows of profiles with a dictionary
+- install() (scripts/api.py get_db, partitions.connect, the CLI readers) registers the SQL
+  function payload_json() and shadows `uplinks` with a TEMP VIEW that decodes
+  object_json, so endpoint SQL and json_extract() see text unchanged. The view is a plain
+  projection, so SQLite flattens it and the uplinks indexes still apply; payload_json()
+  only runs for rows whose object_json a query actually reads.
+
+zstd would compress a little better with trained dictionaries but is not in the standard
+library; deflate's 32 KiB window bounds the dictionary at DICT_BYTES.
+
+Run:
+  python scripts/payload_codec.py train [--sample 5000]     # build/refresh per-profile dictionaries
+  python scripts/payload_codec.py compress [--vacuum]       # encode existing rows in place
+  python scripts/payload_codec.py decompress [--vacuum]     # back to plain text (keeps dictionaries)
+  python scripts/payload_codec.py status
+  python scripts/payload_codec.py bench [--db data/bench/bench-1m-1000d-50g.db] [--json]
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+FORMAT_DEFLATE = 1
+# Deflate's window: a longer preset dictionary is truncated to its last 32 KiB anyway
+DICT_BYTES = 32768
+# Payloads per profile a dictionary is trained on
+SAMPLE_ROWS = 5000
+# Shorter payloads are left as text (the 5-byte header would eat the gain)
+MIN_ENCODE_BYTES = 24
+# Rows encoded per transaction by compress/decompress
+BATCH_ROWS = 20_000
+
+_HEADER = struct.Struct(">BI")
+_ZDICTS: dict[int, bytes] = {}  # dictionary id -> zdict, shared by every connection
+_ENCODERS: dict[tuple, "Encoder"] = {}  # active dictionaries -> primed Encoder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payload_dicts (
+    id INTEGER PRIMARY KEY,
+    profile TEXT NOT NULL,
+    zdict BLOB NOT NULL,
+    samples INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+)
+"""
+
+
+def has_dictionaries(conn: sqlite3.Connection, schema: str = "main") -> bool:
+    return conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'payload_dicts'"
+    ).fetchone() is not None
+
+
+def load_dictionaries(conn: sqlite3.Connection, schema: str = "main") -> dict[str, int]:
+    """Register the schema's dictionaries for decode(); returns {profile: active dictionary id}."""
+    if not has_dictionaries(conn, schema):
+        return {}
+    active = {}
+    missing = []
+    for profile, dict_id in conn.execute(f"SELECT profile, id FROM {schema}.payload_dicts ORDER BY created_at, rowid"):
+        active[profile] = dict_id
+        if dict_id not in _ZDICTS:
+            missing.append(dict_id)
+    for dict_id in missing:
+        (zdict,) = conn.execute(f"SELECT zdict FROM {schema}.payload_dicts WHERE id = ?", (dict_id,)).fetchone()
+        _ZDICTS[dict_id] = bytes(zdict)
+    return active
+
+
+def decode(value):
+    """object_json as stored (text, encoded blob or NULL) -> JSON text or None."""
+    if not isinstance(value, bytes):
+        return value
+    fmt, dict_id = _HEADER.unpack_from(value)
+    zdict = _ZDICTS.get(dict_id)
+    if fmt != FORMAT_DEFLATE or zdict is None:
+        raise ValueError(f"cannot decode payload (format {fmt}, dictionary {dict_id:08x})")
+    d = zlib.decompressobj(-15, zdict=zdict)
+    return (d.decompress(value[_HEADER.size:]) + d.flush()).decode()
+
+
+def loads(value):
+    """json.loads() of a stored object_json; None for NULL/empty."""
+    text = decode(value)
+    return json.loads(text) if text else None
+
+
+def _register(conn: sqlite3.Connection) -> None:
+    conn.create_function("payload_json", 1, decode, deterministic=True)
+
+
+def install(conn: sqlite3.Connection) -> bool:
+    """Make conn read decoded payloads. Returns True when its main DB holds encoded payloads.
+
+    Registers payload_json(); when main has dictionaries, a TEMP VIEW `uplinks` over
+    main.uplinks (same columns, object_json decoded) shadows the table for unqualified names.
+    """
+    _register(conn)
+    if not load_dictionaries(conn):
+        return False
+    cols = [r[1] for r in conn.execute("PRAGMA main.table_info(uplinks)")]
+    select = ", ".join("payload_json(object_json) AS object_json" if c == "object_json" else c for c in cols)
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS uplinks AS SELECT {select} FROM main.uplinks")
+    return True
+
+
+class Encoder:
+    """Encodes object_json for the profiles that have a dictionary in one DB."""
+
+    def __init__(self, active: dict[str, int]):
+        self._base = {}
+        for profile, dict_id in active.items():
+            # Priming a compressor with 32 KiB of dictionary costs ~150us; copies of a primed one ~40us
+            c = zlib.compressobj(6, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _ZDICTS[dict_id])
+            self._base[profile] = (_HEADER.pack(FORMAT_DEFLATE, dict_id), c)
+
+    @classmethod
+    def for_connection(cls, conn: sqlite3.Connection) -> "Encoder | None":
+        active = load_dictionaries(conn)
+        if not active:
+            return None
+        key = tuple(sorted(active.items()))
+        if key not in _ENCODERS:
+            _ENCODERS[key] = cls(active)
+        return _ENCODERS[key]
+
+    def encode(self, profile: str | None, text):
+        """Stored value for object_json text: an encoded blob, or text when it would not shrink."""
+        base = self._base.get(profile)
+        if base is None or not isinstance(text, str) or len(text) < MIN_ENCODE_BYTES:
+            return text
+        header, primed = base
+        c = primed.copy()
+        raw = text.encode()
+        blob = header + c.compress(raw) + c.flush()
+        return blob if len(blob) < len(raw) else text
+
+
+def train_dictionary(payloads: list[str]) -> bytes:
+    """Preset dictionary from sample payloads: distinct payloads, most frequent last (nearest)."""
+    counts = Counter(payloads)
+    ordered = sorted(counts, key=lambda p: (counts[p], len(p), p))
+    return "".join(ordered).encode()[-DICT_BYTES:]
+
+
+def train(conn: sqlite3.Connection, sample: int = SAMPLE_ROWS, profiles: list[str] | None = None) -> dict[str, int]:
+    """Add a dictionary per profile from its newest payloads; returns {profile: samples}. Caller commits."""
+    conn.execute(SCHEMA)
+    load_dictionaries(conn)
+    if profiles is None:
+        profiles = [r[0] for r in conn.execute(
+            "SELECT DISTINCT device_profile_name FROM main.uplinks WHERE device_profile_name IS NOT NULL ORDER BY 1"
+        )]
+    created_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    trained = {}
+    for profile in profiles:
+        payloads = [
+            decode(v) for (v,) in conn.execute(
+                "SELECT object_json FROM main.uplinks WHERE device_profile_name = ? AND object_json IS NOT NULL "
+                "ORDER BY time DESC LIMIT ?",
+                (profile, sample),
+            )
+        ]
+        payloads = [p for p in payloads if len(p) >= MIN_ENCODE_BYTES]
+        if not payloads:
+            continue
+        zdict = train_dictionary(payloads)
+        dict_id = zlib.crc32(profile.encode() + b"\0" + zdict)
+        conn.execute(
+            "INSERT OR REPLACE INTO payload_dicts (id, profile, zdict, samples, created_at) VALUES (?, ?, ?, ?, ?)",
+            (dict_id, profile, zdict, len(payloads), created_at),
+        )
+        _ZDICTS[dict_id] = zdict
+        trained[profile] = len(payloads)
+    return trained
+
+
+def _rewrite(conn: sqlite3.Connection, kind: str, convert, batch_rows: int) -> int:
+    """Rewrite object_json values of typeof() kind through convert(profile, value), batch per transaction."""
+    last = 0
+    changed = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, device_profile_name, object_json FROM main.uplinks "
+            "WHERE rowid > ? AND typeof(object_json) = ? ORDER BY rowid LIMIT ?",
+            (last, kind, batch_rows),
+        ).fetchall()
+        if not rows:
+            return changed
+        last = rows[-1][0]
+        updates = []
+        for rowid, profile, value in rows:
+            new = convert(profile, value)
+            if new is not value:
+                updates.append((new, rowid))
+        conn.executemany("UPDATE main.uplinks SET object_json = ? WHERE rowid = ?", updates)
+        conn.commit()
+        changed += len(updates)
+
+
+def compress(conn: sqlite3.Connection, batch_rows: int = BATCH_ROWS) -> int:
+    """Encode text payloads of profiles with a dictionary; returns rows rewritten."""
+    encoder = Encoder.for_connection(conn)
+    if encoder is None:
+        return 0
+    return _rewrite(conn, "text", encoder.encode, batch_rows)
+
+
+def decompress(conn: sqlite3.Connection, batch_rows: int = BATCH_ROWS) -> int:
+    """Turn every encoded payload back into text; returns rows rewritten."""
+    load_dictionaries(conn)
+    return _rewrite(conn, "blob", lambda _profile, value: decode(value), batch_rows)
+
+
+def status(conn: sqlite3.Connection) -> dict:
+    _register(conn)
+    active = load_dictionaries(conn)
+    profiles = []
+    for profile, rows, text_rows, packed_rows, stored, plain in conn.execute("""
+        SELECT device_profile_name, COUNT(*),
+               SUM(typeof(object_json) = 'text'), SUM(typeof(object_json) = 'blob'),
+               SUM(length(CAST(object_json AS BLOB))), SUM(length(CAST(payload_json(object_json) AS BLOB)))
+        FROM main.uplinks GROUP BY device_profile_name ORDER BY COUNT(*) DESC
+    """):
+        profiles.append({
+            "profile": profile,
+            "rows": rows,
+            "text_rows": text_rows,
+            "encoded_rows": packed_rows,
+            "stored_bytes": stored or 0,
+            "plain_bytes": plain or 0,
+            "dictionary": f"{active[profile]:08x}" if profile in active else None,
+        })
+    stored = sum(p["stored_bytes"] for p in profiles)
+    plain = sum(p["plain_bytes"] for p in profiles)
+    return {
+        "enabled": bool(active),
+        "dictionaries": conn.execute("SELECT COUNT(*) FROM payload_dicts").fetchone()[0] if active else 0,
+        "stored_bytes": stored,
+        "plain_bytes": plain,
+        "ratio": round(stored / plain, 3) if plain else None,
+        "profiles": profiles,
+    }
+
+
+def _copy(src: Path, dst: Path) -> None:
+    dst.unlink(missing_ok=True)
+    s = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    d = sqlite3.connect(dst)
+    try:
+        s.backup(d)
+    finally:
+        d.close()
+        s.close()
+
+
+def _pct(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def _measure(path: Path, devices: list[str], page_rows: int, scan_rows: int, ingest_rows: int) -> dict:
+    """Latency of the payload read paths on one DB file (decoded through install())."""
+    try:
+        from scripts.ingest import INSERT_COLUMNS, insert_rows
+    except ImportError:
+        from ingest import INSERT_COLUMNS, insert_rows
+    conn = sqlite3.connect(path)
+    install(conn)
+    sql = "SELECT time, object_json FROM uplinks WHERE dev_eui = ? ORDER BY time DESC LIMIT ?"
+    for dev in devices[:5]:  # warm the page cache like a running API
+        conn.execute(sql, (dev, page_rows)).fetchall()
+    page_ms = []
+    for dev in devices:
+        t0 = time.perf_counter()
+        for _, obj in conn.execute(sql, (dev, page_rows)):
+            if obj:
+                json.loads(obj)
+        page_ms.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    n = 0
+    for (obj,) in conn.execute("SELECT object_json FROM uplinks LIMIT ?", (scan_rows,)):
+        if obj:
+            json.loads(obj)
+        n += 1
+    scan_sec = time.perf_counter() - t0
+    # Ingest: re-insert recent rows under new event ids (encoded when the DB has dictionaries)
+    conn.row_factory = sqlite3.Row
+    rows = [dict(r) for r in conn.execute(
+        f"SELECT {', '.join(INSERT_COLUMNS)} FROM uplinks ORDER BY time DESC LIMIT ?", (ingest_rows,)
+    )]
+    for r in rows:
+        r["event_id"] = "bench-" + r["event_id"]
+    conn.close()
+    conn = sqlite3.connect(path)  # writers see the table, not the decoding view
+    t0 = time.perf_counter()
+    conn.execute("BEGIN")
+    insert_rows(conn, rows)
+    ingest_sec = time.perf_counter() - t0
+    conn.rollback()
+    conn.close()
+    return {
+        "page_rows": page_rows,
+        "page_ms_p50": round(_pct(page_ms, 50), 2),
+        "page_ms_p95": round(_pct(page_ms, 95), 2),
+        "scan_rows": n,
+        "scan_sec": round(scan_sec, 3),
+        "scan_us_per_row": round(scan_sec / max(n, 1) * 1e6, 2),
+        "ingest_rows": len(rows),
+        "ingest_us_per_row": round(ingest_sec / max(len(rows), 1) * 1e6, 2),
+    }
+
+
+def bench(db_path: Path, work_dir: Path | None = None, devices: int = 50, page_rows: int = 1000,
+          scan_rows: int = 1_000_000, ingest_rows: int = 20_000, sample: int = SAMPLE_ROWS, seed: int = 0) -> dict:
+    """Plain vs encoded copy of db_path: file size, payload bytes and read/ingest latency."""
+    work = Path(tempfile.mkdtemp(prefix="payload-bench-", dir=work_dir or db_path.parent))
+    try:
+        plain = work / "plain.db"
+        packed = work / "packed.db"
+        _copy(db_path, plain)
+        conn = sqlite3.connect(plain)
+        if has_dictionaries(conn):  # the source is already encoded: bench from text
+            decompress(conn)
+            conn.execute("DROP TABLE payload_dicts")
+            conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        _copy(plain, packed)
+        conn = sqlite3.connect(packed)
+        t0 = time.perf_counter()
+        train(conn, sample)
+        conn.commit()
+        train_sec = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        encoded = compress(conn)
+        compress_sec = time.perf_counter() - t0
+        conn.execute("VACUUM")
+        payload = status(conn)
+        rows = conn.execute("SELECT COUNT(*) FROM uplinks").fetchone()[0]
+        devs = [r[0] for r in conn.execute("SELECT DISTINCT dev_eui FROM uplinks")]
+        conn.close()
+        devs = random.Random(seed).sample(devs, min(devices, len(devs)))
+        result = {
+            "db": str(db_path),
+            "rows": rows,
+            "encoded_rows": encoded,
+            "train_sec": round(train_sec, 2),
+            "compress_sec": round(compress_sec, 2),
+            "payload_plain_bytes": payload["plain_bytes"],
+            "payload_stored_bytes": payload["stored_bytes"],
+            "payload_ratio": payload["ratio"],
+        }
+        for name, path in (("plain", plain), ("encoded", packed)):
+            result[name] = {"file_bytes": path.stat().st_size, **_measure(path, devs, page_rows, scan_rows, ingest_rows)}
+        result["file_ratio"] = round(result["encoded"]["file_bytes"] / result["plain"]["file_bytes"], 3)
+        return result
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="add a dictionary per device profile")
+    p_train.add_argument("--sample", type=int, default=SAMPLE_ROWS, help="newest payloads per profile")
+    p_train.add_argument("--profile", action="append", help="only this profile (repeatable)")
+    for name, text in (("compress", "encode text payloads in place"), ("decompress", "turn encoded payloads back into text")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to return freed pages to the OS")
+    p_status = sub.add_parser("status", help="encoded rows and bytes per profile")
+    p_status.add_argument("--json", action="store_true")
+    p_bench = sub.add_parser("bench", help="size and latency of a plain vs encoded copy of --db")
+    p_bench.add_argument("--devices", type=int, default=50, help="devices sampled for page reads")
+    p_bench.add_argument("--page-rows", type=int, default=1000)
+    p_bench.add_argument("--scan-rows", type=int, default=1_000_000)
+    p_bench.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    if not args.db.is_file():
+        print("DB not found:", args.db, file=sys.stderr)
+        return 1
+
+    if args.command == "bench":
+        r = bench(args.db, devices=args.devices, page_rows=args.page_rows, scan_rows=args.scan_rows)
+        if args.json:
+            print(json.dumps(r, indent=2))
+            return 0
+        print(f"{r['db']}: {r['rows']} rows, {r['encoded_rows']} encoded "
+              f"(train {r['train_sec']}s, compress {r['compress_sec']}s)")
+        print(f"object_json: {r['payload_plain_bytes']} -> {r['payload_stored_bytes']} bytes ({r['payload_ratio']:.1%} of plain)")
+        print(f"{'':8} {'file MB':>9} {'page p50/p95 ms':>16} {'scan us/row':>12} {'ingest us/row':>14}")
+        for name in ("plain", "encoded"):
+            m = r[name]
+            print(f"{name:8} {m['file_bytes'] / 1e6:9.1f} {m['page_ms_p50']:>7} / {m['page_ms_p95']:<6} "
+                  f"{m['scan_us_per_row']:12} {m['ingest_us_per_row']:14}")
+        return 0
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.command == "train":
+            trained = train(conn, args.sample, args.profile)
+            conn.commit()
+            for profile, n in trained.items():
+                print(f"{profile}: dictionary from {n} payloads")
+            return 0
+        if args.command in ("compress", "decompress"):
+            t0 = time.perf_counter()
+            n = (compress if args.command == "compress" else decompress)(conn)
+            print(f"{args.command.capitalize()}ed {n} payloads in {time.perf_counter() - t0:.1f}s")
+            if args.vacuum:
+                conn.execute("VACUUM")
+            if args.command == "compress" and not has_dictionaries(conn):
+                print("No dictionaries: run train first", file=sys.stderr)
+            return 0
+        s = status(conn)
+        if args.json:
+            print(json.dumps(s, indent=2))
+            return 0
+        print(f"object_json: {s['stored_bytes']} stored / {s['plain_bytes']} plain bytes"
+              + (f" ({s['ratio']})" if s["ratio"] is not None else ""))
+        print(f"{'profile':28} {'rows':>9} {'encoded':>9} {'stored':>11} {'plain':>11} {'dictionary':>10}")
+        for p in s["profiles"]:
+            print(f"{str(p['profile'])[:28]:28} {p['rows']:9} {p['encoded_rows']:9} {p['stored_bytes']:11} "
+                  f"{p['plain_bytes']:11} {p['dictionary'] or '-':>10}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+On-demand per-request profiling for scripts/api.py.
+
+Enabled only when API_ADMIN_TOKEN is set in the environment; otherwise the middleware is
+not installed at all. A request opts in with `?_profile=table|collapsed` (or `1` = table)
+or an `X-Profile` header (`0`/`false`/`off` = not profiled; anything else is a 400), and must carry `X-Admin-Token: <API_ADMIN_TOKEN>`. The request
+runs normally while a sampler thread snapshots Python stacks every SAMPLE_INTERVAL_SEC;
+the response body is replaced by the profile:
+
+- table: functions sorted by inclusive samples, with self samples (text/plain)
+- collapsed: one `frame;frame;...;leaf count` line per stack, for flamegraph.pl / speedscope
+
+Only stacks that pass through this repo's scripts/ are counted, so idle event-loop and
+worker threads drop out; work from other requests running concurrently through the same
+code can still appear.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import JSONResponse, PlainTextResponse
+
+ADMIN_TOKEN = os.environ.get("API_ADMIN_TOKEN", "")
+SAMPLE_INTERVAL_SEC = 0.001
+SCRIPTS_DIR = str(Path(__file__).resolve().parent)
+FORMATS = {"1": "table", "true": "table", "on": "table", "table": "table", "collapsed": "collapsed"}
+# Values that leave profiling off, as if the parameter were absent
+DISABLED = {"", "0", "false", "off", "no"}
+# Rows in the table output
+TABLE_ROWS = 60
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Background thread collecting collapsed stacks (root first) of every other thread."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SEC):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                codes = []
+                ours = False
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    ours = ours or frame.f_code.co_filename.startswith(SCRIPTS_DIR)
+                    frame = frame.f_back
+                if ours:
+                    self.stacks[tuple(reversed(codes))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        lines = [";".join(_frame_label(c) for c in stack) + f" {n}" for stack, n in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def table(self) -> str:
+        total = Counter()
+        own = Counter()
+        for stack, n in self.stacks.items():
+            for code in set(stack):
+                total[code] += n
+            own[stack[-1]] += n
+        hits = sum(self.stacks.values()) or 1
+        lines = [f"{'total':>7} {'total%':>7} {'self':>7} {'self%':>7}  function"]
+        for code, n in total.most_common(TABLE_ROWS):
+            lines.append(f"{n:7d} {100 * n / hits:6.1f}% {own[code]:7d} {100 * own[code] / hits:6.1f}%  {_frame_label(code)}")
+        return "\n".join(lines) + "\n"
+
+
+def _parse_format(value: str) -> str | None:
+    value = value.strip().lower()
+    if value in DISABLED:
+        return None
+    if value not in FORMATS:
+        raise ValueError(f"Unknown profile format {value!r}; use one of {', '.join(sorted(FORMATS))} or 0/false/off")
+    return FORMATS[value]
+
+
+def _requested_format(scope) -> str | None:
+    """Profile format the request asks for, None when it doesn't; ValueError on an unknown value."""
+    if b"_profile" in scope["query_string"]:
+        value = QueryParams(scope["query_string"]).get("_profile")
+        if value is not None:
+            return _parse_format(value)
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return _parse_format(value.decode("latin-1"))
+    return None
+
+
+class ProfileMiddleware:
+    """Replace the response with a sampled profile when an admin asks for one."""
+
+    def __init__(self, app, token: str = ADMIN_TOKEN):
+        self.app = app
+        self.token = token
+
+    async def __call__(self, scope, receive, send):
+        try:
+            fmt = _requested_format(scope) if scope["type"] == "http" else None
+        except ValueError as e:
+            await JSONResponse(status_code=400, content={"error": str(e)})(scope, receive, send)
+            return
+        if fmt is None:
+            await self.app(scope, receive, send)
+            return
+        given = Headers(scope=scope).get("x-admin-token", "")
+        if not self.token or not hmac.compare_digest(given.encode(), self.token.encode()):
+            response = JSONResponse(status_code=403, content={"error": "Profiling requires a valid X-Admin-Token"})
+            await response(scope, receive, send)
+            return
+
+        status = 0
+        body_bytes = 0
+
+        async def discard(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+
+        t0 = time.perf_counter()
+        with Sampler() as sampler:
+            await self.app(scope, receive, discard)
+        wall_ms = (time.perf_counter() - t0) * 1000
+        report = sampler.collapsed() if fmt == "collapsed" else (
+            f"# {scope['method']} {scope['path']}  status {status}  {wall_ms:.1f} ms  "
+            f"{sampler.samples} samples @ {SAMPLE_INTERVAL_SEC * 1000:g} ms  {body_bytes} body bytes\n"
+            + sampler.table()
+        )
+        headers = {
+            "X-Profiled-Status": str(status),
+            "X-Profile-Wall-Ms": f"{wall_ms:.1f}",
+            "X-Profile-Samples": str(sampler.samples),
+            "Cache-Control": "no-store",
+        }
+        if fmt == "collapsed":
+            headers["Content-Disposition"] = "attachment; filename=profile.collapsed.txt"
+        await PlainTextResponse(report, headers=headers)(scope, receive, send)
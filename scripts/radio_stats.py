@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+RSSI/SNR distributions per gateway, device, spreading factor and frequency, from daily summaries.
+
+rssi, snr and margin are stored per uplink (from the first rxInfo entry, so the receiving
+gateway is the first of gateway_ids). Answering "how good are this gateway's links" from raw
+events means shipping every event; this keeps daily summaries instead, in their own SQLite
+file (data/cache/radio_stats.db):
+
+- radio_daily (dim, key, day): uplinks, count/sum/sum of squares/min/max of rssi and snr,
+  margin count/sum, and `weak` (rssi < WEAK_RSSI), for dim in gateway, device, sf, frequency
+- radio_hist (dim, key, day, metric, bin): counts in RSSI_BIN_DB / SNR_BIN_DB wide bins
+  (sparse: only bins that occur)
+- radio_devices: latest name/profile per device, for labels
+
+refresh() (scripts/incremental.py: watermark, replay queue, locking) loads the uplinks after
+the watermark into a temp table and aggregates them with a GROUP BY per dimension inside
+SQLite, upserting into the daily tables. Rows written at or before the watermark (late or
+re-sent) queue their day via on_write() and the day is recomputed on the next refresh.
+report() sums whole days with SQL over the summaries: a year of a 1000-device fleet is
+~400k daily rows, however many uplinks it took.
+
+Percentiles are interpolated within histogram bins (exact to the bin width).
+
+Run:
+  python scripts/radio_stats.py update             # aggregate new uplinks (first run: backfill)
+  python scripts/radio_stats.py rebuild
+  python scripts/radio_stats.py report [--by gateway|device|sf|frequency] [--from DAY] [--to DAY]
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine, day_key
+    from scripts import partitions
+except ImportError:  # run as python scripts/radio_stats.py
+    from incremental import IncrementalEngine, day_key
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "radio_stats.db"
+DIMENSIONS = ("gateway", "device", "sf", "frequency")
+BUCKETS = ("day", "week", "month")
+RSSI_BIN_DB = 2
+SNR_BIN_DB = 1
+# Same threshold as the Map view's weak links
+WEAK_RSSI = -100
+PERCENTILES = (10, 50, 90)
+# Uplink rows read per fetchmany while loading a batch
+FETCH_ROWS = 50_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS radio_daily (
+    dim TEXT NOT NULL,
+    key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    uplinks INTEGER NOT NULL DEFAULT 0,
+    rssi_n INTEGER NOT NULL DEFAULT 0,
+    rssi_sum REAL NOT NULL DEFAULT 0,
+    rssi_sumsq REAL NOT NULL DEFAULT 0,
+    rssi_min REAL,
+    rssi_max REAL,
+    snr_n INTEGER NOT NULL DEFAULT 0,
+    snr_sum REAL NOT NULL DEFAULT 0,
+    snr_sumsq REAL NOT NULL DEFAULT 0,
+    snr_min REAL,
+    snr_max REAL,
+    margin_n INTEGER NOT NULL DEFAULT 0,
+    margin_sum REAL NOT NULL DEFAULT 0,
+    weak INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dim, key, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS radio_hist (
+    dim TEXT NOT NULL,
+    key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bin INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (dim, key, day, metric, bin)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS radio_devices (dev_eui TEXT PRIMARY KEY, device_name TEXT, profile TEXT);
+CREATE TABLE IF NOT EXISTS radio_replay (day TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS radio_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT substr(time, 1, 10), dev_eui, gateway_ids, spreading_factor, frequency, rssi, snr, margin,
+           device_name, device_profile_name
+    FROM uplinks
+    WHERE {where}
+"""
+
+# SQL key expression per dimension over temp.radio_batch
+_DIM_KEYS = {"gateway": "gateway", "device": "dev_eui", "sf": "CAST(sf AS TEXT)", "frequency": "CAST(freq AS TEXT)"}
+# Bins are floor(value / width); the +1000 offset makes CAST (truncation) a floor for negative readings
+_BINS = {
+    "rssi": f"CAST((rssi + 1000) / {RSSI_BIN_DB} AS INTEGER) - 1000 / {RSSI_BIN_DB}",
+    "snr": f"CAST((snr + 1000) / {SNR_BIN_DB} AS INTEGER) - 1000 / {SNR_BIN_DB}",
+}
+
+_UPSERT_DAILY = """
+    INSERT INTO radio_daily
+    SELECT '{dim}', {key}, day, COUNT(*), COUNT(rssi), TOTAL(rssi), TOTAL(rssi * rssi), MIN(rssi), MAX(rssi),
+           COUNT(snr), TOTAL(snr), TOTAL(snr * snr), MIN(snr), MAX(snr), COUNT(margin), TOTAL(margin),
+           TOTAL(rssi < {weak})
+    FROM temp.radio_batch WHERE {key} IS NOT NULL
+    GROUP BY 2, 3
+    ON CONFLICT(dim, key, day) DO UPDATE SET
+        uplinks = uplinks + excluded.uplinks,
+        rssi_n = rssi_n + excluded.rssi_n, rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_sumsq = rssi_sumsq + excluded.rssi_sumsq,
+        rssi_min = MIN(COALESCE(rssi_min, excluded.rssi_min), COALESCE(excluded.rssi_min, rssi_min)),
+        rssi_max = MAX(COALESCE(rssi_max, excluded.rssi_max), COALESCE(excluded.rssi_max, rssi_max)),
+        snr_n = snr_n + excluded.snr_n, snr_sum = snr_sum + excluded.snr_sum,
+        snr_sumsq = snr_sumsq + excluded.snr_sumsq,
+        snr_min = MIN(COALESCE(snr_min, excluded.snr_min), COALESCE(excluded.snr_min, snr_min)),
+        snr_max = MAX(COALESCE(snr_max, excluded.snr_max), COALESCE(excluded.snr_max, snr_max)),
+        margin_n = margin_n + excluded.margin_n, margin_sum = margin_sum + excluded.margin_sum,
+        weak = weak + excluded.weak
+"""
+
+_UPSERT_HIST = """
+    INSERT INTO radio_hist
+    SELECT '{dim}', {key}, day, '{metric}', {bin}, COUNT(*)
+    FROM temp.radio_batch WHERE {key} IS NOT NULL AND {metric} IS NOT NULL
+    GROUP BY 2, 3, 5
+    ON CONFLICT(dim, key, day, metric, bin) DO UPDATE SET n = n + excluded.n
+"""
+
+
+def _bucket_sql(bucket: str) -> str:
+    if bucket == "week":
+        return "date(day, '-6 days', 'weekday 1')"  # Monday of the ISO week
+    if bucket == "month":
+        return "substr(day, 1, 7) || '-01'"
+    return "day"
+
+
+def _percentile(hist: list[tuple[int, int]], width: float, q: float) -> float | None:
+    """q-th percentile of sorted (bin, count) pairs, linear within the bin."""
+    total = sum(n for _, n in hist)
+    if not total:
+        return None
+    target = total * q / 100
+    seen = 0
+    for b, n in hist:
+        if seen + n >= target:
+            return round((b + (target - seen) / n) * width, 2)
+        seen += n
+    return round((hist[-1][0] + 1) * width, 2)
+
+
+def _moments(n, total, sumsq, lo, hi) -> dict:
+    if not n:
+        return {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+    mean = total / n
+    return {
+        "count": n,
+        "mean": round(mean, 2),
+        "std": round(math.sqrt(max(sumsq / n - mean * mean, 0.0)), 2),
+        "min": lo,
+        "max": hi,
+    }
+
+
+class RadioStats(IncrementalEngine):
+    """Incrementally maintained daily RSSI/SNR summaries in a SQLite file next to the uplinks."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "radio"
+    TABLES = ("radio_daily", "radio_hist", "radio_devices", "radio_replay", "radio_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH):
+        super().__init__(path)
+
+    def _clear_day(self, state, day: str) -> None:
+        state.execute("DELETE FROM radio_daily WHERE day = ?", (day,))
+        state.execute("DELETE FROM radio_hist WHERE day = ?", (day,))
+
+    def _fold(self, state, cur, replay: bool = False) -> int:
+        """Load uplink rows into temp.radio_batch and aggregate them into every dimension in SQL."""
+        first_gateway: dict[str, str | None] = {}
+
+        def gateway_of(gids):
+            gw = first_gateway.get(gids, False)
+            if gw is False:
+                try:
+                    ids = json.loads(gids) if gids else []
+                except (json.JSONDecodeError, TypeError):
+                    ids = []
+                gw = first_gateway[gids] = ids[0] if isinstance(ids, list) and ids and isinstance(ids[0], str) else None
+            return gw
+
+        state.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS radio_batch"
+            " (day, dev_eui, gateway, sf, freq, rssi, snr, margin, device_name, profile)"
+        )
+        state.execute("DELETE FROM temp.radio_batch")
+        n = 0
+        while True:
+            batch = cur.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            state.executemany(
+                "INSERT INTO temp.radio_batch VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(day, dev, gateway_of(gids), *rest) for day, dev, gids, *rest in batch],
+            )
+            n += len(batch)
+        if not n:
+            return 0
+        for dim, key in _DIM_KEYS.items():
+            state.execute(_UPSERT_DAILY.format(dim=dim, key=key, weak=WEAK_RSSI))
+            for metric, bin_sql in _BINS.items():
+                state.execute(_UPSERT_HIST.format(dim=dim, key=key, metric=metric, bin=bin_sql))
+        state.execute(
+            """
+            INSERT OR REPLACE INTO radio_devices
+            SELECT dev_eui, device_name, profile FROM temp.radio_batch
+            WHERE rowid IN (SELECT MAX(rowid) FROM temp.radio_batch GROUP BY dev_eui)
+            """
+        )
+        state.execute("DELETE FROM temp.radio_batch")
+        return n
+
+    def report(
+        self,
+        group_by: str = "gateway",
+        from_day: str | None = None,
+        to_day: str | None = None,
+        key: str | None = None,
+        bucket: str = "day",
+        limit: int = 100,
+    ) -> dict:
+        """Per group (most uplinks first): RSSI/SNR moments, percentiles, histogram, weak share and trend."""
+        if group_by not in DIMENSIONS:
+            raise ValueError(f"group_by must be one of {', '.join(DIMENSIONS)}")
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        lo = day_key(from_day) if from_day else ""
+        hi = day_key(to_day) if to_day else "~"
+        where, args = "dim = ? AND day >= ? AND day <= ?", [group_by, lo, hi]
+        if key is not None:
+            where += " AND key = ?"
+            args.append(key)
+        state = self._open()
+        try:
+            groups = state.execute(
+                f"""
+                SELECT key, SUM(uplinks), SUM(rssi_n), SUM(rssi_sum), SUM(rssi_sumsq), MIN(rssi_min), MAX(rssi_max),
+                       SUM(snr_n), SUM(snr_sum), SUM(snr_sumsq), MIN(snr_min), MAX(snr_max),
+                       SUM(margin_n), SUM(margin_sum), SUM(weak), MIN(day), MAX(day)
+                FROM radio_daily WHERE {where}
+                GROUP BY key ORDER BY SUM(uplinks) DESC, key LIMIT ?
+                """,
+                args + [limit],
+            ).fetchall()
+            keys = [g[0] for g in groups]
+            hists: dict[tuple, list] = {}
+            trends: dict[str, list] = {}
+            labels = {}
+            if keys:
+                # Chunks keep the IN list under SQLite's bound-parameter limit
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    in_sql = f" AND key IN ({', '.join('?' for _ in chunk)})"
+                    for k, metric, b, n in state.execute(
+                        f"SELECT key, metric, bin, SUM(n) FROM radio_hist WHERE {where}{in_sql}"
+                        " GROUP BY key, metric, bin ORDER BY key, metric, bin",
+                        args + chunk,
+                    ):
+                        hists.setdefault((k, metric), []).append((b, n))
+                    for k, b, uplinks, rssi_n, rssi_sum, snr_n, snr_sum, weak in state.execute(
+                        f"""
+                        SELECT key, {_bucket_sql(bucket)} AS b, SUM(uplinks), SUM(rssi_n), SUM(rssi_sum),
+                               SUM(snr_n), SUM(snr_sum), SUM(weak)
+                        FROM radio_daily WHERE {where}{in_sql}
+                        GROUP BY key, b ORDER BY key, b
+                        """,
+                        args + chunk,
+                    ):
+                        trends.setdefault(k, []).append({
+                            "bucket": b,
+                            "uplinks": uplinks,
+                            "rssi_mean": round(rssi_sum / rssi_n, 2) if rssi_n else None,
+                            "snr_mean": round(snr_sum / snr_n, 2) if snr_n else None,
+                            "weak": weak,
+                        })
+                    if group_by == "device":
+                        for dev, name, profile in state.execute(
+                            f"SELECT dev_eui, device_name, profile FROM radio_devices WHERE dev_eui IN ({', '.join('?' for _ in chunk)})",
+                            chunk,
+                        ):
+                            labels[dev] = {"device_name": name, "profile": profile}
+            mark = self.watermark(state)
+        finally:
+            state.close()
+
+        out = []
+        for (k, uplinks, rssi_n, rssi_sum, rssi_sq, rssi_min, rssi_max, snr_n, snr_sum, snr_sq, snr_min, snr_max,
+             margin_n, margin_sum, weak, first_day, last_day) in groups:
+            metrics = {}
+            for metric, width, m in (
+                ("rssi", RSSI_BIN_DB, _moments(rssi_n, rssi_sum, rssi_sq, rssi_min, rssi_max)),
+                ("snr", SNR_BIN_DB, _moments(snr_n, snr_sum, snr_sq, snr_min, snr_max)),
+            ):
+                h = hists.get((k, metric), [])
+                for q in PERCENTILES:
+                    p = _percentile(h, width, q)
+                    # Interpolation within the edge bins can overshoot the observed range
+                    m[f"p{q}"] = p if p is None else min(max(p, m["min"]), m["max"])
+                m["histogram"] = [[b * width, n] for b, n in h]
+                metrics[metric] = m
+            out.append({
+                "key": k,
+                **labels.get(k, {}),
+                "uplinks": uplinks,
+                "from": first_day,
+                "to": last_day,
+                "rssi": metrics["rssi"],
+                "snr": metrics["snr"],
+                "margin_mean": round(margin_sum / margin_n, 2) if margin_n else None,
+                "weak": weak,
+                "weak_pct": round(100 * weak / rssi_n, 2) if rssi_n else None,
+                "trend": trends.get(k, []),
+            })
+        return {
+            "group_by": group_by,
+            "from": lo or None,
+            "to": None if hi == "~" else hi,
+            "bucket": bucket,
+            "bins": {"rssi_db": RSSI_BIN_DB, "snr_db": SNR_BIN_DB},
+            "weak_rssi": WEAK_RSSI,
+            "processed_through": mark[0] if mark else None,
+            "groups": out,
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="summary DB (default data/cache/radio_stats.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="aggregate uplinks after the watermark")
+    sub.add_parser("rebuild", help="drop the summaries and backfill from all uplinks")
+    p_report = sub.add_parser("report", help="distribution per group")
+    p_report.add_argument("--by", choices=DIMENSIONS, default="gateway")
+    p_report.add_argument("--from", dest="from_day")
+    p_report.add_argument("--to", dest="to_day")
+    p_report.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    stats = RadioStats(args.state)
+    if args.command in ("update", "rebuild"):
+        t0 = time.perf_counter()
+        n = (stats.rebuild if args.command == "rebuild" else stats.catch_up)(connect)
+        print(f"Aggregated {n} uplinks in {time.perf_counter() - t0:.1f}s:", args.state)
+        return 0
+    stats.catch_up(connect)
+    report = stats.report(args.by, args.from_day, args.to_day)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{'key':24} {'uplinks':>8} {'rssi p10/p50/p90':>22} {'snr p10/p50/p90':>20} {'weak %':>7}")
+    for g in report["groups"]:
+        r, s = g["rssi"], g["snr"]
+        print(f"{g['key'][:24]:24} {g['uplinks']:8} {str(r['p10']) + ' / ' + str(r['p50']) + ' / ' + str(r['p90']):>22} "
+              f"{str(s['p10']) + ' / ' + str(s['p50']) + ' / ' + str(s['p90']):>20} {g['weak_pct'] if g['weak_pct'] is not None else '-':>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Read replica: consistent snapshots of data/uplinks.db so dashboard reads never wait on writers.
+
+The primary stays in rollback-journal mode and keeps every writer (ingest.py,
+append_synthetic_live.py, POST /api/ingest). Every PUBLISH_INTERVAL_SEC, when the primary
+file has changed, the publisher copies it with SQLite's online backup API (one step, so
+the copy is a single consistent read transaction) into data/replica/uplinks.db.tmp and
+os.replace()s it over data/replica/uplinks.db. snapshot.json records the generation,
+`as_of` (taken before the read lock, so every commit before it is in the snapshot) and
+the primary's (mtime, size) stamp.
+
+Readers open the snapshot with immutable=1: SQLite takes no locks and never checks for
+changes, which is safe because a published file is never modified, only replaced. A
+connection opened before a swap keeps reading the old inode to the end of its request.
+
+status() reports staleness: `age_sec` since the snapshot was taken and `lag_sec`, which is
+0 while the primary is unchanged since then. Only one process publishes (an flock on
+data/replica/publisher.lock); every API worker runs the same thread and takes over when
+the publisher exits.
+
+Run:
+  python scripts/read_replica.py              # publish every PUBLISH_INTERVAL_SEC until Ctrl-C
+  python scripts/read_replica.py --once
+  python scripts/read_replica.py --status
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process publisher lock, run a single worker
+    fcntl = None
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+REPLICA_DIR = APP_ROOT / "data" / "replica"
+# Seconds between checks of the primary (a snapshot is only copied when it changed)
+PUBLISH_INTERVAL_SEC = float(os.environ.get("READ_REPLICA_INTERVAL", "5"))
+
+
+def _stamp(path: Path) -> list | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class ReadReplica:
+    """Publishes snapshots of a primary DB file and opens read connections to the latest one."""
+
+    def __init__(self, primary: Path = DB_PATH, root: Path = REPLICA_DIR):
+        self.primary = Path(primary)
+        self.root = Path(root)
+        self.snapshot = self.root / "uplinks.db"
+        self.meta_path = self.root / "snapshot.json"
+        self._meta = (None, None)  # (meta file stamp, parsed)
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._pending: list[tuple[float, object]] = []  # (written_at, callback)
+
+    def meta(self) -> dict | None:
+        """Parsed snapshot.json, re-read only when the file changes."""
+        stamp = _stamp(self.meta_path)
+        if stamp is None:
+            return None
+        if self._meta[0] != stamp:
+            try:
+                self._meta = (stamp, json.loads(self.meta_path.read_text()))
+            except (OSError, ValueError):
+                return None
+        return self._meta[1]
+
+    def available(self) -> bool:
+        return self.meta() is not None and self.snapshot.is_file()
+
+    def connect(self, factory=sqlite3.Connection) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.snapshot}?immutable=1", uri=True, factory=factory)
+
+    def publish(self, force: bool = False) -> dict | None:
+        """Copy the primary into a new snapshot if it changed; returns the new meta or None."""
+        with self._lock:
+            meta = self.meta()
+            stamp = _stamp(self.primary)
+            if stamp is None or (not force and meta and meta["primary_stamp"] == stamp and self.snapshot.is_file()):
+                return None
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.snapshot.with_suffix(".db.tmp")
+            tmp.unlink(missing_ok=True)
+            as_of = time.time()
+            t0 = time.perf_counter()
+            src = sqlite3.connect(f"file:{self.primary}?mode=ro", uri=True, timeout=30)
+            dst = sqlite3.connect(tmp)
+            try:
+                src.backup(dst)  # pages=-1: one step, one consistent read transaction
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp, self.snapshot)
+            new = {
+                "generation": (meta["generation"] if meta else 0) + 1,
+                "as_of": as_of,
+                "published_at": time.time(),
+                "copy_sec": round(time.perf_counter() - t0, 3),
+                "bytes": self.snapshot.stat().st_size,
+                "primary_stamp": stamp,
+            }
+            tmp_meta = self.meta_path.with_suffix(".json.tmp")
+            tmp_meta.write_text(json.dumps(new))
+            os.replace(tmp_meta, self.meta_path)
+            return new
+
+    def status(self) -> dict:
+        meta = self.meta()
+        if meta is None:
+            return {"enabled": True, "available": False}
+        now = time.time()
+        behind = _stamp(self.primary) != meta["primary_stamp"]
+        return {
+            "enabled": True,
+            "available": self.snapshot.is_file(),
+            "generation": meta["generation"],
+            "as_of": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(meta["as_of"])),
+            "age_sec": round(now - meta["as_of"], 3),
+            "lag_sec": round(now - meta["as_of"], 3) if behind else 0.0,
+            "behind": behind,
+            "copy_sec": meta["copy_sec"],
+            "bytes": meta["bytes"],
+        }
+
+    def after_publish(self, written_at: float, callback) -> None:
+        """Run callback in this process once a snapshot taken after written_at is live."""
+        with self._lock:
+            self._pending.append((written_at, callback))
+
+    def run_due(self) -> None:
+        meta = self.meta()
+        if meta is None or not self._pending:
+            return
+        with self._lock:
+            due = [cb for t, cb in self._pending if t < meta["as_of"]]
+            self._pending = [(t, cb) for t, cb in self._pending if t >= meta["as_of"]]
+        for callback in due:
+            callback()
+
+    def acquire_publisher(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            f = open(self.root / "publisher.lock", "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            self._lock_file = f  # held until the process exits
+        return True
+
+    def start(self, interval_sec: float = PUBLISH_INTERVAL_SEC) -> threading.Event:
+        """Daemon thread: publish (if this process holds the publisher lock) and run due callbacks."""
+        stop = threading.Event()
+
+        def run():
+            while True:
+                try:
+                    if self.acquire_publisher():
+                        self.publish()
+                    self.run_due()
+                except (sqlite3.Error, OSError) as e:
+                    print("Replica publish failed:", e, file=sys.stderr)
+                if stop.wait(interval_sec):
+                    break
+
+        threading.Thread(target=run, name="read-replica", daemon=True).start()
+        return stop
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--dir", type=Path, default=REPLICA_DIR, help="snapshot directory (default data/replica)")
+    parser.add_argument("--interval", type=float, default=PUBLISH_INTERVAL_SEC)
+    parser.add_argument("--once", action="store_true", help="publish one snapshot now and exit")
+    parser.add_argument("--status", action="store_true", help="print snapshot staleness and exit")
+    args = parser.parse_args()
+    replica = ReadReplica(args.db, args.dir)
+    if args.status:
+        print(json.dumps(replica.status() if replica.meta() else {"available": False}, indent=2))
+        return 0
+    if not args.db.is_file():
+        print("DB not found:", args.db, file=sys.stderr)
+        return 1
+    if args.once:
+        meta = replica.publish(force=True)
+        print(f"Snapshot {meta['generation']}: {meta['bytes']} bytes in {meta['copy_sec']}s ->", replica.snapshot)
+        return 0
+    if not replica.acquire_publisher():
+        print("Another process is publishing", args.dir, file=sys.stderr)
+        return 1
+    print(f"Publishing {args.db} -> {replica.snapshot} every {args.interval:g}s (Ctrl-C to stop)")
+    try:
+        while True:
+            meta = replica.publish()
+            if meta:
+                print(f"Snapshot {meta['generation']}: {meta['copy_sec']}s")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
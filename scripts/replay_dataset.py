@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Accelerated replay of the real dataset/ uplinks as a live feed.
+
+Every device directory (dataset/<DeviceType>/<devEui>/*.json) is one time-ordered stream;
+heapq.merge() interleaves them by original `time` with a heap of one head per device, and
+each event's JSON is parsed only when it is emitted. File names are not in time order, so
+a device stream is a sorted (time, file) index built from the first HEAD_BYTES of each
+file; no payload is held in memory.
+
+Event i is emitted at start + (time_i - time_0) / speed and re-stamped with that wall-clock
+time, so at --speed 1000 the two weeks of the shipped dataset play in about 20 minutes and
+land in the DB as if they had just arrived. Each replayed event gets a new deduplicationId
+(the originals are left alone) and is written with synthetic=1, in batches, straight into
+data/uplinks.db (data/partitions/ once split) or through POST /api/ingest, like
+append_synthetic_live.py. Only the
+top-level `time` is rewritten (the one ingest reads); rxInfo nsTime/gwTime keep their
+original values.
+
+Reports achieved events/s and lag (write completion minus scheduled emission) while it runs.
+
+Run:
+  python scripts/replay_dataset.py --speed 1000
+  API_INGEST_TOKEN=<secret> python scripts/replay_dataset.py --url http://localhost:8000/api/ingest --speed 10000 --batch 200
+  python scripts/replay_dataset.py --profile SW3L --from 2026-01-20 --duration 60
+
+Stop with Ctrl+C (or --duration).
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import urllib.error
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from scripts.append_synthetic_live import HttpWriter, Stats, open_writer
+    from scripts.ingest import walk_dataset
+except ImportError:  # run as python scripts/replay_dataset.py
+    from append_synthetic_live import HttpWriter, Stats, open_writer
+    from ingest import walk_dataset
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DATASET_ROOT = APP_ROOT / "dataset"
+# Bytes read per file to find the top-level "time" (it is the second key ChirpStack writes)
+HEAD_BYTES = 512
+MAX_SPEED = 10_000
+
+_TIME_KEY = re.compile(rb'"time"\s*:\s*"([^"]+)"')
+
+
+def _epoch(value: str) -> float | None:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def event_time(path: Path) -> float | None:
+    """Original uplink time of one dataset file (epoch seconds), None if it has none."""
+    with open(path, "rb") as f:
+        m = _TIME_KEY.search(f.read(HEAD_BYTES))
+    if m:
+        return _epoch(m.group(1).decode("utf-8", "replace"))
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return _epoch(raw.get("time")) if isinstance(raw, dict) else None
+
+
+def device_stream(paths: list[Path], t_from: float | None, t_to: float | None):
+    """(time, path) of one device's files in time order, within [t_from, t_to)."""
+    events = []
+    for path in paths:
+        t = event_time(path)
+        if t is None or (t_from is not None and t < t_from) or (t_to is not None and t >= t_to):
+            continue
+        events.append((t, str(path)))
+    events.sort()
+    yield from events
+
+
+def merged_events(dataset_root: Path, profiles: list[str] | None = None,
+                  t_from: float | None = None, t_to: float | None = None):
+    """(time, path) of every device's events, merged by time with a heap (heapq.merge)."""
+    by_device: dict[tuple[str, str], list[Path]] = {}
+    for device_type, dev_eui, path in walk_dataset(dataset_root):
+        if profiles and device_type not in profiles:
+            continue
+        by_device.setdefault((device_type, dev_eui), []).append(path)
+    streams = [device_stream(paths, t_from, t_to) for _, paths in sorted(by_device.items())]
+    return heapq.merge(*streams)
+
+
+def restamp(path: str, when: datetime) -> dict | None:
+    """The event in path with `time` set to when and a fresh deduplicationId."""
+    try:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(raw, dict):
+        return None
+    raw["time"] = when.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    raw["deduplicationId"] = str(uuid.uuid4())
+    return raw
+
+
+def _parse_day(value: str | None) -> float | None:
+    if value is None:
+        return None
+    t = _epoch(value if "T" in value else value + "T00:00:00+00:00")
+    if t is None:
+        raise argparse.ArgumentTypeError(f"bad time: {value}")
+    return t
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", type=Path, default=DATASET_ROOT)
+    parser.add_argument("--speed", type=float, default=1000, help=f"time compression, 1 to {MAX_SPEED} (default 1000)")
+    parser.add_argument("--profile", action="append", help="only this device type directory (repeatable)")
+    parser.add_argument("--from", dest="from_time", type=_parse_day, help="skip events before this original time")
+    parser.add_argument("--to", dest="to_time", type=_parse_day, help="stop at this original time")
+    parser.add_argument("--batch", type=int, default=50, help="uplinks per write/commit (default 50)")
+    parser.add_argument("--max-wait-ms", type=float, default=1000, help="flush a partial batch after this long (default 1000)")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds of replay")
+    parser.add_argument("--report-sec", type=float, default=10, help="progress report interval (default 10)")
+    parser.add_argument("--db", type=Path, help="target DB (default data/uplinks.db, or data/partitions/ once split)")
+    parser.add_argument("--url", help="POST batches to this ingest endpoint instead of writing the DB")
+    parser.add_argument("--token", default=os.environ.get("API_INGEST_TOKEN", ""),
+                        help="X-Ingest-Token for --url (default $API_INGEST_TOKEN)")
+    parser.add_argument("--json-out", type=Path, help="write the final summary as JSON")
+    args = parser.parse_args()
+
+    if not 1 <= args.speed <= MAX_SPEED or args.batch <= 0:
+        print(f"--speed must be within 1..{MAX_SPEED} and --batch positive.", file=sys.stderr)
+        return 1
+    if not args.dataset.is_dir():
+        print("Dataset root not found:", args.dataset, file=sys.stderr)
+        return 1
+    if args.url:
+        writer = HttpWriter(args.url, args.token)
+        target = args.url
+    else:
+        writer, target = open_writer(args.db)
+        if writer is None:
+            print("DB not found. Run ingest.py first.", file=sys.stderr)
+            return 1
+
+    t_index = time.perf_counter()
+    events = merged_events(args.dataset, args.profile, args.from_time, args.to_time)
+    first = next(events, None)  # heapq.merge pulls the head of every device stream here
+    if first is None:
+        print("No events to replay.", file=sys.stderr)
+        writer.close()
+        return 1
+    print(f"Indexed dataset in {time.perf_counter() - t_index:.1f}s; replaying from "
+          f"{datetime.fromtimestamp(first[0], timezone.utc):%Y-%m-%d %H:%M:%S} at {args.speed:g}x -> {target}")
+    print("Stop with Ctrl+C.\n")
+
+    t0 = time.perf_counter()
+    wall0 = time.time()
+    origin = first[0]
+    max_wait = args.max_wait_ms / 1000
+    pending: list[tuple[float, dict]] = []  # (scheduled perf_counter, restamped uplink)
+    stats = Stats(np.random.default_rng(0))
+    skipped = 0
+    last_report = t0
+    last_written = 0
+    last_original = origin
+
+    def flush():
+        try:
+            stats.written += writer.write([raw for _, raw in pending])
+        except (sqlite3.Error, urllib.error.URLError, OSError) as e:
+            stats.errors += len(pending)
+            print("Write error:", e, file=sys.stderr)
+        done = time.perf_counter()
+        stats.add([done - due for due, _ in pending])
+        pending.clear()
+
+    def report(now: float) -> None:
+        nonlocal last_report, last_written
+        rate = (stats.written - last_written) / (now - last_report)
+        s = stats.summary(stats.lags)
+        at = datetime.fromtimestamp(last_original, timezone.utc)
+        print(f"  written={stats.written}  rate={rate:.1f}/s  replayed to {at:%Y-%m-%d %H:%M}  "
+              f"lag p50={s['lag_p50_ms']} p99={s['lag_p99_ms']} max={s['lag_max_ms']} ms  errors={stats.errors}")
+        last_report, last_written = now, stats.written
+        stats.lags = []
+
+    try:
+        for original, path in itertools.chain([first], events):
+            due = t0 + (original - origin) / args.speed
+            if args.duration is not None and due - t0 > args.duration:
+                break
+            while True:
+                now = time.perf_counter()
+                if pending and (len(pending) >= args.batch or now - pending[0][0] >= max_wait):
+                    flush()
+                    now = time.perf_counter()
+                if now - last_report >= args.report_sec:
+                    report(now)
+                if due <= now:
+                    break
+                deadline = min(due, pending[0][0] + max_wait) if pending else due
+                time.sleep(max(0.0, min(deadline, last_report + args.report_sec) - now))
+            raw = restamp(path, datetime.fromtimestamp(wall0 + (due - t0), timezone.utc))
+            if raw is None:
+                skipped += 1
+                continue
+            pending.append((due, raw))
+            last_original = original
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        if pending:
+            flush()
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    summary = {
+        "target": target,
+        "speed": args.speed,
+        "replayed_from": datetime.fromtimestamp(origin, timezone.utc).isoformat(),
+        "replayed_to": datetime.fromtimestamp(last_original, timezone.utc).isoformat(),
+        "elapsed_sec": round(elapsed, 2),
+        "written": stats.written,
+        "skipped": skipped,
+        "errors": stats.errors,
+        "achieved_rate": round(stats.written / elapsed, 2) if elapsed else None,
+        **stats.summary(stats.all_lags),
+        "lag_max_ms": round(stats.lag_max * 1000, 2),
+    }
+    print("Summary:", json.dumps(summary))
+    if args.json_out:
+        args.json_out.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
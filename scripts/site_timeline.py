@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Per-gateway timeline pyramid for the Site view: event counts, active devices and RSSI
+min/mean/max per bucket at 1 min, 15 min, 1 h and 1 d.
+
+The Site view used to chart and scrub the raw events a gateway heard, which stops being
+right (and fast) once a site has more history than one request returns. The pyramid lives
+in data/cache/site_timeline.db:
+
+- tl_buckets (gateway, level, t): events, devices, rssi count/sum/min/max, where level is
+  the bucket width in seconds and t the bucket start (Unix seconds, UTC)
+- tl_last (gateway, dev_eui, level): the latest bucket each device was counted in, so a
+  device heard again in the same bucket by a later refresh is not counted twice; devices()
+  reads it as the list of devices a gateway has heard (/api/site/state)
+
+An event counts for every gateway in gateway_ids, with the uplink's rssi, as in /api/site.
+refresh() (scripts/incremental.py: watermark, replay queue, locking) loads the uplinks
+after the watermark into a temp table and upserts every level with one GROUP BY each
+inside SQLite. Rows written at or before the watermark queue their day via on_write(); the
+day's buckets are recomputed on the next refresh.
+
+timeline() picks the finest level with at most `width` buckets in the range (one per
+pixel; 1 d when even that is more) and returns it as dense columns, so a chart of years of
+history is a single primary-key range read of a few hundred rows.
+
+Run:
+  python scripts/site_timeline.py update       # fold new uplinks (first run: backfill)
+  python scripts/site_timeline.py rebuild
+  python scripts/site_timeline.py show --gateway ID [--from T] [--to T] [--width PX]
+"""
+
+import argparse
+import calendar
+import json
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine
+    from scripts import partitions
+except ImportError:  # run as python scripts/site_timeline.py
+    from incremental import IncrementalEngine
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "site_timeline.db"
+# (name, bucket width in seconds), finest first
+LEVELS = (("1m", 60), ("15m", 900), ("1h", 3600), ("1d", 86400))
+# Uplink rows read per fetchmany while loading a batch
+FETCH_ROWS = 50_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tl_buckets (
+    gateway TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    t INTEGER NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    devices INTEGER NOT NULL DEFAULT 0,
+    rssi_n INTEGER NOT NULL DEFAULT 0,
+    rssi_sum REAL NOT NULL DEFAULT 0,
+    rssi_min REAL,
+    rssi_max REAL,
+    PRIMARY KEY (gateway, level, t)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tl_last (
+    gateway TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    t INTEGER NOT NULL,
+    PRIMARY KEY (gateway, dev_eui, level)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tl_replay (day TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS tl_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT CAST(strftime('%s', time) AS INTEGER), dev_eui, gateway_ids, rssi
+    FROM uplinks
+    WHERE {where}
+"""
+
+# {last} is "" when recomputing whole days (their buckets were just deleted)
+_UPSERT_LEVEL = """
+    INSERT INTO tl_buckets
+    SELECT b.gateway, {size}, b.ts / {size} * {size} AS bt, COUNT(*),
+           COUNT(DISTINCT b.dev_eui) - COUNT(DISTINCT {counted}), COUNT(b.rssi), TOTAL(b.rssi), MIN(b.rssi), MAX(b.rssi)
+    FROM temp.tl_batch b {last}
+    WHERE b.ts IS NOT NULL
+    GROUP BY b.gateway, bt
+    ON CONFLICT(gateway, level, t) DO UPDATE SET
+        events = events + excluded.events,
+        devices = devices + excluded.devices,
+        rssi_n = rssi_n + excluded.rssi_n,
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_min = MIN(COALESCE(rssi_min, excluded.rssi_min), COALESCE(excluded.rssi_min, rssi_min)),
+        rssi_max = MAX(COALESCE(rssi_max, excluded.rssi_max), COALESCE(excluded.rssi_max, rssi_max))
+"""
+
+_UPSERT_LAST = """
+    INSERT INTO tl_last
+    SELECT gateway, dev_eui, {size}, MAX(ts) / {size} * {size}
+    FROM temp.tl_batch WHERE ts IS NOT NULL
+    GROUP BY gateway, dev_eui
+    ON CONFLICT(gateway, dev_eui, level) DO UPDATE SET t = MAX(t, excluded.t)
+"""
+
+
+def _iso(ts: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def choose_level(span_sec: float, width: int) -> tuple[str, int]:
+    """Finest level with at most `width` buckets across span_sec; the coarsest when none fits."""
+    for name, size in LEVELS:
+        if span_sec / size <= width:
+            return name, size
+    return LEVELS[-1]
+
+
+class SiteTimeline(IncrementalEngine):
+    """Per-gateway multi-resolution bucket counts, maintained from the uplinks incrementally."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "tl"
+    TABLES = ("tl_buckets", "tl_last", "tl_replay", "tl_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH):
+        super().__init__(path)
+
+    def _clear_day(self, state, day: str) -> None:
+        start = calendar.timegm(date.fromisoformat(day).timetuple())
+        state.execute("DELETE FROM tl_buckets WHERE t >= ? AND t < ?", (start, start + 86400))
+
+    def _fold(self, state, cur, replay: bool = False) -> int:
+        """Load uplink rows (one per receiving gateway) into temp.tl_batch and upsert every level in SQL."""
+        gateways_of: dict[str, list] = {}
+
+        def gateways(gids):
+            ids = gateways_of.get(gids)
+            if ids is None:
+                try:
+                    ids = json.loads(gids) if gids else []
+                except (json.JSONDecodeError, TypeError):
+                    ids = []
+                gateways_of[gids] = ids = [g for g in ids if isinstance(g, str)] if isinstance(ids, list) else []
+            return ids
+
+        state.execute("CREATE TEMP TABLE IF NOT EXISTS tl_batch (gateway, dev_eui, ts, rssi)")
+        state.execute("DELETE FROM temp.tl_batch")
+        n = 0
+        while True:
+            batch = cur.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            state.executemany(
+                "INSERT INTO temp.tl_batch VALUES (?, ?, ?, ?)",
+                [(gw, dev, ts, rssi) for ts, dev, gids, rssi in batch for gw in gateways(gids)],
+            )
+            n += len(batch)
+        if not n:
+            return 0
+        for _, size in LEVELS:
+            if replay:
+                last, counted = "", "NULL"
+            else:
+                # Rows are after the watermark, so a device's previous bucket is at most this one
+                last = f"LEFT JOIN tl_last l ON l.gateway = b.gateway AND l.dev_eui = b.dev_eui AND l.level = {size}"
+                counted = f"CASE WHEN l.t = b.ts / {size} * {size} THEN b.dev_eui END"
+            state.execute(_UPSERT_LEVEL.format(size=size, last=last, counted=counted))
+            state.execute(_UPSERT_LAST.format(size=size))
+        state.execute("DELETE FROM temp.tl_batch")
+        return n
+
+    def devices(self, gateway: str) -> list[str]:
+        """dev_euis the gateway has heard, up to the watermark."""
+        state = self._open()
+        try:
+            rows = state.execute(
+                "SELECT dev_eui FROM tl_last WHERE gateway = ? AND level = ?", (gateway, LEVELS[-1][1])
+            ).fetchall()
+        finally:
+            state.close()
+        return [dev for (dev,) in rows]
+
+    def timeline(self, gateway: str, from_time: str | None = None, to_time: str | None = None, width: int = 800) -> dict:
+        """Dense per-bucket columns for the gateway at the finest level with <= width buckets in [from, to).
+
+        Without from/to the range is the gateway's whole history. Empty buckets have 0 events and
+        null RSSI.
+        """
+        state = self._open()
+        try:
+            lo = hi = None
+            if from_time or to_time:
+                lo, hi = state.execute(
+                    "SELECT CAST(strftime('%s', ?) AS INTEGER), CAST(strftime('%s', ?) AS INTEGER)",
+                    (from_time, to_time),
+                ).fetchone()
+                if (from_time and lo is None) or (to_time and hi is None):
+                    raise ValueError("from/to must be ISO-8601 times")
+            if lo is None or hi is None:
+                first, last = state.execute(
+                    "SELECT MIN(t), MAX(t) FROM tl_buckets WHERE gateway = ? AND level = ?",
+                    (gateway, LEVELS[-1][1]),
+                ).fetchone()
+                if first is None:
+                    first = last = int(time.time()) // 86400 * 86400
+                lo = first if lo is None else lo
+                hi = last + LEVELS[-1][1] if hi is None else hi
+            if hi <= lo:
+                raise ValueError("to must be after from")
+            name, size = choose_level(hi - lo, width)
+            start = lo // size * size
+            rows = state.execute(
+                """
+                SELECT t, events, devices, rssi_n, rssi_sum, rssi_min, rssi_max FROM tl_buckets
+                WHERE gateway = ? AND level = ? AND t >= ? AND t < ? ORDER BY t
+                """,
+                (gateway, size, start, hi),
+            ).fetchall()
+            mark = self.watermark(state)
+        finally:
+            state.close()
+
+        n = (hi - start + size - 1) // size
+        cols = {
+            "time": [_iso(start + i * size) for i in range(n)],
+            "events": [0] * n,
+            "devices": [0] * n,
+            "rssi_min": [None] * n,
+            "rssi_mean": [None] * n,
+            "rssi_max": [None] * n,
+        }
+        for t, events, devices, rssi_n, rssi_sum, rssi_min, rssi_max in rows:
+            i = (t - start) // size
+            cols["events"][i] = events
+            cols["devices"][i] = devices
+            cols["rssi_min"][i] = rssi_min
+            cols["rssi_mean"][i] = round(rssi_sum / rssi_n, 1) if rssi_n else None
+            cols["rssi_max"][i] = rssi_max
+        return {
+            "gateway": gateway,
+            "level": name,
+            "bucket_sec": size,
+            "levels": [lvl for lvl, _ in LEVELS],
+            "from": _iso(start),
+            "to": _iso(hi),
+            "buckets": n,
+            "total_events": sum(cols["events"]),
+            "processed_through": mark[0] if mark else None,
+            **cols,
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="pyramid DB (default data/cache/site_timeline.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="fold uplinks after the watermark")
+    sub.add_parser("rebuild", help="drop the pyramid and rebuild it from all uplinks")
+    p_show = sub.add_parser("show", help="print one gateway's timeline as JSON")
+    p_show.add_argument("--gateway", required=True)
+    p_show.add_argument("--from", dest="from_time")
+    p_show.add_argument("--to", dest="to_time")
+    p_show.add_argument("--width", type=int, default=800)
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    pyramid = SiteTimeline(args.state)
+    if args.command in ("update", "rebuild"):
+        t0 = time.perf_counter()
+        n = (pyramid.rebuild if args.command == "rebuild" else pyramid.catch_up)(connect)
+        print(f"Folded {n} uplinks in {time.perf_counter() - t0:.1f}s:", args.state)
+        return 0
+    pyramid.catch_up(connect)
+    try:
+        print(json.dumps(pyramid.timeline(args.gateway, args.from_time, args.to_time, args.width), indent=2))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
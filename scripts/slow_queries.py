@@ -0,0 +1,123 @@
+"""
+Slow-query log for scripts/api.py.
+
+Every statement that runs through metrics.TimedConnection (named fetches and plain
+execute() calls alike, the latter named `module.keyword`) and takes at least SLOW_QUERY_MS
+(environment variable, default 200) is logged with its normalized SQL, bound parameters,
+duration and row count. Statements are grouped by shape (whitespace
+collapsed, literals replaced by ?); the first time a shape is seen its EXPLAIN QUERY PLAN
+is captured on the same connection. /api/debug/slow-queries lists shapes by total time.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+# Distinct shapes kept; once full, new shapes are counted as dropped
+MAX_SHAPES = 500
+# Bound parameters are shortened in the log and the debug listing
+MAX_PARAM_CHARS = 120
+
+logger = logging.getLogger("lorawan.slow_queries")
+
+_WS = re.compile(r"\s+")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql: str) -> str:
+    """Statement shape: whitespace collapsed, string and numeric literals replaced by ?."""
+    return _LITERAL.sub("?", _WS.sub(" ", sql).strip())
+
+
+def _short_params(params) -> list:
+    out = []
+    for p in params:
+        if isinstance(p, (str, bytes)) and len(p) > MAX_PARAM_CHARS:
+            p = p[:MAX_PARAM_CHARS] + ("..." if isinstance(p, str) else b"...")
+        out.append(p if isinstance(p, (int, float, str)) or p is None else repr(p))
+    return out
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def explain(conn, sql: str, params) -> list[str]:
+    """EXPLAIN QUERY PLAN as indented detail lines (children under their parent)."""
+    depth = {0: -1}
+    lines = []
+    # The base execute, so the plan lookup itself isn't timed and fed back into the log
+    for node_id, parent, _, detail in sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall():
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+class SlowQueryLog:
+    """Per-shape aggregates of statements at or over threshold_ms."""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, max_shapes: int = MAX_SHAPES):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.dropped = 0
+        self._shapes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, conn, name: str, sql: str, params, seconds: float, rows: int) -> None:
+        ms = seconds * 1000
+        if ms < self.threshold_ms:
+            return
+        shape = normalize_sql(sql)
+        shown = _short_params(params)
+        logger.warning("slow query %s: %.1f ms, %d rows, params=%s: %s", name, ms, rows, shown, shape)
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                entry = self._shapes[shape] = {
+                    "query": name, "sql": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "rows_total": 0, "first_seen": _now(), "plan": None,
+                }
+                need_plan = True
+            else:
+                need_plan = False
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows_total"] += rows
+            entry["last_ms"] = ms
+            entry["last_rows"] = rows
+            entry["last_params"] = shown
+            entry["last_seen"] = _now()
+        if need_plan:
+            try:
+                plan = explain(conn, sql, params)
+            except Exception as exc:  # plan capture must never fail the request
+                plan = [f"EXPLAIN failed: {exc}"]
+            entry["plan"] = plan
+            logger.warning("query plan for %s:\n%s", name, "\n".join(plan))
+
+    def top(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            entries = [dict(e) for e in self._shapes.values()]
+        entries.sort(key=lambda e: e["total_ms"], reverse=True)
+        for e in entries:
+            e["mean_ms"] = round(e["total_ms"] / e["count"], 3)
+            e["total_ms"] = round(e["total_ms"], 3)
+            e["max_ms"] = round(e["max_ms"], 3)
+            e["last_ms"] = round(e["last_ms"], 3)
+        return entries[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+            self.dropped = 0
+
+
+SLOW_QUERIES = SlowQueryLog()
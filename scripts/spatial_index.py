@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+R*Tree index of gateway and device positions for viewport queries (/api/map).
+
+Uplinks carry the location of the first gateway that received them, so:
+
+- a gateway's position is the latest location reported on an uplink it received first
+- a device's position is the latest located uplink's location (where it is being heard)
+
+Points live in data/cache/spatial.db: map_points (one row per gateway/device with
+position, uplink count, last seen) and map_rtree, an SQLite R*Tree over (lat, lon).
+refresh() (scripts/incremental.py) folds uplinks after a (time, event_id) watermark;
+scripts/api.py's background refresher keeps the index current after every POST /api/ingest
+and picks up rows from other writers every few seconds. Rows written at or before the
+watermark are not indexed until a rebuild.
+
+query() returns the points in a bounding box; at zoom levels below CLUSTER_MAX_ZOOM points
+sharing a CLUSTER_CELL_PX square of the Web Mercator pixel grid are merged into one
+cluster (count, centroid, member bounds) so a zoomed-out map gets a few hundred markers
+however large the fleet is.
+
+Run:
+  python scripts/spatial_index.py update     # index uplinks after the watermark
+  python scripts/spatial_index.py rebuild
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine
+    from scripts import partitions
+except ImportError:  # run as python scripts/spatial_index.py
+    from incremental import IncrementalEngine
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+INDEX_PATH = APP_ROOT / "data" / "cache" / "spatial.db"
+# At this zoom and above every point is returned individually
+CLUSTER_MAX_ZOOM = 13
+# Cluster grid cell, in screen pixels at the requested zoom (256 px tiles)
+CLUSTER_CELL_PX = 64
+# Uplinks folded per refresh() batch
+FETCH_ROWS = 50_000
+KINDS = ("gateway", "device")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS map_points (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT,
+    lat REAL,
+    lon REAL,
+    alt REAL,
+    uplinks INTEGER NOT NULL DEFAULT 0,
+    last_seen TEXT,
+    located_at TEXT,
+    UNIQUE (kind, key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS map_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS map_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT time, event_id, dev_eui, device_name, gateway_ids, location_lat, location_lon, location_alt
+    FROM uplinks
+    WHERE {where}
+    ORDER BY time, event_id
+"""
+
+
+def _mercator_px(lat: float, lon: float, zoom: int) -> tuple[float, float]:
+    """Web Mercator pixel coordinates at zoom (256 px tiles)."""
+    scale = 256 * (1 << zoom)
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0 * scale
+    s = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+class SpatialIndex(IncrementalEngine):
+    """Gateway/device positions in an R*Tree, maintained from the uplinks incrementally."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "map"
+    REPLAY = None
+    TABLES = ("map_points", "map_rtree", "map_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = INDEX_PATH):
+        super().__init__(path)
+
+    def _fold(self, index, cur, replay: bool = False) -> int:
+        # (kind, key) -> [name, uplinks, last_seen, (lat, lon, alt, time) or None]
+        points: dict[tuple, list] = {}
+        gateways_of: dict[str, list] = {}
+        n = 0
+
+        def touch(kind, key, name, time_val, location):
+            p = points.get((kind, key))
+            if p is None:
+                p = points[(kind, key)] = [name, 0, time_val, None]
+            p[1] += 1
+            p[2] = time_val
+            if name:
+                p[0] = name
+            if location is not None:
+                p[3] = location
+
+        while True:
+            batch = cur.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            for time_val, event_id, dev_eui, name, gids, lat, lon, alt in batch:
+                location = (lat, lon, alt, time_val) if lat is not None and lon is not None else None
+                touch("device", dev_eui, name, time_val, location)
+                if gids:
+                    ids = gateways_of.get(gids)
+                    if ids is None:
+                        try:
+                            ids = json.loads(gids)
+                        except (json.JSONDecodeError, TypeError):
+                            ids = []
+                        gateways_of[gids] = ids = [g for g in ids if isinstance(g, str)] if isinstance(ids, list) else []
+                    for i, gid in enumerate(ids):
+                        # The stored location came from the first rxInfo entry
+                        touch("gateway", gid, None, time_val, location if i == 0 else None)
+                n += 1
+
+        for (kind, key), (name, uplinks, last_seen, location) in points.items():
+            index.execute(
+                """
+                INSERT INTO map_points (kind, key, name, uplinks, last_seen) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(kind, key) DO UPDATE SET
+                    name = COALESCE(excluded.name, name), uplinks = uplinks + excluded.uplinks,
+                    last_seen = MAX(COALESCE(last_seen, ''), excluded.last_seen)
+                """,
+                (kind, key, name, uplinks, last_seen),
+            )
+            if location is None:
+                continue
+            lat, lon, alt, located_at = location
+            row = index.execute(
+                """
+                UPDATE map_points SET lat = ?, lon = ?, alt = ?, located_at = ?
+                WHERE kind = ? AND key = ? AND (located_at IS NULL OR located_at <= ?)
+                RETURNING id
+                """,
+                (lat, lon, alt, located_at, kind, key, located_at),
+            ).fetchone()
+            if row:
+                index.execute("INSERT OR REPLACE INTO map_rtree VALUES (?, ?, ?, ?, ?)", (row[0], lat, lat, lon, lon))
+        return n
+
+    def extent(self, kinds: tuple = KINDS) -> dict | None:
+        """Bounds of every indexed point of the given kinds, or None."""
+        index = self._open()
+        try:
+            row = index.execute(
+                f"""
+                SELECT MIN(lat), MIN(lon), MAX(lat), MAX(lon) FROM map_points
+                WHERE lat IS NOT NULL AND kind IN ({', '.join('?' for _ in kinds)})
+                """,
+                kinds,
+            ).fetchone()
+        finally:
+            index.close()
+        if row[0] is None:
+            return None
+        return {"south": row[0], "west": row[1], "north": row[2], "east": row[3]}
+
+    def query(self, south: float, west: float, north: float, east: float, zoom: int, kinds: tuple = KINDS) -> dict:
+        """Points in the box (west > east crosses the antimeridian), clustered below CLUSTER_MAX_ZOOM."""
+        boxes = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        kind_sql = ", ".join("?" for _ in kinds)
+        index = self._open()
+        try:
+            rows = []
+            for lo, hi in boxes:
+                rows += index.execute(
+                    f"""
+                    SELECT p.kind, p.key, p.name, p.lat, p.lon, p.alt, p.uplinks, p.last_seen
+                    FROM map_rtree r JOIN map_points p ON p.id = r.id
+                    WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ?
+                      AND p.kind IN ({kind_sql})
+                    """,
+                    (north, south, hi, lo, *kinds),
+                ).fetchall()
+        finally:
+            index.close()
+        points = [
+            {"kind": k, "id": key, "name": name, "lat": lat, "lon": lon, "alt": alt, "uplinks": n, "last_seen": seen}
+            for k, key, name, lat, lon, alt, n, seen in rows
+        ]
+        if zoom >= CLUSTER_MAX_ZOOM:
+            return {"points": points, "clusters": []}
+
+        cells: dict[tuple, list] = {}
+        for p in points:
+            x, y = _mercator_px(p["lat"], p["lon"], zoom)
+            cells.setdefault((int(x // CLUSTER_CELL_PX), int(y // CLUSTER_CELL_PX)), []).append(p)
+        singles, clusters = [], []
+        for members in cells.values():
+            if len(members) == 1:
+                singles.append(members[0])
+                continue
+            lats = [m["lat"] for m in members]
+            lons = [m["lon"] for m in members]
+            clusters.append({
+                "lat": sum(lats) / len(lats),
+                "lon": sum(lons) / len(lons),
+                "count": len(members),
+                "gateways": sum(1 for m in members if m["kind"] == "gateway"),
+                "devices": sum(1 for m in members if m["kind"] == "device"),
+                "uplinks": sum(m["uplinks"] for m in members),
+                "bounds": {"south": min(lats), "west": min(lons), "north": max(lats), "east": max(lons)},
+            })
+        clusters.sort(key=lambda c: -c["count"])
+        return {"points": singles, "clusters": clusters}
+
+    def gateway_locations(self) -> dict[str, dict]:
+        """gateway_id -> {lat, lon, alt} for every located gateway."""
+        index = self._open()
+        try:
+            rows = index.execute(
+                "SELECT key, lat, lon, alt FROM map_points WHERE kind = 'gateway' AND lat IS NOT NULL"
+            ).fetchall()
+        finally:
+            index.close()
+        return {gid: {"lat": lat, "lon": lon, "alt": alt} for gid, lat, lon, alt in rows}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--index", type=Path, default=INDEX_PATH, help="index DB (default data/cache/spatial.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="index uplinks after the watermark")
+    sub.add_parser("rebuild", help="drop the index and rebuild it from all uplinks")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    index = SpatialIndex(args.index)
+    t0 = time.perf_counter()
+    n = (index.rebuild if args.command == "rebuild" else index.catch_up)(connect)
+    print(f"Indexed {n} uplinks in {time.perf_counter() - t0:.1f}s:", args.index)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Streaming statistical anomaly detectors with persisted per-device state.
+
+For every (device, metric) the detector keeps, in O(1) space:
+
+- an EWMA mean and variance (alpha): value is anomalous when |z| > z against it
+- a seasonal baseline: one EWMA mean/variance per UTC hour of day (seasonal_alpha), so a
+  value normal for 03:00 but not for 15:00 is flagged when |z| > seasonal_z
+
+Each uplink is scored before it updates the state; nothing is scored until the baseline
+has seen `warmup` values (seasonal: `seasonal_warmup` per hour slot). The standard
+deviation is floored at `min_std` so flat signals don't turn sensor noise into anomalies.
+
+Which metrics a profile tracks and its thresholds come from PROFILE_METRICS (keys are
+object_json keys or the rssi/snr/battery_normalized columns; "*" applies to every
+profile), overridable per profile with a JSON file named by the DETECTOR_CONFIG
+environment variable, e.g. {"rbs305-ath": {"temperature": {"z": 3.5, "min_std": 0.3}}}.
+
+State and detections live in data/cache/detectors.db. refresh() (scripts/incremental.py)
+scores uplinks after a (time, event_id) watermark in time order, at most MAX_BATCH_ROWS per
+call, so restarts resume from the saved state without replaying history; scripts/api.py's
+background refresher runs it after each POST /api/ingest. The watermark spans all devices,
+so on_write() queues uplinks written behind it (one device's backlog arriving after
+another's newer uplinks) and the next refresh scores them first. A device's uplinks older
+than its last scored one, and re-sent copies of that one, are skipped (the baselines only
+move forward). Late rows written by other processes (ingest.py, the generators) are only
+picked up by a rebuild.
+
+Run:
+  python scripts/stream_detectors.py update     # score everything after the watermark
+  python scripts/stream_detectors.py rebuild    # reset state and rescore all uplinks
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+try:
+    from scripts.incremental import IncrementalEngine
+    from scripts import partitions
+except ImportError:  # run as python scripts/stream_detectors.py
+    from incremental import IncrementalEngine
+    import partitions
+
+APP_ROOT = Path(__file__).resolve().parent.parent
+DB_PATH = APP_ROOT / "data" / "uplinks.db"
+STATE_PATH = APP_ROOT / "data" / "cache" / "detectors.db"
+# Optional JSON file of per-profile metric overrides
+DETECTOR_CONFIG = os.environ.get("DETECTOR_CONFIG")
+# Uplinks scored per refresh(); the CLI loops until caught up
+MAX_BATCH_ROWS = 100_000
+SEASON_SLOTS = 24
+
+DEFAULTS = {
+    "alpha": 0.05,
+    "z": 4.0,
+    "warmup": 30,
+    "seasonal_alpha": 0.2,
+    "seasonal_z": 4.0,
+    "seasonal_warmup": 7,
+    "min_std": 0.1,
+}
+COLUMN_METRICS = ("rssi", "snr", "battery_normalized")
+PROFILE_METRICS = {
+    "*": {
+        "rssi": {"min_std": 2.0},
+        "snr": {"min_std": 1.0},
+        "battery_normalized": {"z": 5.0, "min_std": 0.02},
+    },
+    "Makerfabs Soil Moisture Sensor": {"soil_val": {"min_std": 10.0}, "temp": {"min_std": 0.2}},
+    "rbs305-ath": {"temperature": {"min_std": 0.2}, "humidity": {"min_std": 1.0}},
+    "Multitech RBS301 Temp Sensor": {"temperature": {"min_std": 0.2}},
+    "Dragino DDS75-LB Ultrasonic Distance Sensor": {"distance": {"min_std": 2.0}},
+    "EM500-UDL": {"distance": {"min_std": 2.0}},
+    "SW3L": {"BAT": {"min_std": 0.02}},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detector_state (
+    dev_eui TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    var REAL NOT NULL,
+    season TEXT NOT NULL,
+    last_time TEXT NOT NULL,
+    PRIMARY KEY (dev_eui, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS detector_events (
+    time TEXT NOT NULL,
+    dev_eui TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value REAL NOT NULL,
+    expected REAL NOT NULL,
+    std REAL NOT NULL,
+    z REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_detector_events_dev_time ON detector_events(dev_eui, time);
+CREATE INDEX IF NOT EXISTS idx_detector_events_time ON detector_events(time);
+CREATE TABLE IF NOT EXISTS detector_replay (event_id TEXT PRIMARY KEY, time TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS detector_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_BATCH_SQL = """
+    SELECT dev_eui, device_profile_name, time, event_id, rssi, snr, battery_normalized, object_json
+    FROM uplinks
+    WHERE {where}
+    ORDER BY time, event_id
+"""
+
+
+def load_config(path: str | None = DETECTOR_CONFIG) -> dict:
+    """PROFILE_METRICS with per-profile, per-metric overrides from a JSON file merged in."""
+    config = {profile: {m: dict(opts) for m, opts in metrics.items()} for profile, metrics in PROFILE_METRICS.items()}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for profile, metrics in json.load(f).items():
+                for metric, opts in metrics.items():
+                    config.setdefault(profile, {}).setdefault(metric, {}).update(opts or {})
+    return config
+
+
+class Baseline:
+    """EWMA mean/variance overall and per hour of day for one (device, metric)."""
+
+    __slots__ = ("n", "mean", "var", "season", "last_time")
+
+    def __init__(self, n=0, mean=0.0, var=0.0, season=None, last_time=""):
+        self.n = n
+        self.mean = mean
+        self.var = var
+        # [n, mean, var] per UTC hour
+        self.season = season or [[0, 0.0, 0.0] for _ in range(SEASON_SLOTS)]
+        self.last_time = last_time
+
+    def score_and_update(self, value: float, hour: int, opts: dict) -> list[tuple]:
+        """[(kind, expected, std, z)] for thresholds value crosses, then fold value in."""
+        found = []
+        floor = opts["min_std"]
+        if self.n >= opts["warmup"]:
+            std = max(math.sqrt(self.var), floor)
+            z = (value - self.mean) / std
+            if abs(z) > opts["z"]:
+                found.append(("ewma", self.mean, std, z))
+        slot = self.season[hour]
+        if slot[0] >= opts["seasonal_warmup"]:
+            std = max(math.sqrt(slot[2]), floor)
+            z = (value - slot[1]) / std
+            if abs(z) > opts["seasonal_z"]:
+                found.append(("seasonal", slot[1], std, z))
+        self.n, self.mean, self.var = _ewma(self.n, self.mean, self.var, value, opts["alpha"])
+        slot[0], slot[1], slot[2] = _ewma(slot[0], slot[1], slot[2], value, opts["seasonal_alpha"])
+        return found
+
+
+def _ewma(n: int, mean: float, var: float, x: float, alpha: float) -> tuple[int, float, float]:
+    if n == 0:
+        return 1, x, 0.0
+    diff = x - mean
+    incr = alpha * diff
+    return n + 1, mean + incr, (1 - alpha) * (var + diff * incr)
+
+
+class StreamDetectors(IncrementalEngine):
+    """Watermark-driven scoring of new uplinks against persisted baselines."""
+
+    SCHEMA = SCHEMA
+    PREFIX = "detector"
+    REPLAY = "rows"
+    TABLES = ("detector_state", "detector_events", "detector_replay", "detector_meta")
+    BATCH_SQL = _BATCH_SQL
+
+    def __init__(self, path: Path = STATE_PATH, config: dict | None = None):
+        super().__init__(path)
+        self.config = config if config is not None else load_config()
+        self._metrics_cache: dict[str, list] = {}
+
+    def metrics_for(self, profile: str | None) -> list[tuple[str, dict]]:
+        """[(metric, options)] tracked for a device profile, defaults filled in."""
+        key = profile or ""
+        found = self._metrics_cache.get(key)
+        if found is None:
+            merged = {m: dict(o) for m, o in self.config.get("*", {}).items()}
+            for m, o in self.config.get(key, {}).items():
+                merged.setdefault(m, {}).update(o)
+            found = self._metrics_cache[key] = [(m, {**DEFAULTS, **o}) for m, o in merged.items()]
+        return found
+
+    def refresh(self, connect, max_rows: int = MAX_BATCH_ROWS) -> tuple[int, int]:
+        """Score queued late uplinks and up to max_rows after the watermark; returns (uplinks read, detections)."""
+        found = []
+
+        def fold(state, cur, replay=False):
+            rows = cur.fetchall()
+            if rows:
+                baselines = self._load(state, {r[0] for r in rows})
+                events = self._score(rows, baselines, replay)
+                state.executemany(
+                    "INSERT OR REPLACE INTO detector_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(dev, metric, b.n, b.mean, b.var, json.dumps(b.season), b.last_time)
+                     for (dev, metric), b in baselines.items() if b.n],
+                )
+                state.executemany("INSERT INTO detector_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", events)
+                found.append(len(events))
+            return len(rows)
+
+        n = self._refresh(connect, max_rows, fold)
+        return n, sum(found)
+
+    def _load(self, state, devices: set) -> dict[tuple, Baseline]:
+        baselines = {}
+        for dev in devices:
+            for metric, n, mean, var, season, last_time in state.execute(
+                "SELECT metric, n, mean, var, season, last_time FROM detector_state WHERE dev_eui = ?", (dev,)
+            ):
+                baselines[(dev, metric)] = Baseline(n, mean, var, json.loads(season), last_time)
+        return baselines
+
+    def _score(self, rows: list, baselines: dict, late: bool = False) -> list[tuple]:
+        """Detections for time-ordered rows; late (queued) rows already scored for their device are skipped."""
+        events = []
+        for dev, profile, time_val, _, rssi, snr, battery, obj_json in rows:
+            tracked = self.metrics_for(profile)
+            if not tracked:
+                continue
+            obj = None
+            try:
+                hour = int(time_val[11:13])
+            except ValueError:
+                continue
+            for metric, opts in tracked:
+                if metric in COLUMN_METRICS:
+                    value = rssi if metric == "rssi" else snr if metric == "snr" else battery
+                else:
+                    if obj is None:
+                        try:
+                            obj = json.loads(obj_json) if obj_json else {}
+                        except json.JSONDecodeError:
+                            obj = {}
+                        if not isinstance(obj, dict):
+                            obj = {}
+                    value = obj.get(metric)
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                b = baselines.get((dev, metric))
+                if b is None:
+                    b = baselines[(dev, metric)] = Baseline()
+                elif time_val < b.last_time or (late and time_val == b.last_time):
+                    continue  # late uplink: baselines only move forward
+                for kind, expected, std, z in b.score_and_update(float(value), hour, opts):
+                    events.append((time_val, dev, metric, kind, float(value), expected, std, z))
+                b.last_time = time_val
+        return events
+
+    def catch_up(self, connect) -> tuple[int, int]:
+        """refresh() until the watermark stops moving (it reached the newest uplink); returns (uplinks, detections)."""
+        total = found = 0
+        while True:
+            n, k = self.refresh(connect)
+            total += n
+            found += k
+            if not self._advanced:
+                return total, found
+
+    def events(
+        self,
+        dev_eui: str | None = None,
+        from_time: str | None = None,
+        to_time: str | None = None,
+        metric: str | None = None,
+        kind: str | None = None,
+        limit: int = 500,
+    ) -> list[dict]:
+        """Detections, newest first."""
+        where, args = ["1"], []
+        for cond, value in (("dev_eui = ?", dev_eui), ("time >= ?", from_time), ("time <= ?", to_time),
+                            ("metric = ?", metric), ("kind = ?", kind)):
+            if value:
+                where.append(cond)
+                args.append(value)
+        if not self.path.exists():
+            return []
+        state = self._open()
+        try:
+            rows = state.execute(
+                f"""
+                SELECT time, dev_eui, metric, kind, value, expected, std, z FROM detector_events
+                WHERE {' AND '.join(where)}
+                ORDER BY time DESC
+                LIMIT ?
+                """,
+                args + [limit],
+            ).fetchall()
+        finally:
+            state.close()
+        return [
+            {
+                "time": t, "dev_eui": dev, "metric": m, "type": f"{m}_{k}", "kind": k, "value": v,
+                "expected": round(e, 4), "std": round(s, 4), "z": round(z, 2),
+                "description": f"{m} {v:g} is {abs(z):.1f}σ {'above' if z > 0 else 'below'} "
+                               f"{'its usual value for this hour' if k == 'seasonal' else 'its recent average'} ({e:.4g})",
+            }
+            for t, dev, m, k, v, e, s, z in rows
+        ]
+
+    def baselines(self, dev_eui: str) -> list[dict]:
+        """Current EWMA and this-hour seasonal baseline per metric of one device."""
+        if not self.path.exists():
+            return []
+        state = self._open()
+        try:
+            rows = state.execute(
+                "SELECT metric, n, mean, var, season, last_time FROM detector_state WHERE dev_eui = ? ORDER BY metric",
+                (dev_eui,),
+            ).fetchall()
+        finally:
+            state.close()
+        out = []
+        for metric, n, mean, var, season, last_time in rows:
+            slots = json.loads(season)
+            out.append({
+                "metric": metric, "n": n, "mean": round(mean, 4), "std": round(math.sqrt(var), 4),
+                "last_time": last_time,
+                "hourly_mean": [round(s[1], 4) if s[0] else None for s in slots],
+            })
+        return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, help="uplinks DB; default data/uplinks.db, or data/partitions/ once split")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="detector DB (default data/cache/detectors.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("update", help="score uplinks after the watermark")
+    sub.add_parser("rebuild", help="reset all state and rescore every uplink")
+    args = parser.parse_args()
+    # Without --db, read what the API reads (the partitions once split)
+    connect = partitions.reader(args.db)
+    if connect is None:
+        print("DB not found:", args.db or DB_PATH, file=sys.stderr)
+        return 1
+
+    detectors = StreamDetectors(args.state)
+    if args.command == "rebuild":
+        detectors.reset()
+    t0 = time.perf_counter()
+    n, found = detectors.catch_up(connect)
+    elapsed = time.perf_counter() - t0
+    print(f"Scored {n} uplinks in {elapsed:.1f}s ({n / elapsed if elapsed else 0:.0f}/s), {found} detections:", args.state)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())